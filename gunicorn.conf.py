@@ -0,0 +1,49 @@
+"""Configuracion de gunicorn (se lee sola desde el directorio de trabajo).
+
+Con `preload_app` el master importa la app, y con ella crea el juego de
+motores activo (`src.services.registro_modelos`), antes de hacer fork: los workers comparten las
+paginas de los boosters de LightGBM y del interprete en lugar de cargar
+cada uno su copia. Los arreglos de modelos y scalers vienen mapeados desde el
+almacen de artefactos (`src.services.almacen_artefactos`). Cada worker
+reparte los hilos de LightGBM segun `src.services.hilos_inferencia`; el
+master le asigna su bloque de CPUs antes del fork y lo libera cuando termina.
+"""
+import gc
+import logging
+
+preload_app = True
+
+# Solo se usa en el master: bloque de CPUs de cada worker vivo (BloquesWorkers)
+_bloques = None
+
+
+def when_ready(server):
+    # Los objetos creados por el master pasan a la generacion permanente: el
+    # recolector de los workers no los recorre ni escribe sus cabeceras, que
+    # seguirian compartidas tras el fork
+    gc.freeze()
+
+
+def pre_fork(server, worker):
+    global _bloques
+    from src.services.hilos_inferencia import BloquesWorkers
+
+    if _bloques is None:
+        _bloques = BloquesWorkers()
+    # En el master: el worker hereda su bloque con el fork
+    worker.bloque_cpus = _bloques.asignar(worker.age, server.num_workers)
+
+
+def child_exit(server, worker):
+    if _bloques is not None:
+        _bloques.liberar(worker.age)
+
+
+def post_fork(server, worker):
+    from src.services.almacen_artefactos import memoria_proceso
+    from src.services.hilos_inferencia import PRESUPUESTO
+
+    # Nucleos de este worker: los del host repartidos entre los workers de gunicorn
+    PRESUPUESTO.configurar(server.num_workers, indice=worker.bloque_cpus)
+
+    logging.getLogger("gunicorn.error").info("[artefactos] worker %s: %s", worker.pid, memoria_proceso())
@@ -0,0 +1,14 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+# Uso: scripts/run_extraccion_masiva.sh <entrada: dir|archivo.jsonl> <salida> [args extra]
+ENTRADA=${1:?falta entrada}
+SALIDA=${2:?falta salida}
+shift 2
+
+python -m src.services.extraccion_masiva \
+  --entrada "${ENTRADA}" \
+  --salida "${SALIDA}" \
+  --workers "${WORKERS:-$(nproc)}" \
+  --chunk "${CHUNK:-500}" \
+  "$@"
@@ -1,6 +1,9 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 import yaml
 from src.config.config import CONFIG, CONFIG_FILE
+from src.services.almacen_artefactos import memoria_proceso
+from src.services.hilos_inferencia import PRESUPUESTO
+from src.services.registro_modelos import REGISTRO
 from .routes import requires_auth  # Reutiliza el decorador definido en rutas
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -73,3 +76,67 @@ def update_umbrales():
     # En GET, se recupera la configuración actual de los umbrales.
     current_umbrales = CONFIG.get("contraofertas", {}).get("credit_umbrales", {})
     return render_template("update_umbrales.html", umbrales=current_umbrales)
+
+
+@admin_bp.route('/memoria')
+@requires_auth
+def memoria_worker():
+    """Memoria unica/compartida del worker que atiende la solicitud (ver almacen_artefactos)."""
+    return jsonify(memoria_proceso())
+
+
+@admin_bp.route('/hilos')
+@requires_auth
+def hilos_worker():
+    """Nucleos, workers e hilos de LightGBM efectivos del worker (ver hilos_inferencia)."""
+    return jsonify(PRESUPUESTO.estado())
+
+
+@admin_bp.route('/lotes')
+@requires_auth
+def lotes_worker():
+    """Tamano de lote y demora de cola de la prediccion por motor del juego activo (ver cola_lotes)."""
+    return jsonify(REGISTRO.activo().lotes())
+
+
+@admin_bp.route('/etapas')
+@requires_auth
+def etapas_worker():
+    """Tiempo de cada etapa del grafo de prediccion por motor del juego activo (ver grafo_etapas)."""
+    return jsonify(REGISTRO.activo().etapas())
+
+
+@admin_bp.route('/modelos')
+@requires_auth
+def estado_modelos():
+    """Juego de modelos activo y anterior del worker, con los tiempos de cada fase (ver registro_modelos)."""
+    return jsonify(REGISTRO.estado())
+
+
+@admin_bp.route('/modelos/cargar', methods=["POST"])
+@requires_auth
+def cargar_modelos():
+    """Carga en segundo plano el juego activo con los cambios del JSON (p.e. {"model_paths": {"hortensia": "..."}}).
+
+    Con `?esperar=1` responde al terminar la carga, el canario y la activacion.
+    """
+    esperar = request.args.get("esperar", "0") in ("1", "true")
+    try:
+        operacion = REGISTRO.cargar(request.get_json(silent=True) or {}, esperar=esperar)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    if esperar and operacion["estado"] == "fallida":
+        return jsonify(operacion), 422
+    return jsonify(operacion), 200 if esperar else 202
+
+
+@admin_bp.route('/modelos/revertir', methods=["POST"])
+@requires_auth
+def revertir_modelos():
+    """Vuelve al juego de modelos anterior."""
+    try:
+        return jsonify(REGISTRO.revertir())
+    except (LookupError, RuntimeError) as e:
+        return jsonify({"error": str(e)}), 409
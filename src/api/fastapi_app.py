@@ -1,34 +1,21 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 import logging
 
-from src.services.hortensia_contraofertas_matrix import MotorPrediccionContraofertas as MotorMatrix
-from src.services.hortensia_CF_matrix_BACK import MotorPrediccionHrespaldo
-from src.services.hortensia_CF_matrix_NCL import MotorPrediccionContraofertas as MotorMatrix_NCL
+from src.services.registro_modelos import REGISTRO
 from src.utils.logging_config import setup_logging
 from src.core.decision import decide_and_predict, ValidationError
 from src.config.config import (
     VERSION_HRESPALDO,
     VERSION_FPD_HRESPALDO,
-    MODELO_PATH,
-    SCALER_PATH_H,
-    MODELO_FPD_PATH,
-    SCALER_PATH_FPD,
-    MODELO_NCLF_PATH,
-    SCALER_NCLF_PATH,
-    MODELO_FPD_NCLF_PATH,
-    MODELO_BACK_PATH,
-    SCALER_BACK_PATH,
-    MODELO_FPD_BACK_PATH,
 )
 
 setup_logging()
 app = FastAPI()
 
-# Instancias de motores
-motor_regular = MotorMatrix(MODELO_PATH, SCALER_PATH_H, MODELO_FPD_PATH, SCALER_PATH_FPD)
-motor_nclf = MotorMatrix_NCL(MODELO_NCLF_PATH, SCALER_NCLF_PATH, MODELO_FPD_NCLF_PATH)
-motor_backup = MotorPrediccionHrespaldo(MODELO_BACK_PATH, SCALER_BACK_PATH, MODELO_FPD_BACK_PATH)
+# El primer juego de modelos se crea al importar (ver registro_modelos)
+REGISTRO.activo()
 
 class MotorRechazoZF:
     VERSION_HRESPALDO = VERSION_HRESPALDO
@@ -56,14 +43,11 @@ async def predecir(request: Request):
     try:
         datos = await request.json()
 
-        motores = {
-            "contra": motor_regular,
-            "backup": motor_backup,
-            "NCL": motor_nclf,
-            "ZF": motor_zf
-        }
+        # Juego de modelos activo (compartido con la app Flask si corren en el mismo proceso)
+        motores = REGISTRO.activo().motores(motor_zf)
 
-        resultado, status = decide_and_predict(datos, motores)
+        # En el threadpool: el event loop sigue recibiendo solicitudes y la cola de lotes las junta
+        resultado, status = await run_in_threadpool(decide_and_predict, datos, motores)
         return JSONResponse(content=resultado, status_code=status)
     except ValidationError as ve:
         logging.warning("Validación fallida: %s", ve)
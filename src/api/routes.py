@@ -1,7 +1,5 @@
 from flask import jsonify, request, redirect, url_for, Response
-from src.services.hortensia_contraofertas_matrix import MotorPrediccionContraofertas as MotorMatrix
-from src.services.hortensia_CF_matrix_BACK import MotorPrediccionHrespaldo
-from src.services.hortensia_CF_matrix_NCL import MotorPrediccionContraofertas as MotorMatrix_NCL
+from src.services.registro_modelos import REGISTRO
 
 import logging
 import os
@@ -18,16 +16,6 @@ from src.config.config import (
     VERSION_FPD,
     VERSION_FPD_HRESPALDO,
     VERSION_NCLF_FPD,
-    MODELO_PATH,
-    SCALER_PATH_H,
-    MODELO_FPD_PATH,
-    SCALER_PATH_FPD,
-    MODELO_NCLF_PATH,
-    SCALER_NCLF_PATH,
-    MODELO_FPD_NCLF_PATH,
-    MODELO_BACK_PATH,
-    SCALER_BACK_PATH,
-    MODELO_FPD_BACK_PATH
 )
 from src.utils.responses import error_response
 from src.core.decision import decide_and_predict, ValidationError
@@ -83,9 +71,8 @@ def requires_auth(f):
 
     return decorated
 
-motor_regular = MotorMatrix(MODELO_PATH, SCALER_PATH_H, MODELO_FPD_PATH, SCALER_PATH_FPD)
-motor_nclf = MotorMatrix_NCL(MODELO_NCLF_PATH, SCALER_NCLF_PATH, MODELO_FPD_NCLF_PATH)
-motor_backup = MotorPrediccionHrespaldo(MODELO_BACK_PATH, SCALER_BACK_PATH, MODELO_FPD_BACK_PATH)
+# El primer juego de modelos se crea al importar: con preload_app, en el master antes del fork
+REGISTRO.activo()
 
 @requires_auth
 def index():
@@ -101,7 +88,7 @@ def predict_nocreditlife_cf_new(datos_cliente, grupo_retailer):
     """
     try:
         logging.info("Características de entrada (No Credit Life): %s", datos_cliente)
-        resultado_prediccion = motor_nclf.predecir(
+        resultado_prediccion = REGISTRO.activo().nclf.predecir(
             datos_cliente, grupo_retailer
         )
         logging.info(
@@ -122,7 +109,7 @@ def predict_contraofertas_new(datos_cliente, grupo_retailer):
     Realiza una prediccion para contraofertas.
     """
     try:
-        resultado_prediccion = motor_regular.predecir(
+        resultado_prediccion = REGISTRO.activo().regular.predecir(
             datos_cliente, grupo_retailer
         )
         logging.info(
@@ -140,7 +127,7 @@ def predict_contraofertas_new(datos_cliente, grupo_retailer):
 def hortensia_respaldo(datos_cliente, grupo_retailer ):
 
     try:
-        resultado_prediccion = motor_backup.predecir(datos_cliente, grupo_retailer)
+        resultado_prediccion = REGISTRO.activo().backup.predecir(datos_cliente, grupo_retailer)
         logging.info("Resultado de la prediccion (Respaldo): %s", resultado_prediccion)
         return jsonify({"resultado": resultado_prediccion}), 200
 
@@ -160,12 +147,8 @@ def predict_contraoferta():
         datos_cliente = request.get_json()
         logging.info("Datos recibidos del cliente: %s", datos_cliente)
 
-        motores = {
-            "contra": motor_regular,
-            "backup": motor_backup,
-            "NCL": motor_nclf,
-            "ZF": motor_zf
-        }
+        # El juego de modelos se toma una vez: un cambio en caliente no afecta esta solicitud
+        motores = REGISTRO.activo().motores(motor_zf)
 
         resultado, status = decide_and_predict(datos_cliente, motores)
         if status == 200:
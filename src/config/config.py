@@ -78,13 +78,69 @@ PPT_BLACKLIST_DEPARTMENTS = set(
     CONFIG.get('business_rules', {}).get('ppt_blacklist_departments', [])
 )
 
+# Extraccion XML Experian
+EXTRACCION_ENGINE = CONFIG.get('extraccion', {}).get('engine', 'etree')
+POSTPROCESO_VECTORIZADO = CONFIG.get('extraccion', {}).get('postproceso_vectorizado', True)
+CACHE_INFORMES_MAX_ENTRADAS = CONFIG.get('cache_informes', {}).get('max_entradas', 1024)
+CACHE_INFORMES_TTL_SEGUNDOS = CONFIG.get('cache_informes', {}).get('ttl_segundos', 600)
+
+# Ruta escalar (dict/NumPy) por motor
+RUTA_ESCALAR_REGULAR = CONFIG.get('ruta_escalar', {}).get('regular', True)
+RUTA_ESCALAR_NCL = CONFIG.get('ruta_escalar', {}).get('ncl', True)
+RUTA_ESCALAR_BACKUP = CONFIG.get('ruta_escalar', {}).get('backup', True)
+
+# Plan de features (variables derivadas que usan los modelos) por motor
+PLAN_FEATURES_REGULAR = CONFIG.get('plan_features', {}).get('regular', False)
+PLAN_FEATURES_NCL = CONFIG.get('plan_features', {}).get('ncl', False)
+PLAN_FEATURES_BACKUP = CONFIG.get('plan_features', {}).get('backup', False)
+PLAN_FEATURES_SECCIONES = CONFIG.get('plan_features', {}).get('secciones', False)
+
+# Evaluador NumPy de los modelos (filas maximas por llamada; 0 lo desactiva)
+MODELOS_EVALUADOR_NUMPY_FILAS = CONFIG.get('modelos', {}).get('evaluador_numpy_filas', 0)
+
+# Cola de micro-lotes delante de la prediccion (solicitudes concurrentes del mismo worker)
+MODELOS_LOTES_ACTIVO = CONFIG.get('modelos', {}).get('lotes', {}).get('activo', False)
+MODELOS_LOTES_VENTANA_MS = CONFIG.get('modelos', {}).get('lotes', {}).get('ventana_ms', 2)
+MODELOS_LOTES_MAX_FILAS = CONFIG.get('modelos', {}).get('lotes', {}).get('max_filas', 64)
+
+# Grafo de etapas de los motores (hilos del pool compartido; 0 corre las etapas en orden)
+GRAFO_ETAPAS_HILOS = CONFIG.get('grafo_etapas', {}).get('hilos', 2)
+
+# Presupuesto de hilos de LightGBM por worker
+HILOS_INFERENCIA_ACTIVO = CONFIG.get('hilos_inferencia', {}).get('activo', True)
+HILOS_INFERENCIA_WORKERS = CONFIG.get('hilos_inferencia', {}).get('workers')
+HILOS_INFERENCIA_UMBRAL_LOTE = CONFIG.get('hilos_inferencia', {}).get('umbral_lote', 8)
+HILOS_INFERENCIA_FIJAR_CPUS = CONFIG.get('hilos_inferencia', {}).get('fijar_cpus', False)
+
+# Almacen de artefactos mapeables en memoria
+ARTEFACTOS_MMAP = CONFIG.get('artefactos', {}).get('mmap', True)
+ARTEFACTOS_ALMACEN = CONFIG.get('artefactos', {}).get('almacen', 'src/artifacts/mmap')
+
+# Registro de modelos (carga en caliente, canario y reversion)
+REGISTRO_MODELOS_CANARIO = CONFIG.get('registro_modelos', {}).get('canario', 'src/data/solicitudes_canario.json')
+REGISTRO_MODELOS_CANARIO_REPETICIONES = CONFIG.get('registro_modelos', {}).get('canario_repeticiones', 3)
+REGISTRO_MODELOS_ESTADO = CONFIG.get('registro_modelos', {}).get('estado_compartido', 'src/artifacts/mmap/registro_modelos.json')
+REGISTRO_MODELOS_INTERVALO = CONFIG.get('registro_modelos', {}).get('intervalo_segundos', 2)
+
+# Depuracion
+DEBUG_CONTAR_COPIAS = CONFIG.get('debug', {}).get('contar_copias', False)
+
 # Preprocesamiento
 PREPROC_COMMON_ERR = CONFIG.get('preprocessing', {}).get('common_err_map', {})
 PREPROC_COMP_MAP = CONFIG.get('preprocessing', {}).get('comportamiento_map', {})
 PREPROC_COMP_COLUMNS_NCLF = CONFIG.get('preprocessing', {}).get('comportamiento_columns_nclf', [])
 PREPROC_TENDENCIA_COLS_REG = CONFIG.get('preprocessing', {}).get('tendencia_cols_regular', [])
 PREPROC_TENDENCIA_COLS_NCLF = CONFIG.get('preprocessing', {}).get('tendencia_cols_nclf', [])
+PREPROC_TENDENCIA_VECTORIZADA = CONFIG.get('preprocessing', {}).get('tendencia_vectorizada', True)
+PREPROC_COMPORTAMIENTO_VECTORIZADO = CONFIG.get('preprocessing', {}).get('comportamiento_vectorizado', True)
 PREPROC_NULOS_REGULAR = CONFIG.get('preprocessing', {}).get('nulos_regular', [])
 PREPROC_IMPUTAR_REGULAR = CONFIG.get('preprocessing', {}).get('imputar_regular', [])
 PREPROC_NULOS_NCLF = CONFIG.get('preprocessing', {}).get('nulos_nclf', [])
 PREPROC_IMPUTAR_NCLF = CONFIG.get('preprocessing', {}).get('imputar_nclf', [])
+
+# Politica de dtypes compactos (extraccion masiva y reportes de memoria)
+DTYPES_PARQUET_COMPACTO = CONFIG.get('dtypes', {}).get('parquet_compacto', True)
+DTYPES_POLITICA = {
+    tipo: CONFIG.get('dtypes', {}).get(tipo, [])
+    for tipo in ('fecha', 'categoria', 'int8', 'int16', 'int32', 'float32')
+}
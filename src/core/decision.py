@@ -1,6 +1,7 @@
 import logging
 from typing import Any, Dict, Tuple
-from src.config.config import PPT_BLACKLIST_DEPARTMENTS
+from src.services.normalizacion import NORMALIZACION
+from src.utils.contabilidad_copias import etapa
 class ValidationError(Exception):
     pass
 
@@ -51,9 +52,10 @@ def decide_and_predict(
             motor = motores["contra"]
             
     elif tipo_documento == 6:
-        if departamento_tienda and str(departamento_tienda).lower().replace(" ", "") in PPT_BLACKLIST_DEPARTMENTS:
+        if NORMALIZACION.bloqueado_ppt(departamento_tienda):
             motor = motores["ZF"]
-            resultado = motor.predecir(datos, grupo_retailer)
+            with etapa("solicitud"):
+                resultado = motor.predecir(datos, grupo_retailer)
             return (resultado, 200) 
         if tipo_modelo == 30:
             motor = motores["backup"]
@@ -63,7 +65,8 @@ def decide_and_predict(
             motor = motores["contra"]
 
     try:
-        resultado = motor.predecir(datos, grupo_retailer)
+        with etapa("solicitud"):
+            resultado = motor.predecir(datos, grupo_retailer)
         return (resultado, 200)
     except Exception:
         logging.exception("Fallo en motor de predicción")
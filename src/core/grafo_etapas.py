@@ -0,0 +1,227 @@
+"""Grafo de etapas con entradas y salidas declaradas, ejecutado sobre un pool de hilos compartido.
+
+Un motor corre su prediccion como una lista de `Etapa`: cada una declara los
+nombres que lee (`entradas`) y los que produce (`salidas`). `GrafoEtapas`
+valida al construirse que cada entrada la produzca una etapa anterior o sea
+un valor inicial, que ningun nombre se produzca dos veces y que no haya
+ciclos. `ejecutar(**iniciales)` corre cada etapa en cuanto sus entradas
+estan listas:
+
+- si hay una sola etapa lista corre en el hilo de la solicitud;
+- si hay varias (p.e. la rama H y la rama FPD despues de armar las entradas),
+  una corre en el hilo de la solicitud y las demas en el pool
+  (`grafo_etapas.hilos`). LightGBM suelta el GIL mientras predice, asi que
+  las ramas avanzan a la vez. Con `hilos: 0` todo corre en orden en el hilo
+  de la solicitud.
+
+Una etapa termina el grafo antes con `raise Corte(valor)`: `ejecutar`
+devuelve `valor`. Si una etapa falla se espera a las que estan en el pool y se
+relanza el error. Cada ejecucion registra el tiempo de cada etapa en
+`MetricasEtapas` (p50/p99 por etapa; ver /admin/etapas).
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from src.config.config import GRAFO_ETAPAS_HILOS
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    """Pool de hilos compartido por todos los grafos del proceso; `None` con `grafo_etapas.hilos: 0`."""
+    global _pool
+    if GRAFO_ETAPAS_HILOS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=GRAFO_ETAPAS_HILOS, thread_name_prefix="etapas")
+    return _pool
+
+
+def _despues_de_fork():
+    # Los hilos del pool no pasan al hijo: el worker crea el suyo al primer uso
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_despues_de_fork)
+
+
+class Corte(Exception):
+    """Termina el grafo desde una etapa: `ejecutar` devuelve `valor`."""
+
+    def __init__(self, valor):
+        super().__init__()
+        self.valor = valor
+
+
+class Etapa:
+    """`funcion(*entradas)` (en el orden declarado) devuelve el valor de su unica salida o una tupla con una por salida."""
+
+    __slots__ = ("nombre", "funcion", "entradas", "salidas")
+
+    def __init__(self, nombre, funcion, entradas=(), salidas=()):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.entradas = tuple(entradas)
+        self.salidas = tuple(salidas)
+
+    def correr(self, valores):
+        resultado = self.funcion(*(valores[n] for n in self.entradas))
+        if len(self.salidas) == 1:
+            return {self.salidas[0]: resultado}
+        if len(self.salidas) != len(resultado):
+            raise ValueError(f"La etapa {self.nombre} devolvio {len(resultado)} valores para {self.salidas}")
+        return dict(zip(self.salidas, resultado))
+
+
+class MetricasEtapas:
+    """Tiempos por etapa de las ultimas `muestras` ejecuciones."""
+
+    def __init__(self, nombres, muestras=1024):
+        self._lock = threading.Lock()
+        self.ejecuciones = 0
+        self.cortes = 0
+        self.fallidas = 0
+        self.ms = {n: deque(maxlen=muestras) for n in nombres}
+        self.total_ms = deque(maxlen=muestras)
+
+    def registrar(self, tiempos, total, resultado):
+        with self._lock:
+            self.ejecuciones += 1
+            self.cortes += resultado == "corte"
+            self.fallidas += resultado == "error"
+            for nombre, ms in tiempos.items():
+                self.ms[nombre].append(ms)
+            self.total_ms.append(total)
+
+    def resumen(self):
+        def percentiles(valores):
+            valores = list(valores)
+            if not valores:
+                return None
+            return {"n": len(valores), "p50": round(float(np.percentile(valores, 50)), 3),
+                    "p99": round(float(np.percentile(valores, 99)), 3)}
+
+        with self._lock:
+            return {
+                "ejecuciones": self.ejecuciones,
+                "cortes": self.cortes,
+                "fallidas": self.fallidas,
+                "total_ms": percentiles(self.total_ms),
+                "etapas_ms": {n: percentiles(v) for n, v in self.ms.items()},
+            }
+
+
+class GrafoEtapas:
+    """Etapas de un motor con sus dependencias; `ejecutar` devuelve el valor de `salida`."""
+
+    def __init__(self, nombre, etapas, iniciales, salida):
+        self.nombre = nombre
+        self.etapas = tuple(etapas)
+        self.iniciales = tuple(iniciales)
+        self.salida = salida
+        productor = {n: None for n in self.iniciales}
+        for e in self.etapas:
+            for n in e.salidas:
+                if n in productor:
+                    raise ValueError(f"{nombre}: '{n}' se produce dos veces")
+                productor[n] = e.nombre
+        if salida not in productor:
+            raise ValueError(f"{nombre}: ninguna etapa produce la salida '{salida}'")
+        for e in self.etapas:
+            faltantes = [n for n in e.entradas if n not in productor]
+            if faltantes:
+                raise ValueError(f"{nombre}: la etapa {e.nombre} lee {faltantes}, que nadie produce")
+        # Dependencias entre etapas (las que producen sus entradas)
+        self.dependencias = {
+            e.nombre: {productor[n] for n in e.entradas if productor[n] is not None} for e in self.etapas
+        }
+        self.orden = self._ordenar()
+        self.metricas = MetricasEtapas([e.nombre for e in self.etapas])
+
+    def _ordenar(self):
+        """Etapas en orden topologico (estable respecto al declarado); `ValueError` si hay un ciclo."""
+        pendientes = list(self.etapas)
+        hechas = set()
+        orden = []
+        while pendientes:
+            lista = next((e for e in pendientes if self.dependencias[e.nombre] <= hechas), None)
+            if lista is None:
+                raise ValueError(f"{self.nombre}: ciclo entre {[e.nombre for e in pendientes]}")
+            pendientes.remove(lista)
+            hechas.add(lista.nombre)
+            orden.append(lista)
+        return tuple(orden)
+
+    def ejecutar(self, **iniciales):
+        """Corre las etapas y devuelve el valor de `salida` (o el de un `Corte`)."""
+        faltantes = [n for n in self.iniciales if n not in iniciales]
+        if faltantes:
+            raise ValueError(f"{self.nombre}: faltan los valores iniciales {faltantes}")
+        valores = dict(iniciales)
+        tiempos = {}
+        inicio = time.perf_counter()
+        resultado = "ok"
+        try:
+            self._correr(valores, tiempos, pool())
+            return valores[self.salida]
+        except Corte as c:
+            resultado = "corte"
+            return c.valor
+        except BaseException:
+            resultado = "error"
+            raise
+        finally:
+            self.metricas.registrar(tiempos, (time.perf_counter() - inicio) * 1000, resultado)
+
+    def _correr(self, valores, tiempos, ejecutor):
+        def medida(etapa):
+            t = time.perf_counter()
+            try:
+                return etapa.correr(valores)
+            finally:
+                tiempos[etapa.nombre] = round((time.perf_counter() - t) * 1000, 3)
+
+        if ejecutor is None:
+            for etapa in self.orden:
+                valores.update(medida(etapa))
+            return
+
+        hechas = set()
+        pendientes = list(self.orden)
+        en_pool = {}
+        try:
+            while pendientes or en_pool:
+                listas = [e for e in pendientes if self.dependencias[e.nombre] <= hechas]
+                for e in listas:
+                    pendientes.remove(e)
+                # Las demas al pool, la primera en este hilo
+                for e in listas[1:]:
+                    en_pool[ejecutor.submit(medida, e)] = e
+                if listas:
+                    valores.update(medida(listas[0]))
+                    hechas.add(listas[0].nombre)
+                    continue
+                if not en_pool:
+                    raise RuntimeError(f"{self.nombre}: etapas sin dependencias satisfechas {[e.nombre for e in pendientes]}")
+                terminadas, _ = wait(en_pool, return_when=FIRST_COMPLETED)
+                for futuro in terminadas:
+                    e = en_pool.pop(futuro)
+                    valores.update(futuro.result())
+                    hechas.add(e.nombre)
+        except BaseException:
+            if en_pool:
+                wait(en_pool)
+                logging.debug("[etapas] %s: se esperaron %d etapas del pool tras un error", self.nombre, len(en_pool))
+            raise
@@ -0,0 +1,240 @@
+"""Cola de micro-lotes: junta las filas de solicitudes concurrentes en una sola prediccion.
+
+Cada solicitud termina en `PipelineModelos` con una fila de entradas y dos
+llamadas a LightGBM de una fila, donde el costo fijo de la llamada domina.
+`ColaLotes` se pone delante de la prediccion del pipeline (matrices de los
+modelos + `probabilidad`):
+
+- la primera fila que llega sin lote en curso es la lider: espera hasta
+  `ventana_ms` desde la llegada de la fila mas vieja, o hasta juntar
+  `max_filas`, y predice todas las filas pendientes en una llamada por modelo;
+- las filas que llegan mientras tanto esperan su resultado; las que llegan
+  mientras el lote se predice quedan para el siguiente, que arma una de ellas
+  al terminar el actual (un lote a la vez por pipeline).
+
+Con `ventana_ms: 0` no se espera: solo se juntan las filas que llegan
+mientras otro lote se predice, asi que sin concurrencia no se agrega demora.
+Cada fila recibe lo mismo que con una prediccion propia (LightGBM y el
+evaluador NumPy puntuan cada fila por separado). Si el lote falla, cada fila
+se vuelve a predecir sola y solo la que falla recibe la excepcion.
+
+`MetricasLotes` cuenta lotes y filas, la distribucion del tamano de lote y la
+demora de cola (llegada de la fila -> inicio de la prediccion). Solo hay
+concurrencia con workers de hilos (gunicorn `threads`, el threadpool de
+FastAPI). Medir con:
+
+    python -m src.models.cola_lotes --hilos 16 --solicitudes 200
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+def _percentil(valores, q):
+    return round(float(np.percentile(valores, q)), 3) if valores else None
+
+
+class MetricasLotes:
+    """Tamano de los lotes y demora de cola de las ultimas `muestras` filas (se actualiza bajo el lock de la cola)."""
+
+    def __init__(self, max_filas, muestras=2048):
+        self.cotas = [1]
+        while self.cotas[-1] < max_filas:
+            self.cotas.append(min(self.cotas[-1] * 2, max_filas))
+        self.histograma = [0] * len(self.cotas)
+        self.lotes = 0
+        self.filas = 0
+        self.fallidos = 0
+        self.espera_ms = deque(maxlen=muestras)
+        self.prediccion_ms = deque(maxlen=muestras)
+
+    def registrar(self, tamano, esperas_ms, prediccion_ms):
+        self.lotes += 1
+        self.filas += tamano
+        self.histograma[next(i for i, c in enumerate(self.cotas) if tamano <= c)] += 1
+        self.espera_ms.extend(esperas_ms)
+        self.prediccion_ms.append(prediccion_ms)
+
+    def resumen(self):
+        espera = list(self.espera_ms)
+        prediccion = list(self.prediccion_ms)
+        return {
+            "lotes": self.lotes,
+            "filas": self.filas,
+            "filas_por_lote": round(self.filas / self.lotes, 2) if self.lotes else None,
+            "lotes_fallidos": self.fallidos,
+            # Lotes con tamano <= cota (y > la cota anterior)
+            "tamano_lote": {f"<={c}": n for c, n in zip(self.cotas, self.histograma)},
+            "espera_cola_ms": {"p50": _percentil(espera, 50), "p99": _percentil(espera, 99),
+                               "max": round(max(espera), 3) if espera else None},
+            "prediccion_lote_ms": {"p50": _percentil(prediccion, 50), "p99": _percentil(prediccion, 99)},
+        }
+
+
+class _Pendiente:
+    __slots__ = ("fila", "llegada", "resultado", "error", "listo")
+
+    def __init__(self, fila):
+        self.fila = fila
+        self.llegada = time.perf_counter()
+        self.resultado = None
+        self.error = None
+        self.listo = False
+
+
+class ColaLotes:
+    """Junta filas concurrentes y las predice con `puntuar(matriz)` -> tupla de arreglos (uno por modelo)."""
+
+    def __init__(self, puntuar, ventana_ms, max_filas, nombre="pipeline"):
+        self._puntuar = puntuar
+        self.ventana = max(ventana_ms, 0) / 1000
+        self.max_filas = max(int(max_filas), 1)
+        self.nombre = nombre
+        self.metricas = MetricasLotes(self.max_filas)
+        self._cond = threading.Condition()
+        self._pendientes = []
+        self._lider = False
+
+    def puntuar(self, fila):
+        """Probabilidades de `fila` (vector de entradas): tupla de arreglos de un elemento."""
+        pendiente = _Pendiente(fila)
+        with self._cond:
+            self._pendientes.append(pendiente)
+            while not pendiente.listo and self._lider:
+                if len(self._pendientes) >= self.max_filas:
+                    self._cond.notify_all()
+                self._cond.wait()
+            if not pendiente.listo:
+                self._lider = True
+        if not pendiente.listo:
+            self._liderar(pendiente)
+        if pendiente.error is not None:
+            raise pendiente.error
+        return pendiente.resultado
+
+    def _liderar(self, propia):
+        """Arma y predice lotes hasta que la fila `propia` tenga resultado; luego cede el rol de lider."""
+        try:
+            while not propia.listo:
+                with self._cond:
+                    limite = self._pendientes[0].llegada + self.ventana
+                    while len(self._pendientes) < self.max_filas:
+                        restante = limite - time.perf_counter()
+                        if restante <= 0:
+                            break
+                        self._cond.wait(restante)
+                    lote = self._pendientes[:self.max_filas]
+                    del self._pendientes[:self.max_filas]
+                self._predecir(lote)
+        finally:
+            with self._cond:
+                self._lider = False
+                self._cond.notify_all()
+
+    def _predecir(self, lote):
+        inicio = time.perf_counter()
+        esperas = [(inicio - p.llegada) * 1000 for p in lote]
+        fallido = False
+        try:
+            probabilidades = self._puntuar(np.vstack([p.fila for p in lote]))
+            for i, p in enumerate(lote):
+                p.resultado = tuple(proba[i:i + 1] for proba in probabilidades)
+        except Exception:
+            logging.exception("[lotes] %s: fallo el lote de %d filas, se predicen por separado", self.nombre, len(lote))
+            fallido = True
+            for p in lote:
+                try:
+                    p.resultado = self._puntuar(p.fila[None, :])
+                except Exception as e:
+                    p.error = e
+        prediccion = (time.perf_counter() - inicio) * 1000
+        with self._cond:
+            self.metricas.registrar(len(lote), esperas, prediccion)
+            self.metricas.fallidos += fallido
+            for p in lote:
+                p.listo = True
+            self._cond.notify_all()
+
+    def resumen(self):
+        with self._cond:
+            return {"ventana_ms": self.ventana * 1000, "max_filas": self.max_filas, **self.metricas.resumen()}
+
+
+def medir_concurrencia(pipeline, filas, hilos, solicitudes):
+    """p50/p99 por solicitud y solicitudes por segundo con `hilos` clientes llamando a la vez.
+
+    Cada hilo hace `solicitudes` llamadas a `pipeline.puntuar_fila` con las
+    filas de `filas` por turno.
+    """
+    tiempos = [[] for _ in range(hilos)]
+    barrera = threading.Barrier(hilos + 1)
+
+    def cliente(h):
+        barrera.wait()
+        for s in range(solicitudes):
+            t = time.perf_counter()
+            pipeline.puntuar_fila(filas[(h * solicitudes + s) % len(filas)])
+            tiempos[h].append(time.perf_counter() - t)
+
+    trabajadores = [threading.Thread(target=cliente, args=(h,)) for h in range(hilos)]
+    for t in trabajadores:
+        t.start()
+    barrera.wait()
+    inicio = time.perf_counter()
+    for t in trabajadores:
+        t.join()
+    total = time.perf_counter() - inicio
+    ms = 1000 * np.concatenate([np.asarray(t) for t in tiempos])
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "solicitudes_s": round(hilos * solicitudes / total, 1),
+    }
+
+
+def filas_sinteticas(pipeline, cantidad, semilla=0):
+    """Filas de entradas del pipeline dentro del rango de ajuste de sus scalers (el resto en [0, 1))."""
+    rng = np.random.default_rng(semilla)
+    filas = rng.random((cantidad, len(pipeline.entradas)))
+    for e in pipeline.escaladores:
+        minimo = np.asarray(e.scaler.data_min_, dtype=np.float64)
+        maximo = np.asarray(e.scaler.data_max_, dtype=np.float64)
+        filas[:, e.posiciones] = minimo + rng.random((cantidad, len(minimo))) * (maximo - minimo)
+    return filas
+
+
+def main(argv=None):
+    from src.models.pipeline_modelos import PipelineModelos
+    from src.services.motores import SECCIONES_RUTAS, especificacion_config
+    from src.utils.helpers import cargar_modelo
+
+    parser = argparse.ArgumentParser(description="Latencia y rendimiento de la prediccion con y sin cola de micro-lotes")
+    parser.add_argument("--hilos", type=int, default=16, help="Clientes concurrentes")
+    parser.add_argument("--solicitudes", type=int, default=200, help="Llamadas por cliente")
+    parser.add_argument("--ventana-ms", type=float, nargs="+", default=[0.0, 2.0], help="Ventanas a medir")
+    parser.add_argument("--max-filas", type=int, default=64)
+    args = parser.parse_args(argv)
+    modelos, modelos_fpd, scalers = (especificacion_config()[s] for s in SECCIONES_RUTAS)
+    pares = [
+        (cargar_modelo(modelos["hortensia"]), cargar_modelo(scalers["min_max_scaler_experian_H"])),
+        (cargar_modelo(modelos_fpd["hortensia_fpd"]), cargar_modelo(scalers["min_max_scaler_experian_FPD"])),
+    ]
+    reporte = {}
+    for ventana in [None] + args.ventana_ms:
+        pipeline = PipelineModelos(pares, lotes=ventana is not None, ventana_ms=ventana or 0, max_filas=args.max_filas)
+        filas = filas_sinteticas(pipeline, 1024)
+        clave = "sin_cola" if ventana is None else f"ventana_{ventana:g}ms"
+        reporte[clave] = medir_concurrencia(pipeline, filas, args.hilos, args.solicitudes)
+        if pipeline.cola is not None:
+            reporte[clave]["cola"] = pipeline.cola.resumen()
+    print(json.dumps(reporte, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,292 @@
+"""Evaluador NumPy de los ensambles LightGBM (sin entrar a LightGBM).
+
+`predict_proba` sobre una fila paga un costo fijo alto: validacion de la
+entrada, conversion del DataFrame, llamada a la libreria nativa y su pool de
+hilos. `EnsambleNumpy.compilar` exporta los arboles del booster
+(`dump_model`) a arreglos planos, una entrada por nodo interno:
+
+- `feature`, `umbral`: el split numerico (`x <= umbral` va a la izquierda).
+- `faltante`: el valor que toma un NaN en ese nodo, -inf si va a la izquierda
+  (segun `missing_type` y `default_left`) o NaN si va a la derecha; se aplica
+  con un solo `np.fmax`.
+- `descarte`: las hojas del arbol que siguen en juego si el nodo va a la
+  derecha (todas menos las de su subarbol izquierdo), como bits de un uint64.
+- los splits categoricos (`==`) aparte: sus nodos y un bitset de las
+  categorias que van a la izquierda.
+
+Cada fila evalua todos los nodos a la vez; por arbol, el AND de los
+`descarte` de los nodos que van a la derecha deja como bit mas bajo la hoja
+de salida (el recorrido de QuickScorer), asi que el costo no depende de la
+profundidad. La suma de las hojas en el orden de los arboles, las reglas de
+NaN y de categorias y la sigmoide son las de LightGBM: las probabilidades
+coinciden bit a bit con `predict_proba` (`verificar_ensamble`). Un modelo con
+algo que el evaluador no reproduce (multiclase, arboles lineales,
+`average_output`, categoricas de pandas, `missing_type` Zero, mas de 64
+hojas) no se compila y sigue por el booster.
+
+`medir_latencia` compara p50/p99 de `predict_proba`, del booster y del
+evaluador. Uso:
+
+    python -m src.models.ensamble_numpy --filas 2000 --repeticiones 300
+"""
+import argparse
+import json
+import logging
+import math
+import time
+
+import numpy as np
+from lightgbm import LGBMClassifier
+
+# LightGBM trata |x| <= kZeroThreshold (1e-35f) como cero al leer una fila densa
+K_CERO = float(np.float32(1e-35))
+TODAS = np.uint64(0xFFFFFFFFFFFFFFFF)
+MAX_HOJAS = 64
+
+
+def _aplanar(arboles):
+    """Nodos internos de `arboles` (`tree_structure` de `dump_model`) en listas planas.
+
+    Devuelve `(nodos, categorias, inicios, hojas, bases)`: cada nodo es
+    `(feature, umbral, faltante, mascara)` con `mascara` los bits de las hojas
+    de su subarbol izquierdo; `categorias` va de nodo a las categorias que van
+    a la izquierda; `inicios[t]` es el primer nodo del arbol `t` y `bases[t]`
+    su primera hoja en `hojas` (de izquierda a derecha). Devuelve `None` si
+    algun arbol no se puede reproducir.
+    """
+    nodos = []
+    categorias = {}
+    inicios = []
+    hojas = []
+    bases = []
+    for arbol in arboles:
+        inicios.append(len(nodos))
+        bases.append(len(hojas))
+        if "leaf_value" in arbol:
+            # Arbol de una hoja: un nodo que nunca descarta nada
+            nodos.append((0, np.nan, np.nan, 0))
+            hojas.append(float(arbol["leaf_value"]))
+            continue
+        # (nodo, k): k es None en la primera visita y el indice del nodo al volver del subarbol izquierdo
+        pila = [(arbol, None)]
+        primera = {}
+        while pila:
+            nodo, k = pila.pop()
+            if k is not None:
+                hoja = len(hojas) - bases[-1]
+                feature, umbral, faltante, _ = nodos[k]
+                nodos[k] = (feature, umbral, faltante, ((1 << hoja) - 1) ^ ((1 << primera[k]) - 1))
+                pila.append((nodo["right_child"], None))
+                continue
+            if "leaf_value" in nodo:
+                hojas.append(float(nodo["leaf_value"]))
+                continue
+            if nodo["missing_type"] == "Zero":
+                return None
+            k = len(nodos)
+            primera[k] = len(hojas) - bases[-1]
+            if nodo["decision_type"] == "==":
+                # CategoricalDecision: NaN y negativos a la derecha; el resto se trunca a int
+                categorias[k] = sorted({int(c) for c in str(nodo["threshold"]).split("||")})
+                nodos.append((nodo["split_feature"], np.nan, np.nan, 0))
+            else:
+                umbral = float(nodo["threshold"])
+                # dump_model recorta los umbrales infinitos a +-1e300 (AvoidInf)
+                if abs(umbral) >= 1e300:
+                    umbral = math.copysign(math.inf, umbral)
+                # NumericalDecision: un NaN sin missing_type NaN se evalua como 0.0
+                izquierda = bool(nodo["default_left"]) if nodo["missing_type"] == "NaN" else 0.0 <= umbral
+                nodos.append((nodo["split_feature"], umbral, -np.inf if izquierda else np.nan, 0))
+            pila.append((nodo, k))
+            pila.append((nodo["left_child"], None))
+        if len(hojas) - bases[-1] > MAX_HOJAS:
+            return None
+    return nodos, categorias, inicios, hojas, bases
+
+
+class EnsambleNumpy:
+    """Arboles de un clasificador binario LightGBM en arreglos NumPy planos."""
+
+    def __init__(self, dump, aplanado):
+        nodos, categorias, inicios, hojas, bases = aplanado
+        self.n_features = dump["max_feature_idx"] + 1
+        self.n_arboles = len(inicios)
+        self.sigmoide = float(dump["objective"].split("sigmoid:")[1].split()[0])
+        feature, umbral, faltante, mascara = zip(*nodos)
+        self.feature = np.array(feature, dtype=np.intp)
+        self.umbral = np.array(umbral, dtype=np.float64)
+        self.faltante = np.array(faltante, dtype=np.float64)
+        self.descarte = ~np.array(mascara, dtype=np.uint64)
+        self.inicios = np.array(inicios, dtype=np.intp)
+        self.bases = np.array(bases, dtype=np.intp)
+        self.hojas = np.array(hojas, dtype=np.float64)
+        # Solo hace falta llevar |x| <= K_CERO a 0.0 si algun umbral cae en ese intervalo
+        self.con_cero = bool((np.abs(self.umbral) <= K_CERO).any())
+        # Splits categoricos: tabla[inicio_cat[j] + c] para 0 <= c < ancho_cat[j]
+        self.nodos_cat = np.array(sorted(categorias), dtype=np.intp)
+        self.feature_cat = self.feature[self.nodos_cat]
+        anchos = [categorias[k][-1] + 1 for k in self.nodos_cat]
+        self.ancho_cat = np.array(anchos, dtype=np.float64)
+        self.inicio_cat = np.cumsum([0] + anchos, dtype=np.intp)[:len(anchos)]
+        self.tabla = np.zeros(sum(anchos), dtype=bool)
+        for j, k in enumerate(self.nodos_cat):
+            self.tabla[self.inicio_cat[j] + np.array(categorias[k], dtype=np.intp)] = True
+
+    @classmethod
+    def compilar(cls, modelo):
+        """Ensamble del LGBMClassifier binario `modelo`; `None` si el evaluador no lo reproduce."""
+        if not isinstance(modelo, LGBMClassifier) or modelo.n_classes_ != 2 or not isinstance(modelo.objective_, str):
+            return None
+        booster = modelo.booster_
+        if getattr(booster, "pandas_categorical", None) or booster.params.get("linear_tree"):
+            return None
+        inicio = time.perf_counter()
+        dump = booster.dump_model()
+        if (
+            dump.get("num_tree_per_iteration", 1) != 1
+            or dump.get("average_output")
+            or not str(dump.get("objective", "")).startswith("binary sigmoid:")
+        ):
+            return None
+        aplanado = _aplanar([t["tree_structure"] for t in dump["tree_info"]])
+        if aplanado is None:
+            logging.info("[ensamble] modelo con splits que el evaluador no reproduce: se usa el booster")
+            return None
+        ensamble = cls(dump, aplanado)
+        logging.info(
+            "[ensamble] %d arboles, %d nodos (%d categoricos) compilados en %.0f ms",
+            ensamble.n_arboles, len(ensamble.feature), len(ensamble.nodos_cat), 1000 * (time.perf_counter() - inicio),
+        )
+        return ensamble
+
+    def margen(self, X):
+        """Suma de las hojas (score crudo) por fila de `X` `(filas, n_features)`."""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"Se esperaban {self.n_features} features y llegaron {X.shape[1]}")
+        x = X[:, self.feature]
+        if self.con_cero:
+            x[np.abs(x) <= K_CERO] = 0.0
+        izquierda = np.fmax(x, self.faltante) <= self.umbral
+        if len(self.nodos_cat):
+            c = np.trunc(X[:, self.feature_cat])
+            valida = (c >= 0) & (c < self.ancho_cat)
+            izquierda[:, self.nodos_cat] = valida & self.tabla[self.inicio_cat + np.where(valida, c, 0).astype(np.intp)]
+        restantes = np.bitwise_and.reduceat(np.where(izquierda, TODAS, self.descarte), self.inicios, axis=1)
+        # La hoja de salida es el bit mas bajo que sobrevive
+        hoja = np.log2((restantes & (~restantes + np.uint64(1))).astype(np.float64)).astype(np.intp)
+        # LightGBM acumula los arboles en orden, uno a uno: cumsum suma en ese orden
+        return np.cumsum(self.hojas[self.bases + hoja], axis=1)[:, -1]
+
+    def probabilidad(self, X):
+        """Probabilidad de la clase positiva por fila de `X` (lo de `predict_proba(X)[:, 1]`)."""
+        # math.exp es la exp de la libm, la misma que usa LightGBM
+        return np.array([1.0 / (1.0 + math.exp(-self.sigmoide * m)) for m in self.margen(X).tolist()])
+
+
+def conjunto_referencia(ensamble, filas, semilla=0):
+    """Matriz `(filas, n_features)` que ejercita los splits del ensamble.
+
+    Cada valor sale de los umbrales de su feature (el umbral exacto y sus
+    vecinos flotantes), de las categorias de sus splits categoricos o es NaN,
+    cero, infinito o un valor aleatorio, para cubrir las dos ramas y los
+    faltantes de cada nodo.
+    """
+    rng = np.random.default_rng(semilla)
+    candidatos = [[np.nan, 0.0, -0.0, K_CERO / 2, np.inf, -np.inf, -1.0, -0.5] for _ in range(ensamble.n_features)]
+    for f, u in zip(ensamble.feature, ensamble.umbral):
+        if not np.isnan(u):
+            candidatos[f].extend((u, np.nextafter(u, -np.inf), np.nextafter(u, np.inf)))
+    for j, f in enumerate(ensamble.feature_cat):
+        ancho = int(ensamble.ancho_cat[j])
+        tabla = ensamble.tabla[ensamble.inicio_cat[j]:ensamble.inicio_cat[j] + ancho]
+        candidatos[f].extend(np.flatnonzero(tabla) + 0.0)
+        candidatos[f].extend((ancho + 0.0, ancho + 5.0, 0.5, 2.0**31))
+    X = np.empty((filas, ensamble.n_features), dtype=np.float64)
+    for f, valores in enumerate(candidatos):
+        valores = np.asarray(valores, dtype=np.float64)
+        X[:, f] = valores[rng.integers(len(valores), size=filas)]
+        aleatorios = rng.random(filas) < 0.1
+        X[aleatorios, f] = rng.normal(0, 10, size=int(aleatorios.sum()))
+    return X
+
+
+def verificar_ensamble(modelo, X, ensamble=None):
+    """Filas de `X` en que el evaluador no da exactamente `predict_proba(X)[:, 1]`.
+
+    Devuelve la lista de `(fila, referencia, numpy)`.
+    """
+    ensamble = ensamble or EnsambleNumpy.compilar(modelo)
+    referencia = modelo.predict_proba(X)[:, 1]
+    evaluada = ensamble.probabilidad(X)
+    distintas = np.flatnonzero(referencia != evaluada)
+    diferencias = [(int(i), float(referencia[i]), float(evaluada[i])) for i in distintas]
+    logging.info("[ensamble] verificar_ensamble: %d filas, %d diferencias", len(X), len(diferencias))
+    return diferencias
+
+
+def _percentiles(tiempos):
+    ms = 1000 * np.asarray(tiempos)
+    return {"p50_ms": round(float(np.percentile(ms, 50)), 4), "p99_ms": round(float(np.percentile(ms, 99)), 4)}
+
+
+def medir_latencia(modelo, X, repeticiones=200, lote=64, ensamble=None):
+    """p50/p99 por llamada de `predict_proba`, del booster y del evaluador NumPy.
+
+    Mide una fila por llamada (las filas de `X` por turno) y lotes de `lote`
+    filas.
+    """
+    ensamble = ensamble or EnsambleNumpy.compilar(modelo)
+    rutas = {
+        "predict_proba": lambda A: modelo.predict_proba(A)[:, 1],
+        "booster": modelo.booster_.predict,
+        "numpy": ensamble.probabilidad,
+    }
+    resultado = {}
+    for nombre, funcion in rutas.items():
+        for etiqueta, filas in (("fila", 1), (f"lote_{lote}", lote)):
+            tiempos = []
+            for r in range(repeticiones):
+                inicio = (r * filas) % max(len(X) - filas + 1, 1)
+                A = X[inicio:inicio + filas]
+                t = time.perf_counter()
+                funcion(A)
+                tiempos.append(time.perf_counter() - t)
+            resultado[f"{nombre}/{etiqueta}"] = _percentiles(tiempos)
+    return resultado
+
+
+def main(argv=None):
+    import warnings
+
+    from src.config.config import MODEL_PATHS, MODEL_PATHS_FPD
+    from src.utils.helpers import cargar_modelo
+
+    parser = argparse.ArgumentParser(description="Exactitud y latencia del evaluador NumPy de los modelos LightGBM")
+    parser.add_argument("--filas", type=int, default=2000, help="Filas del conjunto de referencia por modelo")
+    parser.add_argument("--repeticiones", type=int, default=200, help="Llamadas medidas por ruta")
+    parser.add_argument("--lote", type=int, default=64, help="Filas por llamada en la medicion de lotes")
+    args = parser.parse_args(argv)
+    # predict_proba advierte por los arreglos sin nombres de columnas
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+    reporte = {}
+    for nombre, ruta in {**MODEL_PATHS, **MODEL_PATHS_FPD}.items():
+        modelo = cargar_modelo(ruta)
+        ensamble = EnsambleNumpy.compilar(modelo)
+        if ensamble is None:
+            reporte[nombre] = {"compilado": False}
+            continue
+        X = conjunto_referencia(ensamble, args.filas)
+        reporte[nombre] = {
+            "compilado": True,
+            "diferencias": len(verificar_ensamble(modelo, X, ensamble)),
+            "latencia": medir_latencia(modelo, X, args.repeticiones, args.lote, ensamble),
+        }
+    print(json.dumps(reporte, indent=2))
+    return 1 if any(r.get("diferencias") for r in reporte.values()) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
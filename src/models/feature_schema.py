@@ -0,0 +1,177 @@
+"""Esquema fijo de features respaldado por arreglos.
+
+Un `EsquemaFeatures` es el registro declarado de features (nombre, dtype y
+default) con el slot de cada una calculado una sola vez. Un `RegistroFeatures`
+es una fila de ese esquema: los valores numericos viven en un arreglo float64
+preasignado y se escriben por slot, sin diccionarios intermedios ni coercion
+posterior con `pd.to_numeric`.
+"""
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Optional, Sequence
+
+FLOAT = "float64"
+INT = "int64"
+TEXTO = "object"
+
+
+def a_numero(valor: Any) -> float:
+    """Convierte un valor suelto igual que `pd.to_numeric(errors='coerce')`."""
+    if valor is None:
+        return np.nan
+    if isinstance(valor, (int, float, np.integer, np.floating)) and not isinstance(valor, bool):
+        return float(valor)
+    if not isinstance(valor, str) or '_' in valor:
+        return np.nan
+    try:
+        return float(valor)
+    except ValueError:
+        return np.nan
+
+
+class Feature:
+    """Entrada del registro: nombre, dtype (FLOAT, INT o TEXTO) y valor por defecto."""
+
+    __slots__ = ("nombre", "dtype", "default")
+
+    def __init__(self, nombre: str, dtype: str = FLOAT, default: Any = np.nan):
+        if dtype not in (FLOAT, INT, TEXTO):
+            raise ValueError(f"dtype no soportado para {nombre}: {dtype}")
+        self.nombre = nombre
+        self.dtype = dtype
+        self.default = default
+
+    def __repr__(self) -> str:
+        return f"Feature({self.nombre!r}, {self.dtype!r}, {self.default!r})"
+
+
+class EsquemaFeatures:
+    """Registro inmutable de features con slots precalculados.
+
+    `texto_extra` decide si una clave fuera del esquema se conserva como texto
+    (por defecto todas las extras se convierten a numero).
+    """
+
+    def __init__(self, features: Iterable[Feature], texto_extra: Optional[Callable[[str], bool]] = None):
+        self.features = tuple(features)
+        self.nombres = tuple(f.nombre for f in self.features)
+        self.slots = {nombre: i for i, nombre in enumerate(self.nombres)}
+        if len(self.slots) != len(self.nombres):
+            repetidos = sorted({n for n in self.nombres if self.nombres.count(n) > 1})
+            raise ValueError(f"Features repetidas en el esquema: {repetidos}")
+        dtypes = np.array([f.dtype for f in self.features], dtype=object)
+        self.numericos = dtypes != TEXTO
+        self.enteros = dtypes == INT
+        self.defaults = np.array(
+            [float(f.default) if f.dtype != TEXTO else np.nan for f in self.features],
+            dtype=np.float64,
+        )
+        self.texto_extra = texto_extra or (lambda nombre: False)
+        self._indices = {}
+
+    @classmethod
+    def desde_nombres(cls, nombres: Sequence[str], dtype: str = FLOAT, default: Any = np.nan) -> "EsquemaFeatures":
+        """Esquema homogeneo, p.e. a partir de `scaler.feature_names_in_`."""
+        return cls(Feature(str(nombre), dtype, default) for nombre in nombres)
+
+    def __len__(self) -> int:
+        return len(self.nombres)
+
+    def __contains__(self, nombre: str) -> bool:
+        return nombre in self.slots
+
+    def indices(self, nombres: Sequence[str]) -> np.ndarray:
+        """Slots de `nombres` (en ese orden); se memoriza por lista de nombres."""
+        clave = tuple(nombres)
+        idx = self._indices.get(clave)
+        if idx is None:
+            faltantes = [n for n in clave if n not in self.slots]
+            if faltantes:
+                raise KeyError(f"Features fuera del esquema: {faltantes}")
+            idx = np.fromiter((self.slots[n] for n in clave), dtype=np.intp, count=len(clave))
+            self._indices[clave] = idx
+        return idx
+
+    def nuevo_registro(self) -> "RegistroFeatures":
+        return RegistroFeatures(self)
+
+
+class RegistroFeatures:
+    """Una fila de un `EsquemaFeatures`.
+
+    Acepta la misma interfaz de escritura que el `OrderedDict` de la extraccion
+    (`registro[clave] = valor`, `update`), de modo que los reductores pueden
+    volcar sus pares directamente sobre el arreglo.
+    """
+
+    __slots__ = ("esquema", "valores", "presentes", "textos", "extras")
+
+    def __init__(self, esquema: EsquemaFeatures):
+        self.esquema = esquema
+        self.valores = esquema.defaults.copy()
+        self.presentes = np.zeros(len(esquema), dtype=bool)
+        self.textos = {}
+        self.extras = OrderedDict()
+
+    def __setitem__(self, nombre: str, valor: Any) -> None:
+        slot = self.esquema.slots.get(nombre)
+        if slot is None:
+            self.extras[nombre] = valor
+            return
+        self.presentes[slot] = True
+        if self.esquema.numericos[slot]:
+            self.valores[slot] = a_numero(valor)
+        else:
+            self.textos[slot] = valor
+
+    def update(self, pares) -> None:
+        for nombre, valor in (pares.items() if hasattr(pares, "items") else pares):
+            self[nombre] = valor
+
+    def __contains__(self, nombre: str) -> bool:
+        slot = self.esquema.slots.get(nombre)
+        return bool(self.presentes[slot]) if slot is not None else nombre in self.extras
+
+    def __len__(self) -> int:
+        return int(self.presentes.sum()) + len(self.extras)
+
+    def get(self, nombre: str, default: Any = None) -> Any:
+        slot = self.esquema.slots.get(nombre)
+        if slot is None:
+            return self.extras.get(nombre, default)
+        if not self.presentes[slot]:
+            return default
+        if self.esquema.numericos[slot]:
+            return self.valores[slot]
+        return self.textos[slot]
+
+    def vector(self, nombres: Sequence[str]) -> np.ndarray:
+        """Gather float64 de `nombres` por slot (los ausentes quedan con su default)."""
+        return self.valores[self.esquema.indices(nombres)]
+
+    def a_dataframe(self) -> pd.DataFrame:
+        """DataFrame de una fila con las features presentes, ya tipadas.
+
+        Las columnas numericas salen en bloques float64/int64 construidos desde el
+        arreglo; solo las claves fuera del esquema pasan por `pd.to_numeric`.
+        """
+        esquema = self.esquema
+        slots = np.flatnonzero(self.presentes)
+        nombres = [esquema.nombres[i] for i in slots]
+
+        num = slots[esquema.numericos[slots] & ~esquema.enteros[slots]]
+        ent = slots[esquema.enteros[slots]]
+        txt = slots[~esquema.numericos[slots]]
+        bloques = [
+            pd.DataFrame(self.valores[num][None, :], columns=[esquema.nombres[i] for i in num]),
+            pd.DataFrame(self.valores[ent][None, :].astype(np.int64), columns=[esquema.nombres[i] for i in ent]),
+            pd.DataFrame([[self.textos[i] for i in txt]], columns=[esquema.nombres[i] for i in txt], dtype=object),
+        ]
+        if self.extras:
+            extras = pd.DataFrame([self.extras])
+            numericas = [c for c in extras.columns if not esquema.texto_extra(c)]
+            extras[numericas] = extras[numericas].apply(pd.to_numeric, errors='coerce')
+            bloques.append(extras)
+            nombres.extend(c for c in extras.columns if c not in esquema.slots)
+        return pd.concat(bloques, axis=1)[nombres]
@@ -1,8 +1,47 @@
 import logging
 import numpy as np
 import pandas as pd
+from lightgbm import LGBMClassifier
 from typing import Optional, Tuple
 
+from src.services.hilos_inferencia import PRESUPUESTO
+from src.services.registro import es_numero
+from src.utils.contabilidad_copias import etapa
+
+
+def matriz_scaler(df: pd.DataFrame, scaler) -> np.ndarray:
+    """Arreglo float64 con las features del scaler, en su orden (inf -> NaN)."""
+    X = df[scaler.feature_names_in_].to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+    X[np.isinf(X)] = np.nan
+    return X
+
+
+def escalar_minmax(X: np.ndarray, scaler) -> np.ndarray:
+    """Aplica el MinMaxScaler ajustado directamente sobre el arreglo (in place).
+
+    Mismas operaciones que `MinMaxScaler.transform`, sin reconstruir un
+    DataFrame ni volver a validar/alinear nombres de columnas.
+    """
+    X *= scaler.scale_
+    X += scaler.min_
+    if scaler.clip:
+        np.clip(X, scaler.feature_range[0], scaler.feature_range[1], out=X)
+    return X
+
+
+def frame_modelo(df: pd.DataFrame, X: np.ndarray, scaler, features_modelo) -> pd.DataFrame:
+    """DataFrame con las features del modelo: las del scaler desde `X`, el resto tal cual de `df`.
+
+    Solo se construyen las columnas que el modelo va a leer; `df` no se copia
+    ni se modifica.
+    """
+    posiciones = {f: j for j, f in enumerate(scaler.feature_names_in_)}
+    columnas = {}
+    for f in features_modelo:
+        j = posiciones.get(f)
+        columnas[f] = X[:, j] if j is not None else df[f]
+    return pd.DataFrame(columnas, index=df.index, copy=False)
+
 
 def normalize_and_select(
     df: pd.DataFrame,
@@ -13,28 +52,167 @@ def normalize_and_select(
 ) -> Tuple[pd.DataFrame, list, pd.DataFrame, Optional[list]]:
     """
     Normaliza features para modelos H y FPD y retorna dataframes y listas de features.
+
+    `df_h` y `df_fpd` traen solo las features de cada modelo (ver
+    `frame_modelo`), sin copiar el DataFrame completo del cliente.
     """
     logging.info("Normalizando y seleccionando features (util)")
+    with etapa("normalize_and_select"):
+        # H
+        features_minmax_h = scaler_h.feature_names_in_
+        logging.info("[features] scaler_H features_in full: %s", features_minmax_h)
+
+        features_h = model_h.feature_name_
+        df_h = frame_modelo(df, escalar_minmax(matriz_scaler(df, scaler_h), scaler_h), scaler_h, features_h)
+        logging.info("[features] model_H features_in full: %s", features_h)
+
+        # FPD
+        features_minmax_fpd = scaler_fpd.feature_names_in_
+        logging.info("[features] scaler_FPD features_in full: %s", features_minmax_fpd)
+        features_fpd = model_fpd.feature_name_
+        df_fpd = frame_modelo(df, escalar_minmax(matriz_scaler(df, scaler_fpd), scaler_fpd), scaler_fpd, features_fpd)
+        logging.info("[features] model_FPD features_in full: %s", features_fpd)
+
+    return df_h, features_h, df_fpd, features_fpd
+
+
+def vector_registro(registro: dict, nombres) -> Optional[np.ndarray]:
+    """Fila `(1, len(nombres))` float64 del registro, como `matriz_scaler` sobre la fila (inf -> NaN).
+
+    `None` (nulo) pasa a NaN y un texto numerico se convierte como lo haria
+    `to_numpy(dtype=float64)`; cualquier otro valor devuelve `None`.
+    """
+    fila = []
+    for nombre in nombres:
+        valor = registro[nombre]
+        if valor is None:
+            fila.append(np.nan)
+        elif es_numero(valor) or isinstance(valor, (bool, np.bool_)):
+            fila.append(float(valor))
+        elif isinstance(valor, str):
+            try:
+                fila.append(float(valor))
+            except ValueError:
+                return None
+        else:
+            return None
+    X = np.array([fila], dtype=np.float64)
+    X[np.isinf(X)] = np.nan
+    return X
+
+
+def fila_modelo(registro: dict, X: np.ndarray, scaler, features_modelo) -> Optional[np.ndarray]:
+    """Fila float64 con las features del modelo en su orden: las del scaler desde `X`, el resto del registro.
 
-    # H
-    features_minmax_h = scaler_h.feature_names_in_
-    logging.info("[features] scaler_H features_in full: %s", features_minmax_h)
-
-    df_minmax_h = df[features_minmax_h].copy().astype(float)
-    df_minmax_h.replace([np.inf, -np.inf], np.nan, inplace=True)
-    df_h = df.copy()
-    df_h[features_minmax_h] = scaler_h.transform(df_minmax_h)
-    features_h = model_h.feature_name_
-    logging.info("[features] model_H features_in full: %s", features_h)
-
-    # FPD
-    features_minmax_fpd = scaler_fpd.feature_names_in_
-    logging.info("[features] scaler_FPD features_in full: %s", features_minmax_fpd) 
-    df_minmax_fpd = df[features_minmax_fpd].copy().astype(float)
-    df_minmax_fpd.replace([np.inf, -np.inf], np.nan, inplace=True)
-    df_fpd = df.copy()
-    df_fpd[features_minmax_fpd] = scaler_fpd.transform(df_minmax_fpd)
-    features_fpd = model_fpd.feature_name_
-    logging.info("[features] model_FPD features_in full: %s", features_fpd)
-
-    return df_h, features_h, df_fpd, features_fpd
\ No newline at end of file
+    Es la matriz que LightGBM arma desde `frame_modelo`. `None` si alguna
+    feature sin escalar no seria una columna numerica (LightGBM la rechaza).
+    """
+    posiciones = {f: j for j, f in enumerate(scaler.feature_names_in_)}
+    fila = np.empty((1, len(features_modelo)), dtype=np.float64)
+    solo_bool = True
+    for k, f in enumerate(features_modelo):
+        j = posiciones.get(f)
+        if j is not None:
+            fila[0, k] = X[0, j]
+            solo_bool = False
+            continue
+        valor = registro[f]
+        if es_numero(valor):
+            solo_bool = False
+        elif not isinstance(valor, (bool, np.bool_)):
+            return None
+        fila[0, k] = float(valor)
+    if solo_bool:
+        # Con solo columnas bool LightGBM convierte a float32
+        return None
+    return fila
+
+
+def normalize_and_select_registro(
+    registro: dict,
+    model_h,
+    scaler_h,
+    model_fpd,
+    scaler_fpd,
+) -> Optional[Tuple[np.ndarray, list, np.ndarray, list]]:
+    """Ruta escalar de `normalize_and_select`: filas float64 de las features de cada modelo.
+
+    Devuelve `(X_h, features_h, X_fpd, features_fpd)` o `None` si el registro
+    no la admite (se usa la ruta pandas).
+    """
+    logging.info("Normalizando y seleccionando features (registro)")
+    with etapa("normalize_and_select"):
+        seleccion = []
+        for modelo, scaler in ((model_h, scaler_h), (model_fpd, scaler_fpd)):
+            X = vector_registro(registro, scaler.feature_names_in_)
+            if X is None:
+                return None
+            fila = fila_modelo(registro, escalar_minmax(X, scaler), scaler, modelo.feature_name_)
+            if fila is None:
+                return None
+            seleccion += [fila, modelo.feature_name_]
+    return tuple(seleccion)
+
+
+def probabilidad(modelo, X: np.ndarray) -> np.ndarray:
+    """`modelo.predict_proba(...)[:, 1]` para una matriz float64 con las features del modelo en orden.
+
+    Con un LGBMClassifier binario se llama directo al booster: mismo
+    resultado, sin la validacion de nombres de columnas de sklearn (que
+    advierte con arreglos sin nombres). Los hilos de LightGBM salen del
+    presupuesto del worker segun las filas de `X` (ver `hilos_inferencia`).
+    """
+    hilos = PRESUPUESTO.hilos(len(X))
+    parametros = {"num_threads": hilos} if hilos else {}
+    if isinstance(modelo, LGBMClassifier) and modelo.n_classes_ == 2 and isinstance(modelo.objective_, str):
+        return modelo.booster_.predict(X, **parametros)
+    if isinstance(modelo, LGBMClassifier):
+        return modelo.predict_proba(X, **parametros)[:, 1]
+    return modelo.predict_proba(X)[:, 1]
+
+
+def probabilidades_lote(
+    registros: list,
+    model_h,
+    scaler_h,
+    model_fpd,
+    scaler_fpd,
+) -> list:
+    """`normalize_and_select_registro` + `probabilidad` para varios registros a la vez.
+
+    Los vectores de todos los registros se apilan en una matriz por scaler, se
+    escalan juntos y cada modelo predice una sola vez; fila a fila el resultado
+    es el mismo que con un registro a la vez. Devuelve una lista alineada con
+    `registros`: `(proba_h, proba_fpd)` (arreglos de un elemento, como
+    `probabilidad` sobre una fila) o `None` si el registro no admite la ruta
+    escalar o falla al armar sus filas (el llamador lo procesa solo).
+    """
+    logging.info("Normalizando y seleccionando features (lote de %d registros)", len(registros))
+    modelos = ((model_h, scaler_h), (model_fpd, scaler_fpd))
+    resultado = [None] * len(registros)
+    with etapa("normalize_and_select"):
+        vectores = {}
+        for i, registro in enumerate(registros):
+            try:
+                crudos = [vector_registro(registro, scaler.feature_names_in_) for _, scaler in modelos]
+            except Exception:
+                logging.exception("Registro %d del lote sin ruta escalar", i)
+                continue
+            if all(X is not None for X in crudos):
+                vectores[i] = crudos
+        filas = {i: [] for i in vectores}
+        for k, (modelo, scaler) in enumerate(modelos):
+            if not vectores:
+                break
+            X = escalar_minmax(np.vstack([crudos[k] for crudos in vectores.values()]), scaler)
+            for fila_X, i in enumerate(vectores):
+                filas[i].append(fila_modelo(registros[i], X[fila_X:fila_X + 1], scaler, modelo.feature_name_))
+        admitidos = [i for i, filas_i in filas.items() if all(f is not None for f in filas_i)]
+    if not admitidos:
+        return resultado
+    probabilidades = [
+        probabilidad(modelo, np.vstack([filas[i][k] for i in admitidos])) for k, (modelo, _) in enumerate(modelos)
+    ]
+    for fila, i in enumerate(admitidos):
+        resultado[i] = (probabilidades[0][fila:fila + 1], probabilidades[1][fila:fila + 1])
+    return resultado
@@ -0,0 +1,386 @@
+"""Scalers y modelos compilados en un solo pipeline de prediccion.
+
+`normalize_and_select` arma, por cada modelo, la matriz de las columnas de su
+scaler y la escala. Luego construye un DataFrame con las features del modelo,
+que LightGBM vuelve a convertir en arreglo. En NCL y Respaldo los dos modelos
+comparten scaler, asi que la misma transformacion se hace dos veces.
+`PipelineModelos` compila los pares `(modelo, scaler)` una sola vez, al
+cargar el motor:
+
+- `entradas`: union ordenada de las columnas que leen los scalers y de las
+  features que los modelos toman sin escalar. Una solicitud se lee con un
+  solo gather (`df[entradas]` o el registro).
+- por scaler distinto: las posiciones de sus columnas en `entradas` y los
+  vectores `scale_`/`min_` (mas el recorte). Dos scalers con el mismo
+  contenido se aplican una sola vez.
+- por modelo: la permutacion que toma sus features, en el orden del booster,
+  de la matriz `[entradas | escaladas]`.
+
+Una solicitud (o un lote) es un gather, una transformacion afin por scaler
+sobre un arreglo contiguo y `probabilidad` por modelo, sin DataFrames
+intermedios. Las operaciones son las de `matriz_scaler` + `escalar_minmax` +
+`frame_modelo`, asi que las probabilidades coinciden bit a bit. Si la entrada
+se sale del caso soportado (una feature sin escalar que LightGBM no tomaria
+como numerica, un modelo sin features escaladas) se devuelve `None` y el
+llamador usa `normalize_and_select`. `verificar_pipeline` compara ambas rutas.
+
+Con `modelos.evaluador_numpy_filas` > 0 cada modelo se compila ademas a un
+`EnsambleNumpy`, que predice las llamadas de hasta esas filas sin entrar a
+LightGBM (mismo resultado bit a bit).
+
+Con `modelos.lotes.activo` la prediccion de una fila pasa por una
+`ColaLotes`: las filas de solicitudes concurrentes se predicen juntas, con
+una llamada por modelo (ver `cola_lotes`).
+
+`etapas` da la parte de prediccion del grafo de un motor (ver
+`src.core.grafo_etapas`): una rama por modelo que escala y predice, con una
+etapa de escalado comun cuando los dos modelos comparten scaler. Las ramas
+corren en paralelo; cada una da lo mismo que `_probabilidades`.
+"""
+import logging
+
+import numpy as np
+
+from src.config.config import (
+    MODELOS_EVALUADOR_NUMPY_FILAS,
+    MODELOS_LOTES_ACTIVO,
+    MODELOS_LOTES_MAX_FILAS,
+    MODELOS_LOTES_VENTANA_MS,
+)
+from src.core.grafo_etapas import Etapa
+from src.models.cola_lotes import ColaLotes
+from src.models.ensamble_numpy import EnsambleNumpy
+from src.models.feature_utils import escalar_minmax, frame_modelo, matriz_scaler, normalize_and_select, probabilidad
+from src.services.almacen_artefactos import ALMACEN
+from src.services.registro import es_numero
+from src.utils.contabilidad_copias import etapa
+
+
+def _mismo_scaler(a, b):
+    """True si `a` y `b` transforman igual (mismo objeto o mismo contenido)."""
+    if a is b:
+        return True
+    return (
+        list(a.feature_names_in_) == list(b.feature_names_in_)
+        and np.array_equal(a.scale_, b.scale_)
+        and np.array_equal(a.min_, b.min_)
+        and bool(a.clip) == bool(b.clip)
+        and tuple(a.feature_range) == tuple(b.feature_range)
+    )
+
+
+class _Escalador:
+    __slots__ = ("scaler", "posiciones", "scale", "minimo", "recorte", "inicio")
+
+    def __init__(self, scaler, posiciones, inicio):
+        self.scaler = scaler
+        self.posiciones = np.asarray(posiciones, dtype=np.intp)
+        self.scale = np.asarray(scaler.scale_, dtype=np.float64)
+        self.minimo = np.asarray(scaler.min_, dtype=np.float64)
+        self.recorte = tuple(scaler.feature_range) if scaler.clip else None
+        self.inicio = inicio
+
+    def aplicar(self, crudo, destino):
+        """Escribe en `destino` (vista de la matriz combinada) las columnas escaladas de `crudo`."""
+        X = crudo[:, self.posiciones]
+        X[np.isinf(X)] = np.nan
+        X *= self.scale
+        X += self.minimo
+        if self.recorte is not None:
+            np.clip(X, self.recorte[0], self.recorte[1], out=X)
+        destino[:] = X
+
+
+class PipelineModelos:
+    """Pares `(modelo, scaler)` compilados: gather, transformacion afin y permutacion por modelo."""
+
+    def __init__(self, pares, evaluador_filas=None, lotes=None, ventana_ms=None, max_filas=None, nombre="pipeline"):
+        self.modelos = tuple(modelo for modelo, _ in pares)
+        self.evaluador_filas = MODELOS_EVALUADOR_NUMPY_FILAS if evaluador_filas is None else evaluador_filas
+        # Si el modelo vino del almacen de artefactos, su ensamble ya esta compilado y mapeado
+        self.evaluadores = tuple(
+            (ALMACEN.ensamble(modelo) or EnsambleNumpy.compilar(modelo)) if self.evaluador_filas > 0 else None
+            for modelo in self.modelos
+        )
+        posicion = {}
+
+        def entrada(nombre):
+            return posicion.setdefault(nombre, len(posicion))
+
+        escaladores = []
+        por_modelo = []
+        for _, scaler in pares:
+            k = next((i for i, e in enumerate(escaladores) if _mismo_scaler(e.scaler, scaler)), None)
+            if k is None:
+                k = len(escaladores)
+                escaladores.append(_Escalador(scaler, [entrada(n) for n in scaler.feature_names_in_], 0))
+            por_modelo.append(k)
+
+        crudas = set()
+        referencias = []
+        for modelo, k in zip(self.modelos, por_modelo):
+            columnas = {f: j for j, f in enumerate(escaladores[k].scaler.feature_names_in_)}
+            refs = []
+            for f in modelo.feature_name_:
+                j = columnas.get(f)
+                if j is None:
+                    refs.append((None, entrada(f)))
+                    crudas.add(f)
+                else:
+                    refs.append((k, j))
+            referencias.append(refs)
+
+        self.entradas = list(posicion)
+        self.crudas = [n for n in self.entradas if n in crudas]
+        inicio = len(self.entradas)
+        for e in escaladores:
+            e.inicio = inicio
+            inicio += len(e.posiciones)
+        self.ancho = inicio
+        self.escaladores = tuple(escaladores)
+        self.por_modelo = tuple(por_modelo)
+        self.permutaciones = tuple(
+            np.array([j if k is None else escaladores[k].inicio + j for k, j in refs], dtype=np.intp)
+            for refs in referencias
+        )
+        # Un modelo sin features escaladas deja a LightGBM el dtype de la matriz (p.e. float32 con
+        # bools) y uno entrenado con categoricas de pandas necesita el DataFrame
+        self.admitido = all(
+            (perm >= len(self.entradas)).any() and not getattr(getattr(modelo, "booster_", None), "pandas_categorical", None)
+            for modelo, perm in zip(self.modelos, self.permutaciones)
+        )
+        self._es_cruda = np.array([n in crudas for n in self.entradas])
+        # Cola de micro-lotes para las predicciones de una fila (None: cada una predice sola)
+        self.cola = ColaLotes(
+            self._puntuar,
+            MODELOS_LOTES_VENTANA_MS if ventana_ms is None else ventana_ms,
+            MODELOS_LOTES_MAX_FILAS if max_filas is None else max_filas,
+            nombre,
+        ) if (MODELOS_LOTES_ACTIVO if lotes is None else lotes) else None
+        logging.info(
+            "[pipeline] %d modelos, %d scalers distintos, %d entradas (%d sin escalar)",
+            len(self.modelos), len(escaladores), len(self.entradas), len(self.crudas),
+        )
+
+    def _matrices(self, crudo):
+        """Matriz float64 contigua de cada modelo desde las entradas crudas `(filas, entradas)`."""
+        combinada = np.empty((crudo.shape[0], self.ancho), dtype=np.float64)
+        combinada[:, :crudo.shape[1]] = crudo
+        for e in self.escaladores:
+            e.aplicar(crudo, combinada[:, e.inicio:e.inicio + len(e.posiciones)])
+        return [np.take(combinada, perm, axis=1) for perm in self.permutaciones]
+
+    def _probabilidad(self, m, X):
+        """`probabilidad` del modelo `m`; el evaluador NumPy si esta compilado y la matriz es chica."""
+        evaluador = self.evaluadores[m]
+        if evaluador is not None and len(X) <= self.evaluador_filas:
+            return evaluador.probabilidad(X)
+        return probabilidad(self.modelos[m], X)
+
+    def _probabilidades(self, matrices):
+        """`_probabilidad` de cada modelo."""
+        return tuple(self._probabilidad(m, X) for m, X in enumerate(matrices))
+
+    def escalar(self, k, crudo):
+        """Columnas escaladas por el escalador `k` desde las entradas crudas `(filas, entradas)`."""
+        e = self.escaladores[k]
+        escaladas = np.empty((crudo.shape[0], len(e.posiciones)), dtype=np.float64)
+        e.aplicar(crudo, escaladas)
+        return escaladas
+
+    def puntuar_modelo(self, m, crudo, escaladas):
+        """Probabilidad del modelo `m` desde las entradas crudas y las columnas de su escalador."""
+        e = self.escaladores[self.por_modelo[m]]
+        # Solo se llenan las entradas y el bloque de su escalador: la permutacion no lee otros
+        combinada = np.empty((crudo.shape[0], self.ancho), dtype=np.float64)
+        combinada[:, :crudo.shape[1]] = crudo
+        combinada[:, e.inicio:e.inicio + len(e.posiciones)] = escaladas
+        return self._probabilidad(m, np.take(combinada, self.permutaciones[m], axis=1))
+
+    def probabilidad_frame(self, m, df):
+        """Probabilidad del modelo `m` por la ruta de `normalize_and_select` (entradas que el pipeline no admite)."""
+        modelo = self.modelos[m]
+        scaler = self.escaladores[self.por_modelo[m]].scaler
+        X = frame_modelo(df, escalar_minmax(matriz_scaler(df, scaler), scaler), scaler, modelo.feature_name_)
+        return modelo.predict_proba(X[modelo.feature_name_])[:, 1]
+
+    def etapas(self, nombres):
+        """Etapas de grafo que van de (`crudo`, `frame`) a `proba_<nombre>` de cada modelo.
+
+        `crudo` son las entradas `(filas, entradas)` o `None` si el pipeline no
+        las admite; entonces cada modelo predice desde `frame` (el DataFrame del
+        cliente) como `normalize_and_select`. Con la cola de micro-lotes activa
+        los modelos van juntos en una sola etapa (la cola ya los predice en una
+        llamada por modelo).
+        """
+        salidas = tuple(f"proba_{n}" for n in nombres)
+        if self.cola is not None:
+            def modelos(crudo, frame):
+                if crudo is None:
+                    return tuple(self.probabilidad_frame(m, frame) for m in range(len(self.modelos)))
+                return self.cola.puntuar(crudo[0]) if len(crudo) == 1 else self._puntuar(crudo)
+            return [Etapa("modelos", modelos, ("crudo", "frame"), salidas)]
+
+        def escalar(k):
+            return lambda crudo: None if crudo is None else self.escalar(k, crudo)
+
+        def rama(m, propia):
+            # `propia`: el escalador solo sirve a este modelo y se aplica dentro de la rama
+            def puntuar(crudo, frame, *escaladas):
+                if crudo is None:
+                    return self.probabilidad_frame(m, frame)
+                return self.puntuar_modelo(m, crudo, self.escalar(self.por_modelo[m], crudo) if propia else escaladas[0])
+            return puntuar
+
+        usos = [self.por_modelo.count(k) for k in range(len(self.escaladores))]
+        etapas = [
+            Etapa(f"escalar_{k}", escalar(k), ("crudo",), (f"escaladas_{k}",))
+            for k in range(len(self.escaladores)) if usos[k] > 1
+        ]
+        for m, (nombre, k) in enumerate(zip(nombres, self.por_modelo)):
+            entradas = ("crudo", "frame") if usos[k] == 1 else ("crudo", "frame", f"escaladas_{k}")
+            etapas.append(Etapa(f"modelo_{nombre}", rama(m, usos[k] == 1), entradas, (salidas[m],)))
+        return etapas
+
+    def _puntuar(self, crudo):
+        """Probabilidad de cada modelo para las entradas crudas `(filas, entradas)`."""
+        return self._probabilidades(self._matrices(crudo))
+
+    def puntuar_fila(self, fila):
+        """`_puntuar` de una fila de entradas, por la cola de micro-lotes si esta activa."""
+        if self.cola is not None:
+            return self.cola.puntuar(fila)
+        return self._puntuar(fila[None, :])
+
+    def matrices(self, df):
+        """Matrices de los modelos desde el DataFrame del cliente; `None` si no se admite."""
+        crudo = self.crudo(df)
+        if crudo is None:
+            return None
+        with etapa("normalize_and_select"):
+            return self._matrices(crudo)
+
+    def crudo(self, df):
+        """Entradas crudas `(filas, entradas)` float64 del DataFrame del cliente; `None` si no se admite."""
+        if not self.admitido or not df.columns.is_unique:
+            return None
+        for nombre in self.crudas:
+            dtype = df[nombre].dtype
+            # LightGBM solo acepta columnas int, float o bool
+            if not isinstance(dtype, np.dtype) or dtype.kind not in "iufb":
+                return None
+        with etapa("normalize_and_select"):
+            return df[self.entradas].to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+
+    def vector(self, registro):
+        """Fila float64 de las entradas desde el registro (ruta escalar); `None` si no se admite.
+
+        Una entrada que solo lee un scaler sigue a `vector_registro` (nulo ->
+        NaN, texto numerico convertido); una que algun modelo toma sin escalar,
+        a `fila_modelo` (solo numeros o bool).
+        """
+        fila = np.empty(len(self.entradas), dtype=np.float64)
+        for j, nombre in enumerate(self.entradas):
+            valor = registro[nombre]
+            if es_numero(valor) or isinstance(valor, (bool, np.bool_)):
+                fila[j] = float(valor)
+            elif self._es_cruda[j]:
+                return None
+            elif valor is None:
+                fila[j] = np.nan
+            elif isinstance(valor, str):
+                try:
+                    fila[j] = float(valor)
+                except ValueError:
+                    return None
+            else:
+                return None
+        return fila
+
+    def probabilidades(self, df):
+        """Probabilidad de cada modelo (arreglos) para el DataFrame del cliente; `None` si no se admite."""
+        if self.cola is not None and len(df) == 1:
+            crudo = self.crudo(df)
+            return None if crudo is None else self.cola.puntuar(crudo[0])
+        matrices = self.matrices(df)
+        if matrices is None:
+            return None
+        return self._probabilidades(matrices)
+
+    def probabilidades_registro(self, registro):
+        """`probabilidades` sobre el registro de la ruta escalar; `None` si no se admite."""
+        if not self.admitido:
+            return None
+        with etapa("normalize_and_select"):
+            fila = self.vector(registro)
+        if fila is None:
+            return None
+        return self.puntuar_fila(fila)
+
+    def probabilidades_lote(self, registros):
+        """`probabilidades_registro` para varios registros con un gather y una prediccion por modelo.
+
+        Devuelve una lista alineada con `registros`: la tupla de probabilidades
+        (arreglos de un elemento) o `None` si el registro no se admite o falla al
+        leerse (el llamador lo procesa solo).
+        """
+        logging.info("Normalizando y seleccionando features (lote de %d registros)", len(registros))
+        resultado = [None] * len(registros)
+        if not self.admitido:
+            return resultado
+        with etapa("normalize_and_select"):
+            filas = {}
+            for i, registro in enumerate(registros):
+                try:
+                    fila = self.vector(registro)
+                except Exception:
+                    logging.exception("Registro %d del lote sin ruta escalar", i)
+                    continue
+                if fila is not None:
+                    filas[i] = fila
+            if not filas:
+                return resultado
+            matrices = self._matrices(np.vstack(list(filas.values())))
+        probabilidades = self._probabilidades(matrices)
+        for fila, i in enumerate(filas):
+            resultado[i] = tuple(p[fila:fila + 1] for p in probabilidades)
+        return resultado
+
+
+def probabilidades_referencia(df, pares):
+    """Probabilidades de `normalize_and_select` + `predict_proba` para dos pares `(modelo, scaler)`."""
+    (model_h, scaler_h), (model_fpd, scaler_fpd) = pares
+    df_h, features_h, df_fpd, features_fpd = normalize_and_select(df, model_h, scaler_h, model_fpd, scaler_fpd)
+    return model_h.predict_proba(df_h[features_h])[:, 1], model_fpd.predict_proba(df_fpd[features_fpd])[:, 1]
+
+
+def verificar_pipeline(pares, dfs, evaluador_filas=None):
+    """Compara `PipelineModelos` con `normalize_and_select` sobre `dfs` (DataFrames listos para predecir).
+
+    Exige igualdad exacta. Devuelve la lista de `(i, error)` que no coinciden;
+    un DataFrame que el pipeline no admite cuenta como coincidente (usa la
+    referencia). `evaluador_filas` se pasa a `PipelineModelos` (p.e. para
+    verificar tambien el evaluador NumPy).
+    """
+    pipeline = PipelineModelos(pares, evaluador_filas)
+    diferencias = []
+    for i, df in enumerate(dfs):
+        try:
+            referencia = probabilidades_referencia(df, pares)
+        except Exception as e:
+            referencia = e
+        try:
+            compilada = pipeline.probabilidades(df)
+        except Exception as e:
+            compilada = e
+        if compilada is None:
+            continue
+        if isinstance(referencia, Exception) or isinstance(compilada, Exception):
+            if type(referencia) is not type(compilada):
+                diferencias.append((i, f"referencia={referencia!r} pipeline={compilada!r}"))
+            continue
+        for nombre, r, c in zip(("H", "FPD"), referencia, compilada):
+            if not np.array_equal(r, c, equal_nan=True):
+                diferencias.append((i, f"{nombre}: referencia={r} pipeline={c}"))
+    logging.info("[pipeline] verificar_pipeline: %d DataFrames, %d diferencias", len(dfs), len(diferencias))
+    return diferencias
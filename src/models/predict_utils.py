@@ -1,8 +1,14 @@
+import hashlib
 import logging
+import threading
+import time
 import pandas as pd
 import numpy as np
+from collections import OrderedDict
 from typing import Any, Dict, List, Optional, Tuple, Callable
 
+from src.config.config import CACHE_INFORMES_MAX_ENTRADAS, CACHE_INFORMES_TTL_SEGUNDOS
+
 
 def validar_datos_cliente(datos_cliente: Dict[str, Any], required_keys: List[str]) -> None:
     for key in required_keys:
@@ -47,20 +53,114 @@ def extraer_datos_iniciales(
     return datos_cliente, tid
 
 
+class CacheInformes:
+    """Cache LRU + TTL de informes Experian ya extraidos.
+
+    La clave es un digest del XML y la variante del extractor (Regular / NCL).
+    Guarda el DataFrame de una fila tal cual, sin comprimir, con sus bloques
+    consolidados (la extraccion lo deja fragmentado columna a columna): un
+    acierto lo devuelve sin reconstruir nada. Lleva contadores de hit, miss,
+    eviction (por capacidad) y expiracion (por TTL).
+    """
+
+    def __init__(self, max_entradas: int, ttl_segundos: float):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self._entradas: "OrderedDict[Tuple[str, str], Tuple[float, pd.DataFrame]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirados = 0
+
+    @staticmethod
+    def clave(xml: str | bytes, variante: str) -> Tuple[str, str]:
+        contenido = xml.encode("utf-8") if isinstance(xml, str) else xml
+        return hashlib.blake2b(contenido, digest_size=16).hexdigest(), variante
+
+    def obtener(self, clave: Tuple[str, str]) -> Optional[pd.DataFrame]:
+        if self.max_entradas <= 0:
+            return None
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] < time.monotonic():
+                del self._entradas[clave]
+                self.expirados += 1
+                entrada = None
+            if entrada is None:
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.hits += 1
+            return entrada[1]
+
+    def guardar(self, clave: Tuple[str, str], df: pd.DataFrame) -> pd.DataFrame:
+        if self.max_entradas <= 0:
+            return df
+        # copy() consolida los bloques; el DataFrame no se comprime
+        consolidado = df.copy()
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl_segundos, consolidado)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self.evictions += 1
+        return consolidado
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+
+    def estadisticas(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirados": self.expirados,
+            }
+
+
+CACHE_INFORMES = CacheInformes(CACHE_INFORMES_MAX_ENTRADAS, CACHE_INFORMES_TTL_SEGUNDOS)
+
+
 def procesar_xml_experian(
     datos_cliente: Dict[str, Any],
     cliente_experian_xml: Optional[str],
     procesar_informe_func: Callable[[str], pd.DataFrame],
+    variante: Optional[str] = None,
+    plan=None,
 ) -> Dict[str, Any]:
-    """Fusiona los campos del XML Experian (si existe) con los datos del cliente."""
+    """Fusiona los campos del XML Experian (si existe) con los datos del cliente.
+
+    El informe extraido se busca primero en `CACHE_INFORMES` por digest del XML
+    y `variante` (por defecto, el modulo del extractor). Con `plan` (ver
+    `plan_features`) la extraccion omite las variables que no usan los
+    modelos y la clave incluye la firma del plan.
+    """
     if cliente_experian_xml:
-        datos_experian_df = procesar_informe_func(cliente_experian_xml)
+        variante = variante or procesar_informe_func.__module__
+        if plan is not None:
+            variante = f"{variante}:{plan.firma}"
+        clave = CACHE_INFORMES.clave(cliente_experian_xml, variante)
+        datos_experian_df = CACHE_INFORMES.obtener(clave)
+        if datos_experian_df is None:
+            if plan is not None:
+                datos_experian_df = procesar_informe_func(cliente_experian_xml, plan=plan)
+            else:
+                datos_experian_df = procesar_informe_func(cliente_experian_xml)
+            if isinstance(datos_experian_df, pd.DataFrame) and not datos_experian_df.empty:
+                datos_experian_df = CACHE_INFORMES.guardar(clave, datos_experian_df)
+        logging.info("[cache] informes: %s", CACHE_INFORMES.estadisticas())
         if datos_experian_df is not None and not datos_experian_df.empty:
             logging.info(
                 "Valores obtenidos del XML de Experian: %s",
                 datos_experian_df.to_dict(orient="records")[0],
             )
             datos_cliente_df = pd.DataFrame([datos_cliente])
+            # concat copia los bloques: la solicitud recibe un DataFrame propio
+            # (que las etapas siguientes modifican en su lugar) y el del cache no cambia
             datos_cliente_df = pd.concat([datos_cliente_df, datos_experian_df], axis=1)
             #datos_cliente = datos_cliente_df.to_dict(orient="records")[0]
         else:
@@ -167,4 +267,76 @@ def assign_nested_bins(
             return (grupoH, None)
 
         grupoFPD = f"{f_prefix}{f_index:0{pad}d}"
-        return grupoH, grupoFPD
\ No newline at end of file
+        return grupoH, grupoFPD
+
+def grupos_lote(grupo_retailer, n: int) -> list:
+    """`grupo_retailer` de `predecir_lote`: uno para todo el lote o una lista por solicitud."""
+    if isinstance(grupo_retailer, (list, tuple)):
+        if len(grupo_retailer) != n:
+            raise ValueError(f"Se esperaban {n} grupos_retailer y llegaron {len(grupo_retailer)}")
+        return list(grupo_retailer)
+    return [grupo_retailer] * n
+
+
+def _intervalos(edges: np.ndarray, valores: np.ndarray) -> np.ndarray:
+    """Indice 1..k del intervalo `[e0, e1], (e1, e2], ...` de cada valor; 0 si queda fuera."""
+    indices = np.searchsorted(edges, valores, side="left")
+    indices[(indices == 0) & (valores == edges[0])] = 1
+    indices[indices > edges.size - 1] = 0
+    return indices
+
+
+def assign_nested_bins_lote(
+        proba_h,
+        proba_fpd,
+        edges_cfg: dict | None = None,
+        h_prefix: str = "H",
+        f_prefix: str = "F",
+        pad: int = 2,
+    ) -> list:
+        """
+        `assign_nested_bins` para varias parejas (H, FPD) con los mismos bordes.
+
+        `proba_h` y `proba_fpd` traen una probabilidad por cliente (float o
+        array-like, se toma el primer elemento). Los intervalos de todo el lote se
+        buscan con `np.searchsorted`; si algun borde no esta ordenado se usa
+        `assign_nested_bins` pareja por pareja. Devuelve una lista de
+        `(grupoH, grupoFPD)`, con los mismos `None` que `assign_nested_bins`.
+        """
+        if not edges_cfg or "edges_h" not in edges_cfg or "edges_f_by_h" not in edges_cfg:
+            return [assign_nested_bins(h, f, edges_cfg, h_prefix, f_prefix, pad) for h, f in zip(proba_h, proba_fpd)]
+        edges_h = np.asarray(edges_cfg.get("edges_h", []), dtype=float)
+        edges_f_by_h = {
+            clave: np.asarray(edges_f, dtype=float)
+            for clave, edges_f in edges_cfg.get("edges_f_by_h", {}).items()
+            if edges_f
+        }
+        ordenados = all(
+            not np.isnan(edges).any() and (np.diff(edges) >= 0).all()
+            for edges in [edges_h, *edges_f_by_h.values()]
+        )
+        try:
+            h = np.array([float(np.atleast_1d(p)[0]) for p in proba_h], dtype=float)
+            f = np.array([float(np.atleast_1d(p)[0]) for p in proba_fpd], dtype=float)
+        except Exception:
+            ordenados = False
+        if not ordenados or edges_h.size < 2:
+            return [assign_nested_bins(ph, pf, edges_cfg, h_prefix, f_prefix, pad) for ph, pf in zip(proba_h, proba_fpd)]
+
+        indices_h = _intervalos(edges_h, h)
+        indices_f = np.zeros_like(indices_h)
+        for h_index in np.unique(indices_h[indices_h > 0]).tolist():
+            edges_f = edges_f_by_h.get(str(h_index))
+            if edges_f is None or edges_f.size < 2:
+                continue
+            seleccion = indices_h == h_index
+            indices_f[seleccion] = _intervalos(edges_f, f[seleccion])
+
+        grupos = []
+        for h_index, f_index in zip(indices_h.tolist(), indices_f.tolist()):
+            if not h_index:
+                grupos.append((None, None))
+                continue
+            grupoFPD = f"{f_prefix}{f_index:0{pad}d}" if f_index else None
+            grupos.append((f"{h_prefix}{h_index:0{pad}d}", grupoFPD))
+        return grupos
@@ -0,0 +1,211 @@
+"""Almacen de artefactos mapeables en memoria, compartidos entre workers.
+
+Cada worker de gunicorn/uvicorn cargaba con `joblib.load` todos los pickles de
+modelos y scalers: la memoria crece con el numero de workers. El almacen
+convierte cada artefacto una sola vez a un formato que se puede mapear:
+
+    <almacen>/<huella>.joblib            el objeto, joblib sin comprimir
+    <almacen>/<huella>.ensamble.joblib   el EnsambleNumpy de un LGBMClassifier
+
+`huella` es el sha256 del pickle de origen: un pickle nuevo con el mismo
+nombre genera otra conversion y nunca se lee una desactualizada. En joblib sin
+comprimir los arreglos NumPy quedan alineados dentro del archivo, asi que
+`joblib.load(..., mmap_mode="r")` los mapea de solo lectura en lugar de
+copiarlos. Los parametros de los scalers y los arreglos del evaluador NumPy
+(`modelos.evaluador_numpy_filas`) quedan en el page cache del sistema, una
+sola copia fisica para todos los workers del host.
+
+El booster de LightGBM no se puede mapear: al cargarse parsea el modelo a su
+propio heap nativo. Se comparte por fork: con `preload_app` (ver
+`gunicorn.conf.py`) el master carga los motores una vez y los workers heredan
+esas paginas mientras nadie las escriba (`gc.freeze()` evita que el
+recolector las toque).
+
+`cargar` convierte al vuelo si falta la conversion (escritura atomica: un
+worker que llega a la vez ve el archivo completo o no lo ve).
+`memoria_proceso` lee `/proc/<pid>/smaps_rollup` y `smaps` y separa la
+memoria unica del worker (privada) de la compartida, y la parte mapeada
+desde el almacen. Uso:
+
+    python -m src.services.almacen_artefactos convertir
+    python -m src.services.almacen_artefactos memoria <pid> [<pid> ...]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import weakref
+from pathlib import Path
+
+import joblib
+
+from src.config.config import ARTEFACTOS_ALMACEN, MODEL_PATHS, MODEL_PATHS_FPD, SCALER_PATHS
+from src.models.ensamble_numpy import EnsambleNumpy
+
+RAIZ = Path(__file__).resolve().parents[2]
+
+
+def huella(ruta):
+    """sha256 (20 caracteres) del contenido de `ruta`."""
+    digest = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            digest.update(bloque)
+    return digest.hexdigest()[:20]
+
+
+def _volcar(objeto, destino):
+    """`joblib.dump` sin comprimir a un temporal y `os.replace` a `destino`."""
+    fd, temporal = tempfile.mkstemp(dir=destino.parent, prefix=destino.name, suffix=".tmp")
+    os.close(fd)
+    try:
+        joblib.dump(objeto, temporal, compress=0)
+        # mkstemp crea 0600: los workers pueden correr con otro usuario
+        os.chmod(temporal, 0o644)
+        os.replace(temporal, destino)
+    except BaseException:
+        os.unlink(temporal)
+        raise
+
+
+class AlmacenArtefactos:
+    """Conversiones `pickle -> joblib mapeable` en `directorio`, cargadas una vez por proceso."""
+
+    def __init__(self, directorio):
+        directorio = Path(directorio)
+        self.directorio = directorio if directorio.is_absolute() else RAIZ / directorio
+        # Objetos cargados por huella, mientras algun motor los use (el registro de modelos libera juegos viejos)
+        self._cargados = weakref.WeakValueDictionary()
+        # Ensamble mapeado de cada modelo cargado (para PipelineModelos)
+        self._ensambles = weakref.WeakKeyDictionary()
+
+    def rutas(self, h):
+        return self.directorio / f"{h}.joblib", self.directorio / f"{h}.ensamble.joblib"
+
+    def convertir(self, ruta):
+        """Convierte el pickle `ruta` (si no estaba) y devuelve su huella y archivos."""
+        h = huella(ruta)
+        objeto_ruta, ensamble_ruta = self.rutas(h)
+        if not objeto_ruta.exists():
+            self.directorio.mkdir(parents=True, exist_ok=True)
+            objeto = joblib.load(ruta)
+            ensamble = EnsambleNumpy.compilar(objeto)
+            # El ensamble primero: quien ve el objeto ya encuentra su ensamble
+            if ensamble is not None:
+                _volcar(ensamble, ensamble_ruta)
+            _volcar(objeto, objeto_ruta)
+            logging.info("[artefactos] %s convertido a %s", ruta, objeto_ruta.name)
+        return {
+            "origen": str(ruta),
+            "huella": h,
+            "objeto": str(objeto_ruta),
+            "ensamble": str(ensamble_ruta) if ensamble_ruta.exists() else None,
+            "bytes": objeto_ruta.stat().st_size + (ensamble_ruta.stat().st_size if ensamble_ruta.exists() else 0),
+        }
+
+    def cargar(self, ruta):
+        """Objeto del pickle `ruta` con sus arreglos mapeados de solo lectura.
+
+        Un mismo archivo se carga una sola vez por proceso mientras siga en uso.
+        """
+        h = huella(ruta)
+        objeto = self._cargados.get(h)
+        if objeto is not None:
+            return objeto
+        objeto_ruta, ensamble_ruta = self.rutas(h)
+        if not objeto_ruta.exists():
+            self.convertir(ruta)
+        objeto = joblib.load(objeto_ruta, mmap_mode="r")
+        try:
+            if ensamble_ruta.exists():
+                self._ensambles[objeto] = joblib.load(ensamble_ruta, mmap_mode="r")
+            self._cargados[h] = objeto
+        except TypeError:
+            # Sin soporte de weakref (p.e. un dict): se vuelve a mapear en la proxima carga
+            pass
+        logging.info("[artefactos] %s mapeado desde %s", ruta, objeto_ruta.name)
+        return objeto
+
+    def ensamble(self, modelo):
+        """EnsambleNumpy mapeado de `modelo` si se cargo desde el almacen; si no, `None`."""
+        try:
+            return self._ensambles.get(modelo)
+        except TypeError:
+            return None
+
+
+def rutas_configuradas():
+    """Pickles de modelos y scalers declarados en config.yaml."""
+    return list(dict.fromkeys([*MODEL_PATHS.values(), *MODEL_PATHS_FPD.values(), *SCALER_PATHS.values()]))
+
+
+def _kb(linea):
+    return int(linea.split()[1])
+
+
+def memoria_proceso(pid="self", almacen=None):
+    """Memoria del proceso `pid` en MB: unica, compartida y la mapeada desde el almacen.
+
+    `privada` es lo que solo usa este proceso (se libera si muere);
+    `compartida` lo que comparte con otros (el master y los demas workers tras
+    el fork, el page cache de los archivos mapeados); `pss` reparte lo
+    compartido entre quienes lo usan, asi que la suma de `pss` de los workers
+    es la memoria real del servicio.
+    """
+    almacen = almacen or ALMACEN
+    base = Path("/proc") / str(pid)
+    total = {}
+    with open(base / "smaps_rollup") as f:
+        for linea in f:
+            campo = linea.split(":")[0]
+            if campo in ("Rss", "Pss", "Private_Clean", "Private_Dirty", "Shared_Clean", "Shared_Dirty"):
+                total[campo] = _kb(linea)
+    mapeado = {"Size": 0, "Rss": 0, "Shared_Clean": 0, "Shared_Dirty": 0}
+    prefijo = str(almacen.directorio)
+    en_almacen = False
+    with open(base / "smaps") as f:
+        for linea in f:
+            partes = linea.split()
+            if partes and "-" in partes[0] and ":" not in partes[0]:
+                en_almacen = len(partes) >= 6 and partes[5].startswith(prefijo)
+            elif en_almacen and partes and partes[0].rstrip(":") in mapeado:
+                mapeado[partes[0].rstrip(":")] += _kb(linea)
+    mb = 1 / 1024
+    return {
+        "pid": os.getpid() if pid == "self" else int(pid),
+        "rss_mb": round(total.get("Rss", 0) * mb, 1),
+        "pss_mb": round(total.get("Pss", 0) * mb, 1),
+        "privada_mb": round((total.get("Private_Clean", 0) + total.get("Private_Dirty", 0)) * mb, 1),
+        "compartida_mb": round((total.get("Shared_Clean", 0) + total.get("Shared_Dirty", 0)) * mb, 1),
+        "almacen_mapeado_mb": round(mapeado["Size"] * mb, 1),
+        "almacen_rss_mb": round(mapeado["Rss"] * mb, 1),
+        "almacen_compartida_mb": round((mapeado["Shared_Clean"] + mapeado["Shared_Dirty"]) * mb, 1),
+    }
+
+
+ALMACEN = AlmacenArtefactos(ARTEFACTOS_ALMACEN)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Almacen de artefactos mapeables en memoria")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    convertir = sub.add_parser("convertir", help="Convierte los modelos y scalers de config.yaml (o los indicados)")
+    convertir.add_argument("rutas", nargs="*", help="Pickles a convertir (por defecto, los de config.yaml)")
+    memoria = sub.add_parser("memoria", help="Memoria unica/compartida de los procesos indicados (p.e. los workers)")
+    memoria.add_argument("pids", nargs="+", help="PIDs a medir")
+    args = parser.parse_args(argv)
+    if args.comando == "convertir":
+        resultado = [ALMACEN.convertir(ruta) for ruta in (args.rutas or rutas_configuradas())]
+    else:
+        resultado = [memoria_proceso(pid) for pid in args.pids]
+        resultado.append({
+            "total_pss_mb": round(sum(r["pss_mb"] for r in resultado), 1),
+            "total_rss_mb": round(sum(r["rss_mb"] for r in resultado), 1),
+        })
+    print(json.dumps(resultado, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Codificacion de estados de comportamiento con tabla de consulta.
+
+`preprocesscomportamiento` (Regular) traduce los codigos de
+`comportamiento_1..24` y de las familias `morasMaxSectorFinanciero_i`,
+`morasMaxSectorReal_i` y `morasMaximas_i` con `astype(str).map(comportamiento_map)`
+y luego cuenta, por fila, cuantas veces aparece cada estado en
+`comportamiento_1..24` (`estado_*.0`).
+
+Aqui `comportamiento_map` se compila una sola vez en una tabla de consulta
+caracter -> indice de estado (los codigos son de un caracter). Todas las
+columnas se leen en un solo bloque, se traducen con una indexacion sobre la
+tabla y los conteos salen de un solo `np.bincount`, para 1 o N filas. Los
+valores que la referencia no mapea (`''`, `'nan'`, `'1.0'`, ...) quedan como
+NaN, con el mismo dtype por columna (int64 si todo mapea, si no float64).
+
+A diferencia de `value_counts`, los conteos traen siempre una columna por cada
+estado del mapa (0.0 si no aparece), en orden de estado, para que el esquema
+no dependa de los datos. Si el mapa tiene claves que no son un caracter ASCII
+se devuelve `None` y el llamador usa la version de referencia.
+
+`verificar_comportamiento` compara ambas rutas sobre un conjunto de DataFrames.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+SECTORES_MORA = ("morasMaxSectorFinanciero", "morasMaxSectorReal", "morasMaximas")
+
+
+class CodificadorEstados:
+    """Tabla de consulta de `comportamiento_map`: codigo (un caracter) -> indice de estado."""
+
+    def __init__(self, mapa):
+        self.estados = np.array(sorted(set(mapa.values())), dtype=np.int64)
+        self.tabla = None
+        if all(isinstance(k, str) and len(k) == 1 and ord(k) < 128 for k in mapa):
+            indice = {estado: j for j, estado in enumerate(self.estados.tolist())}
+            self.tabla = np.full(128, -1, dtype=np.int8)
+            for codigo, estado in mapa.items():
+                self.tabla[ord(codigo)] = indice[estado]
+
+    def codificar(self, valores):
+        """Indices de estado (int8, -1 = sin mapear) de un bloque de valores crudos.
+
+        Cada valor se toma como `str(valor)`, igual que `astype(str)`: solo los
+        textos de un caracter pueden estar en la tabla, asi que basta con los
+        dos primeros caracteres para distinguirlos.
+        """
+        texto = np.asarray(valores, dtype=object).astype('<U2', order='C')
+        puntos = texto.view(np.uint32).reshape(texto.shape + (2,))
+        primero = puntos[..., 0]
+        un_caracter = (primero > 0) & (primero < 128) & (puntos[..., 1] == 0)
+        return np.where(un_caracter, self.tabla[np.where(un_caracter, primero, 0)], -1).astype(np.int8)
+
+    def valores(self, indices):
+        """Estado de cada indice; NaN (y float64) donde no hay estado."""
+        estados = self.estados[np.maximum(indices, 0)]
+        sin_estado = indices < 0
+        if sin_estado.any():
+            return np.where(sin_estado, np.nan, estados.astype(np.float64))
+        return estados
+
+    def conteos(self, indices):
+        """Conteo por fila de cada estado (float64, `(filas, estados)`), con un solo bincount."""
+        n, total = indices.shape[0], len(self.estados)
+        validos = indices >= 0
+        filas = np.broadcast_to(np.arange(n)[:, None], indices.shape)
+        plano = filas[validos] * total + indices[validos]
+        return np.bincount(plano, minlength=n * total).reshape(n, total).astype(np.float64)
+
+    def nombres_conteos(self, flotante):
+        """`estado_{estado}.0` como lo arma la referencia: con estado float si la fila es float."""
+        return [f'estado_{float(e) if flotante else int(e)}.0' for e in self.estados.tolist()]
+
+
+def columnas_comportamiento(columnas):
+    """Columnas que mapea la referencia, en su orden, y las `comportamiento_i` que cuenta.
+
+    `columnas` es cualquier contenedor de nombres (`df.columns`, un registro).
+    """
+    mapeadas, comport = [], []
+    for i in range(1, 25):
+        col = f'comportamiento_{i}'
+        if col in columnas:
+            mapeadas.append(col)
+            comport.append(col)
+        for sector in SECTORES_MORA:
+            col = f'{sector}_{i}'
+            if col in columnas:
+                mapeadas.append(col)
+    return mapeadas, comport
+
+
+def features_comportamiento(df, codificador):
+    """Columnas mapeadas (dict `nombre -> valores`) y DataFrame de conteos `estado_*.0`.
+
+    `None` si hay que usar la referencia (mapa no compilable, columnas
+    repetidas, sin filas o sin `comportamiento_i`).
+    """
+    if codificador.tabla is None or not df.columns.is_unique or len(df) == 0:
+        return None
+    mapeadas, comport = columnas_comportamiento(df.columns)
+    if not comport:
+        return None
+    indices = codificador.codificar(df.iloc[:, df.columns.get_indexer(mapeadas)].to_numpy(dtype=object))
+    columnas = {nombre: codificador.valores(indices[:, j]) for j, nombre in enumerate(mapeadas)}
+
+    contadas = set(comport)
+    en_conteo = np.array([nombre in contadas for nombre in mapeadas])
+    indices_comport = indices[:, en_conteo]
+    # La fila de `df[comport_cols]` es float si alguna columna quedo con NaN
+    flotante = bool((indices_comport < 0).any(axis=0).any())
+    conteos = pd.DataFrame(
+        codificador.conteos(indices_comport),
+        columns=codificador.nombres_conteos(flotante),
+        index=df.index,
+    )
+    return columnas, conteos
+
+
+def _conteos_estado(df):
+    return [c for c in df.columns if isinstance(c, str) and c.startswith('estado_')]
+
+
+def verificar_comportamiento(preprocesscomportamiento, dfs):
+    """Compara la ruta vectorizada con la de referencia sobre `dfs`.
+
+    Cada ruta recibe su propia copia. Las columnas que no son conteos deben
+    coincidir exactamente (valores, dtypes y orden); los conteos `estado_*.0`
+    de la referencia deben estar en la vectorizada con los mismos valores, y
+    los que solo trae la vectorizada (estados ausentes) deben valer 0. Devuelve
+    la lista de `(i, error)` que no coinciden.
+    """
+    diferencias = []
+    for i, df in enumerate(dfs):
+        try:
+            referencia = preprocesscomportamiento(df.copy(), vectorizado=False)
+        except Exception as e:
+            referencia = e
+        try:
+            vectorizado = preprocesscomportamiento(df.copy(), vectorizado=True)
+        except Exception as e:
+            vectorizado = e
+        if isinstance(referencia, Exception) or isinstance(vectorizado, Exception):
+            if type(referencia) is not type(vectorizado):
+                diferencias.append((i, f"referencia={referencia!r} vectorizado={vectorizado!r}"))
+            continue
+        try:
+            estados_ref, estados_vec = _conteos_estado(referencia), _conteos_estado(vectorizado)
+            resto = [c for c in referencia.columns if c not in set(estados_ref)]
+            pd.testing.assert_index_equal(
+                pd.Index([c for c in vectorizado.columns if c not in set(estados_vec)]), pd.Index(resto)
+            )
+            pd.testing.assert_frame_equal(vectorizado[resto], referencia[resto], check_exact=True)
+            faltan = set(estados_ref) - set(estados_vec)
+            assert not faltan, f"conteos ausentes en la ruta vectorizada: {sorted(faltan)}"
+            pd.testing.assert_frame_equal(vectorizado[estados_ref], referencia[estados_ref], check_exact=True)
+            extra = [c for c in estados_vec if c not in set(estados_ref)]
+            assert (vectorizado[extra].to_numpy() == 0).all(), f"conteos extra distintos de 0: {extra}"
+        except AssertionError as e:
+            diferencias.append((i, str(e)))
+    logging.info("[preprocess] verificar_comportamiento: %d DataFrames, %d diferencias", len(dfs), len(diferencias))
+    return diferencias
@@ -0,0 +1,79 @@
+"""Constructor de features: columnas nuevas de un DataFrame en una sola materializacion.
+
+Las etapas del pipeline (`variables_income`, `construir_dataframe_informe`,
+`_completar_columnas`, `PlanFeatures.completar`) agregaban sus
+variables con un `df[c] = valores` por columna. Cada insercion agrega un bloque
+al `BlockManager`: el DataFrame queda fragmentado (de ahi el
+`PerformanceWarning`) y la siguiente operacion que lo consolide copia todo.
+
+`ConstructorFeatures` junta los arreglos en un dict, en el orden final de las
+columnas, y los materializa una sola vez con `postproceso_vectorizado.asignar`
+(un solo `concat` para las nuevas). Los defaults de columnas faltantes (las
+listas `nulos`/`imputar` del preprocesamiento, el relleno del plan de features)
+se aplican con un `reindex` por valor. El resultado es el mismo que el de los
+`df[c] = ...` sucesivos: mismas columnas, mismo orden, mismos dtypes.
+"""
+import pandas as pd
+
+from src.services.postproceso_vectorizado import asignar
+
+
+class ConstructorFeatures:
+    """Acumula las columnas de una etapa sobre `df` y las materializa con `construir()`.
+
+    Se escribe como un DataFrame (`constructor[c] = valores`); una columna que
+    se asigna dos veces conserva la posicion de la primera, como con
+    `df[c] = ...`. Las lecturas van a `df`: quien necesite un valor pendiente
+    lo guarda en una variable local.
+    """
+
+    __slots__ = ("df", "columnas", "defaults")
+
+    def __init__(self, df):
+        self.df = df
+        self.columnas = {}
+        self.defaults = []
+
+    def __setitem__(self, nombre, valores):
+        self.columnas[nombre] = valores
+
+    def __contains__(self, nombre):
+        return nombre in self.columnas or nombre in self.df.columns
+
+    def __len__(self):
+        return len(self.df)
+
+    def update(self, columnas):
+        self.columnas.update(columnas)
+        return self
+
+    def completar(self, nombres, valor):
+        """Agrega con `valor` las columnas de `nombres` que falten al construir.
+
+        Equivale a `for c in nombres: if c not in df.columns: df[c] = valor`
+        despues de las columnas ya registradas.
+        """
+        self.defaults.append((nombres, valor))
+        return self
+
+    def construir(self):
+        """DataFrame con todas las columnas: las registradas y luego los defaults.
+
+        `df` queda en manos del resultado (ver `asignar`).
+        """
+        df = asignar(self.df, self.columnas) if self.columnas else self.df
+        for nombres, valor in self.defaults:
+            presentes = set(df.columns)
+            faltan = [c for c in dict.fromkeys(nombres) if c not in presentes]
+            if not faltan:
+                continue
+            if df.columns.is_unique:
+                df = df.reindex(columns=df.columns.append(pd.Index(faltan)), fill_value=valor)
+            else:
+                # reindex no admite columnas repetidas
+                for c in faltan:
+                    df[c] = valor
+        self.df = df
+        self.columnas = {}
+        self.defaults = []
+        return df
@@ -0,0 +1,91 @@
+"""Esquema declarado de las variables extraidas del XML Experian.
+
+Cada variante (Regular / NCL) registra, en el orden de la extraccion etree,
+todas las claves de posicion fija que produce `procesar_informe` con su dtype y
+su default. Las columnas de texto son exactamente las `cols_cats` de
+`construir_dataframe_informe`; el resto es numerico.
+
+Las familias de largo variable se registran hasta un maximo razonable (24 meses,
+12 vectores de saldos, ...). Lo que quede fuera del esquema (p.e. las cantidades
+`{tipo}_Activa_cantidad_{j}` de tipos de cuenta arbitrarios) se guarda como
+extra y se convierte a numero al armar el DataFrame, igual que antes.
+"""
+from src.models.feature_schema import Feature, EsquemaFeatures, FLOAT, INT, TEXTO
+from src.services.extraccion_stream import VARIANTES
+
+MAX_MESES = 24
+MAX_TIPOS_CUENTA = 6
+MAX_TRIMESTRES = 4
+MAX_VECTOR_SALDOS = 12
+TIPOS_TELCOS = ['COM', 'CTC', 'CDC']
+
+# Hasta aqui llegan las listas fijas de cols_cats en construir_dataframe_informe
+CATS_COMPORTAMIENTO = 24
+CATS_TOTAL_TIPO = 3
+CATS_MORA_MAXIMA = 3
+
+
+def _es_fecha_consulta(nombre):
+    return nombre.startswith('Consulta_') and nombre.endswith('_fecha')
+
+
+def _features_informe(variante):
+    config = VARIANTES[variante]
+    f = [
+        Feature('fechaConsulta', TEXTO, ''),
+        Feature('identificacionDigitada'),
+        Feature('ciudad_exp', TEXTO, ''),
+        Feature('departamento_exp', TEXTO, ''),
+        Feature('genero_exp'),
+        Feature('puntaje_experian'),
+    ]
+    if config["razones_score"]:
+        f += [Feature('razon_codigo_1'), Feature('razon_codigo_2')]
+    f += [
+        Feature('ahorros_fechaApertura_reciente', TEXTO, ''),
+        Feature('Ctas_pCliente', INT, 0),
+        Feature('Cuentas_sector1', INT, 0),
+    ]
+    if config["fecha_max_vencimiento"]:
+        f.append(Feature('fecha_max_vencimiento', TEXTO, ''))
+    f += [
+        Feature('cartera_fechaApertura_reciente', TEXTO, ''),
+        Feature('CC_TipoContrato_1', INT, 0),
+        Feature('cc_tpobl_2_con', INT, 0),
+        Feature('tdc_fechaApertura_reciente', TEXTO, ''),
+        Feature('quanto'),
+        Feature('quanto_pct'),
+    ]
+    f += [
+        Feature(f'agr_prinp_{key}', TEXTO if key == 'antiguedadDesde' else FLOAT, '' if key == 'antiguedadDesde' else float('nan'))
+        for key in config["principales"]
+    ]
+    f += [Feature(f'agr_saldos_{key}') for key in config["saldos"]]
+    for i in range(1, MAX_MESES + 1):
+        f += [Feature(f'saldoTotalMora_{i}'), Feature(f'saldoTotal_{i}')]
+    for i in range(1, MAX_MESES + 1):
+        dtype = TEXTO if i <= CATS_COMPORTAMIENTO else FLOAT
+        f += [Feature(f'comportamiento_{i}', dtype, '' if dtype == TEXTO else float('nan')), Feature(f'cantidad_{i}')]
+    for i in range(1, MAX_TIPOS_CUENTA + 1):
+        dtype = TEXTO if i <= CATS_TOTAL_TIPO else FLOAT
+        f += [Feature(f'total_tipo_{i}', dtype, '' if dtype == TEXTO else float('nan')), Feature(f'total_cantidad_{i}')]
+    f += [Feature(f'agr_analisisPromedio_{key}') for key in ['cuota', 'porcentajeUso', 'totalCerradas', 'totalAbiertas', 'saldo']]
+    for i in range(1, MAX_TRIMESTRES + 1):
+        for key in config["trimestre"]:
+            texto = key == 'moraMaxima' and i <= CATS_MORA_MAXIMA
+            f.append(Feature(f'trimestre_{i}_{key}', TEXTO if texto else FLOAT, '' if texto else float('nan')))
+    f += [Feature('Cc_sectorTelcos'), Feature('Cc_totalComoPrincipal')]
+    for tipo in TIPOS_TELCOS:
+        f += [Feature(f'{tipo}_trim_{i}_saldoMora') for i in range(1, 4)]
+    for i in range(1, MAX_VECTOR_SALDOS + 1):
+        f += [Feature(f'{key}_{i}') for key in config["vector_saldos"]]
+    f += [Feature(key) for key in ['cartera_saldo_actual', 'cartera_saldo_mora', 'tdc_saldo_actual', 'tdc_saldo_mora']]
+    if config["sumas_activas"]:
+        f += [Feature('cartera_valorInicial_activa'), Feature('tdc_cupototal_activo')]
+    return f
+
+
+ESQUEMAS_INFORME = {
+    variante: EsquemaFeatures(_features_informe(variante), texto_extra=_es_fecha_consulta)
+    for variante in VARIANTES
+}
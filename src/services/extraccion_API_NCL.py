@@ -8,61 +8,185 @@ from datetime import datetime
 from collections import defaultdict, OrderedDict
 from sklearn.linear_model import LinearRegression
 from pandas.api.types import is_numeric_dtype
+from src.config.config import EXTRACCION_ENGINE, POSTPROCESO_VECTORIZADO
+from src.services.extraccion_stream import extraer_datos_stream
+from src.services.extraccion_lxml import extraer_datos_lxml
+from src.services.esquema_informe import ESQUEMAS_INFORME
+from src.models.feature_schema import RegistroFeatures
+from src.services.familias_columnas import indice_familias
+from src.services import postproceso_vectorizado as pv
+from src.services.constructor_features import ConstructorFeatures
+from src.services.plan_features import calculador, secciones_omitidas
+from src.utils.contabilidad_copias import etapa
 
 # Logging centralizado desde logging_config.setup_logging()
-def variables_income(df):
-    cuota = [col for col in df.columns if col.startswith('Sector') and col.endswith('cuota')]
-    df['promedio_cuota'] = df.loc[:, cuota].sum(axis=1) / df.loc[:, cuota].notna().sum(axis=1)
-    cartera_Cuota = []
-    cartera_totalCuotas = []
-    cartera_cuotasCanceladas = []
-    for col in df.columns:
-        if 'Sector' in col:
-            if col.endswith('cuota'):
-                cartera_Cuota.append(col)
-            elif 'totalCuotas' in col:
-                cartera_totalCuotas.append(col)
-            elif 'cuotasCanceladas' in col:
-                cartera_cuotasCanceladas.append(col)
-
-    # Conversión de tipos
-    cols_to_convert = cartera_Cuota + cartera_totalCuotas + cartera_cuotasCanceladas
-    for col in cols_to_convert:
-        if col in df.columns and not is_numeric_dtype(df[col]):
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-
-    # Cálculo de amortización general (con control de división por cero)
-    denom_amort = df[cartera_totalCuotas].sum(axis=1) * df[cartera_Cuota].sum(axis=1)
-    denom_amort = denom_amort.replace(0, np.nan)
+def variables_income(df, agregados=None, plan=None):
+    """Variables de cuotas por sector; con `plan` (ver `plan_features`) se omiten las que no usan los modelos."""
+    calcular = calculador(plan)
+    nuevas = ConstructorFeatures(df)
+    cartera = [c for c in ['promedio_cuota', 'amortizacion_cartera', 'ratio_cartera_real', 'ratio_cartera_telcos'] if calcular(c)]
+    if cartera and agregados is None:
+        idx = indice_familias(df.columns)
+        cuota = idx.pos('cuota')
+        nuevas['promedio_cuota'] = df.iloc[:, cuota].sum(axis=1) / df.iloc[:, cuota].notna().sum(axis=1)
+        cartera_Cuota = idx.nombres('sector_cuota')
+        cartera_totalCuotas = idx.nombres('sector_totalCuotas')
+        cartera_cuotasCanceladas = idx.nombres('sector_cuotasCanceladas')
+
+        # Conversión de tipos
+        cols_to_convert = cartera_Cuota + cartera_totalCuotas + cartera_cuotasCanceladas
+        for col in cols_to_convert:
+            if col in df.columns and not is_numeric_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+
+        # Cálculo de amortización general (con control de división por cero)
+        denom_amort = df[cartera_totalCuotas].sum(axis=1) * df[cartera_Cuota].sum(axis=1)
+        denom_amort = denom_amort.replace(0, np.nan)
 
     
-    df["amortizacion_cartera"] = (
-        (df[cartera_cuotasCanceladas].sum(axis=1) * df[cartera_Cuota].sum(axis=1)) / denom_amort
-    )
-    # Sector3: cartera real
-    cartera_real_cuotasCanceladas = [col for col in df.columns if 'Sector3' in col and col.endswith('cuotasCanceladas')]
-    cartera_real_totalCuotas = [col for col in df.columns if 'Sector3' in col and 'totalCuotas' in col]
+        nuevas["amortizacion_cartera"] = (
+            (df[cartera_cuotasCanceladas].sum(axis=1) * df[cartera_Cuota].sum(axis=1)) / denom_amort
+        )
+        # Sector3: cartera real
+        cartera_real_cuotasCanceladas = idx.pos('sector3_cuotasCanceladas')
+        cartera_real_totalCuotas = idx.pos('sector3_totalCuotas')
 
-    cuotas_canceladas_real = df[cartera_real_cuotasCanceladas].replace([0, -1], np.nan)
-    total_cuotas_real = df[cartera_real_totalCuotas].replace([0, -1], np.nan)
+        cuotas_canceladas_real = df.iloc[:, cartera_real_cuotasCanceladas].replace([0, -1], np.nan)
+        total_cuotas_real = df.iloc[:, cartera_real_totalCuotas].replace([0, -1], np.nan)
 
-    df["ratio_cartera_real"] = cuotas_canceladas_real.sum(axis=1) / total_cuotas_real.sum(axis=1)
+        ratio_cartera_real = cuotas_canceladas_real.sum(axis=1) / total_cuotas_real.sum(axis=1)
 
-    # Sector4: telcos
-    cartera_telcos_cuotas = [col for col in df.columns if 'Sector4' in col and col.endswith('cuota')]
-    cuotas_canceladas_telcos = df[cartera_telcos_cuotas].where(lambda x: (x != 0))
+        # Sector4: telcos
+        cartera_telcos_cuotas = idx.pos('sector4_cuota')
+        cuotas_canceladas_telcos = df.iloc[:, cartera_telcos_cuotas].where(lambda x: (x != 0))
 
-    df["ratio_cartera_telcos"] = cuotas_canceladas_telcos.sum(axis=1) / cuotas_canceladas_telcos.count(axis=1)
-    # Limpiar infs
-    df['ratio_cartera_real'] = df['ratio_cartera_real'].replace([np.inf, -np.inf], np.nan)
-    df['ratio_cartera_telcos'] = np.abs(df['ratio_cartera_telcos'])
+        ratio_cartera_telcos = cuotas_canceladas_telcos.sum(axis=1) / cuotas_canceladas_telcos.count(axis=1)
+        # Limpiar infs
+        nuevas['ratio_cartera_real'] = ratio_cartera_real.replace([np.inf, -np.inf], np.nan)
+        nuevas['ratio_cartera_telcos'] = np.abs(ratio_cartera_telcos)
+    elif cartera:
+        for col in cartera:
+            nuevas[col] = agregados[col]
 
-    return df
+    return nuevas.construir()
+
+COLS_FECHAS_APERTURA = ['tdc_fechaApertura_reciente', 'cartera_fechaApertura_reciente', 'ahorros_fechaApertura_reciente']
+COLS_SALDOS_PRODUCTOS = ['tdc_saldo_actual', 'cartera_saldo_actual', 'tdc_saldo_mora', 'cartera_saldo_mora']
+COLS_RATIOS_FINALES = ['agr_prinp_creditoVigentes', 'agr_saldos_saldoTotalEnMora', 'agr_saldos_cuotaMensual', 'agr_saldos_saldoTotal']
+
+
+def procesar_cuotas_y_amortizacion(df, agregados=None, vectorizado=None, plan=None):
+    """Variables de portafolio, estados de cartera, mora telcos y fechas de apertura.
+
+    Con `vectorizado` (por defecto `POSTPROCESO_VECTORIZADO`) las familias se
+    calculan sobre bloques NumPy para 1 o N filas; si la entrada no lo admite se
+    usa la version de referencia, que da el mismo resultado. Con `plan` (ver
+    `plan_features`) la ruta vectorizada omite las variables que no usan los
+    modelos; la de referencia las calcula todas.
+    """
+    if POSTPROCESO_VECTORIZADO if vectorizado is None else vectorizado:
+        resultado = _procesar_cuotas_vectorizado(df, agregados, plan)
+        if resultado is not None:
+            return resultado
+    return _procesar_cuotas_y_amortizacion_referencia(df, agregados)
+
+
+def _procesar_cuotas_vectorizado(df, agregados, plan=None):
+    idx = indice_familias(df.columns)
+    if len(idx.pos('Telcos_mora_trimestre')):
+        return None
+    familias = [
+        'total_cantidad', 'activa_cantidad', 'aldia_cantidad',
+        'trim_1_saldoMora', 'trim_2_saldoMora', 'trim_3_saldoMora', 'COM_trim', 'CTC_trim', 'CDC_trim',
+    ]
+    if agregados is None:
+        familias += ['nitSuscriptor', 'cartera_codigo']
+    bloque = pv.BloqueFamilias.desde(df, idx, familias)
+    if bloque is None or any(df[c].dtype.kind not in 'if' for c in COLS_SALDOS_PRODUCTOS):
+        return None
+    fechas = pv.fechas_ns(df, COLS_FECHAS_APERTURA + ['fechaConsulta'])
+    if fechas is None:
+        return None
+    n = len(df)
+    nuevas = {}
+
+    ahorros = df.get('total_tipo_1', 0) == 'AHO'
+    total_ahorros = np.broadcast_to(np.where(ahorros, df.get('total_cantidad_1', 0), 0), (n,))
+    positivas_ahorros = np.broadcast_to(np.where(ahorros, df.get('AHO_Activa_cantidad_1', 0), 0), (n,))
+    cantidades = bloque['total_cantidad']
+    buenas = bloque['activa_cantidad', 'aldia_cantidad']
+    totales = pv.nansum_filas(cantidades, bloque.entera('total_cantidad'))
+    aldia = pv.nansum_filas(buenas, bloque.entera(('activa_cantidad', 'aldia_cantidad')))
+    mora = totales - aldia
+    nuevas['portafolio_total_ahorros'] = total_ahorros
+    nuevas['portafolio_positivas_ahorros'] = positivas_ahorros
+    nuevas['portafolio_totales_diferentes'] = pv.conteo_mascara(~np.isnan(cantidades))
+    nuevas['portafolio_aldia_diferentes'] = pv.conteo_mascara(~np.isnan(buenas))
+    nuevas['portafolio_totales'] = totales
+    nuevas['portafolio_aldia'] = aldia
+    nuevas['portafolio_mora'] = mora
+    base = totales - total_ahorros
+    nuevas['portafolio_num_can_n'] = pv.sin_infinitos(pv.dividir(mora - (total_ahorros - positivas_ahorros), base))
+    nuevas['portafolio_num_can_p'] = pv.sin_infinitos(pv.dividir(aldia + positivas_ahorros, base))
+
+    if agregados is None:
+        nuevas['Consultas_competencia_72h'] = pv.conteo_mascara(np.isin(bloque['nitSuscriptor'], pv.ENTIDADES_COMPETENCIA))
+        estados = bloque['cartera_codigo']
+        cuenta_validas = pv.conteo_mascara(~np.isnan(estados))
+        nuevas['buenas_carteras'] = pv.conteo_mascara(np.isin(estados, pv.CODIGOS_BUENAS))
+        nuevas['activos'] = pv.conteo_mascara(np.isin(estados, pv.CODIGOS_ACTIVAS))
+        nuevas['carteras_activas_pp'] = pv.dividir(nuevas['activos'], cuenta_validas)
+        nuevas['carteras_buenas_pp'] = pv.dividir(nuevas['buenas_carteras'], cuenta_validas)
+    else:
+        for col in ['Consultas_competencia_72h', 'buenas_carteras', 'activos', 'carteras_activas_pp', 'carteras_buenas_pp']:
+            nuevas[col] = agregados[col]
+
+    # Trimestres
+    trimestres = [pv.nansum_filas(bloque[f'trim_{i}_saldoMora']) for i in (1, 2, 3)]
+    for i, suma in enumerate(trimestres, 1):
+        nuevas[f'Telcos_trim{i}'] = suma
+    nuevas['variacion_mora_telcos'] = ((trimestres[1] - trimestres[0]) + (trimestres[2] - trimestres[1])) / 2
+
+    #Saldos productos
+    tdc_actual, cartera_actual, tdc_mora, cartera_mora = (df[c].to_numpy() for c in COLS_SALDOS_PRODUCTOS)
+    nuevas['productos_saldo_total'] = tdc_actual + cartera_actual
+    nuevas['productos_mora_total'] = tdc_mora + cartera_mora
+
+    # Fechas
+    for j, col in enumerate(COLS_FECHAS_APERTURA + ['fechaConsulta']):
+        nuevas[col] = pv.como_fecha(fechas[:, j])
+    apertura_max = pv.max_fechas(fechas[:, :3])
+    nuevas['fechaApertura_max'] = pv.como_fecha(apertura_max)
+    nuevas['Meses_apertura'] = pv.entero_nulable(pv.dias(fechas[:, 3], apertura_max) // 30)
+
+    # Mora por sector
+    promedios = []
+    for sector in ['COM', 'CTC', 'CDC']:
+        valores = bloque[f'{sector}_trim']
+        promedio = pv.dividir(pv.nansum_filas(valores, bloque.entera(f'{sector}_trim')), pv.conteo_filas(valores))
+        nuevas[f'Telcos_mora_trimestre_{sector}'] = promedio
+        promedios.append(promedio)
+    telcos = np.asfortranarray(np.column_stack(promedios))
+    nuevas['Telcos_mora_trimestre'] = pv.dividir(pv.nansum_filas(telcos), pv.conteo_filas(telcos))
 
-def procesar_cuotas_y_amortizacion(df):
-    totales_cantidad = [col for col in df.columns if 'total_cantidad' in col ]
-    activas = [col for col in df.columns if 'Activa_' in col and 'cantidad' in col ]
-    aldia =  [col for col in df.columns if '_Al dia_' in col and 'cantidad' in col]
+    # Ratios finales
+    vigentes, en_mora, cuota_mensual, saldo_total = (pv.numerico(df[c]) for c in COLS_RATIOS_FINALES)
+    for col, valores in zip(COLS_RATIOS_FINALES, (vigentes, en_mora, cuota_mensual, saldo_total)):
+        if df[col].dtype.kind not in 'if':
+            nuevas[col] = valores
+    nuevas['saldo_prom_mora_prod'] = pv.dividir(en_mora, vigentes)
+    nuevas['ratio_cuota_saldo'] = pv.dividir(cuota_mensual, saldo_total)
+    nuevas['Dias_ultimo_producto'] = pv.dias(fechas[:, 3], fechas[:, 1])
+    if plan is not None:
+        nuevas = plan.filtrar(nuevas)
+    return pv.asignar(df, nuevas)
+
+
+def _procesar_cuotas_y_amortizacion_referencia(df, agregados=None):
+    idx = indice_familias(df.columns)
+    totales_cantidad = idx.nombres('total_cantidad')
+    activas = idx.nombres('activa_cantidad')
+    aldia = idx.nombres('aldia_cantidad')
     buenas = activas + aldia 
 
     df['portafolio_total_ahorros'] = np.where(
@@ -90,31 +214,31 @@ def procesar_cuotas_y_amortizacion(df):
     df['portafolio_num_can_p'] = df['portafolio_num_can_p'].replace([np.inf, -np.inf], np.nan)
     df['portafolio_num_can_n'] = df['portafolio_num_can_n'].replace([np.inf, -np.inf], np.nan)
 
-    # Consultas Nit
-    consultas_nit = df.filter(regex='nitSuscriptor').columns
-    df[consultas_nit] = df[consultas_nit].apply(pd.to_numeric, errors='coerce')
-    entidades_set = {
-        901344787.0, 901258467.0, 901308756.0, 901279350.0, 901310399.0
-    }
-    df['Consultas_competencia_72h'] = df[consultas_nit].isin(entidades_set).sum(axis=1)
-
-    cartera_estados = [col for col in df.columns if 'Cartera' in col and col.endswith('codigo')]
-    valores_buenas = [1.0, 3.0]
-    valores_activas = [1.0, 2.0]
-    cuenta_validas = df[cartera_estados].notna().sum(axis=1)
-    df['buenas_carteras'] = df[cartera_estados].isin(valores_buenas).sum(axis=1)
-    df['activos'] = df[cartera_estados].isin(valores_activas).sum(axis=1)
-    df['carteras_activas_pp'] = df['activos'] / cuenta_validas
-    df['carteras_buenas_pp'] = df['buenas_carteras'] / cuenta_validas
+    if agregados is None:
+        # Consultas Nit
+        consultas_nit = idx.nombres('nitSuscriptor')
+        df[consultas_nit] = df[consultas_nit].apply(pd.to_numeric, errors='coerce')
+        entidades_set = {
+            901344787.0, 901258467.0, 901308756.0, 901279350.0, 901310399.0
+        }
+        df['Consultas_competencia_72h'] = df[consultas_nit].isin(entidades_set).sum(axis=1)
+
+        cartera_estados = idx.nombres('cartera_codigo')
+        valores_buenas = [1.0, 3.0]
+        valores_activas = [1.0, 2.0]
+        cuenta_validas = df[cartera_estados].notna().sum(axis=1)
+        df['buenas_carteras'] = df[cartera_estados].isin(valores_buenas).sum(axis=1)
+        df['activos'] = df[cartera_estados].isin(valores_activas).sum(axis=1)
+        df['carteras_activas_pp'] = df['activos'] / cuenta_validas
+        df['carteras_buenas_pp'] = df['buenas_carteras'] / cuenta_validas
+    else:
+        for col in ['Consultas_competencia_72h', 'buenas_carteras', 'activos', 'carteras_activas_pp', 'carteras_buenas_pp']:
+            df[col] = agregados[col]
 
     # Trimestres
-    trim1 = [col for col in df.columns if 'trim_1_saldoMora' in col]
-    trim2 = [col for col in df.columns if 'trim_2_saldoMora' in col]
-    trim3 = [col for col in df.columns if 'trim_3_saldoMora' in col]
-
-    t1 = df[trim1].astype('float')
-    t2 = df[trim2].astype('float')
-    t3 = df[trim3].astype('float')
+    t1 = df.iloc[:, idx.pos('trim_1_saldoMora')].astype('float')
+    t2 = df.iloc[:, idx.pos('trim_2_saldoMora')].astype('float')
+    t3 = df.iloc[:, idx.pos('trim_3_saldoMora')].astype('float')
 
     df['Telcos_trim1'] = t1.sum(axis=1)
     df['Telcos_trim2'] = t2.sum(axis=1)
@@ -141,9 +265,9 @@ def procesar_cuotas_y_amortizacion(df):
     ).astype('Int64')
     
     # Mora por sector
-    sector_mora_COM = [col for col in df.columns if 'COM_trim' in col]
-    sector_mora_CTC = [col for col in df.columns if 'CTC_trim' in col]
-    sector_mora_CDC = [col for col in df.columns if 'CDC_trim' in col]
+    sector_mora_COM = idx.nombres('COM_trim')
+    sector_mora_CTC = idx.nombres('CTC_trim')
+    sector_mora_CDC = idx.nombres('CDC_trim')
 
     for sector in [sector_mora_COM, sector_mora_CTC, sector_mora_CDC]:
         df[sector] = df[sector].apply(pd.to_numeric, errors='coerce')
@@ -152,8 +276,8 @@ def procesar_cuotas_y_amortizacion(df):
     df['Telcos_mora_trimestre_COM'] = df[sector_mora_COM].sum(axis=1) / df[sector_mora_COM].count(axis=1)
     df['Telcos_mora_trimestre_CTC'] = df[sector_mora_CTC].sum(axis=1) / df[sector_mora_CTC].count(axis=1)
     df['Telcos_mora_trimestre_CDC'] = df[sector_mora_CDC].sum(axis=1) / df[sector_mora_CDC].count(axis=1)
-    telcos = [col for col in df.columns if 'Telcos_mora_trimestre' in col]
-    df['Telcos_mora_trimestre'] = df[telcos].sum(axis=1) / df[telcos].count(axis=1)
+    telcos = indice_familias(df.columns).pos('Telcos_mora_trimestre')
+    df['Telcos_mora_trimestre'] = df.iloc[:, telcos].sum(axis=1) / df.iloc[:, telcos].count(axis=1)
 
     # Ratios finales
     df['agr_prinp_creditoVigentes'] = pd.to_numeric(df['agr_prinp_creditoVigentes'], errors='coerce')
@@ -166,7 +290,57 @@ def procesar_cuotas_y_amortizacion(df):
     df['Dias_ultimo_producto'] = (df['fechaConsulta'] - df['cartera_fechaApertura_reciente']).dt.days
     return df
 
-def procesar_consultas_experian(df):
+def procesar_consultas_experian(df, agregados=None, vectorizado=None, plan=None):
+    """Fechas y conteos de consultas (ver `procesar_cuotas_y_amortizacion` sobre `vectorizado` y `plan`)."""
+    if POSTPROCESO_VECTORIZADO if vectorizado is None else vectorizado:
+        resultado = _procesar_consultas_vectorizado(df, agregados, plan)
+        if resultado is not None:
+            return resultado
+    return _procesar_consultas_experian_referencia(df, agregados)
+
+
+def _procesar_consultas_vectorizado(df, agregados, plan=None):
+    # Caso del pipeline: fechas ya convertidas por procesar_cuotas_y_amortizacion
+    if (
+        df['fechaConsulta'].dtype != pv.M8_NS
+        or df['cartera_fechaApertura_reciente'].dtype != pv.M8_NS
+        or 'periodo_consulta' in df.columns
+    ):
+        return None
+    if agregados is None:
+        idx = indice_familias(df.columns)
+        consultas_fecha = idx.nombres('consulta_fecha')
+        bloque = pv.BloqueFamilias.desde(df, idx, ['consulta_SFI_cantidad'])
+        fechas = pv.fechas_ns(df, consultas_fecha) if consultas_fecha and bloque is not None else None
+        if fechas is None:
+            return None
+    fecha_consulta = df['fechaConsulta'].to_numpy().view(np.int64)
+    periodo = pv.piso_dia(fecha_consulta)
+    nuevas = {'periodo_consulta': pv.como_fecha(periodo)}
+
+    if agregados is None:
+        for j, col in enumerate(consultas_fecha):
+            nuevas[col] = pv.como_fecha(fechas[:, j])
+        maxima = pv.max_fechas(fechas)
+        nuevas['max_fecha_consulta'] = pv.como_fecha(maxima)
+        nuevas['Dias_ultimaconsul'] = pv.dias(fecha_consulta, maxima)
+        nuevas['Consultas_entidad'] = pv.conteo_mascara(fechas != pv.NAT)
+        nuevas['Consultas_SFI'] = pv.nansum_filas(bloque['consulta_SFI_cantidad'], bloque.entera('consulta_SFI_cantidad'))
+        nuevas['Consultas_ult_mes'] = pv.conteo_mascara(pv.mayores(fechas, pv.menos_un_mes(periodo)))
+        return pv.asignar(df, nuevas if plan is None else plan.filtrar(nuevas))
+
+    # Familias Consulta_* agregadas durante la extraccion
+    maxima = pd.Series(agregados['max_fecha_consulta'], index=df.index)
+    nuevas['max_fecha_consulta'] = maxima
+    nuevas['Dias_ultimaconsul'] = (df['fechaConsulta'] - maxima).dt.days
+    df = pv.asignar(df, nuevas if plan is None else plan.filtrar(nuevas))
+    for col in ['Consultas_entidad', 'Consultas_SFI', 'Consultas_ult_mes']:
+        if plan is None or plan.calcular(col):
+            df.loc[:, col] = agregados[col]
+    return df
+
+
+def _procesar_consultas_experian_referencia(df, agregados=None):
     # 1. Conversión de fechas
     df['periodo_consulta'] = df['fechaConsulta'].astype(str).str[:10]
     
@@ -175,25 +349,53 @@ def procesar_consultas_experian(df):
     df['cartera_fechaApertura_reciente'] = pd.to_datetime(df['cartera_fechaApertura_reciente'], errors='coerce')
     
     # 2. Identificación de columnas
-    consultas_SFI = [col for col in df.columns if col.startswith('Consulta_SFI') and col.endswith('cantidad')]
-    consultas_fecha = [col for col in df.columns if col.startswith('Consulta_') and col.endswith('_fecha')]
+    if agregados is None:
+        idx = indice_familias(df.columns)
+        consultas_SFI = idx.nombres('consulta_SFI_cantidad')
+        consultas_fecha = idx.nombres('consulta_fecha')
     
-    df[consultas_fecha] = df[consultas_fecha].apply(pd.to_datetime, errors='coerce')
-    df['fechaConsulta'] = pd.to_datetime(df['fechaConsulta'], errors='coerce')
-    df['max_fecha_consulta'] = df[consultas_fecha].max(axis=1)
+        df[consultas_fecha] = df[consultas_fecha].apply(pd.to_datetime, errors='coerce')
+        df['fechaConsulta'] = pd.to_datetime(df['fechaConsulta'], errors='coerce')
+        df['max_fecha_consulta'] = df[consultas_fecha].max(axis=1)
+    else:
+        # Familias Consulta_* agregadas durante la extraccion
+        df['max_fecha_consulta'] = agregados['max_fecha_consulta']
     df['Dias_ultimaconsul'] = (df['fechaConsulta'] - df['max_fecha_consulta']).dt.days
 
     # 5. Agregados
 
-    df.loc[:, 'Consultas_entidad'] = df[consultas_fecha].notna().sum(axis=1)
-    df.loc[:, 'Consultas_SFI'] = df[consultas_SFI].sum(axis=1)
-    df.loc[:, 'Consultas_ult_mes'] = (
-        df[consultas_fecha].gt(df['periodo_consulta'] - pd.DateOffset(months=1), axis=0)
-    ).sum(axis=1)
+    if agregados is None:
+        df.loc[:, 'Consultas_entidad'] = df[consultas_fecha].notna().sum(axis=1)
+        df.loc[:, 'Consultas_SFI'] = df[consultas_SFI].sum(axis=1)
+        df.loc[:, 'Consultas_ult_mes'] = (
+            df[consultas_fecha].gt(df['periodo_consulta'] - pd.DateOffset(months=1), axis=0)
+        ).sum(axis=1)
+    else:
+        for col in ['Consultas_entidad', 'Consultas_SFI', 'Consultas_ult_mes']:
+            df.loc[:, col] = agregados[col]
 
     return df
 
-def procesar_informe(xml_string):
+def procesar_informe(xml_string, engine=None, vectorizado=None, plan=None):
+    engine = engine or EXTRACCION_ENGINE
+    omitir = secciones_omitidas(plan)
+    if engine == "stream":
+        extraido = extraer_datos_stream(xml_string, variante="ncl", destino=ESQUEMAS_INFORME["ncl"].nuevo_registro(), omitir=omitir)
+    elif engine == "lxml":
+        extraido = extraer_datos_lxml(xml_string, variante="ncl", destino=ESQUEMAS_INFORME["ncl"].nuevo_registro(), omitir=omitir)
+    elif engine == "etree":
+        extraido = _extraer_datos_etree(xml_string, omitir)
+    else:
+        raise ValueError(f"Engine de extraccion no soportado: {engine}")
+    if extraido is None:
+        return None
+    return construir_dataframe_informe(*extraido, vectorizado=vectorizado, plan=plan)
+
+def _extraer_datos_etree(xml_string, omitir=frozenset()):
+    """Extraccion original: arbol completo en memoria y un findall por seccion.
+
+    `omitir` son las secciones que no se procesan (ver `plan_features.SECCIONES`).
+    """
     try:
         if xml_string.startswith("<?xml"):
             xml_string = xml_string.split("?>", 1)[1]
@@ -218,88 +420,93 @@ def procesar_informe(xml_string):
     datos['identificacionDigitada'] = informe.get('identificacionDigitada', '')
     
     # 2. Sección NaturalNacional
-    natural_nacional = informe.find('NaturalNacional')
-    identificacion = natural_nacional.find('Identificacion') if natural_nacional is not None else None
-    for key in ['ciudad', 'departamento', 'genero']:
-        datos[f'{key}_exp'] = get_attr(identificacion, key)
+    if 'NaturalNacional' not in omitir:
+        natural_nacional = informe.find('NaturalNacional')
+        identificacion = natural_nacional.find('Identificacion') if natural_nacional is not None else None
+        for key in ['ciudad', 'departamento', 'genero']:
+            datos[f'{key}_exp'] = get_attr(identificacion, key)
     
     # 3. Score
-    score = informe.find('Score')
-    datos['puntaje_experian'] = get_attr(score, 'puntaje')
-        # Extraer códigos de razones 
-    if score is not None:
-        razones = score.findall('Razon')
-        codigos_razon = [razon.get('codigo') for razon in razones]
-        # Puedes guardar solo los primeros 2 o hasta N si necesitas
-        datos['razon_codigo_1'] = codigos_razon[0] if len(codigos_razon) > 0 else None 
-        datos['razon_codigo_2'] = codigos_razon[1] if len(codigos_razon) > 1 else None
-    else:
-        datos['razon_codigo_1'] = None
-        datos['razon_codigo_2'] = None
+    if 'Score' not in omitir:
+        score = informe.find('Score')
+        datos['puntaje_experian'] = get_attr(score, 'puntaje')
+            # Extraer códigos de razones 
+        if score is not None:
+            razones = score.findall('Razon')
+            codigos_razon = [razon.get('codigo') for razon in razones]
+            # Puedes guardar solo los primeros 2 o hasta N si necesitas
+            datos['razon_codigo_1'] = codigos_razon[0] if len(codigos_razon) > 0 else None 
+            datos['razon_codigo_2'] = codigos_razon[1] if len(codigos_razon) > 1 else None
+        else:
+            datos['razon_codigo_1'] = None
+            datos['razon_codigo_2'] = None
     
     # 4. Cuentas Ahorro
-    cuentas_ahorro = informe.findall('CuentaAhorro')
-    fechas_apertura1 = [ahorro.get('fechaApertura') for ahorro in cuentas_ahorro
-                        if ahorro.get('fechaApertura', '').strip()]
-    datos['ahorros_fechaApertura_reciente'] = max(fechas_apertura1) if fechas_apertura1 else ''
-    datos['Ctas_pCliente'] = len(cuentas_ahorro) 
-    datos['Cuentas_sector1'] = sum(1 for cuenta in cuentas_ahorro if cuenta.attrib.get('sector') == '1')
+    if 'CuentaAhorro' not in omitir:
+        cuentas_ahorro = informe.findall('CuentaAhorro')
+        fechas_apertura1 = [ahorro.get('fechaApertura') for ahorro in cuentas_ahorro
+                            if ahorro.get('fechaApertura', '').strip()]
+        datos['ahorros_fechaApertura_reciente'] = max(fechas_apertura1) if fechas_apertura1 else ''
+        datos['Ctas_pCliente'] = len(cuentas_ahorro) 
+        datos['Cuentas_sector1'] = sum(1 for cuenta in cuentas_ahorro if cuenta.attrib.get('sector') == '1')
 
     # 5. Cuentas Cartera
-    contador_por_sector = defaultdict(int)
-    fechas_apertura2 = []
-    carteras = informe.findall('CuentaCartera')
+    if 'CuentaCartera' not in omitir:
+        contador_por_sector = defaultdict(int)
+        fechas_apertura2 = []
+        carteras = informe.findall('CuentaCartera')
 
-    for i, cartera in enumerate(carteras, 1):
-        sector = cartera.get('sector', '')
+        for i, cartera in enumerate(carteras, 1):
+            sector = cartera.get('sector', '')
         
-        if fecha_str := cartera.get('fechaApertura'):
-            fecha_str = fecha_str.strip()
-            if len(fecha_str) == 10 and fecha_str.count('-') == 2:
-                try:
-                    fecha_dt = datetime.strptime(fecha_str, '%Y-%m-%d')
-                    fechas_apertura2.append(fecha_dt)
-                except ValueError:
-                    pass
-
-        if valores := cartera.find('Valores'):
-            for tipo in valores.findall('Valor') or []:
-                contador_por_sector[sector] += 1
-                idx = contador_por_sector[sector]
-                datos.update({
-                    f'Sector{sector}_{idx}_cuota': tipo.get('cuota', ''),
-                    f'Sector{sector}_{idx}_totalCuotas': tipo.get('totalCuotas', ''),
-                    f'Sector{sector}_{idx}_cuotasCanceladas': tipo.get('cuotasCanceladas', '')
-                })
-
-        estados = cartera.find('Estados')
-        if estados is not None:
-            estado_cuentas = estados.findall('EstadoCuenta')
-            for j, estado in enumerate(estado_cuentas, 1): 
-                for key in ['codigo']:
-                    datos[f'Cartera_{i}_{j}_{key}'] = estado.attrib.get(key, '')
-
-    datos['cartera_fechaApertura_reciente'] = max(fechas_apertura2) if fechas_apertura2 else ''
+            if fecha_str := cartera.get('fechaApertura'):
+                fecha_str = fecha_str.strip()
+                if len(fecha_str) == 10 and fecha_str.count('-') == 2:
+                    try:
+                        fecha_dt = datetime.strptime(fecha_str, '%Y-%m-%d')
+                        fechas_apertura2.append(fecha_dt)
+                    except ValueError:
+                        pass
+
+            if 'CuentaCartera/Valores' not in omitir and (valores := cartera.find('Valores')):
+                for tipo in valores.findall('Valor') or []:
+                    contador_por_sector[sector] += 1
+                    idx = contador_por_sector[sector]
+                    datos.update({
+                        f'Sector{sector}_{idx}_cuota': tipo.get('cuota', ''),
+                        f'Sector{sector}_{idx}_totalCuotas': tipo.get('totalCuotas', ''),
+                        f'Sector{sector}_{idx}_cuotasCanceladas': tipo.get('cuotasCanceladas', '')
+                    })
+
+            estados = cartera.find('Estados') if 'CuentaCartera/Estados' not in omitir else None
+            if estados is not None:
+                estado_cuentas = estados.findall('EstadoCuenta')
+                for j, estado in enumerate(estado_cuentas, 1): 
+                    for key in ['codigo']:
+                        datos[f'Cartera_{i}_{j}_{key}'] = estado.attrib.get(key, '')
+
+        datos['cartera_fechaApertura_reciente'] = max(fechas_apertura2) if fechas_apertura2 else ''
     
-    datos['CC_TipoContrato_1'] = sum(
-        1 for cartera in carteras
-        if (caract := cartera.find('Caracteristicas')) is not None and caract.attrib.get('tipoContrato') == '1'
-    )
+        datos['CC_TipoContrato_1'] = sum(
+            1 for cartera in carteras
+            if (caract := cartera.find('Caracteristicas')) is not None and caract.attrib.get('tipoContrato') == '1'
+        )
 
-    datos['cc_tpobl_2_con'] = sum(
-        1 for cartera in carteras
-        if (caract := cartera.find('Caracteristicas')) is not None and caract.attrib.get('tipoObligacion') == '2'
-    )
+        datos['cc_tpobl_2_con'] = sum(
+            1 for cartera in carteras
+            if (caract := cartera.find('Caracteristicas')) is not None and caract.attrib.get('tipoObligacion') == '2'
+        )
 
     # 6. Tarjeta de Crédito
-    tdc = informe.findall('TarjetaCredito')
-    fechas_apertura3 = [tc.get('fechaApertura') for tc in tdc
-                        if tc.get('fechaApertura', '').strip()]
+    if 'TarjetaCredito' not in omitir:
+        tdc = informe.findall('TarjetaCredito')
+        fechas_apertura3 = [tc.get('fechaApertura') for tc in tdc
+                            if tc.get('fechaApertura', '').strip()]
 
-    datos['tdc_fechaApertura_reciente'] = max(fechas_apertura3) if fechas_apertura3 else ''
+        datos['tdc_fechaApertura_reciente'] = max(fechas_apertura3) if fechas_apertura3 else ''
 
     # 7. Consultas en Experian
-    consultas = informe.findall('Consulta')
+    consultas = informe.findall('Consulta') if 'Consulta' not in omitir else []
     consultas_por_tipo = defaultdict(list)
     for consulta in consultas:
         consultas_por_tipo[consulta.get('tipoCuenta', '')].append(consulta)
@@ -312,24 +519,27 @@ def procesar_informe(xml_string):
                 f'Consulta_{tipo}_{i}_fecha': consulta.get('fecha', '')
             })
     # 8. ProductosValores
-    datos['quanto'] = get_attr(informe.find('productosValores'), 'valor1')
-    datos['quanto_pct'] = get_attr(informe.find('productosValores'), 'valor1smlv')
+    if 'productosValores' not in omitir:
+        datos['quanto'] = get_attr(informe.find('productosValores'), 'valor1')
+        datos['quanto_pct'] = get_attr(informe.find('productosValores'), 'valor1smlv')
 
     # 9. infoAgregada
     info = informe.find('InfoAgregada')
     res = info.find('Resumen') if info is not None else None
 
     # Principales
-    principales = res.find('Principales') if res is not None else None
-    for key in ['cuentasCerradasAHOCCB', 'creditosCerrados', 'antiguedadDesde', 'creditoVigentes','consultadasUlt6meses']:
-        datos[f'agr_prinp_{key}'] = get_attr(principales, key)
+    if 'InfoAgregada/Principales' not in omitir:
+        principales = res.find('Principales') if res is not None else None
+        for key in ['cuentasCerradasAHOCCB', 'creditosCerrados', 'antiguedadDesde', 'creditoVigentes','consultadasUlt6meses']:
+            datos[f'agr_prinp_{key}'] = get_attr(principales, key)
 
     # Saldos
     saldo = res.find('Saldos') if res is not None else None
-    for key in ['cuotaMensual', 'saldoTotal', 'saldoTotalEnMora', 'saldoCreditoMasAlto']:
-        datos[f'agr_saldos_{key}'] = get_attr(saldo, key)
+    if 'InfoAgregada/Saldos' not in omitir:
+        for key in ['cuotaMensual', 'saldoTotal', 'saldoTotalEnMora', 'saldoCreditoMasAlto']:
+            datos[f'agr_saldos_{key}'] = get_attr(saldo, key)
 
-    if saldo is not None:
+    if saldo is not None and 'InfoAgregada/Saldos/Mes' not in omitir:
         for i, mes in enumerate(saldo.findall('Mes') or [], 1):
             datos.update({
                 f'saldoTotalMora_{i}': mes.get('saldoTotalMora', ''),
@@ -337,7 +547,7 @@ def procesar_informe(xml_string):
             })
 
     # Comportamiento
-    comp = res.find('Comportamiento') if res is not None else None
+    comp = res.find('Comportamiento') if res is not None and 'InfoAgregada/Comportamiento' not in omitir else None
     if comp is not None:
         for i, mes in enumerate(comp.findall('Mes') or [], 1):
             datos.update({
@@ -346,7 +556,7 @@ def procesar_informe(xml_string):
             })
 
     # Portafolio
-    if info is not None and (por := info.find('ComposicionPortafolio')) is not None:
+    if info is not None and 'InfoAgregada/ComposicionPortafolio' not in omitir and (por := info.find('ComposicionPortafolio')) is not None:
         for i, tipo in enumerate(por.findall('TipoCuenta'), 1):
             if tipo is not None and hasattr(tipo, 'attrib'):
                 for key in ['tipo', 'cantidad']:
@@ -365,7 +575,7 @@ def procesar_informe(xml_string):
     #     if ap := evo.find('AnalisisPromedio'):
     #         for key in ['cuota', 'porcentajeUso', 'totalCerradas', 'totalAbiertas', 'saldo']:
     #             datos[f'agr_analisisPromedio_{key}'] = ap.get(key, '')
-    evo = info.find('EvolucionDeuda') if info is not None else None
+    evo = info.find('EvolucionDeuda') if info is not None and 'InfoAgregada/EvolucionDeuda' not in omitir else None
     if evo is not None:
         # Buscar el nodo AnalisisPromedio robustamente
         for ap in evo.iter('AnalisisPromedio'):
@@ -390,7 +600,7 @@ def procesar_informe(xml_string):
         resumen_path = micro.find('Resumen')
         
         # 1. Extraer datos de CreditosCerrados
-        if resumen_path is not None:
+        if resumen_path is not None and 'InfoAgregadaMicrocredito/PerfilGeneral' not in omitir:
             perfil_general_path = resumen_path.find('PerfilGeneral')
             if perfil_general_path is not None:
                 creditos_cerrados_path = perfil_general_path.find('CreditosCerrados')
@@ -399,7 +609,7 @@ def procesar_informe(xml_string):
                     datos['Cc_totalComoPrincipal'] = creditos_cerrados_path.get('totalComoPrincipal', '')
 
         # 2. Extraer datos de EvolucionDeuda
-        if (evd := micro.find('EvolucionDeuda')) is not None:
+        if 'InfoAgregadaMicrocredito/EvolucionDeuda' not in omitir and (evd := micro.find('EvolucionDeuda')) is not None:
             for sector in evd.findall('EvolucionDeudaSector'):
                 if sector.get('codSector') == "4":
                     for tipo_cuenta in sector.findall('EvolucionDeudaTipoCuenta'):
@@ -408,7 +618,7 @@ def procesar_informe(xml_string):
                             datos[f'{tipo}_trim_{i}_saldoMora'] = trimestre.get('saldoMora', '')
 
         # VectorSaldosYMoras 
-        if resumen_path is not None: 
+        if resumen_path is not None and 'InfoAgregadaMicrocredito/VectorSaldosYMoras' not in omitir:
             vector_saldos = resumen_path.find('VectorSaldosYMoras')
             if vector_saldos is not None:
                 saldos_moras_list = vector_saldos.findall('SaldosYMoras')
@@ -436,60 +646,81 @@ def procesar_informe(xml_string):
         'tdc_saldo_mora': sumar_valores(".//TarjetaCredito/Valores/Valor", 'saldoMora')
     })
     
+    return datos, len(consultas)
+
+def construir_dataframe_informe(datos, n_consultas, agregados=None, vectorizado=None, plan=None):
+    """Convierte `datos` en el DataFrame de una fila con las variables derivadas.
+
+    `datos` puede ser el `OrderedDict` de la extraccion etree o el
+    `RegistroFeatures` de los engines stream/lxml (ver `esquema_informe`).
+    Con `agregados` (engines stream/lxml) `datos` ya no trae las familias
+    `Sector*_*`, `Cartera_*_codigo` ni `Consulta_*`: sus variables llegan
+    calculadas y no hay columnas temporales que buscar ni eliminar.
+    `vectorizado` se pasa a `procesar_cuotas_y_amortizacion` y
+    `procesar_consultas_experian`; `plan` (ver `plan_features`) a todas las
+    etapas, que omiten las variables derivadas que no usan los modelos.
+
+    El DataFrame que se construye aqui es propio de esta funcion: cada etapa
+    (`variables_income`, `procesar_cuotas_y_amortizacion`,
+    `procesar_consultas_experian`) lo recibe en propiedad, lo modifica en su
+    lugar y devuelve el resultado, sin copias intermedias. Quien llame a esas
+    funciones por separado y necesite conservar su entrada debe copiarla antes.
+    """
     if datos:
-        df = pd.DataFrame([datos])
-        
-        cols_cats = [
-            'fechaConsulta', 'ciudad_exp', 'departamento_exp', 
-            'ahorros_fechaApertura_reciente', 'cartera_fechaApertura_reciente', 'tdc_fechaApertura_reciente',
-            'agr_prinp_antiguedadDesde', 'comportamiento_1', 'comportamiento_2', 
-            'comportamiento_3', 'comportamiento_4', 'comportamiento_5', 'comportamiento_6', 
-            'comportamiento_7', 'comportamiento_8', 
-            'comportamiento_9', 'comportamiento_10', 'comportamiento_11', 'comportamiento_12', 
-            'comportamiento_13', 'comportamiento_14', 'comportamiento_15', 'comportamiento_16', 
-            'comportamiento_17', 'comportamiento_18', 'comportamiento_19', 'comportamiento_20', 
-            'comportamiento_21', 'comportamiento_22', 'comportamiento_23', 'comportamiento_24', 
-            'total_tipo_1', 'total_tipo_2', 'total_tipo_3', 
-            'trimestre_1_moraMaxima', 'trimestre_2_moraMaxima', 'trimestre_3_moraMaxima']
-        for col in df.loc[:,(df.columns.str.endswith('_fecha'))&(df.columns.str.startswith('Consulta_'))].columns:
-            cols_cats.append(col)
+        if isinstance(datos, RegistroFeatures):
+            # Registro del esquema: columnas ya tipadas, sin coercion con to_numeric
+            df = datos.a_dataframe()
+        else:
+            df = pd.DataFrame([datos])
         
-        cols_to_convert = df.columns.difference(cols_cats)
-        df[cols_to_convert] = df[cols_to_convert].apply(pd.to_numeric, errors='coerce')
+            cols_cats = [
+                'fechaConsulta', 'ciudad_exp', 'departamento_exp', 
+                'ahorros_fechaApertura_reciente', 'cartera_fechaApertura_reciente', 'tdc_fechaApertura_reciente',
+                'agr_prinp_antiguedadDesde', 'comportamiento_1', 'comportamiento_2', 
+                'comportamiento_3', 'comportamiento_4', 'comportamiento_5', 'comportamiento_6', 
+                'comportamiento_7', 'comportamiento_8', 
+                'comportamiento_9', 'comportamiento_10', 'comportamiento_11', 'comportamiento_12', 
+                'comportamiento_13', 'comportamiento_14', 'comportamiento_15', 'comportamiento_16', 
+                'comportamiento_17', 'comportamiento_18', 'comportamiento_19', 'comportamiento_20', 
+                'comportamiento_21', 'comportamiento_22', 'comportamiento_23', 'comportamiento_24', 
+                'total_tipo_1', 'total_tipo_2', 'total_tipo_3', 
+                'trimestre_1_moraMaxima', 'trimestre_2_moraMaxima', 'trimestre_3_moraMaxima']
+            cols_cats.extend(indice_familias(df.columns).nombres('consulta_fecha'))
         
-        df = variables_income(df.copy())
+            cols_to_convert = df.columns.difference(cols_cats)
+            df[cols_to_convert] = df[cols_to_convert].apply(pd.to_numeric, errors='coerce')
         
-        cartera_Cuota = []
-        cartera_totalCuotas = []
-        cartera_cuotasCanceladas = []
+        with etapa("variables_income"):
+            df = variables_income(df, agregados, plan)
         
-        for col in df.columns:
-            if 'Sector' in col:
-                if col.endswith('cuota'):
-                    cartera_Cuota.append(col)
-                elif 'totalCuotas' in col:
-                    cartera_totalCuotas.append(col)
-                elif 'cuotasCanceladas' in col:
-                    cartera_cuotasCanceladas.append(col)
-        cols_to_convert = cartera_Cuota + cartera_totalCuotas + cartera_cuotasCanceladas
-            # 7. Eliminar columnas temporales
-        columnas_a_eliminar = [col for col in cols_to_convert if col in df.columns]
-        df.drop(columns=columnas_a_eliminar, inplace=True, errors='ignore')
-
-        df = procesar_cuotas_y_amortizacion(df.copy())
+        if agregados is None:
+            idx = indice_familias(df.columns)
+            cols_to_convert = idx.nombres('sector_cuota') + idx.nombres('sector_totalCuotas') + idx.nombres('sector_cuotasCanceladas')
+                # 7. Eliminar columnas temporales
+            df.drop(columns=cols_to_convert, inplace=True, errors='ignore')
+
+        with etapa("cuotas_y_amortizacion"):
+            df = procesar_cuotas_y_amortizacion(df, agregados, vectorizado, plan)
             # Eliminar columnas de 'Cartera'
-        df.drop(columns=[col for col in df.columns if 'Cartera' in col and col.endswith('codigo')], inplace=True)
+        if agregados is None:
+            df.drop(columns=indice_familias(df.columns).nombres('cartera_codigo'), inplace=True)
         
         df['quanto'] = pd.to_numeric(df["quanto"], errors="coerce")
         df['agr_saldos_cuotaMensual'] = pd.to_numeric(df["agr_saldos_cuotaMensual"], errors="coerce")
 
-        df["capacidad_endeudamiento"] = df["quanto"] - (df["quanto"] * 0.4) - df["agr_saldos_cuotaMensual"]
-        df['ratio_endeudamiento'] = np.nan
-        df.loc[df["quanto"] > 0, 'ratio_endeudamiento'] = df["capacidad_endeudamiento"] / df["quanto"]
+        calcular = calculador(plan)
+        nuevas = ConstructorFeatures(df)
+        capacidad = df["quanto"] - (df["quanto"] * 0.4) - df["agr_saldos_cuotaMensual"]
+        if calcular("capacidad_endeudamiento"):
+            nuevas["capacidad_endeudamiento"] = capacidad
+        if calcular("ratio_endeudamiento"):
+            nuevas['ratio_endeudamiento'] = (capacidad / df["quanto"]).where(df["quanto"] > 0)
+        df = nuevas.construir()
         #datos = pd.DataFrame([datos])
         
-        if consultas:
-            df = procesar_consultas_experian(df.copy())
+        if n_consultas:
+            with etapa("consultas_experian"):
+                df = procesar_consultas_experian(df, agregados, vectorizado, plan)
         return df
 
     return []
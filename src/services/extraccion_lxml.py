@@ -0,0 +1,117 @@
+"""Extraccion de XML Experian con lxml (motor 'lxml').
+
+- Todas las expresiones XPath se compilan una sola vez al importar el modulo.
+- El XML se parsea desde bytes con un parser por hilo; lxml libera el GIL
+  mientras libxml2 parsea, asi que en un servidor con pool de hilos el trabajo
+  de parseo de varias solicitudes se solapa de verdad.
+- Las secciones se reparten al mismo `ReductorInforme` del motor 'stream', por
+  lo que el diccionario `datos` es identico al de la extraccion etree.
+"""
+import logging
+import threading
+
+from lxml import etree
+
+from src.services.extraccion_stream import ReductorInforme, CODIGOS_TDC_ACTIVA, _es_numero
+
+# XPath precompilados (sin smart strings: los resultados no retienen el arbol)
+XP_INFORME = etree.XPath('(.//Informe)[1]')
+XP_SECCIONES = etree.XPath('./*')
+XP_CARTERA_SALDO_ACTUAL = etree.XPath('.//CuentaCartera/Valores/Valor/@saldoActual', smart_strings=False)
+XP_CARTERA_SALDO_MORA = etree.XPath('.//CuentaCartera/Valores/Valor/@saldoMora', smart_strings=False)
+XP_CARTERA_VALORES_ACTIVOS = etree.XPath('.//CuentaCartera/Valores/Valor[@saldoActual]')
+XP_TDC_SALDO_ACTUAL = etree.XPath('.//TarjetaCredito/Valores/Valor/@saldoActual', smart_strings=False)
+XP_TDC_SALDO_MORA = etree.XPath('.//TarjetaCredito/Valores/Valor/@saldoMora', smart_strings=False)
+XP_TARJETAS = etree.XPath('.//TarjetaCredito')
+XP_TDC_ULTIMO_ESTADO = etree.XPath('./Estados[1]/EstadoCuenta[last()]/@codigo', smart_strings=False)
+XP_TDC_CUPO_TOTAL = etree.XPath('./Valores[1]/Valor/@cupoTotal', smart_strings=False)
+XP_CARTERA_VALOR = etree.XPath('./Valores[1]/Valor')
+XP_CARTERA_ESTADO = etree.XPath('./Estados[1]/EstadoCuenta')
+XP_CARTERA_CARACTERISTICAS = etree.XPath('./Caracteristicas[1]')
+
+_parsers = threading.local()
+
+
+def _parser(forzar_utf8):
+    """Parser por hilo: lxml solo libera el GIL si el parser no se comparte entre hilos."""
+    nombre = 'utf8' if forzar_utf8 else 'doc'
+    parser = getattr(_parsers, nombre, None)
+    if parser is None:
+        opciones = dict(resolve_entities=False, no_network=True, remove_comments=True, remove_pis=True)
+        if forzar_utf8:
+            # El texto ya viene decodificado; se ignora el encoding declarado en el prologo
+            opciones['encoding'] = 'utf-8'
+        parser = etree.XMLParser(**opciones)
+        setattr(_parsers, nombre, parser)
+    return parser
+
+
+class ReductorInformeLxml(ReductorInforme):
+    """Reductor que resuelve los hijos de cada CuentaCartera con XPath precompilado."""
+
+    def _partes_cartera(self, cartera):
+        caract = XP_CARTERA_CARACTERISTICAS(cartera)
+        return XP_CARTERA_VALOR(cartera), XP_CARTERA_ESTADO(cartera), caract[0] if caract else None
+
+
+def sumar_valores(xpath, informe):
+    return sum(float(v) for v in xpath(informe) if _es_numero(v))
+
+
+def sumar_valor_inicial_activa(informe):
+    return sum(
+        float(valor.get('valorInicial', 0))
+        for valor in XP_CARTERA_VALORES_ACTIVOS(informe)
+        if _es_numero(valor.get('saldoActual')) and float(valor.get('saldoActual')) not in [0, -1]
+    )
+
+
+def sumar_cupo_total_estado_tarjetas(informe, codigos_validos=CODIGOS_TDC_ACTIVA):
+    suma = 0.0
+    for tarjeta in XP_TARJETAS(informe):
+        codigo = XP_TDC_ULTIMO_ESTADO(tarjeta)
+        if (codigo[0] if codigo else None) in codigos_validos:
+            for v in XP_TDC_CUPO_TOTAL(tarjeta):
+                if _es_numero(v):
+                    suma += float(v)
+    return suma
+
+
+def extraer_datos_lxml(xml, variante="regular", agregar=True, destino=None, omitir=()):
+    """Parsea con lxml y devuelve `(datos, n_consultas, agregados)`, o None si el XML no es valido.
+
+    `omitir` son las secciones que no se procesan (ver `ReductorInforme`).
+    """
+    try:
+        if isinstance(xml, str):
+            root = etree.fromstring(xml.encode('utf-8'), _parser(forzar_utf8=True))
+        else:
+            root = etree.fromstring(xml, _parser(forzar_utf8=False))
+    except etree.XMLSyntaxError as e:
+        logging.error("No se pudo parsear el XML: %s", e)
+        return None
+
+    encontrados = XP_INFORME(root)
+    if not encontrados:
+        logging.error("No se encontró la etiqueta 'Informe' en el XML")
+        return None
+    informe = encontrados[0]
+
+    reductor = ReductorInformeLxml(variante, sumas=False, agregar=agregar, omitir=omitir)
+    reductor.inicio_informe(informe.attrib)
+    for seccion in XP_SECCIONES(informe):
+        reductor.seccion(seccion)
+
+    reductor.cartera_saldo_actual = sumar_valores(XP_CARTERA_SALDO_ACTUAL, informe)
+    reductor.cartera_saldo_mora = sumar_valores(XP_CARTERA_SALDO_MORA, informe)
+    reductor.tdc_saldo_actual = sumar_valores(XP_TDC_SALDO_ACTUAL, informe)
+    reductor.tdc_saldo_mora = sumar_valores(XP_TDC_SALDO_MORA, informe)
+    if reductor.variante["sumas_activas"]:
+        reductor.cartera_valor_inicial = sumar_valor_inicial_activa(informe)
+        reductor.tdc_cupo_activo = sumar_cupo_total_estado_tarjetas(informe)
+
+    logging.info(
+        "[extract][lxml] secciones | ahorro=%d cartera=%d tdc=%d consultas=%d",
+        reductor.n_ahorro, reductor.n_cartera, reductor.n_tdc, reductor.n_consultas,
+    )
+    return reductor.resultado(destino), reductor.n_consultas, reductor.agregados() if agregar else None
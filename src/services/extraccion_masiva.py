@@ -0,0 +1,413 @@
+"""Extraccion masiva de features Experian a Parquet.
+
+Recorre payloads archivados (un directorio de `*.json` o un `.jsonl`, un
+payload por linea, con la misma forma que el cuerpo de `/predict_contraoferta`),
+corre `procesar_informe` + `calcular_variables_cliente` +
+`preprocesscomportamiento` + `calcular_tendencia` de la variante que
+corresponda y escribe particiones Parquet con esquema estable:
+
+    <salida>/variante=regular/part-000000.parquet
+    <salida>/variante=ncl/part-000000.parquet
+    <salida>/_chunks/chunk-000000.json    (marca de chunk terminado)
+    <salida>/_resumen.json                (throughput por worker)
+
+El esquema de cada variante es la union ordenada de las features de sus
+scalers y modelos mas `payload_id`, `variante` y `error`. Un payload que falla
+queda como fila con `error` y features nulas. Con `dtypes.parquet_compacto`
+cada feature se escribe con el tipo de la politica de dtypes (ver
+`politica_dtypes`): conteos e indicadores en int8/int16/int32, ratios en
+float32 y el resto en float64. El tipo de cada columna se fija una vez por
+corrida, antes del primer chunk, y queda en `<salida>/_esquema.json`: todas las
+particiones comparten esquema. Un chunk con valores que no caben en el tipo
+de su columna falla con `ValueError` (hay que ampliar la regla en `dtypes` o
+apagar `parquet_compacto`), y relanzar sobre una salida con otro esquema
+tambien.
+
+Con `--reporte-memoria N` no se extrae a Parquet: se procesan los primeros N
+payloads y se escribe `<salida>/_memoria.json` con los bytes por fila de cada
+etapa antes y despues de compactar, y la diferencia maxima de probabilidad de
+cada modelo con las features compactadas.
+
+Los chunks se numeran de forma determinista sobre la entrada, asi que al
+relanzar el mismo comando se saltan los que ya tienen su marca en `_chunks/`.
+
+Uso:
+    python -m src.services.extraccion_masiva --entrada payloads.jsonl --salida features/ --workers 8
+    python -m src.services.extraccion_masiva --entrada payloads.jsonl --salida reporte/ --variante regular --reporte-memoria 200
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.config.config import (
+    MODELO_PATH,
+    MODELO_FPD_PATH,
+    SCALER_PATH_H,
+    SCALER_PATH_FPD,
+    MODELO_NCLF_PATH,
+    MODELO_FPD_NCLF_PATH,
+    SCALER_NCLF_PATH,
+    DTYPES_PARQUET_COMPACTO,
+)
+from src.models.predict_utils import CACHE_INFORMES, extraer_datos_iniciales, procesar_xml_experian
+from src.services import extraccion_API, extraccion_API_NCL, preprocess, preprocess_NCL
+from src.services.politica_dtypes import (
+    CATEGORIA,
+    ENTEROS,
+    FLOAT32,
+    POLITICA,
+    reducir,
+    reporte_memoria,
+    verificar_politica,
+)
+from src.utils.helpers import cargar_modelo
+from src.utils.logging_config import setup_logging
+
+COLUMNAS_META = ['payload_id', 'variante', 'error']
+
+PIPELINES = {
+    "regular": (extraccion_API.procesar_informe, preprocess),
+    "ncl": (extraccion_API_NCL.procesar_informe, preprocess_NCL),
+}
+
+ARTEFACTOS = {
+    "regular": (MODELO_PATH, SCALER_PATH_H, MODELO_FPD_PATH, SCALER_PATH_FPD),
+    "ncl": (MODELO_NCLF_PATH, SCALER_NCLF_PATH, MODELO_FPD_NCLF_PATH, SCALER_NCLF_PATH),
+}
+
+# Esquemas (variante -> [(columna, dtype)]) que cada worker recibe al arrancar
+_esquemas = {}
+
+
+def columnas_variante(variante):
+    """Union ordenada de las features de los scalers y modelos de la variante."""
+    modelo_h, scaler_h, modelo_fpd, scaler_fpd = (cargar_modelo(ruta) for ruta in ARTEFACTOS[variante])
+    columnas = set(scaler_h.feature_names_in_) | set(scaler_fpd.feature_names_in_)
+    columnas |= set(modelo_h.feature_name_) | set(modelo_fpd.feature_name_)
+    return sorted(str(c) for c in columnas)
+
+
+def tipos_parquet(columnas):
+    """`[(columna, dtype)]` con el dtype de cada feature en el Parquet segun la politica.
+
+    Las fechas ya llegan numericas a la fila de features y las columnas sin
+    regla quedan en float64, igual que con `parquet_compacto` apagado.
+    """
+    tipos = []
+    for c in columnas:
+        tipo = POLITICA.tipo(c) if DTYPES_PARQUET_COMPACTO else None
+        if tipo == CATEGORIA:
+            dtype = "int8"
+        elif tipo in ENTEROS or tipo == FLOAT32:
+            dtype = tipo
+        else:
+            dtype = "float64"
+        tipos.append((c, dtype))
+    return tipos
+
+
+def _fijar_esquemas(salida, esquemas):
+    """Escribe `_esquema.json` o verifica que coincida con el de una corrida anterior."""
+    ruta = salida / "_esquema.json"
+    actual = {v: [list(t) for t in tipos] for v, tipos in esquemas.items()}
+    if ruta.exists():
+        previo = json.loads(ruta.read_text(encoding="utf-8"))
+        distintas = [v for v in actual if v in previo and previo[v] != actual[v]]
+        if distintas:
+            raise ValueError(
+                f"{salida} tiene particiones con otro esquema para {distintas}; "
+                "usar otra salida o la misma politica de dtypes"
+            )
+        actual = {**previo, **actual}
+    temporal = ruta.with_suffix('.tmp')
+    temporal.write_text(json.dumps(actual), encoding="utf-8")
+    os.replace(temporal, ruta)
+
+
+def resolver_variante(datos_cliente, variante):
+    """Con `auto` se replica el ruteo por score_experian de decide_and_predict."""
+    if variante != "auto":
+        return variante
+    score = int(datos_cliente.get("score_experian", 30))
+    if score in (0, 1, 2, 3, 4):
+        return "ncl"
+    if score == 30:
+        return None  # Respaldo: no usa el XML Experian
+    return "regular"
+
+
+def features_payload(payload, variante, etapas=None):
+    """Corre extraccion + preprocesamiento sobre un payload y devuelve la fila de features.
+
+    Con `etapas` (dict `etapa -> lista`) se agrega el DataFrame de cada paso.
+    """
+    datos_cliente, _ = extraer_datos_iniciales(payload, ["score_experian"])
+    xml = payload.get("experianXML")
+    if not xml:
+        raise ValueError("Payload sin experianXML")
+    procesar_informe, modulo = PIPELINES[variante]
+    df = procesar_xml_experian(datos_cliente, xml, procesar_informe, variante=variante)
+    if etapas is not None:
+        etapas.setdefault("procesar_informe", []).append(df.copy())
+    for paso in (modulo.calcular_variables_cliente, modulo.preprocesscomportamiento, modulo.calcular_tendencia):
+        df = paso(df)
+        if etapas is not None:
+            etapas.setdefault(paso.__name__, []).append(df.copy())
+    # Mismos alias que agregan los motores antes de normalizar
+    df["ident_genero"] = df['genero_exp']
+    df['Edad'] = df['edad_cliente']
+    df["puntaje_quanto"] = df["quanto"]
+    return df
+
+
+def _fila(payload_id, variante, columnas, df=None, error=None):
+    valores = np.full(len(columnas), np.nan)
+    if df is not None:
+        presentes = [c for c in columnas if c in df.columns]
+        fila = pd.to_numeric(df.iloc[0][presentes], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        valores[[columnas.index(c) for c in presentes]] = fila
+    return [payload_id, variante, error], valores
+
+
+def _leer_item(item):
+    payload_id, fuente = item
+    if isinstance(fuente, Path):
+        with open(fuente, "r", encoding="utf-8") as f:
+            return payload_id, json.load(f)
+    return payload_id, json.loads(fuente)
+
+
+def _escribir_parquet(filas, variante, ruta):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tipos = _esquemas[variante]
+    meta = list(zip(*(m for m, _ in filas)))
+    matriz = np.vstack([v for _, v in filas])
+    campos = [(c, pa.string()) for c in COLUMNAS_META]
+    arrays = [pa.array(list(col), type=pa.string()) for col in meta]
+    for j, (c, dtype) in enumerate(tipos):
+        array = _array_tipo(matriz[:, j], c, dtype)
+        campos.append((c, array.type))
+        arrays.append(array)
+    tabla = pa.Table.from_arrays(arrays, schema=pa.schema(campos))
+
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    temporal = ruta.with_suffix('.tmp')
+    pq.write_table(tabla, temporal)
+    os.replace(temporal, ruta)
+
+
+def _array_tipo(valores, columna, dtype):
+    """Columna de features en `dtype` (el del esquema de la corrida); `ValueError` si algun valor no cabe."""
+    import pyarrow as pa
+
+    if dtype == "float64":
+        return pa.array(valores, type=pa.float64(), from_pandas=True)
+    reducida = reducir(valores, FLOAT32 if dtype == FLOAT32 else dtype)
+    if reducida is None:
+        raise ValueError(
+            f"{columna}: hay valores que no caben en {dtype} (politica de dtypes); "
+            "ampliar su regla en `dtypes` o apagar `dtypes.parquet_compacto`"
+        )
+    arreglo, nulos = reducida
+    return pa.array(arreglo, mask=nulos)
+
+
+def _iniciar_worker(esquemas):
+    # El pipeline registra cada paso en INFO; en lote solo interesan advertencias
+    logging.getLogger().setLevel(logging.WARNING)
+    # Cada payload se procesa una sola vez: la cache de informes solo ocuparia memoria
+    CACHE_INFORMES.max_entradas = 0
+    _esquemas.update(esquemas)
+
+
+def procesar_chunk(indice, items, variante, salida):
+    """Procesa un chunk en un worker y escribe sus particiones; devuelve estadisticas."""
+    inicio = time.perf_counter()
+    filas = {v: [] for v in _esquemas}
+    columnas = {v: [c for c, _ in tipos] for v, tipos in _esquemas.items()}
+    errores = omitidos = 0
+    for item in items:
+        payload_id = str(item[0])
+        try:
+            payload_id, payload = _leer_item(item)
+            datos_cliente = payload.get("cliente", {})
+            destino = resolver_variante(datos_cliente, variante)
+            if destino is None:
+                omitidos += 1
+                continue
+            df = features_payload(payload, destino)
+            filas[destino].append(_fila(payload_id, destino, columnas[destino], df=df))
+        except Exception as e:
+            errores += 1
+            destino = variante if variante != "auto" else "regular"
+            filas[destino].append(_fila(payload_id, destino, columnas[destino], error=f"{type(e).__name__}: {e}"))
+
+    for v, filas_v in filas.items():
+        if filas_v:
+            _escribir_parquet(filas_v, v, salida / f"variante={v}" / f"part-{indice:06d}.parquet")
+
+    stats = {
+        "chunk": indice,
+        "pid": os.getpid(),
+        "payloads": len(items),
+        "errores": errores,
+        "omitidos": omitidos,
+        "segundos": round(time.perf_counter() - inicio, 3),
+    }
+    marca = salida / "_chunks" / f"chunk-{indice:06d}.json"
+    temporal = marca.with_suffix('.tmp')
+    temporal.write_text(json.dumps(stats), encoding="utf-8")
+    os.replace(temporal, marca)
+    return stats
+
+
+def iterar_chunks(entrada, tamano):
+    """Genera `(indice, items)` en orden determinista; cada item es `(payload_id, fuente)`."""
+    entrada = Path(entrada)
+    if entrada.is_dir():
+        items = ((p.stem, p) for p in sorted(entrada.glob("*.json")))
+    else:
+        def lineas():
+            with open(entrada, "r", encoding="utf-8") as f:
+                for n, linea in enumerate(f, 1):
+                    if linea.strip():
+                        yield f"{entrada.name}:{n}", linea
+        items = lineas()
+    indice = 0
+    while True:
+        chunk = list(islice(items, tamano))
+        if not chunk:
+            return
+        yield indice, chunk
+        indice += 1
+
+
+def ejecutar(entrada, salida, workers=os.cpu_count(), tamano_chunk=500, variante="auto"):
+    salida = Path(salida)
+    (salida / "_chunks").mkdir(parents=True, exist_ok=True)
+    variantes = list(PIPELINES) if variante == "auto" else [variante]
+    esquemas = {v: tipos_parquet(columnas_variante(v)) for v in variantes}
+    for v, tipos in esquemas.items():
+        logging.info("[masiva] esquema %s: %d features", v, len(tipos))
+    _fijar_esquemas(salida, esquemas)
+
+    hechos = {int(p.stem.split('-')[1]) for p in (salida / "_chunks").glob("chunk-*.json")}
+    por_worker = {}
+    total = saltados = 0
+    inicio = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker, initargs=(esquemas,)) as pool:
+        pendientes = set()
+
+        def recoger(bloquear):
+            nonlocal total
+            listos, _ = wait(pendientes, return_when=FIRST_COMPLETED) if bloquear else (set(f for f in pendientes if f.done()), None)
+            for futuro in listos:
+                pendientes.discard(futuro)
+                stats = futuro.result()
+                w = por_worker.setdefault(stats["pid"], {"chunks": 0, "payloads": 0, "errores": 0, "omitidos": 0, "segundos": 0.0})
+                for clave in ("payloads", "errores", "omitidos", "segundos"):
+                    w[clave] += stats[clave]
+                w["chunks"] += 1
+                total += stats["payloads"]
+                logging.info(
+                    "[masiva] chunk %d | worker=%d payloads=%d errores=%d omitidos=%d %.1f payloads/s",
+                    stats["chunk"], stats["pid"], stats["payloads"], stats["errores"], stats["omitidos"],
+                    stats["payloads"] / stats["segundos"] if stats["segundos"] else 0.0,
+                )
+
+        for indice, items in iterar_chunks(entrada, tamano_chunk):
+            if indice in hechos:
+                saltados += 1
+                continue
+            # Se acota el trabajo en vuelo para no leer toda la entrada en memoria
+            while len(pendientes) >= 2 * workers:
+                recoger(bloquear=True)
+            pendientes.add(pool.submit(procesar_chunk, indice, items, variante, salida))
+        while pendientes:
+            recoger(bloquear=True)
+
+    duracion = time.perf_counter() - inicio
+    for w in por_worker.values():
+        w["payloads_por_segundo"] = round(w["payloads"] / w["segundos"], 2) if w["segundos"] else 0.0
+        w["segundos"] = round(w["segundos"], 3)
+    resumen = {
+        "payloads": total,
+        "chunks_saltados": saltados,
+        "segundos": round(duracion, 3),
+        "payloads_por_segundo": round(total / duracion, 2) if duracion else 0.0,
+        "workers": {str(pid): w for pid, w in por_worker.items()},
+    }
+    (salida / "_resumen.json").write_text(json.dumps(resumen, indent=2), encoding="utf-8")
+    for pid, w in por_worker.items():
+        logging.info("[masiva] worker %d | chunks=%d payloads=%d %.2f payloads/s", pid, w["chunks"], w["payloads"], w["payloads_por_segundo"])
+    logging.info("[masiva] total: %d payloads en %.1f s (%d chunks ya hechos)", total, duracion, saltados)
+    return resumen
+
+
+def reporte_memoria_payloads(entrada, salida, variante="regular", n=200):
+    """Reporte de memoria por etapa sobre los primeros `n` payloads de `entrada` (ver modulo)."""
+    salida = Path(salida)
+    salida.mkdir(parents=True, exist_ok=True)
+    etapas = {}
+    filas = {}
+    for _, items in iterar_chunks(entrada, n):
+        for item in items:
+            try:
+                payload_id, payload = _leer_item(item)
+                destino = resolver_variante(payload.get("cliente", {}), variante)
+                if destino is None:
+                    continue
+                df = features_payload(payload, destino, etapas=etapas.setdefault(destino, {}))
+                filas.setdefault(destino, []).append(df)
+            except Exception:
+                logging.exception("[masiva] payload %s fuera del reporte", item[0])
+        break
+
+    reporte = {}
+    for destino, por_etapa in etapas.items():
+        modelo_h, scaler_h, modelo_fpd, scaler_fpd = (cargar_modelo(ruta) for ruta in ARTEFACTOS[destino])
+        por_etapa = {nombre: pd.concat(dfs, ignore_index=True) for nombre, dfs in por_etapa.items()}
+        features = pd.concat(filas[destino], ignore_index=True)
+        por_etapa["parquet"] = features.reindex(columns=columnas_variante(destino)).apply(pd.to_numeric, errors='coerce').astype(np.float64)
+        reporte[destino] = {
+            "etapas": reporte_memoria(por_etapa),
+            "max_diferencia_probabilidad": verificar_politica(
+                features, [("H", modelo_h, scaler_h), ("FPD", modelo_fpd, scaler_fpd)]
+            ),
+        }
+    (salida / "_memoria.json").write_text(json.dumps(reporte, indent=2), encoding="utf-8")
+    return reporte
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extraccion masiva de features Experian a Parquet")
+    parser.add_argument("--entrada", required=True, help="Directorio con *.json o archivo .jsonl de payloads")
+    parser.add_argument("--salida", required=True, help="Directorio de salida (particiones Parquet)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Procesos del pool")
+    parser.add_argument("--chunk", type=int, default=500, help="Payloads por chunk / particion")
+    parser.add_argument("--variante", choices=["auto", "regular", "ncl"], default="auto",
+                        help="auto: ruteo por score_experian como en decide_and_predict")
+    parser.add_argument("--reporte-memoria", type=int, default=0, metavar="N",
+                        help="Solo reporta bytes por fila por etapa (antes/despues de compactar) con N payloads")
+    args = parser.parse_args(argv)
+
+    setup_logging("extraccion_masiva")
+    if args.reporte_memoria:
+        reporte_memoria_payloads(args.entrada, args.salida, variante=args.variante, n=args.reporte_memoria)
+        return
+    ejecutar(args.entrada, args.salida, workers=args.workers, tamano_chunk=args.chunk, variante=args.variante)
+
+
+if __name__ == "__main__":
+    main()
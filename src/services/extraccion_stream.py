@@ -0,0 +1,615 @@
+"""Extraccion de XML Experian en una sola pasada (motor 'stream').
+
+Alternativa a `procesar_informe` basado en `ElementTree.fromstring`: el XML se
+alimenta por bloques a un `XMLPullParser` y cada hijo directo de `<Informe>` se
+entrega a un reductor apenas se cierra su etiqueta. El reductor acumula lo que
+necesita de la seccion y el elemento se libera inmediatamente, de modo que el
+arbol completo nunca vive en memoria y ninguna seccion se recorre dos veces.
+
+Con `agregar=False` el resultado es el mismo diccionario `datos` (mismas
+claves, mismo orden y mismos valores) que arma la version etree de cada
+variante (Regular o NCL). Con `agregar=True` (lo que usa `procesar_informe`)
+las familias temporales `Sector*_*`, `Cartera_*_codigo` y `Consulta_*` no se
+emiten: sus agregados (promedio_cuota, buenas_carteras, Consultas_SFI, ...) se
+calculan al vuelo y el post-procesamiento los recibe ya resueltos.
+"""
+import logging
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from collections import defaultdict, OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from src.models.feature_schema import a_numero as _a_numero
+
+# Tamaño de bloque con el que se alimenta el parser (caracteres o bytes)
+CHUNK_SIZE = 64 * 1024
+
+CODIGOS_TDC_ACTIVA = ['01', '13', '14', '15', '16']
+
+# NIT de las entidades competencia (Consultas_competencia_72h)
+NITS_COMPETENCIA = {901344787.0, 901258467.0, 901308756.0, 901279350.0, 901310399.0}
+
+# Diferencias entre la extraccion Regular (extraccion_API) y NCL (extraccion_API_NCL)
+VARIANTES = {
+    "regular": {
+        "razones_score": False,
+        "fecha_max_vencimiento": True,
+        "principales": [
+            'creditoVigentes', 'creditosCerrados', 'creditosActualesNegativos', 'histNegUlt12Meses',
+            'cuentasAbiertasAHOCCB', 'cuentasCerradasAHOCCB', 'consultadasUlt6meses',
+            'desacuerdosALaFecha', 'antiguedadDesde', 'reclamosVigentes',
+        ],
+        "saldos": ['saldoTotalEnMora', 'saldoM30', 'saldoM60', 'saldoM90', 'cuotaMensual', 'saldoCreditoMasAlto', 'saldoTotal'],
+        "trimestre": ['cuota', 'cupoTotal', 'moraMaxima', 'saldo', 'porcentajeUso'],
+        "vector_saldos": ['saldoDeudaTotalMora', 'saldoDeudaTotal', 'numCreditosMayorIgual60', 'totalCuentasMora', 'numCreditos30'],
+        "sumas_activas": True,
+        "promedio_cuota_fillna": True,
+    },
+    "ncl": {
+        "razones_score": True,
+        "fecha_max_vencimiento": False,
+        "principales": ['cuentasCerradasAHOCCB', 'creditosCerrados', 'antiguedadDesde', 'creditoVigentes', 'consultadasUlt6meses'],
+        "saldos": ['cuotaMensual', 'saldoTotal', 'saldoTotalEnMora', 'saldoCreditoMasAlto'],
+        "trimestre": ['cuota', 'cupoTotal', 'moraMaxima', 'saldo'],
+        "vector_saldos": ['saldoDeudaTotalMora', 'saldoDeudaTotal', 'numCreditosMayorIgual60', 'totalCuentasMora'],
+        "sumas_activas": False,
+        "promedio_cuota_fillna": False,
+    },
+}
+
+
+def _es_numero(valor):
+    return valor.replace('.', '', 1).isdigit()
+
+
+def _suma(valores):
+    """Suma de una familia como `DataFrame.sum(axis=1)`: NaN cuenta como 0."""
+    arr = np.asarray(valores, dtype=float)
+    return np.where(np.isnan(arr), 0.0, arr).sum()
+
+
+def _conteo(valores):
+    return int(np.count_nonzero(~np.isnan(np.asarray(valores, dtype=float))))
+
+
+def _nodos(seccion, tag):
+    """Equivalente a `informe.findall('.//tag')` restringido a una seccion."""
+    if seccion.tag == tag:
+        yield seccion
+    yield from seccion.iterfind(f'.//{tag}')
+
+
+class ReductorInforme:
+    """Acumula, seccion por seccion, los campos que `procesar_informe` extrae del XML.
+
+    Cada seccion conserva su propio buffer de pares (clave, valor); `resultado()`
+    los vuelca en el mismo orden que la extraccion etree, con lo que el
+    diccionario final es identico sin importar el orden de las secciones en el XML.
+
+    Con `agregar=True` las familias de cuotas, estados de cartera y consultas se
+    acumulan como vectores numericos y `agregados()` devuelve las variables que
+    el post-procesamiento calculaba escaneando esas columnas.
+
+    `omitir` son las secciones (claves de `plan_features.SECCIONES`) que no se
+    procesan: sus campos no aparecen en el resultado.
+    """
+
+    def __init__(self, variante="regular", sumas=True, agregar=False, omitir=()):
+        self.variante = VARIANTES[variante]
+        self.omitir = frozenset(omitir)
+        # Con sumas=False el llamador calcula las sumas de saldos por su cuenta (p.e. XPath)
+        self.sumas = sumas
+        self.agregar = agregar
+        self.meta = []
+        self.natural = None
+        self.score = None
+        self.ahorro_fechas = []
+        self.n_ahorro = 0
+        self.ahorro_sector1 = 0
+        self.n_cartera = 0
+        self.cartera_pares = []
+        self.cartera_vencimientos = []
+        self.cartera_aperturas = []
+        self.contador_por_sector = defaultdict(int)
+        self.cc_tipo_contrato_1 = 0
+        self.cc_tpobl_2 = 0
+        self.tdc_fechas = []
+        self.n_tdc = 0
+        self.consultas_por_tipo = defaultdict(list)
+        self.n_consultas = 0
+        self.productos = None
+        self.info = None
+        self.micro = None
+        # Las sumas arrancan en 0 (int) igual que `sum()` en la version etree
+        self.cartera_saldo_actual = 0
+        self.cartera_saldo_mora = 0
+        self.tdc_saldo_actual = 0
+        self.tdc_saldo_mora = 0
+        self.cartera_valor_inicial = 0
+        self.tdc_cupo_activo = 0.0
+        # Familias agregadas al vuelo (agregar=True), en orden de aparicion
+        self.cuota = []
+        self.total_cuotas = []
+        self.cuotas_canceladas = []
+        self.canceladas_sector3 = []
+        self.total_sector3 = []
+        self.cuota_sector4 = []
+        self.codigos_cartera = []
+        self.consultas_nit = []
+        self.consultas_sfi = []
+        self.consultas_fecha = []
+
+    # ------------------------------------------------------------------ secciones
+    def inicio_informe(self, attrib):
+        self.meta = [
+            ('fechaConsulta', attrib.get('fechaConsulta', '')),
+            ('identificacionDigitada', attrib.get('identificacionDigitada', '')),
+        ]
+
+    def seccion(self, elem):
+        """Recibe un hijo directo de <Informe> ya cerrado (subarbol completo)."""
+        tag = elem.tag
+        if tag in self.omitir:
+            pass
+        elif tag == 'CuentaCartera':
+            self._cartera(elem)
+        elif tag == 'TarjetaCredito':
+            self._tarjeta(elem)
+        elif tag == 'Consulta':
+            self.n_consultas += 1
+            if self.agregar:
+                self._agregar_consulta(elem)
+            else:
+                self.consultas_por_tipo[elem.get('tipoCuenta', '')].append(dict(elem.attrib))
+        elif tag == 'CuentaAhorro':
+            self.n_ahorro += 1
+            if elem.get('fechaApertura', '').strip():
+                self.ahorro_fechas.append(elem.get('fechaApertura'))
+            if elem.attrib.get('sector') == '1':
+                self.ahorro_sector1 += 1
+        elif tag == 'NaturalNacional' and self.natural is None:
+            identificacion = elem.find('Identificacion')
+            self.natural = [(f'{key}_exp', _get_attr(identificacion, key)) for key in ['ciudad', 'departamento', 'genero']]
+        elif tag == 'Score' and self.score is None:
+            self._score(elem)
+        elif tag == 'productosValores' and self.productos is None:
+            self.productos = [('quanto', elem.get('valor1', '')), ('quanto_pct', elem.get('valor1smlv', ''))]
+        elif tag == 'InfoAgregada' and self.info is None:
+            self._info_agregada(elem)
+        elif tag == 'InfoAgregadaMicrocredito' and self.micro is None:
+            self._microcredito(elem)
+
+        # Cuentas anidadas en otras secciones tambien cuentan en las sumas (.//)
+        if not self.sumas:
+            return
+        if tag != 'CuentaCartera':
+            for cartera in elem.iterfind('.//CuentaCartera'):
+                self._sumas_cartera(cartera)
+        if tag != 'TarjetaCredito':
+            for tarjeta in elem.iterfind('.//TarjetaCredito'):
+                self._sumas_tarjeta(tarjeta)
+
+    def _score(self, score):
+        self.score = [('puntaje_experian', score.get('puntaje', ''))]
+        if self.variante["razones_score"]:
+            codigos_razon = [razon.get('codigo') for razon in score.findall('Razon')]
+            self.score.append(('razon_codigo_1', codigos_razon[0] if len(codigos_razon) > 0 else None))
+            self.score.append(('razon_codigo_2', codigos_razon[1] if len(codigos_razon) > 1 else None))
+
+    def _partes_cartera(self, cartera):
+        """Valor (del primer Valores), EstadoCuenta (del primer Estados) y Caracteristicas."""
+        valores = cartera.find('Valores')
+        estados = cartera.find('Estados')
+        return (
+            valores.findall('Valor') if valores is not None else [],
+            estados.findall('EstadoCuenta') if estados is not None else [],
+            cartera.find('Caracteristicas'),
+        )
+
+    def _cartera(self, cartera):
+        self.n_cartera += 1
+        i = self.n_cartera
+        sector = cartera.get('sector', '')
+
+        if cartera.get('fechaVencimiento', '').strip():
+            self.cartera_vencimientos.append(cartera.get('fechaVencimiento'))
+
+        if fecha_str := cartera.get('fechaApertura'):
+            fecha_str = fecha_str.strip()
+            if len(fecha_str) == 10 and fecha_str.count('-') == 2:
+                try:
+                    self.cartera_aperturas.append(datetime.strptime(fecha_str, '%Y-%m-%d'))
+                except ValueError:
+                    pass
+
+        valores, estados, caract = self._partes_cartera(cartera)
+        if 'CuentaCartera/Valores' in self.omitir:
+            valores = []
+        if 'CuentaCartera/Estados' in self.omitir:
+            estados = []
+        for tipo in valores:
+            self.contador_por_sector[sector] += 1
+            idx = self.contador_por_sector[sector]
+            if self.agregar:
+                self._agregar_valor(f'Sector{sector}_{idx}', tipo)
+                continue
+            self.cartera_pares.extend([
+                (f'Sector{sector}_{idx}_cuota', tipo.get('cuota', '')),
+                (f'Sector{sector}_{idx}_totalCuotas', tipo.get('totalCuotas', '')),
+                (f'Sector{sector}_{idx}_cuotasCanceladas', tipo.get('cuotasCanceladas', '')),
+            ])
+
+        for j, estado in enumerate(estados, 1):
+            if self.agregar:
+                self.codigos_cartera.append(_a_numero(estado.attrib.get('codigo', '')))
+            else:
+                self.cartera_pares.append((f'Cartera_{i}_{j}_codigo', estado.attrib.get('codigo', '')))
+
+        if caract is not None:
+            if caract.attrib.get('tipoContrato') == '1':
+                self.cc_tipo_contrato_1 += 1
+            if caract.attrib.get('tipoObligacion') == '2':
+                self.cc_tpobl_2 += 1
+
+        if not self.sumas:
+            return
+        for nodo in _nodos(cartera, 'CuentaCartera'):
+            self._sumas_cartera(nodo)
+
+    def _agregar_valor(self, prefijo, valor):
+        """Reparte un Valor de cartera en las familias que antes se buscaban por nombre de columna."""
+        cuota = _a_numero(valor.get('cuota', ''))
+        total = _a_numero(valor.get('totalCuotas', ''))
+        canceladas = _a_numero(valor.get('cuotasCanceladas', ''))
+        self.cuota.append(cuota)
+        self.total_cuotas.append(total)
+        self.cuotas_canceladas.append(canceladas)
+        # Mismo criterio de subcadena que `'Sector3' in col` sobre `Sector{sector}_{idx}_...`
+        if 'Sector3' in prefijo:
+            self.canceladas_sector3.append(canceladas)
+            self.total_sector3.append(total)
+        if 'Sector4' in prefijo:
+            self.cuota_sector4.append(cuota)
+
+    def _agregar_consulta(self, consulta):
+        tipo = consulta.get('tipoCuenta', '')
+        self.consultas_nit.append(_a_numero(consulta.get('nitSuscriptor', '')))
+        self.consultas_fecha.append(consulta.get('fecha', ''))
+        if tipo.startswith('SFI'):
+            self.consultas_sfi.append(_a_numero(consulta.get('cantidad', '')))
+
+    def _sumas_cartera(self, cartera):
+        for valor in cartera.iterfind('Valores/Valor'):
+            if _es_numero(valor.get('saldoActual', '')):
+                self.cartera_saldo_actual += float(valor.get('saldoActual', 0))
+                if self.variante["sumas_activas"] and float(valor.get('saldoActual', 0)) not in [0, -1]:
+                    self.cartera_valor_inicial += float(valor.get('valorInicial', 0))
+            if _es_numero(valor.get('saldoMora', '')):
+                self.cartera_saldo_mora += float(valor.get('saldoMora', 0))
+
+    def _tarjeta(self, tarjeta):
+        self.n_tdc += 1
+        if tarjeta.get('fechaApertura', '').strip():
+            self.tdc_fechas.append(tarjeta.get('fechaApertura'))
+        if not self.sumas:
+            return
+        for nodo in _nodos(tarjeta, 'TarjetaCredito'):
+            self._sumas_tarjeta(nodo)
+
+    def _sumas_tarjeta(self, tarjeta):
+        for valor in tarjeta.iterfind('Valores/Valor'):
+            if _es_numero(valor.get('saldoActual', '')):
+                self.tdc_saldo_actual += float(valor.get('saldoActual', 0))
+            if _es_numero(valor.get('saldoMora', '')):
+                self.tdc_saldo_mora += float(valor.get('saldoMora', 0))
+
+        if not self.variante["sumas_activas"]:
+            return
+        estados = tarjeta.find('Estados')
+        codigo_estado = None
+        if estados is not None:
+            for estado in estados.findall('EstadoCuenta'):
+                codigo_estado = estado.get('codigo')
+        if codigo_estado in CODIGOS_TDC_ACTIVA:
+            valores = tarjeta.find('Valores')
+            if valores is not None:
+                for valor in valores.findall('Valor'):
+                    v = valor.get('cupoTotal', '')
+                    if _es_numero(v):
+                        self.tdc_cupo_activo += float(v)
+
+    def _info_agregada(self, info):
+        pares = []
+        omitir = self.omitir
+        res = info.find('Resumen')
+
+        if 'InfoAgregada/Principales' not in omitir:
+            principales = res.find('Principales') if res is not None else None
+            for key in self.variante["principales"]:
+                pares.append((f'agr_prinp_{key}', _get_attr(principales, key)))
+
+        saldo = res.find('Saldos') if res is not None else None
+        if 'InfoAgregada/Saldos' not in omitir:
+            for key in self.variante["saldos"]:
+                pares.append((f'agr_saldos_{key}', _get_attr(saldo, key)))
+        if saldo is not None and 'InfoAgregada/Saldos/Mes' not in omitir:
+            for i, mes in enumerate(saldo.findall('Mes'), 1):
+                pares.append((f'saldoTotalMora_{i}', mes.get('saldoTotalMora', '')))
+                pares.append((f'saldoTotal_{i}', mes.get('saldoTotal', '')))
+
+        comp = res.find('Comportamiento') if res is not None and 'InfoAgregada/Comportamiento' not in omitir else None
+        if comp is not None:
+            for i, mes in enumerate(comp.findall('Mes'), 1):
+                pares.append((f'comportamiento_{i}', mes.get('comportamiento', '')))
+                pares.append((f'cantidad_{i}', mes.get('cantidad', '')))
+
+        por = info.find('ComposicionPortafolio') if 'InfoAgregada/ComposicionPortafolio' not in omitir else None
+        if por is not None:
+            for i, tipo in enumerate(por.findall('TipoCuenta'), 1):
+                for key in ['tipo', 'cantidad']:
+                    pares.append((f'total_{key}_{i}', tipo.attrib.get(key, '')))
+                for j, est in enumerate(tipo.findall('Estado'), 1):
+                    codigo_valor = est.attrib.get('codigo', '')
+                    if codigo_valor in {'Al dia', 'Activa'}:
+                        pares.append((f'{tipo.attrib.get("tipo", "tipo")}_{codigo_valor}_cantidad_{j}', est.attrib.get('cantidad', '')))
+
+        evo = info.find('EvolucionDeuda') if 'InfoAgregada/EvolucionDeuda' not in omitir else None
+        if evo is not None:
+            for ap in evo.iter('AnalisisPromedio'):
+                for key in ['cuota', 'porcentajeUso', 'totalCerradas', 'totalAbiertas', 'saldo']:
+                    pares.append((f'agr_analisisPromedio_{key}', ap.get(key, '')))
+                break
+            for i, trimestre in enumerate(evo.iter('Trimestre'), 1):
+                for key in self.variante["trimestre"]:
+                    pares.append((f'trimestre_{i}_{key}', trimestre.get(key, 'missing')))
+        self.info = pares
+
+    def _microcredito(self, micro):
+        pares = []
+        omitir = self.omitir
+        resumen_path = micro.find('Resumen')
+        if resumen_path is not None and 'InfoAgregadaMicrocredito/PerfilGeneral' not in omitir:
+            perfil_general_path = resumen_path.find('PerfilGeneral')
+            if perfil_general_path is not None:
+                creditos_cerrados_path = perfil_general_path.find('CreditosCerrados')
+                if creditos_cerrados_path is not None:
+                    pares.append(('Cc_sectorTelcos', creditos_cerrados_path.get('sectorTelcos', '')))
+                    pares.append(('Cc_totalComoPrincipal', creditos_cerrados_path.get('totalComoPrincipal', '')))
+
+        evd = micro.find('EvolucionDeuda') if 'InfoAgregadaMicrocredito/EvolucionDeuda' not in omitir else None
+        if evd is not None:
+            for sector in evd.findall('EvolucionDeudaSector'):
+                if sector.get('codSector') == "4":
+                    for tipo_cuenta in sector.findall('EvolucionDeudaTipoCuenta'):
+                        tipo = tipo_cuenta.get('tipoCuenta', '')
+                        for i, trimestre in enumerate(tipo_cuenta.findall('EvolucionDeudaValorTrimestre')[:3], 1):
+                            pares.append((f'{tipo}_trim_{i}_saldoMora', trimestre.get('saldoMora', '')))
+
+        if resumen_path is not None and 'InfoAgregadaMicrocredito/VectorSaldosYMoras' not in omitir:
+            vector_saldos = resumen_path.find('VectorSaldosYMoras')
+            if vector_saldos is not None:
+                for i, saldos_moras in enumerate(vector_saldos.findall('SaldosYMoras'), 1):
+                    for key in self.variante["vector_saldos"]:
+                        pares.append((f'{key}_{i}', saldos_moras.get(key, '')))
+        self.micro = pares
+
+    # ------------------------------------------------------------------ agregados
+    def agregados(self):
+        """Variables derivadas de las familias acumuladas (ver `construir_dataframe_informe`).
+
+        Replica la semantica de las operaciones por fila de pandas: sumas con
+        NaN como 0, conteos de no nulos, divisiones 0/0 -> NaN.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cuota = np.asarray(self.cuota, dtype=float)
+            suma_cuota = _suma(cuota)
+            promedio_cuota = suma_cuota / np.float64(_conteo(cuota))
+            if self.variante["promedio_cuota_fillna"] and np.isnan(promedio_cuota):
+                promedio_cuota = 0.0
+
+            denom_amort = _suma(self.total_cuotas) * suma_cuota
+            denom_amort = np.nan if denom_amort == 0 else denom_amort
+            amortizacion = (_suma(self.cuotas_canceladas) * suma_cuota) / denom_amort
+
+            canceladas3 = np.asarray(self.canceladas_sector3, dtype=float)
+            total3 = np.asarray(self.total_sector3, dtype=float)
+            canceladas3 = np.where(np.isin(canceladas3, [0, -1]), np.nan, canceladas3)
+            total3 = np.where(np.isin(total3, [0, -1]), np.nan, total3)
+            ratio_real = _suma(canceladas3) / _suma(total3)
+            if np.isinf(ratio_real):
+                ratio_real = np.nan
+
+            telcos = np.asarray(self.cuota_sector4, dtype=float)
+            telcos = np.where(telcos != 0, telcos, np.nan)
+            ratio_telcos = np.abs(_suma(telcos) / np.float64(_conteo(telcos)))
+
+            codigos = np.asarray(self.codigos_cartera, dtype=float)
+            validas = np.float64(_conteo(codigos))
+            buenas = int(np.isin(codigos, [1.0, 3.0]).sum())
+            activos = int(np.isin(codigos, [1.0, 2.0]).sum())
+            carteras_activas_pp = activos / validas
+            carteras_buenas_pp = buenas / validas
+
+        agregados = {
+            'promedio_cuota': promedio_cuota,
+            'amortizacion_cartera': amortizacion,
+            'ratio_cartera_real': ratio_real,
+            'ratio_cartera_telcos': ratio_telcos,
+            'Consultas_competencia_72h': sum(1 for nit in self.consultas_nit if nit in NITS_COMPETENCIA),
+            'buenas_carteras': buenas,
+            'activos': activos,
+            'carteras_activas_pp': carteras_activas_pp,
+            'carteras_buenas_pp': carteras_buenas_pp,
+        }
+        agregados.update(self._agregados_consultas())
+        return agregados
+
+    def _agregados_consultas(self):
+        fecha_consulta = pd.to_datetime(dict(self.meta).get('fechaConsulta', ''), errors='coerce')
+        periodo = pd.to_datetime(str(fecha_consulta)[:10], errors='coerce')
+        try:
+            fechas = pd.to_datetime(pd.Series(self.consultas_fecha, dtype=object), errors='coerce', format='mixed')
+        except (ValueError, TypeError):
+            # Zonas horarias mezcladas: se convierte fecha por fecha, como hacia el apply por columna
+            fechas = pd.Series([pd.to_datetime(f, errors='coerce') for f in self.consultas_fecha], dtype=object)
+        return {
+            'max_fecha_consulta': fechas.max() if fechas.notna().any() else pd.NaT,
+            'Consultas_entidad': int(fechas.notna().sum()),
+            'Consultas_SFI': _suma(self.consultas_sfi),
+            'Consultas_ult_mes': int((fechas > periodo - pd.DateOffset(months=1)).sum()) if pd.notna(periodo) else 0,
+        }
+
+    # ------------------------------------------------------------------ resultado
+    def resultado(self, destino=None):
+        """Arma el `OrderedDict` final en el orden de la extraccion etree.
+
+        Con `destino` (p.e. un `RegistroFeatures`) los pares se escriben ahi.
+        """
+        datos = OrderedDict() if destino is None else destino
+        omitir = self.omitir
+        datos.update(self.meta)
+        if 'NaturalNacional' not in omitir:
+            datos.update(self.natural or [(f'{key}_exp', '') for key in ['ciudad', 'departamento', 'genero']])
+        if self.score is not None:
+            datos.update(self.score)
+        elif 'Score' not in omitir:
+            datos['puntaje_experian'] = ''
+            if self.variante["razones_score"]:
+                datos['razon_codigo_1'] = None
+                datos['razon_codigo_2'] = None
+
+        if 'CuentaAhorro' not in omitir:
+            datos['ahorros_fechaApertura_reciente'] = max(self.ahorro_fechas) if self.ahorro_fechas else ''
+            datos['Ctas_pCliente'] = self.n_ahorro
+            datos['Cuentas_sector1'] = self.ahorro_sector1
+
+        if 'CuentaCartera' not in omitir:
+            if self.variante["fecha_max_vencimiento"]:
+                datos['fecha_max_vencimiento'] = max(self.cartera_vencimientos) if self.cartera_vencimientos else ''
+            for clave, valor in self.cartera_pares:
+                datos[clave] = valor
+            datos['cartera_fechaApertura_reciente'] = max(self.cartera_aperturas) if self.cartera_aperturas else ''
+            datos['CC_TipoContrato_1'] = self.cc_tipo_contrato_1
+            datos['cc_tpobl_2_con'] = self.cc_tpobl_2
+
+        if 'TarjetaCredito' not in omitir:
+            datos['tdc_fechaApertura_reciente'] = max(self.tdc_fechas) if self.tdc_fechas else ''
+
+        for tipo in sorted(self.consultas_por_tipo):
+            for i, consulta in enumerate(self.consultas_por_tipo[tipo], 1):
+                datos[f'Consulta_{tipo}_{i}_cantidad'] = consulta.get('cantidad', '')
+                datos[f'Consulta_{tipo}_{i}_nitSuscriptor'] = consulta.get('nitSuscriptor', '')
+                datos[f'Consulta_{tipo}_{i}_fecha'] = consulta.get('fecha', '')
+
+        if 'productosValores' not in omitir:
+            datos.update(self.productos or [('quanto', ''), ('quanto_pct', '')])
+
+        if self.info is not None:
+            for clave, valor in self.info:
+                datos[clave] = valor
+        else:
+            if 'InfoAgregada/Principales' not in omitir:
+                for key in self.variante["principales"]:
+                    datos[f'agr_prinp_{key}'] = ''
+            if 'InfoAgregada/Saldos' not in omitir:
+                for key in self.variante["saldos"]:
+                    datos[f'agr_saldos_{key}'] = ''
+
+        for clave, valor in self.micro or []:
+            datos[clave] = valor
+
+        datos['cartera_saldo_actual'] = self.cartera_saldo_actual
+        datos['cartera_saldo_mora'] = self.cartera_saldo_mora
+        datos['tdc_saldo_actual'] = self.tdc_saldo_actual
+        datos['tdc_saldo_mora'] = self.tdc_saldo_mora
+        if self.variante["sumas_activas"]:
+            datos['cartera_valorInicial_activa'] = self.cartera_valor_inicial
+            datos['tdc_cupototal_activo'] = self.tdc_cupo_activo
+        return datos
+
+
+def _get_attr(el, k, d=''):
+    return el.get(k, d) if el is not None else d
+
+
+def extraer_datos_stream(xml_string, variante="regular", chunk_size=CHUNK_SIZE, agregar=True, destino=None, omitir=()):
+    """Recorre el XML una sola vez y devuelve `(datos, n_consultas, agregados)`.
+
+    `agregados` es None con `agregar=False` (datos con las familias temporales).
+    `destino` reemplaza al `OrderedDict` de salida (ver `ReductorInforme.resultado`).
+    `omitir` son las secciones que no se procesan (ver `ReductorInforme`).
+    Retorna None si el XML no se puede parsear o no contiene `<Informe>`.
+    """
+    reductor = ReductorInforme(variante, agregar=agregar, omitir=omitir)
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    profundidad = 0
+    informe = None
+    nivel_informe = None
+    informe_cerrado = False
+
+    try:
+        for inicio in range(0, len(xml_string), chunk_size):
+            parser.feed(xml_string[inicio:inicio + chunk_size])
+            for evento, elem in parser.read_events():
+                if evento == 'start':
+                    profundidad += 1
+                    if informe is None and elem.tag == 'Informe' and profundidad > 1:
+                        informe = elem
+                        nivel_informe = profundidad
+                        reductor.inicio_informe(elem.attrib)
+                    continue
+
+                if informe is not None and not informe_cerrado and profundidad == nivel_informe + 1:
+                    reductor.seccion(elem)
+                    informe.remove(elem)
+                elif elem is informe:
+                    informe_cerrado = True
+                elif informe is None or informe_cerrado:
+                    elem.clear()
+                profundidad -= 1
+        parser.close()
+    except ET.ParseError as e:
+        logging.error("No se pudo parsear el XML: %s", e)
+        return None
+
+    if informe is None:
+        logging.error("No se encontró la etiqueta 'Informe' en el XML")
+        return None
+
+    logging.info(
+        "[extract][stream] secciones | ahorro=%d cartera=%d tdc=%d consultas=%d",
+        reductor.n_ahorro, reductor.n_cartera, reductor.n_tdc, reductor.n_consultas,
+    )
+    return reductor.resultado(destino), reductor.n_consultas, reductor.agregados() if agregar else None
+
+
+def comparar_engines(procesar_informe_func, xml_string, engines=("etree", "stream"), repeticiones=5):
+    """Mide latencia (mediana, ms) y pico de memoria (KiB) de cada engine sobre un mismo XML.
+
+    Pensado para correr a mano sobre informes reales, p.e.:
+        comparar_engines(extraccion_API.procesar_informe, xml)
+    """
+    resultados = {}
+    for engine in engines:
+        tiempos = []
+        for _ in range(repeticiones):
+            t0 = time.perf_counter()
+            procesar_informe_func(xml_string, engine=engine)
+            tiempos.append((time.perf_counter() - t0) * 1000)
+
+        tracemalloc.start()
+        procesar_informe_func(xml_string, engine=engine)
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        tiempos.sort()
+        resultados[engine] = {
+            "latencia_ms": round(tiempos[len(tiempos) // 2], 3),
+            "pico_kb": round(pico / 1024, 1),
+        }
+        logging.info("[extract] engine=%s latencia_ms=%s pico_kb=%s", engine, resultados[engine]["latencia_ms"], resultados[engine]["pico_kb"])
+    return resultados
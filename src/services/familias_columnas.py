@@ -0,0 +1,137 @@
+"""Indice de familias de columnas del post-procesamiento Experian.
+
+`variables_income`, `procesar_cuotas_y_amortizacion`,
+`procesar_consultas_experian` y `construir_dataframe_informe` trabajan sobre
+bloques de columnas (cuotas por sector, saldos de mora telcos por trimestre,
+fechas de consulta, ...). En lugar de recorrer `df.columns` con comparaciones de
+texto en cada solicitud, cada familia se resuelve una sola vez por esquema de
+columnas y se guarda como arreglo de posiciones enteras.
+
+El indice se memoriza por huella del esquema (la tupla de nombres de columnas):
+el mismo layout de salida del extractor reutiliza el indice ya construido.
+Cada familia conserva exactamente el predicado original y el orden de las
+columnas en el DataFrame.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def _sector(col):
+    return 'Sector' in col
+
+
+def _sector_cuota(col):
+    return 'Sector' in col and col.endswith('cuota')
+
+
+def _sector_total_cuotas(col):
+    return 'Sector' in col and not col.endswith('cuota') and 'totalCuotas' in col
+
+
+def _sector_cuotas_canceladas(col):
+    return (
+        'Sector' in col and not col.endswith('cuota')
+        and 'totalCuotas' not in col and 'cuotasCanceladas' in col
+    )
+
+
+# familia -> predicado sobre el nombre de la columna
+FAMILIAS = {
+    # variables_income
+    'cuota': lambda col: col.startswith('Sector') and col.endswith('cuota'),
+    'sector_cuota': _sector_cuota,
+    'sector_totalCuotas': _sector_total_cuotas,
+    'sector_cuotasCanceladas': _sector_cuotas_canceladas,
+    'sector3_cuotasCanceladas': lambda col: 'Sector3' in col and col.endswith('cuotasCanceladas'),
+    'sector3_totalCuotas': lambda col: 'Sector3' in col and 'totalCuotas' in col,
+    'sector4_cuota': lambda col: 'Sector4' in col and col.endswith('cuota'),
+    # procesar_cuotas_y_amortizacion
+    'total_cantidad': lambda col: 'total_cantidad' in col,
+    'activa_cantidad': lambda col: 'Activa_' in col and 'cantidad' in col,
+    'aldia_cantidad': lambda col: '_Al dia_' in col and 'cantidad' in col,
+    'nitSuscriptor': lambda col: 'nitSuscriptor' in col,
+    'cartera_codigo': lambda col: 'Cartera' in col and col.endswith('codigo'),
+    'trim_1_saldoMora': lambda col: 'trim_1_saldoMora' in col,
+    'trim_2_saldoMora': lambda col: 'trim_2_saldoMora' in col,
+    'trim_3_saldoMora': lambda col: 'trim_3_saldoMora' in col,
+    'COM_trim': lambda col: 'COM_trim' in col,
+    'CTC_trim': lambda col: 'CTC_trim' in col,
+    'CDC_trim': lambda col: 'CDC_trim' in col,
+    'Telcos_mora_trimestre': lambda col: 'Telcos_mora_trimestre' in col,
+    # procesar_consultas_experian / construir_dataframe_informe
+    'consulta_SFI_cantidad': lambda col: col.startswith('Consulta_SFI') and col.endswith('cantidad'),
+    'consulta_fecha': lambda col: col.startswith('Consulta_') and col.endswith('_fecha'),
+}
+
+
+class IndiceFamilias:
+    """Posiciones enteras de cada familia para un esquema de columnas fijo."""
+
+    __slots__ = ("columnas", "posiciones", "_nombres")
+
+    def __init__(self, columnas):
+        self.columnas = pd.Index(columnas)
+        nombres = [c if isinstance(c, str) else str(c) for c in self.columnas]
+        self.posiciones = {
+            familia: np.flatnonzero(np.fromiter((pred(c) for c in nombres), dtype=bool, count=len(nombres)))
+            for familia, pred in FAMILIAS.items()
+        }
+        self._nombres = {}
+
+    def pos(self, familia):
+        """Posiciones (orden de columnas) de la familia, para `df.iloc[:, pos]`."""
+        return self.posiciones[familia]
+
+    def nombres(self, familia):
+        """Nombres de la familia; se calculan por posicion y se memorizan."""
+        nombres = self._nombres.get(familia)
+        if nombres is None:
+            nombres = self.columnas[self.posiciones[familia]].tolist()
+            self._nombres[familia] = nombres
+        return nombres
+
+
+class _MemoIndices:
+    """LRU acotado de indices por huella de esquema."""
+
+    def __init__(self, max_entradas=256):
+        self.max_entradas = max_entradas
+        self._indices = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def obtener(self, columnas):
+        huella = tuple(columnas)
+        with self._lock:
+            indice = self._indices.get(huella)
+            if indice is not None:
+                self._indices.move_to_end(huella)
+                self.hits += 1
+                return indice
+            self.misses += 1
+        indice = IndiceFamilias(huella)
+        with self._lock:
+            self._indices[huella] = indice
+            while len(self._indices) > self.max_entradas:
+                self._indices.popitem(last=False)
+        return indice
+
+    def estadisticas(self):
+        with self._lock:
+            return {"entradas": len(self._indices), "hits": self.hits, "misses": self.misses}
+
+
+_MEMO = _MemoIndices()
+
+
+def indice_familias(columnas):
+    """Indice de familias para `columnas` (p.e. `df.columns`), memorizado por esquema."""
+    return _MEMO.obtener(columnas)
+
+
+def estadisticas_indices():
+    return _MEMO.estadisticas()
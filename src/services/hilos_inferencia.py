@@ -0,0 +1,170 @@
+"""Presupuesto de hilos de LightGBM por worker.
+
+LightGBM predice con un equipo de hilos OpenMP y, si no se le pasa
+`num_threads`, usa todos los nucleos del host. Con N workers de
+gunicorn/uvicorn cada uno abre su equipo de hilos sobre los mismos nucleos;
+los equipos se pisan y el p99 se dispara con carga.
+
+`PresupuestoHilos` reparte los nucleos que el proceso puede usar (afinidad de
+CPU y cuota del cgroup) entre los workers:
+
+    hilos_worker = max(1, nucleos // workers)
+
+- una prediccion de menos de `umbral_lote` filas (la de una solicitud) usa
+  un hilo: LightGBM reparte las filas entre hilos, asi que para una fila los
+  demas solo agregan el costo de despertarlos;
+- un lote (`predecir_lote`, la cola de micro-lotes) usa `hilos_worker`.
+
+`probabilidad` (feature_utils) pide los hilos por llamada con `hilos(filas)`
+y `aplicar_modelos` fija `n_jobs` en los modelos de los motores para las
+rutas que llaman a `predict_proba` (una solicitud). Con `fijar_cpus` cada
+worker queda ademas fijado a su propio bloque de nucleos (`sched_setaffinity`).
+
+El numero de workers sale de gunicorn (`post_fork`, ver `gunicorn.conf.py`),
+de `WEB_CONCURRENCY` o de `hilos_inferencia.workers`. El bloque de cada
+worker lo reparte el master con `BloquesWorkers`: un worker que reemplaza a
+otro que murio recibe el bloque que quedo libre. Los valores efectivos se ven
+en /admin/hilos.
+"""
+import logging
+import math
+import os
+
+from src.config.config import (
+    HILOS_INFERENCIA_ACTIVO,
+    HILOS_INFERENCIA_FIJAR_CPUS,
+    HILOS_INFERENCIA_UMBRAL_LOTE,
+    HILOS_INFERENCIA_WORKERS,
+)
+
+CPU_MAX = "/sys/fs/cgroup/cpu.max"
+
+
+def cpus_afinidad():
+    """CPUs en que el proceso puede correr, ordenadas."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        # Sin sched_getaffinity (p.e. macOS)
+        return list(range(os.cpu_count() or 1))
+
+
+def cuota_cgroup(ruta=CPU_MAX):
+    """Nucleos que permite la cuota del cgroup v2 (`cpu.max`, redondeada hacia arriba); `None` sin cuota."""
+    try:
+        with open(ruta) as f:
+            cuota, periodo = f.read().split()[:2]
+    except (OSError, ValueError):
+        return None
+    if cuota == "max":
+        return None
+    return max(1, math.ceil(int(cuota) / int(periodo)))
+
+
+def workers_entorno():
+    """Workers declarados en `WEB_CONCURRENCY` o en config.yaml; 1 si no hay ninguno."""
+    for valor in (os.environ.get("WEB_CONCURRENCY"), HILOS_INFERENCIA_WORKERS):
+        try:
+            if valor is not None and int(valor) > 0:
+                return int(valor)
+        except ValueError:
+            logging.warning("[hilos] Numero de workers invalido: %r", valor)
+    return 1
+
+
+class BloquesWorkers:
+    """Bloque de CPUs (0..workers-1) de cada worker vivo; vive en el master de gunicorn.
+
+    `age` de gunicorn sigue creciendo cuando un worker se reemplaza, asi que no
+    sirve de indice: `asignar` da el bloque libre mas bajo y `liberar` lo
+    devuelve cuando el worker termina. Durante un reload conviven workers
+    viejos y nuevos; si no hay bloque libre se comparte el menos ocupado.
+    """
+
+    def __init__(self):
+        self._ocupados = {}
+
+    def asignar(self, clave, workers):
+        usos = [0] * max(int(workers), 1)
+        for bloque in self._ocupados.values():
+            if bloque < len(usos):
+                usos[bloque] += 1
+        bloque = min(range(len(usos)), key=lambda i: (usos[i], i))
+        self._ocupados[clave] = bloque
+        return bloque
+
+    def liberar(self, clave):
+        return self._ocupados.pop(clave, None)
+
+
+class PresupuestoHilos:
+    """Hilos de LightGBM por llamada segun los nucleos del proceso y los workers que los comparten."""
+
+    def __init__(self, activo=HILOS_INFERENCIA_ACTIVO, umbral_lote=HILOS_INFERENCIA_UMBRAL_LOTE):
+        self.activo = activo
+        self.umbral_lote = max(int(umbral_lote), 2)
+        self.fijado = None
+        self.indice = None
+        self.configurar(workers_entorno())
+
+    def configurar(self, workers, indice=None, fijar_cpus=HILOS_INFERENCIA_FIJAR_CPUS):
+        """Recalcula el presupuesto para `workers` procesos; con `fijar_cpus` fija este (el `indice`) a sus nucleos."""
+        self.workers = max(int(workers), 1)
+        self.indice = indice
+        cpus = cpus_afinidad()
+        cuota = cuota_cgroup()
+        self.nucleos = min(len(cpus), cuota) if cuota else len(cpus)
+        self.hilos_worker = max(1, self.nucleos // self.workers)
+        if fijar_cpus and indice is not None:
+            self.fijado = self._fijar(cpus, indice)
+            if self.fijado:
+                self.hilos_worker = len(self.fijado)
+        logging.info("[hilos] %s", self.estado())
+
+    def _fijar(self, cpus, indice):
+        """Fija el proceso a su bloque de `hilos_worker` CPUs (de a una CPU por worker si hay mas workers que CPUs)."""
+        if self.workers >= len(cpus):
+            bloque = [cpus[indice % len(cpus)]]
+        else:
+            inicio = (indice % self.workers) * self.hilos_worker
+            bloque = cpus[inicio:inicio + self.hilos_worker]
+        try:
+            os.sched_setaffinity(0, bloque)
+        except (AttributeError, OSError):
+            logging.exception("[hilos] No se pudo fijar el worker %s a las CPUs %s", indice, bloque)
+            return None
+        return bloque
+
+    def hilos(self, filas):
+        """`num_threads` para predecir `filas` filas; 0 (lo que decida LightGBM) si esta desactivado."""
+        if not self.activo:
+            return 0
+        return 1 if filas < self.umbral_lote else self.hilos_worker
+
+    def aplicar_modelos(self, modelos):
+        """Fija `n_jobs` (los hilos de `predict_proba`) de los LGBMClassifier en los de una solicitud."""
+        if not self.activo:
+            return
+        for modelo in modelos:
+            if hasattr(modelo, "booster_") and hasattr(modelo, "set_params"):
+                modelo.set_params(n_jobs=self.hilos(1))
+
+    def estado(self):
+        return {
+            "pid": os.getpid(),
+            "activo": self.activo,
+            "cpus_afinidad": cpus_afinidad(),
+            "cuota_cgroup": cuota_cgroup(),
+            "nucleos": self.nucleos,
+            "workers": self.workers,
+            "worker": self.indice,
+            "cpus_fijadas": self.fijado,
+            "hilos_worker": self.hilos_worker,
+            "hilos_solicitud": self.hilos(1),
+            "hilos_lote": self.hilos(self.umbral_lote),
+            "umbral_lote": self.umbral_lote,
+            "OMP_NUM_THREADS": os.environ.get("OMP_NUM_THREADS"),
+        }
+
+
+PRESUPUESTO = PresupuestoHilos()
@@ -2,9 +2,14 @@ import logging
 import numpy as np
 import pandas as pd
 from pathlib import Path
-from src.utils.helpers import cargar_modelo, cargar_json
-from src.models.feature_utils import normalize_and_select 
-from src.models.predict_utils import extraer_datos_iniciales, assign_nested_bins
+from src.utils.helpers import cargar_modelo
+from src.utils.contabilidad_copias import etapa
+from src.models.feature_utils import normalize_and_select
+from src.models.pipeline_modelos import PipelineModelos
+from src.core.grafo_etapas import Etapa, GrafoEtapas
+from src.services.normalizacion import NORMALIZACION
+from src.services.plan_features import plan_motor
+from src.models.predict_utils import extraer_datos_iniciales, assign_nested_bins, assign_nested_bins_lote, grupos_lote
 from src.utils.responses import build_rejection_response, build_approval_response, error_response
 #cargar_json
 from src.config.config import(
@@ -17,8 +22,9 @@ Var_TRM_1,
 IBR_Var,
 Var_TPM_1,
 Var_TD3,
-PREPROC_COMMON_ERR,
-CUOTAS
+CUOTAS,
+RUTA_ESCALAR_BACKUP,
+PLAN_FEATURES_BACKUP
 )
 BASE_DIR = Path(__file__).resolve().parents[1]  # sube desde /services hasta /src
 
@@ -35,27 +41,65 @@ class MotorPrediccionHrespaldo:
     - Produce una respuesta final, ya sea aprobación, rechazo o contraofertas.
     """
 
-    def __init__(self, modelo_path: str, min_max_scaler_path: str, modelo_fpd_path: str):
+    def __init__(self, modelo_path: str, min_max_scaler_path: str, modelo_fpd_path: str, ruta_escalar=None, plan_features=None,
+                 version=None, version_fpd=None):
         """
         Inicializa el motor de predicción, cargando modelos, mapeos y escaladores necesarios.
 
         Args:
             modelo_path (str): Ruta al modelo principal de predicción Hrespaldo.
             min_max_scaler_path (str): Ruta al objeto MinMaxScaler para normalización.
+            ruta_escalar (bool, opcional): Usa la ruta escalar (registro dict); por defecto la de config.yaml.
+            plan_features (bool, opcional): Arma y registra el plan de features; por defecto el de config.yaml.
         """
+        # Versiones que reporta el motor (las de config.yaml salvo que el registro de modelos cargue otras)
+        self.version = VERSION_HRESPALDO if version is None else version
+        self.version_fpd = VERSION_FPD_HRESPALDO if version_fpd is None else version_fpd
         # Carga de modelos
         self.modelo_h = cargar_modelo(modelo_path)
         self.modelo_fpd = cargar_modelo(modelo_fpd_path)
         self.min_max_scaler = cargar_modelo(min_max_scaler_path)
 
-        # Cargar mapeos desde archivos JSON
-        self.departamentos_colombia = cargar_json("departamentos_colombia.json")
-        self.tipo_trabajo_mapping = cargar_json("tipo_trabajo_mapping.json")
-        self.genero_mapping = cargar_json("genero_mapping.json")
+        # Mapeos de la tabla de normalizacion compartida (cargada una vez por proceso)
+        self.departamentos_colombia = NORMALIZACION.departamentos
+        self.tipo_trabajo_mapping = NORMALIZACION.tipo_trabajo_mapping
+        self.genero_mapping = NORMALIZACION.genero_mapping
+        self.ruta_escalar = RUTA_ESCALAR_BACKUP if ruta_escalar is None else ruta_escalar
+        # Respaldo no extrae el XML ni calcula derivadas: el plan solo queda en el log
+        self.plan = plan_motor(
+            "backup",
+            [(self.modelo_h, self.min_max_scaler), (self.modelo_fpd, self.min_max_scaler)],
+            PLAN_FEATURES_BACKUP if plan_features is None else plan_features,
+        )
+        # Scalers + modelos compilados: H y FPD comparten scaler, que se aplica una sola vez
+        self.pipeline = PipelineModelos(
+            [(self.modelo_h, self.min_max_scaler), (self.modelo_fpd, self.min_max_scaler)], nombre="backup"
+        )
+        self.grafo = self.construir_grafo()
 
 
         # Gestor de configuración (ampliable para futuras mejoras)
 
+    def construir_grafo(self):
+        """Etapas de `predecir`: variables -> entradas -> escalado -> ramas H y FPD (a la vez) -> segmentos -> respuesta."""
+        return GrafoEtapas(
+            "backup",
+            [
+                Etapa("variables_cliente", self.calcular_variables_cliente, ("datos_cliente",), ("cliente",)),
+                Etapa("entradas", self.entradas_modelos, ("cliente",), ("crudo", "frame")),
+                *self.pipeline.etapas(("H", "FPD")),
+                Etapa("probabilidades", self.ajustar_probabilidades, ("proba_H", "proba_FPD", "tid"), ("proba_pagar", "proba_fpd")),
+                Etapa("segmentos", self.segmentar, ("proba_pagar", "proba_fpd"), ("segmentoH", "segmentoFPD")),
+                Etapa(
+                    "respuesta", self.responder,
+                    ("dni_consultado", "proba_pagar", "proba_fpd", "grupo_retailer", "segmentoH", "segmentoFPD"),
+                    ("respuesta",),
+                ),
+            ],
+            iniciales=("datos_cliente", "grupo_retailer", "tid", "dni_consultado"),
+            salida="respuesta",
+        )
+
     def preprocesar(self, df:pd.DataFrame) -> pd.DataFrame:
         """Preprocesa los datos del cliente
 
@@ -65,11 +109,10 @@ class MotorPrediccionHrespaldo:
         Returns:
             pd.DataFrame: dataframe preprocesado
         """
-        common_err = PREPROC_COMMON_ERR
+        df["region_ret"] = df["constitucion_department_retailer"].map(NORMALIZACION.region_por_valor)
         df["constitucion_department_retailer"] = df["constitucion_department_retailer"].replace(
-            common_err
+            NORMALIZACION.errores
         )
-        df["region_ret"] = df["constitucion_department_retailer"].map(self.departamentos_colombia)
         df['Var_pct_IPC_3'] = Var_pct_IPC_3
         df['Var_TRM_1'] = Var_TRM_1 
         df['IBR_Var'] = IBR_Var
@@ -78,6 +121,26 @@ class MotorPrediccionHrespaldo:
 
         return df
 
+    def preprocesar_registro(self, registro: dict) -> dict:
+        """Ruta escalar de `preprocesar` (y del `replace({None: np.nan})` posterior) sobre el registro.
+
+        Args:
+            registro (dict): datos del cliente ya calculados (se modifica).
+
+        Returns:
+            dict: registro preprocesado
+        """
+        departamento = registro["constitucion_department_retailer"]
+        registro["constitucion_department_retailer"] = NORMALIZACION.departamento(departamento)
+        registro["region_ret"] = NORMALIZACION.region(departamento)
+        registro.update(
+            Var_pct_IPC_3=Var_pct_IPC_3, Var_TRM_1=Var_TRM_1, IBR_Var=IBR_Var, Var_TPM_1=Var_TPM_1, Var_TD3=Var_TD3
+        )
+        for nombre, valor in registro.items():
+            if valor is None:
+                registro[nombre] = np.nan
+        return registro
+
 
     def calcular_variables_cliente(self, datos_cliente: dict) -> dict:
         """
@@ -130,79 +193,234 @@ class MotorPrediccionHrespaldo:
 
             logging.info("Iniciando proceso de predicción para el cliente %s", dni_cliente_consultado)
 
-            # Cálculo de variables adicionales del cliente
-            datos_cliente = self.calcular_variables_cliente(datos_cliente)
-            datos_cliente_df = pd.DataFrame([datos_cliente])
-            datos_cliente_df = self.preprocesar(datos_cliente_df)
-            # con el loogin imprimimos las columnas finales
-            logging.info("Variables finales: %s", datos_cliente_df)
-            datos_cliente_df = datos_cliente_df.replace({None: np.nan})
-            logging.info("Variables adicionales calculadas exitosamente.")
-            proba_pagar, proba_fpd = self.generar_probabilidad(datos_cliente_df, tid)
-            logging.info("Probabilidades generadas exitosamente.")
-            segmentoH, segmentoFPD = assign_nested_bins(proba_h= proba_pagar, proba_fpd = proba_fpd, edges_cfg = EDGES_CFG_BACKUP)
-            logging.info(f"Segmentos de cliente identificados: {segmentoH} {segmentoFPD}.")
-            contraofertas, mensaje, razones_rechazo = self.generar_contraofertas(proba_pagar, proba_fpd , grupo_retailer, segmentoH, segmentoFPD)
-
-            # Lógica de respuesta final
-            if mensaje == 'Aprobado':
-                return build_approval_response(
-                    VERSION_HRESPALDO,
-                    VERSION_FPD_HRESPALDO,
-                    dni_cliente_consultado=dni_cliente_consultado,
-                    proba_h=proba_pagar,
-                    proba_fpd=proba_fpd,
-                    contraofertas=contraofertas,
-                    codigo="2",
-                )
-            elif mensaje == 'Rechazado':
-                return build_rejection_response(
-                    VERSION_HRESPALDO,
-                    VERSION_FPD_HRESPALDO,
-                    dni_cliente_consultado=dni_cliente_consultado,
-                    mensaje=razones_rechazo,
-                    codigo="0",
-                    proba_h=proba_pagar,
-                    proba_fpd=proba_fpd,
-                    contraofertas=contraofertas,
-                    only_group_in_contraofertas=True,
-                )
+            return self.grafo.ejecutar(
+                datos_cliente=datos_cliente, grupo_retailer=grupo_retailer, tid=tid, dni_consultado=dni_cliente_consultado,
+            )
 
         except KeyError as ke:
             logging.exception("Error en la clave")
-            return error_response(VERSION_HRESPALDO, VERSION_FPD_HRESPALDO, dni_cliente_consultado)
+            return error_response(self.version, self.version_fpd, dni_cliente_consultado)
         except Exception as e:
             logging.exception("Error inesperado")
-            return error_response(VERSION_HRESPALDO, VERSION_FPD_HRESPALDO, dni_cliente_consultado)
+            return error_response(self.version, self.version_fpd, dni_cliente_consultado)
 
 
-    def generar_probabilidad(self, cliente, tid):
+    def predecir_lote(self, lista_datos_cliente_json, grupo_retailer):
         """
-        Genera la probabilidad de aprobación Hrespaldo y la probabilidad FPD para un cliente.
+        Predice varias solicitudes con un solo escalado y una predicción por modelo.
+
+        Las variables del cliente y el preprocesamiento (ruta escalar) van por solicitud;
+        las filas de todas se normalizan y predicen juntas, y los segmentos se asignan
+        con un solo `assign_nested_bins_lote`.
 
         Args:
-            cliente (pd.DataFrame): DataFrame con variables ya calculadas del cliente.
+            lista_datos_cliente_json (list): JSON de cada solicitud.
+            grupo_retailer (str | list): grupo para todo el lote o uno por solicitud.
 
         Returns:
-            Tuple[np.ndarray, np.ndarray]: Probabilidades Hrespaldo y FPD.
+            list: una respuesta por solicitud, en orden, igual a la de `predecir`; la que
+            falla recibe `error_response` sin afectar al resto.
         """
-        # Renombrar variables para el modelo
+        n = len(lista_datos_cliente_json)
+        grupos = grupos_lote(grupo_retailer, n)
+        respuestas = [None] * n
+        dnis_consultados = [None] * n
+        clientes = {}
+
+        def fallo(i):
+            logging.exception("Error en la solicitud %d del lote", i)
+            respuestas[i] = error_response(self.version, self.version_fpd, dnis_consultados[i])
+
+        for i, datos_cliente_json in enumerate(lista_datos_cliente_json):
+            try:
+                datos_cliente, tid = extraer_datos_iniciales(datos_cliente_json, ["score_experian"])
+                dnis_consultados[i] = datos_cliente.get("dni_cliente", "")
+                datos_cliente = self.calcular_variables_cliente(datos_cliente)
+                registro = self.preparar_registro(datos_cliente) if self.ruta_escalar else None
+                clientes[i] = (datos_cliente, registro, tid)
+            except Exception:
+                fallo(i)
+
+        probabilidades = {}
+        con_registro = [i for i, cliente in clientes.items() if cliente[1] is not None]
+        if con_registro:
+            try:
+                with etapa("generar_probabilidad"):
+                    lote = self.pipeline.probabilidades_lote([clientes[i][1] for i in con_registro])
+                for i, probas in zip(con_registro, lote):
+                    if probas is not None:
+                        proba_hrespaldo, proba_hrespaldo_fpd = probas
+                        if clientes[i][2] == 6:
+                            proba_hrespaldo = max(proba_hrespaldo - 0.05, 0.0)
+                        probabilidades[i] = proba_hrespaldo, proba_hrespaldo_fpd
+            except Exception:
+                logging.exception("Error en la predicción del lote, se predice por solicitud")
+                probabilidades.clear()
+        for i, (datos_cliente, _, tid) in clientes.items():
+            if i not in probabilidades:
+                try:
+                    probabilidades[i] = self.calcular_probabilidades(datos_cliente, tid, escalar=False)
+                except Exception:
+                    fallo(i)
+
+        listos = list(probabilidades)
+        segmentos = assign_nested_bins_lote(
+            [probabilidades[i][0] for i in listos],
+            [probabilidades[i][1] for i in listos],
+            edges_cfg=EDGES_CFG_BACKUP,
+        )
+        for i, (segmentoH, segmentoFPD) in zip(listos, segmentos):
+            proba_pagar, proba_fpd = probabilidades[i]
+            try:
+                respuestas[i] = self.responder(dnis_consultados[i], proba_pagar, proba_fpd, grupos[i], segmentoH, segmentoFPD)
+            except Exception:
+                fallo(i)
+        logging.info("Lote de %d solicitudes procesado.", n)
+        return respuestas
+
+    def entradas_modelos(self, datos_cliente: dict):
+        """Entradas crudas del pipeline (`crudo`) y, si vienen de la ruta pandas, el DataFrame (`frame`).
+
+        `crudo` es `None` si el pipeline no admite el DataFrame: los modelos
+        predicen desde `frame` como `normalize_and_select`.
+        """
+        if self.ruta_escalar and self.pipeline.admitido:
+            fila = self.pipeline.vector(self.preparar_registro(datos_cliente))
+            if fila is not None:
+                return fila[None, :], None
+            logging.info("Ruta escalar no aplicable, se usa la ruta pandas.")
+        df = self.alias_frame(self.preprocesar_frame(datos_cliente))
+        return self.pipeline.crudo(df), df
+
+    def ajustar_probabilidades(self, proba_hrespaldo, proba_hrespaldo_fpd, tid):
+        """Descuento de H para tipo de documento 6."""
+        if tid == 6:
+            proba_hrespaldo = max(proba_hrespaldo - 0.05, 0.0)
+        logging.info("Probabilidades generadas exitosamente.")
+        return proba_hrespaldo, proba_hrespaldo_fpd
+
+    def segmentar(self, proba_pagar, proba_fpd):
+        segmentoH, segmentoFPD = assign_nested_bins(proba_h=proba_pagar, proba_fpd=proba_fpd, edges_cfg=EDGES_CFG_BACKUP)
+        logging.info(f"Segmentos de cliente identificados: {segmentoH} {segmentoFPD}.")
+        return segmentoH, segmentoFPD
+
+    def responder(self, dni_cliente_consultado, proba_pagar, proba_fpd, grupo_retailer, segmentoH, segmentoFPD):
+        """Genera las contraofertas y arma la respuesta de aprobación o rechazo."""
+        contraofertas, mensaje, razones_rechazo = self.generar_contraofertas(proba_pagar, proba_fpd , grupo_retailer, segmentoH, segmentoFPD)
+
+        # Lógica de respuesta final
+        if mensaje == 'Aprobado':
+            return build_approval_response(
+                self.version,
+                self.version_fpd,
+                dni_cliente_consultado=dni_cliente_consultado,
+                proba_h=proba_pagar,
+                proba_fpd=proba_fpd,
+                contraofertas=contraofertas,
+                codigo="2",
+            )
+        elif mensaje == 'Rechazado':
+            return build_rejection_response(
+                self.version,
+                self.version_fpd,
+                dni_cliente_consultado=dni_cliente_consultado,
+                mensaje=razones_rechazo,
+                codigo="0",
+                proba_h=proba_pagar,
+                proba_fpd=proba_fpd,
+                contraofertas=contraofertas,
+                only_group_in_contraofertas=True,
+            )
+
+    def calcular_probabilidades(self, datos_cliente: dict, tid, escalar=None):
+        """
+        Preprocesa los datos del cliente y genera las probabilidades Hrespaldo y FPD.
+
+        Con la ruta escalar (`escalar`, por defecto `self.ruta_escalar`) el cliente se
+        procesa como registro dict; si no la admite, o con `escalar=False`, se arma el
+        DataFrame de una fila. `datos_cliente` no se modifica en la ruta escalar.
+        """
+        if self.ruta_escalar if escalar is None else escalar:
+            probabilidades = self.generar_probabilidad_registro(datos_cliente, tid)
+            if probabilidades is not None:
+                return probabilidades
+            logging.info("Ruta escalar no aplicable, se usa la ruta pandas.")
+        datos_cliente_df = self.preprocesar_frame(datos_cliente)
+        with etapa("generar_probabilidad"):
+            return self.generar_probabilidad(datos_cliente_df, tid)
+
+    def preprocesar_frame(self, datos_cliente: dict) -> pd.DataFrame:
+        """Ruta pandas de `preprocesar`: DataFrame de una fila del cliente, con nulos como NaN."""
+        with etapa("preprocesamiento"):
+            datos_cliente_df = pd.DataFrame([datos_cliente])
+            datos_cliente_df = self.preprocesar(datos_cliente_df)
+        # con el loogin imprimimos las columnas finales
+        logging.info("Variables finales: %s", datos_cliente_df)
+        datos_cliente_df = datos_cliente_df.replace({None: np.nan})
+        logging.info("Variables adicionales calculadas exitosamente.")
+        return datos_cliente_df
+
+    @staticmethod
+    def alias_frame(cliente: pd.DataFrame) -> pd.DataFrame:
+        """Renombra (agrega como alias) las variables que usan los modelos."""
         cliente["genero_cliente"] = cliente["genero"]
         cliente["numero_hijos_cliente"] = cliente["numero_hijos"]
         cliente["tiene_tarjeta_credito"] = cliente["tarjeta_credito"]
         cliente["tipo_trabajo_cliente"] = cliente["tipo_trabajo"]
         cliente["Edad"] = cliente["edad_al_contratar"]
+        return cliente
+
+    def preparar_registro(self, datos_cliente: dict) -> dict:
+        """Registro del cliente (ruta escalar) con los alias del modelo; `datos_cliente` no se modifica."""
+        with etapa("preprocesamiento"):
+            registro = self.preprocesar_registro(dict(datos_cliente))
+        logging.info("Variables finales (registro): %s", registro)
+        registro["genero_cliente"] = registro["genero"]
+        registro["numero_hijos_cliente"] = registro["numero_hijos"]
+        registro["tiene_tarjeta_credito"] = registro["tarjeta_credito"]
+        registro["tipo_trabajo_cliente"] = registro["tipo_trabajo"]
+        registro["Edad"] = registro["edad_al_contratar"]
+        return registro
+
+    def generar_probabilidad_registro(self, datos_cliente: dict, tid):
+        """Ruta escalar de `preprocesar` + `generar_probabilidad`; `None` si la entrada no la admite."""
+        registro = self.preparar_registro(datos_cliente)
+        with etapa("generar_probabilidad"):
+            probabilidades = self.pipeline.probabilidades_registro(registro)
+            if probabilidades is None:
+                return None
+            proba_hrespaldo, proba_hrespaldo_fpd = probabilidades
+        if tid == 6:
+            proba_hrespaldo = max(proba_hrespaldo - 0.05, 0.0)
+        return proba_hrespaldo, proba_hrespaldo_fpd
 
-        df_H, featuresH, df_FPD, featuresFPD  = normalize_and_select(
-            cliente,
-            model_h=self.modelo_h,
-            scaler_h=self.min_max_scaler,
-            model_fpd=self.modelo_fpd,
-            scaler_fpd=self.min_max_scaler,
-        )
-        logging.info("Datos del cliente normalizados y seleccionados exitosamente.")
-        proba_hrespaldo = self.modelo_h.predict_proba(df_H[featuresH])[:, 1]
-        proba_hrespaldo_fpd = self.modelo_fpd.predict_proba(df_FPD[featuresFPD])[:, 1]
+    def generar_probabilidad(self, cliente, tid):
+        """
+        Genera la probabilidad de aprobación Hrespaldo y la probabilidad FPD para un cliente.
+
+        Args:
+            cliente (pd.DataFrame): DataFrame con variables ya calculadas del cliente.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Probabilidades Hrespaldo y FPD.
+        """
+        # Renombrar variables para el modelo
+        cliente = self.alias_frame(cliente)
+
+        probabilidades = self.pipeline.probabilidades(cliente)
+        if probabilidades is not None:
+            proba_hrespaldo, proba_hrespaldo_fpd = probabilidades
+        else:
+            df_H, featuresH, df_FPD, featuresFPD  = normalize_and_select(
+                cliente,
+                model_h=self.modelo_h,
+                scaler_h=self.min_max_scaler,
+                model_fpd=self.modelo_fpd,
+                scaler_fpd=self.min_max_scaler,
+            )
+            logging.info("Datos del cliente normalizados y seleccionados exitosamente.")
+            proba_hrespaldo = self.modelo_h.predict_proba(df_H[featuresH])[:, 1]
+            proba_hrespaldo_fpd = self.modelo_fpd.predict_proba(df_FPD[featuresFPD])[:, 1]
         if tid == 6:
             proba_hrespaldo = max(proba_hrespaldo - 0.05, 0.0)
         return proba_hrespaldo, proba_hrespaldo_fpd
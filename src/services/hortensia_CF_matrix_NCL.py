@@ -6,14 +6,22 @@ from src.services.extraccion_API_NCL import procesar_informe
 from src.services.preprocess_NCL import (
     calcular_variables_cliente,
     preprocesscomportamiento,
-    calcular_tendencia
+    calcular_tendencia,
+    preprocesar_registro
 )
 from src.models.feature_utils import normalize_and_select
-from src.utils.helpers import cargar_modelo, cargar_json
+from src.models.pipeline_modelos import PipelineModelos
+from src.core.grafo_etapas import Etapa, GrafoEtapas
+from src.utils.helpers import cargar_modelo
+from src.services.normalizacion import NORMALIZACION
+from src.services.plan_features import plan_motor
+from src.utils.contabilidad_copias import etapa
 from src.models.predict_utils import (
     extraer_datos_cliente_campos,
     procesar_xml_experian,
-    assign_nested_bins
+    assign_nested_bins,
+    assign_nested_bins_lote,
+    grupos_lote
 )
 from src.utils.responses import build_rejection_response, build_approval_response, error_response
 #cargar_json
@@ -23,19 +31,59 @@ VERSION_NCLF_FPD,
 EDGES_CFG_NCL,
 REJECT_THRESHOLDS_NCL,
 CREDIT_CONDITIONS_NCL,
-CUOTAS
+CUOTAS,
+RUTA_ESCALAR_NCL,
+PLAN_FEATURES_NCL
 )
 
 class MotorPrediccionContraofertas:
     """Clase que maneja la lógica de predicción y generación de contraofertas."""
 
-    def __init__(self, MODELO_PATH, SCALER_PATH_H, MODELO_PATH_FPD):
+    def __init__(self, MODELO_PATH, SCALER_PATH_H, MODELO_PATH_FPD, ruta_escalar=None, plan_features=None,
+                 version=None, version_fpd=None):
+        # Versiones que reporta el motor (las de config.yaml salvo que el registro de modelos cargue otras)
+        self.version = VERSION_NCLF if version is None else version
+        self.version_fpd = VERSION_NCLF_FPD if version_fpd is None else version_fpd
         self.modelo_h = cargar_modelo(MODELO_PATH)
         self.modelo_fpd = cargar_modelo(MODELO_PATH_FPD)
         self.min_max_scaler = cargar_modelo(SCALER_PATH_H)
-        self.departamentos_colombia = cargar_json("departamentos_colombia.json")
-        self.tipo_trabajo_mapping = cargar_json("tipo_trabajo_mapping.json")
-        self.genero_mapping = cargar_json("genero_mapping.json")
+        # Ruta escalar (registro dict + vectores NumPy) para la solicitud de un cliente
+        self.ruta_escalar = RUTA_ESCALAR_NCL if ruta_escalar is None else ruta_escalar
+        # Variables derivadas que usan los modelos cargados (None: se calculan todas)
+        self.plan = plan_motor(
+            "ncl",
+            [(self.modelo_h, self.min_max_scaler), (self.modelo_fpd, self.min_max_scaler)],
+            PLAN_FEATURES_NCL if plan_features is None else plan_features,
+        )
+        # Scalers + modelos compilados: H y FPD comparten scaler, que se aplica una sola vez
+        self.pipeline = PipelineModelos(
+            [(self.modelo_h, self.min_max_scaler), (self.modelo_fpd, self.min_max_scaler)], nombre="ncl"
+        )
+        # Mapeos de la tabla de normalizacion compartida (cargada una vez por proceso)
+        self.departamentos_colombia = NORMALIZACION.departamentos
+        self.tipo_trabajo_mapping = NORMALIZACION.tipo_trabajo_mapping
+        self.genero_mapping = NORMALIZACION.genero_mapping
+        self.grafo = self.construir_grafo()
+
+    def construir_grafo(self):
+        """Etapas de `predecir`: XML -> entradas -> escalado -> ramas H y FPD (a la vez) -> segmentos -> respuesta."""
+        return GrafoEtapas(
+            "ncl",
+            [
+                Etapa("procesar_xml_experian", self.procesar_xml, ("datos_cliente", "experian_xml"), ("cliente",)),
+                Etapa("entradas", self.entradas_modelos, ("cliente",), ("crudo", "frame")),
+                *self.pipeline.etapas(("H", "FPD")),
+                Etapa("probabilidades", self.ajustar_probabilidades, ("proba_H", "proba_FPD", "tid"), ("proba_pagar", "proba_fpd")),
+                Etapa("segmentos", self.segmentar, ("proba_pagar", "proba_fpd", "grupo_retailer"), ("segmentoH", "segmentoFPD")),
+                Etapa(
+                    "respuesta", self.responder,
+                    ("dni_consultado", "p3", "proba_pagar", "proba_fpd", "grupo_retailer", "segmentoH", "segmentoFPD"),
+                    ("respuesta",),
+                ),
+            ],
+            iniciales=("datos_cliente", "experian_xml", "grupo_retailer", "p3", "tid", "dni_consultado"),
+            salida="respuesta",
+        )
 
     def normalizar_y_seleccionar_features(self, df):
         """
@@ -75,59 +123,237 @@ class MotorPrediccionContraofertas:
             datos_cliente, cliente_experian_xml, p3, score_experian, dni_cliente_consultado, tid = extraer_datos_cliente_campos(datos_cliente_json, ["p6", "score_experian"])
 
             if score_experian == 3:
-                mensaje = "Cliente reportado como fallecido"
-                codigo = "0"
-                return build_rejection_response(
-                    VERSION_NCLF,
-                    VERSION_NCLF_FPD,
-                    dni_cliente_consultado=dni_cliente_consultado,
-                    mensaje=mensaje,
-                    codigo=codigo
-                )
-            logging.info("Iniciando el proceso de extracción de experian.")
-            
-            datos_cliente = procesar_xml_experian(datos_cliente, cliente_experian_xml, procesar_informe)
-            logging.info("Iniciando un nuevo proceso de predicción.")
-            datos_cliente = calcular_variables_cliente(datos_cliente)
-            datos_cliente = preprocesscomportamiento(datos_cliente)
-            datos_cliente = calcular_tendencia(datos_cliente)
-            logging.info("Variables adicionales calculadas exitosamente.")
-            proba_pagar, proba_fpd = self.generar_probabilidad(datos_cliente, tid)
-            logging.info("Probabilidades generadas exitosamente.")
-            segmentoH, segmentoFPD = assign_nested_bins(proba_h= proba_pagar, proba_fpd = proba_fpd, edges_cfg = EDGES_CFG_NCL[grupo_retailer])
-            logging.info(f"Segmentos de cliente identificados: {segmentoH} {segmentoFPD}.")
-            contraofertas, mensaje, razones_rechazo = self.generar_contraofertas(p3, proba_pagar, proba_fpd , grupo_retailer, segmentoH, segmentoFPD)
-
-            # Lógica de respuesta final
-            if mensaje == 'Aprobado':
-                return build_approval_response(
-                    VERSION_NCLF,
-                    VERSION_NCLF_FPD,
-                    dni_cliente_consultado=dni_cliente_consultado,
-                    proba_h=proba_pagar,
-                    proba_fpd=proba_fpd,
-                    contraofertas=contraofertas,
-                    codigo="2",
-                )
-            elif mensaje == 'Rechazado':
-                return build_rejection_response(
-                    VERSION_NCLF,
-                    VERSION_NCLF_FPD,
-                    dni_cliente_consultado=dni_cliente_consultado,
-                    mensaje=razones_rechazo,
-                    codigo="0",
-                    proba_h=proba_pagar,
-                    proba_fpd=proba_fpd,
-                    contraofertas=contraofertas,
-                    only_group_in_contraofertas=True,
-                )
+                return self.respuesta_fallecido(dni_cliente_consultado)
+            return self.grafo.ejecutar(
+                datos_cliente=datos_cliente, experian_xml=cliente_experian_xml, grupo_retailer=grupo_retailer,
+                p3=p3, tid=tid, dni_consultado=dni_cliente_consultado,
+            )
 
         except KeyError as ke:
             logging.exception("Error en la clave")
-            return error_response(VERSION_NCLF, VERSION_NCLF_FPD, dni_cliente_consultado)
+            return error_response(self.version, self.version_fpd, dni_cliente_consultado)
         except Exception as e:
             logging.exception("Error inesperado")
-            return error_response(VERSION_NCLF, VERSION_NCLF_FPD, dni_cliente_consultado)
+            return error_response(self.version, self.version_fpd, dni_cliente_consultado)
+
+    def predecir_lote(self, lista_datos_cliente_json, grupo_retailer):
+        """
+        Predice varias solicitudes con un solo escalado y una predicción por modelo.
+
+        La extracción y el preprocesamiento (ruta escalar) van por solicitud; las filas de
+        todas se normalizan y predicen juntas, y los segmentos se asignan por grupo con
+        `assign_nested_bins_lote`.
+
+        Args:
+            lista_datos_cliente_json (list): JSON de cada solicitud.
+            grupo_retailer (str | list): grupo para todo el lote o uno por solicitud.
+
+        Returns:
+            list: una respuesta por solicitud, en orden, igual a la de `predecir`; la que
+            falla recibe `error_response` sin afectar al resto.
+        """
+        n = len(lista_datos_cliente_json)
+        grupos = grupos_lote(grupo_retailer, n)
+        respuestas = [None] * n
+        dnis_consultados = [None] * n
+        clientes = {}
+
+        def fallo(i):
+            logging.exception("Error en la solicitud %d del lote", i)
+            respuestas[i] = error_response(self.version, self.version_fpd, dnis_consultados[i])
+
+        for i, datos_cliente_json in enumerate(lista_datos_cliente_json):
+            try:
+                datos_cliente, cliente_experian_xml, p3, score_experian, dnis_consultados[i], tid = extraer_datos_cliente_campos(datos_cliente_json, ["p6", "score_experian"])
+                if score_experian == 3:
+                    respuestas[i] = self.respuesta_fallecido(dnis_consultados[i])
+                    continue
+                with etapa("procesar_xml_experian"):
+                    datos_cliente = procesar_xml_experian(datos_cliente, cliente_experian_xml, procesar_informe, variante="ncl", plan=self.plan)
+                registro = self.preparar_registro(datos_cliente) if self.ruta_escalar else None
+                clientes[i] = (datos_cliente, registro, p3, tid)
+            except Exception:
+                fallo(i)
+
+        probabilidades = {}
+        con_registro = [i for i, cliente in clientes.items() if cliente[1] is not None]
+        if con_registro:
+            try:
+                with etapa("generar_probabilidad"):
+                    lote = self.pipeline.probabilidades_lote([clientes[i][1] for i in con_registro])
+                for i, probas in zip(con_registro, lote):
+                    if probas is not None:
+                        proba_pagar, proba_fpd = probas
+                        if clientes[i][3] == 6:
+                            proba_pagar = max(proba_pagar - 0.07, 0.0)
+                        probabilidades[i] = proba_pagar, proba_fpd
+            except Exception:
+                logging.exception("Error en la predicción del lote, se predice por solicitud")
+                probabilidades.clear()
+        for i, (datos_cliente, _, _, tid) in clientes.items():
+            if i not in probabilidades:
+                try:
+                    probabilidades[i] = self.calcular_probabilidades(datos_cliente, tid, escalar=False)
+                except Exception:
+                    fallo(i)
+
+        for grupo in dict.fromkeys(grupos[i] for i in probabilidades):
+            del_grupo = [i for i in probabilidades if grupos[i] == grupo]
+            try:
+                segmentos = assign_nested_bins_lote(
+                    [probabilidades[i][0] for i in del_grupo],
+                    [probabilidades[i][1] for i in del_grupo],
+                    edges_cfg=EDGES_CFG_NCL[grupo],
+                )
+            except Exception:
+                for i in del_grupo:
+                    fallo(i)
+                continue
+            for i, (segmentoH, segmentoFPD) in zip(del_grupo, segmentos):
+                proba_pagar, proba_fpd = probabilidades[i]
+                try:
+                    respuestas[i] = self.responder(dnis_consultados[i], clientes[i][2], proba_pagar, proba_fpd, grupo, segmentoH, segmentoFPD)
+                except Exception:
+                    fallo(i)
+        logging.info("Lote de %d solicitudes procesado.", n)
+        return respuestas
+
+    def procesar_xml(self, datos_cliente, cliente_experian_xml):
+        logging.info("Iniciando el proceso de extracción de experian.")
+        with etapa("procesar_xml_experian"):
+            return procesar_xml_experian(datos_cliente, cliente_experian_xml, procesar_informe, variante="ncl", plan=self.plan)
+
+    def entradas_modelos(self, datos_cliente):
+        """Entradas crudas del pipeline (`crudo`) y, si vienen de la ruta pandas, el DataFrame (`frame`).
+
+        `crudo` es `None` si el pipeline no admite el DataFrame: los modelos
+        predicen desde `frame` como `normalize_and_select`.
+        """
+        logging.info("Iniciando un nuevo proceso de predicción.")
+        if self.ruta_escalar and self.pipeline.admitido:
+            registro = self.preparar_registro(datos_cliente)
+            fila = self.pipeline.vector(registro) if registro is not None else None
+            if fila is not None:
+                return fila[None, :], None
+            logging.info("Ruta escalar no aplicable, se usa la ruta pandas.")
+        df = self.alias_frame(self.preprocesar_frame(datos_cliente))
+        return self.pipeline.crudo(df), df
+
+    def ajustar_probabilidades(self, proba_pagar, proba_fpd, tid):
+        """Descuento de H para tipo de documento 6."""
+        if tid == 6:
+            proba_pagar = max(proba_pagar - 0.07, 0.0)
+        logging.info("Probabilidad de pago NCL: %s", proba_pagar)
+        logging.info("Probabilidad FPD NCL: %s", proba_fpd)
+        return proba_pagar, proba_fpd
+
+    def segmentar(self, proba_pagar, proba_fpd, grupo_retailer):
+        segmentoH, segmentoFPD = assign_nested_bins(proba_h=proba_pagar, proba_fpd=proba_fpd, edges_cfg=EDGES_CFG_NCL[grupo_retailer])
+        logging.info(f"Segmentos de cliente identificados: {segmentoH} {segmentoFPD}.")
+        return segmentoH, segmentoFPD
+
+    def respuesta_fallecido(self, dni_cliente_consultado):
+        return build_rejection_response(
+            self.version,
+            self.version_fpd,
+            dni_cliente_consultado=dni_cliente_consultado,
+            mensaje="Cliente reportado como fallecido",
+            codigo="0"
+        )
+
+    def responder(self, dni_cliente_consultado, p3, proba_pagar, proba_fpd, grupo_retailer, segmentoH, segmentoFPD):
+        """Genera las contraofertas y arma la respuesta de aprobación o rechazo."""
+        contraofertas, mensaje, razones_rechazo = self.generar_contraofertas(p3, proba_pagar, proba_fpd , grupo_retailer, segmentoH, segmentoFPD)
+
+        # Lógica de respuesta final
+        if mensaje == 'Aprobado':
+            return build_approval_response(
+                self.version,
+                self.version_fpd,
+                dni_cliente_consultado=dni_cliente_consultado,
+                proba_h=proba_pagar,
+                proba_fpd=proba_fpd,
+                contraofertas=contraofertas,
+                codigo="2",
+            )
+        elif mensaje == 'Rechazado':
+            return build_rejection_response(
+                self.version,
+                self.version_fpd,
+                dni_cliente_consultado=dni_cliente_consultado,
+                mensaje=razones_rechazo,
+                codigo="0",
+                proba_h=proba_pagar,
+                proba_fpd=proba_fpd,
+                contraofertas=contraofertas,
+                only_group_in_contraofertas=True,
+            )
+
+    def calcular_probabilidades(self, datos_cliente, tid: int, escalar=None):
+        """
+        Preprocesa el cliente extraido (DataFrame de una fila) y genera las probabilidades.
+
+        Con la ruta escalar (`escalar`, por defecto `self.ruta_escalar`) el cliente se
+        procesa como registro dict; si no la admite, o con `escalar=False`, se usa la
+        ruta pandas. `datos_cliente` no se modifica en la ruta escalar.
+        """
+        if self.ruta_escalar if escalar is None else escalar:
+            probabilidades = self.generar_probabilidad_registro(datos_cliente, tid)
+            if probabilidades is not None:
+                return probabilidades
+            logging.info("Ruta escalar no aplicable, se usa la ruta pandas.")
+        datos_cliente = self.preprocesar_frame(datos_cliente)
+        with etapa("generar_probabilidad"):
+            return self.generar_probabilidad(datos_cliente, tid)
+
+    def preprocesar_frame(self, datos_cliente):
+        """Ruta pandas de preprocesamiento sobre el cliente extraido (DataFrame de una fila)."""
+        with etapa("preprocesamiento"):
+            datos_cliente = calcular_variables_cliente(datos_cliente)
+            datos_cliente = preprocesscomportamiento(datos_cliente)
+            datos_cliente = calcular_tendencia(datos_cliente, plan=self.plan)
+            if self.plan is not None:
+                datos_cliente = self.plan.completar(datos_cliente)
+        logging.info("Variables adicionales calculadas exitosamente.")
+        return datos_cliente
+
+    @staticmethod
+    def alias_frame(df):
+        """Agrega al DataFrame los alias de columnas que usan los modelos (sin copiarlo)."""
+        df["ident_genero"] = df['genero_exp']
+        df['Edad'] = df['edad_cliente']
+        df["puntaje_quanto"] = df["quanto"]
+        return df
+
+    def preparar_registro(self, datos_cliente):
+        """Registro del cliente (ruta escalar) con los alias del modelo; `None` si la entrada no la admite."""
+        with etapa("preprocesamiento"):
+            registro = preprocesar_registro(datos_cliente, self.plan)
+        if registro is None:
+            return None
+        if self.plan is not None:
+            self.plan.completar_registro(registro)
+        logging.info("Variables adicionales calculadas exitosamente (registro).")
+        registro["ident_genero"] = registro['genero_exp']
+        registro['Edad'] = registro['edad_cliente']
+        registro["puntaje_quanto"] = registro["quanto"]
+        return registro
+
+    def generar_probabilidad_registro(self, datos_cliente, tid: int):
+        """Ruta escalar de preprocesamiento + `generar_probabilidad`; `None` si la entrada no la admite."""
+        registro = self.preparar_registro(datos_cliente)
+        if registro is None:
+            return None
+        with etapa("generar_probabilidad"):
+            probabilidades = self.pipeline.probabilidades_registro(registro)
+            if probabilidades is None:
+                return None
+            proba_pagar, proba_fpd = probabilidades
+            if tid == 6:
+                proba_pagar = max(proba_pagar - 0.07, 0.0)
+        logging.info("Probabilidad de pago NCL: %s", proba_pagar)
+        logging.info("Probabilidad FPD NCL: %s", proba_fpd)
+        return proba_pagar, proba_fpd
 
     def generar_probabilidad(self, cliente, tid: int):
         """
@@ -140,20 +366,21 @@ class MotorPrediccionContraofertas:
             Tuple[np.ndarray, np.ndarray]: Probabilidades Hrespaldo y FPD.
         """
         logging.info("Generando probabilidad de pago...")
-        df = cliente.copy()
-        df["ident_genero"] = df['genero_exp']
-        df['Edad'] = df['edad_cliente']
-        df_H, featuresH, df_FPD, featuresFPD  = self.normalizar_y_seleccionar_features(df)
-        logging.info("Features normalizados y seleccionados H: %s", df_H.to_dict(orient="records")[0])
-        logging.info("Calculando probablidad H")
-        
-        proba_pagar = self.modelo_h.predict_proba(df_H[featuresH])[:, 1]
+        # `cliente` es propio de predecir y no se vuelve a usar: los alias se agregan sin copiarlo
+        df = self.alias_frame(cliente)
+        probabilidades = self.pipeline.probabilidades(df)
+        if probabilidades is not None:
+            proba_pagar, proba_fpd = probabilidades
+        else:
+            df_H, featuresH, df_FPD, featuresFPD  = self.normalizar_y_seleccionar_features(df)
+            logging.info("Features normalizados y seleccionados H: %s", df_H.to_dict(orient="records")[0])
+            logging.info("Calculando probablidad H")
+            proba_pagar = self.modelo_h.predict_proba(df_H[featuresH])[:, 1]
+            logging.info("Features normalizados y seleccionados FPD: %s", df_H.to_dict(orient="records")[0])
+            logging.info("Calculando probablidad FPD")
+            proba_fpd = self.modelo_fpd.predict_proba(df_FPD[featuresFPD])[:, 1]
         if tid == 6:
             proba_pagar = max(proba_pagar - 0.07, 0.0)
-        logging.info("Features normalizados y seleccionados FPD: %s", df_H.to_dict(orient="records")[0])
-        logging.info("Calculando probablidad FPD")
-        
-        proba_fpd = self.modelo_fpd.predict_proba(df_FPD[featuresFPD])[:, 1]
         logging.info("Probabilidad de pago NCL: %s", proba_pagar)
         logging.info("Probabilidad FPD NCL: %s", proba_fpd)
 
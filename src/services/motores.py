@@ -0,0 +1,121 @@
+"""Motores de prediccion construidos desde una especificacion de artefactos.
+
+La app Flask (`routes.py`) y la FastAPI (`fastapi_app.py`) instanciaban cada
+una sus tres motores, con su propia copia de modelos y scalers. Ahora los
+motores del proceso son el juego activo del registro de modelos
+(`registro_modelos.REGISTRO`); con `preload_app` el master de gunicorn lo crea
+antes del fork y todos los workers lo heredan (ver `almacen_artefactos`).
+
+Una especificacion es un dict con las mismas secciones de config.yaml:
+
+    model_paths, model_paths_fpd, scaler_paths   rutas de los pickles
+    versions_hortensia, versions_fpd             versiones que reportan los motores
+
+`especificacion_config` devuelve la de config.yaml y `combinar` le aplica los
+cambios de una carga (solo claves ya existentes, rutas de archivos que existan
+dentro de `src/artifacts`).
+"""
+import copy
+import hashlib
+import json
+from pathlib import Path
+
+from src.config.config import CONFIG, MODEL_PATHS, MODEL_PATHS_FPD, SCALER_PATHS
+from src.services.hortensia_contraofertas_matrix import MotorPrediccionContraofertas as MotorMatrix
+from src.services.hortensia_CF_matrix_BACK import MotorPrediccionHrespaldo
+from src.services.hortensia_CF_matrix_NCL import MotorPrediccionContraofertas as MotorMatrix_NCL
+from src.services.hilos_inferencia import PRESUPUESTO
+
+RAIZ = Path(__file__).resolve().parents[2]
+# Unico directorio desde el que una carga puede leer pickles
+ARTEFACTOS = RAIZ / "src" / "artifacts"
+
+SECCIONES_RUTAS = ("model_paths", "model_paths_fpd", "scaler_paths")
+SECCIONES_VERSIONES = ("versions_hortensia", "versions_fpd")
+
+
+def ruta_proyecto(ruta):
+    """`ruta` como Path absoluto; las relativas son relativas a la raiz del proyecto."""
+    ruta = Path(ruta)
+    return ruta if ruta.is_absolute() else RAIZ / ruta
+
+
+def _ruta_artefacto(valor, campo):
+    """`valor` relativo a la raiz (como en config.yaml) si es un archivo dentro de `ARTEFACTOS`.
+
+    Se resuelven `..` y enlaces antes de comparar: `cargar_modelo` deserializa
+    el pickle, asi que una carga no puede apuntar fuera de los artefactos.
+    """
+    ruta = ruta_proyecto(valor).resolve()
+    if not ruta.is_relative_to(ARTEFACTOS.resolve()):
+        raise ValueError(f"{campo}: {valor} esta fuera de {ARTEFACTOS.relative_to(RAIZ)}")
+    if not ruta.is_file():
+        raise ValueError(f"No existe el archivo {valor} ({campo})")
+    return ruta.relative_to(RAIZ.resolve()).as_posix()
+
+
+def especificacion_config():
+    """Especificacion de artefactos declarada en config.yaml."""
+    return {
+        "model_paths": dict(MODEL_PATHS),
+        "model_paths_fpd": dict(MODEL_PATHS_FPD),
+        "scaler_paths": dict(SCALER_PATHS),
+        "versions_hortensia": dict(CONFIG["versions_hortensia"]),
+        "versions_fpd": dict(CONFIG["versions_fpd"]),
+    }
+
+
+def huella_especificacion(spec):
+    """sha256 (12 caracteres) de la especificacion, independiente del orden de las claves."""
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def combinar(base, cambios):
+    """Copia de `base` con `cambios` aplicados por seccion.
+
+    Lanza `ValueError` si una seccion o clave no existe en `base`, si un valor
+    no es texto o si una ruta no es un archivo dentro de `ARTEFACTOS`
+    (`cargar_modelo` termina el proceso ante un archivo faltante, asi que se
+    valida antes de cargar). Las rutas quedan relativas a la raiz del proyecto.
+    """
+    if not isinstance(cambios, dict):
+        raise ValueError("Los cambios deben ser un objeto JSON")
+    spec = copy.deepcopy(base)
+    for seccion, valores in cambios.items():
+        if seccion not in SECCIONES_RUTAS + SECCIONES_VERSIONES:
+            raise ValueError(f"Seccion desconocida: {seccion}")
+        if not isinstance(valores, dict):
+            raise ValueError(f"La seccion {seccion} debe ser un objeto")
+        for clave, valor in valores.items():
+            if clave not in spec[seccion]:
+                raise ValueError(f"Clave desconocida: {seccion}.{clave}")
+            if not isinstance(valor, str) or not valor:
+                raise ValueError(f"{seccion}.{clave} debe ser texto")
+            if seccion in SECCIONES_RUTAS:
+                valor = _ruta_artefacto(valor, f"{seccion}.{clave}")
+            spec[seccion][clave] = valor
+    return spec
+
+
+def construir_motores(spec):
+    """`(motor_regular, motor_nclf, motor_backup)` con los artefactos y versiones de `spec`."""
+    modelos, modelos_fpd, scalers = (spec[s] for s in SECCIONES_RUTAS)
+    versiones, versiones_fpd = (spec[s] for s in SECCIONES_VERSIONES)
+    motores = (
+        MotorMatrix(
+            modelos["hortensia"], scalers["min_max_scaler_experian_H"],
+            modelos_fpd["hortensia_fpd"], scalers["min_max_scaler_experian_FPD"],
+            version=versiones["hortensia_contraofertas"], version_fpd=versiones_fpd["fpd_hortensia"],
+        ),
+        MotorMatrix_NCL(
+            modelos["hortensia_NCLF"], scalers["min_max_scaler_NCL"], modelos_fpd["hortensia_NCLF_FPD"],
+            version=versiones["hortensia_NCLF"], version_fpd=versiones_fpd["fpd_hortensia_NCLF"],
+        ),
+        MotorPrediccionHrespaldo(
+            modelos["respaldo"], scalers["min_max_scaler_hrespaldo"], modelos_fpd["respaldo_fpd"],
+            version=versiones["hrespaldo"], version_fpd=versiones_fpd["fpd_hrespaldo"],
+        ),
+    )
+    # predict_proba (rutas de una solicitud) con los hilos del presupuesto del worker
+    PRESUPUESTO.aplicar_modelos(m for motor in motores for m in (motor.modelo_h, motor.modelo_fpd))
+    return motores
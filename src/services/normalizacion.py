@@ -0,0 +1,97 @@
+"""Tabla de normalizacion de departamentos, regiones, tipo de trabajo y genero.
+
+Hay una sola instancia por proceso, `NORMALIZACION`, que se construye al
+importar el modulo a partir de `preprocessing.common_err_map`,
+`business_rules.ppt_blacklist_departments` y los JSON de `src/data`. El
+preprocesamiento, los tres motores y el enrutador leen de aqui en lugar de
+cargar cada uno sus JSON.
+
+Todo se resuelve de antemano:
+
+- `region_por_valor`: el `replace(common_err_map)` seguido de
+  `map(departamentos)` en un solo dict cuya clave es el valor crudo.
+- `bloqueo_ppt`: las variantes de los departamentos bloqueados para PPT en
+  forma canonica (sin mayusculas, espacios ni tildes), incluidas las de
+  `common_err_map` que apuntan a ellos.
+
+Las features de los modelos conservan exactamente la normalizacion con que se
+entrenaron. En Regular y NCL solo `departamento_exp` pasa por
+`lower().strip()`; en Respaldo se usa el valor crudo. Las tablas son
+`MapeoFijo`, un dict de solo lectura, y la instancia tampoco admite
+reasignar atributos.
+"""
+import unicodedata
+
+import numpy as np
+
+from src.config.config import PREPROC_COMMON_ERR, PPT_BLACKLIST_DEPARTMENTS
+from src.utils.helpers import cargar_json
+
+
+class MapeoFijo(dict):
+    """dict de solo lectura (sigue siendo `dict` para `Series.map`/`replace`)."""
+
+    def _solo_lectura(self, *args, **kwargs):
+        raise TypeError("La tabla de normalizacion es de solo lectura")
+
+    __setitem__ = __delitem__ = __ior__ = _solo_lectura
+    clear = pop = popitem = setdefault = update = _solo_lectura
+
+
+def canonico(texto):
+    """Forma canonica de un departamento: minusculas, sin espacios ni tildes (ñ -> n)."""
+    sin_tildes = unicodedata.normalize("NFKD", str(texto))
+    return "".join(c for c in sin_tildes if not unicodedata.combining(c) and not c.isspace()).lower()
+
+
+class TablaNormalizacion:
+    """Mapeos de normalizacion inmutables, resueltos una sola vez."""
+
+    __slots__ = ("errores", "departamentos", "region_por_valor", "tipo_trabajo_mapping", "genero_mapping", "bloqueo_ppt")
+
+    def __init__(self, errores, departamentos, tipo_trabajo_mapping, genero_mapping, bloqueados_ppt=()):
+        region_por_valor = {d: region for d, region in departamentos.items()}
+        for valor, departamento in errores.items():
+            if departamento in departamentos:
+                region_por_valor[valor] = departamentos[departamento]
+            else:
+                # replace deja un departamento desconocido: el map da NaN
+                region_por_valor.pop(valor, None)
+        bloqueo = {canonico(d) for d in bloqueados_ppt}
+        bloqueo |= {canonico(valor) for valor, departamento in errores.items() if canonico(departamento) in bloqueo}
+
+        asignar = super().__setattr__
+        asignar("errores", MapeoFijo(errores))
+        asignar("departamentos", MapeoFijo(departamentos))
+        asignar("region_por_valor", MapeoFijo(region_por_valor))
+        asignar("tipo_trabajo_mapping", MapeoFijo(tipo_trabajo_mapping))
+        asignar("genero_mapping", MapeoFijo(genero_mapping))
+        asignar("bloqueo_ppt", frozenset(bloqueo))
+
+    def __setattr__(self, nombre, valor):
+        raise AttributeError("La tabla de normalizacion es de solo lectura")
+
+    @classmethod
+    def desde_config(cls):
+        return cls(
+            PREPROC_COMMON_ERR,
+            cargar_json("data/departamentos_colombia.json"),
+            cargar_json("data/tipo_trabajo_mapping.json"),
+            cargar_json("data/genero_mapping.json"),
+            PPT_BLACKLIST_DEPARTMENTS,
+        )
+
+    def departamento(self, valor):
+        """`Series.replace(common_err_map)` de un valor."""
+        return self.errores.get(valor, valor) if isinstance(valor, str) else valor
+
+    def region(self, valor):
+        """Region del valor crudo (`replace` + `map`): NaN si no esta o no es texto."""
+        return self.region_por_valor.get(valor, np.nan) if isinstance(valor, str) else np.nan
+
+    def bloqueado_ppt(self, departamento):
+        """True si el departamento de la tienda esta en la lista negra de PPT (cualquier variante)."""
+        return bool(departamento) and canonico(departamento) in self.bloqueo_ppt
+
+
+NORMALIZACION = TablaNormalizacion.desde_config()
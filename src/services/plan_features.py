@@ -0,0 +1,280 @@
+"""Plan de features: que variables derivadas necesita cada motor.
+
+La extraccion (`variables_income`, `procesar_cuotas_y_amortizacion`,
+`procesar_consultas_experian`, `construir_dataframe_informe`) y el
+preprocesamiento (`calcular_tendencia`) calculan muchas mas variables de las
+que usan los modelos. Al construir un motor se leen sus scalers y boosters
+cargados y se arma un `PlanFeatures`:
+
+- `esquema`: columnas que leen `normalize_and_select` y su ruta escalar
+  (`feature_names_in_` de los scalers y `feature_name_` de los modelos).
+- `usadas`: features de los boosters con al menos un split. Las que tienen 0
+  splits no cambian la prediccion.
+- `necesarias`: las derivadas de `DERIVADAS` que estan en `usadas`, mas sus
+  entradas derivadas (cierre transitivo).
+
+Las etapas consultan `plan.calcular(nombre)` y omiten las derivadas que no
+estan en `necesarias`; todo lo que no esta en `DERIVADAS` se calcula siempre.
+`completar` agrega como NaN las columnas del esquema que se omitieron, para que
+la seleccion de features las encuentre (el modelo no las usa). Sin plan
+(`None`) las etapas calculan todo, como siempre.
+
+El plan tambien poda la extraccion: `SECCIONES` declara que campos produce
+cada seccion del XML y `secciones_omitidas` son las que no producen ninguna
+feature usada, ninguna entrada de las derivadas necesarias ni ningun campo de
+`SIEMPRE` (los que leen el preprocesamiento y las reglas de negocio). Los tres
+engines de `procesar_informe` se saltan esas secciones.
+"""
+import hashlib
+import logging
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
+import numpy as np
+
+from src.config.config import PREPROC_TENDENCIA_COLS_REG, PREPROC_TENDENCIA_COLS_NCLF, PLAN_FEATURES_SECCIONES
+from src.services import tendencias
+from src.services.constructor_features import ConstructorFeatures
+
+# etapa -> {derivada: entradas}. Las entradas son columnas del informe, otras
+# derivadas o familias de `familias_columnas.FAMILIAS`.
+ETAPAS = OrderedDict()
+
+ETAPAS["variables_income"] = {
+    'Avance_global_cartera': ('cartera_saldo_actual', 'cartera_valorInicial_activa'),
+    'promedio_cuota': ('cuota',),
+    'amortizacion_cartera': ('sector_cuota', 'sector_totalCuotas', 'sector_cuotasCanceladas'),
+    'ratio_cartera_real': ('sector3_cuotasCanceladas', 'sector3_totalCuotas'),
+    'ratio_cartera_telcos': ('sector4_cuota',),
+    'ratio_creditos_Neg': ('agr_prinp_creditoVigentes', 'agr_prinp_creditosActualesNegativos'),
+    'ratio_mora_saldo_3m': tuple(f'{c}_{i}' for c in ('saldoTotalMora', 'saldoTotal') for i in (1, 2, 3)),
+    'ratio_cuota_saldo_6m': ('trimestre_1_cuota', 'trimestre_1_saldo', 'trimestre_2_cuota', 'trimestre_2_saldo'),
+    'VarPctUso': ('trimestre_1_porcentajeUso', 'trimestre_2_porcentajeUso', 'trimestre_3_porcentajeUso'),
+    'Periodos_max_vencimiento': ('fecha_max_vencimiento', 'fechaConsulta'),
+    'porcentajeUso_1al2': ('trimestre_1_porcentajeUso', 'trimestre_2_porcentajeUso'),
+    'porcentajeUso_1al3': ('trimestre_1_porcentajeUso', 'trimestre_3_porcentajeUso'),
+}
+
+ETAPAS["cuotas_y_amortizacion"] = {
+    'portafolio_total_ahorros': ('total_tipo_1', 'total_cantidad_1'),
+    'portafolio_positivas_ahorros': ('total_tipo_1', 'AHO_Activa_cantidad_1'),
+    'portafolio_totales_diferentes': ('total_cantidad',),
+    'portafolio_aldia_diferentes': ('activa_cantidad', 'aldia_cantidad'),
+    'portafolio_totales': ('total_cantidad',),
+    'portafolio_aldia': ('activa_cantidad', 'aldia_cantidad'),
+    'portafolio_mora': ('portafolio_totales', 'portafolio_aldia'),
+    'portafolio_num_can_n': ('portafolio_totales', 'portafolio_aldia', 'portafolio_total_ahorros'),
+    'portafolio_num_can_p': ('portafolio_totales', 'portafolio_aldia', 'portafolio_total_ahorros', 'portafolio_positivas_ahorros'),
+    'Consultas_competencia_72h': ('nitSuscriptor',),
+    'buenas_carteras': ('cartera_codigo',),
+    'activos': ('cartera_codigo',),
+    'carteras_activas_pp': ('activos', 'cartera_codigo'),
+    'carteras_buenas_pp': ('buenas_carteras', 'cartera_codigo'),
+    'Telcos_trim1': ('trim_1_saldoMora',),
+    'Telcos_trim2': ('trim_2_saldoMora',),
+    'Telcos_trim3': ('trim_3_saldoMora',),
+    'variacion_mora_telcos': ('Telcos_trim1', 'Telcos_trim2', 'Telcos_trim3'),
+    'productos_saldo_total': ('tdc_saldo_actual', 'cartera_saldo_actual'),
+    'productos_mora_total': ('tdc_saldo_mora', 'cartera_saldo_mora'),
+    'fechaApertura_max': ('tdc_fechaApertura_reciente', 'cartera_fechaApertura_reciente', 'ahorros_fechaApertura_reciente'),
+    'Meses_apertura': ('fechaApertura_max', 'fechaConsulta'),
+    'Telcos_mora_trimestre_COM': ('COM_trim',),
+    'Telcos_mora_trimestre_CTC': ('CTC_trim',),
+    'Telcos_mora_trimestre_CDC': ('CDC_trim',),
+    'Telcos_mora_trimestre': ('Telcos_mora_trimestre_COM', 'Telcos_mora_trimestre_CTC', 'Telcos_mora_trimestre_CDC'),
+    'saldo_prom_mora_prod': ('agr_saldos_saldoTotalEnMora', 'agr_prinp_creditoVigentes'),
+    'ratio_cuota_saldo': ('agr_saldos_cuotaMensual', 'agr_saldos_saldoTotal'),
+}
+
+ETAPAS["capacidad_endeudamiento"] = {
+    'capacidad_endeudamiento': ('quanto', 'agr_saldos_cuotaMensual'),
+    'ratio_endeudamiento': ('capacidad_endeudamiento', 'quanto'),
+}
+
+ETAPAS["consultas_experian"] = {
+    'max_fecha_consulta': ('consulta_fecha',),
+    'Dias_ultimaconsul': ('max_fecha_consulta', 'fechaConsulta'),
+    'Dias_ultimo_producto': ('fechaConsulta', 'cartera_fechaApertura_reciente'),
+    'Consultas_entidad': ('consulta_fecha',),
+    'Consultas_SFI': ('consulta_SFI_cantidad',),
+    'Consultas_ult_mes': ('consulta_fecha', 'fechaConsulta'),
+}
+
+ETAPAS["tendencia"] = {'saldos_tri_tendencia': ('trimestre_1_saldo', 'trimestre_2_saldo', 'trimestre_3_saldo')}
+for _col in dict.fromkeys(list(PREPROC_TENDENCIA_COLS_REG) + list(PREPROC_TENDENCIA_COLS_NCLF)):
+    for _nombre in tendencias.nombres_features(_col):
+        ETAPAS["tendencia"][_nombre] = tuple(tendencias.nombres_series([_col]))
+
+# derivada -> (etapa, entradas)
+DERIVADAS = {nombre: (etapa, entradas) for etapa, salidas in ETAPAS.items() for nombre, entradas in salidas.items()}
+
+# seccion del XML -> campos que produce (nombres, patrones fnmatch o familias de
+# `familias_columnas.FAMILIAS`). Las subsecciones van como ruta bajo su seccion.
+SECCIONES = OrderedDict([
+    ('NaturalNacional', ('ciudad_exp', 'departamento_exp', 'genero_exp', 'region_exp')),
+    ('Score', ('puntaje_experian', 'razon_codigo_*')),
+    ('CuentaAhorro', ('ahorros_fechaApertura_reciente', 'Ctas_pCliente', 'Cuentas_sector1')),
+    ('CuentaCartera', ('fecha_max_vencimiento', 'cartera_fechaApertura_reciente', 'CC_TipoContrato_1', 'cc_tpobl_2_con')),
+    ('CuentaCartera/Valores', (
+        'Sector*', 'cuota', 'sector_cuota', 'sector_totalCuotas', 'sector_cuotasCanceladas',
+        'sector3_cuotasCanceladas', 'sector3_totalCuotas', 'sector4_cuota',
+    )),
+    ('CuentaCartera/Estados', ('Cartera_*', 'cartera_codigo')),
+    ('TarjetaCredito', ('tdc_fechaApertura_reciente',)),
+    ('Consulta', ('Consulta_*', 'consulta_fecha', 'consulta_SFI_cantidad', 'nitSuscriptor')),
+    ('productosValores', ('quanto', 'quanto_pct')),
+    ('InfoAgregada/Principales', ('agr_prinp_*',)),
+    ('InfoAgregada/Saldos', ('agr_saldos_*',)),
+    ('InfoAgregada/Saldos/Mes', ('saldoTotalMora_*', 'saldoTotal_*')),
+    ('InfoAgregada/Comportamiento', ('comportamiento_*', 'cantidad_*', 'estado_*')),
+    ('InfoAgregada/ComposicionPortafolio', (
+        'total_tipo_*', 'total_cantidad_*', '*_Activa_cantidad_*', '*_Al dia_cantidad_*',
+        'total_cantidad', 'activa_cantidad', 'aldia_cantidad',
+    )),
+    ('InfoAgregada/EvolucionDeuda', ('agr_analisisPromedio_*', 'trimestre_*')),
+    ('InfoAgregadaMicrocredito/PerfilGeneral', ('Cc_sectorTelcos', 'Cc_totalComoPrincipal')),
+    ('InfoAgregadaMicrocredito/EvolucionDeuda', (
+        '*_trim_*_saldoMora', 'trim_1_saldoMora', 'trim_2_saldoMora', 'trim_3_saldoMora', 'COM_trim', 'CTC_trim', 'CDC_trim',
+    )),
+    ('InfoAgregadaMicrocredito/VectorSaldosYMoras', (
+        'saldoDeudaTotalMora_*', 'saldoDeudaTotal_*', 'numCreditosMayorIgual60_*', 'totalCuentasMora_*', 'numCreditos30_*',
+    )),
+])
+
+# Campos que se leen fuera de los modelos (construir_dataframe_informe,
+# preprocesamiento, reglas de negocio): sus secciones se extraen siempre
+SIEMPRE = (
+    'fechaConsulta', 'ciudad_exp', 'departamento_exp', 'genero_exp', 'quanto',
+    'agr_prinp_antiguedadDesde', 'agr_saldos_cuotaMensual',
+)
+SIEMPRE_VARIANTE = {
+    # calcular_tendencia (Regular) selecciona los saldos trimestrales sin verificar que existan
+    "regular": ('trimestre_1_saldo', 'trimestre_2_saldo', 'trimestre_3_saldo'),
+}
+
+
+def produce(seccion, nombre):
+    """True si `nombre` es uno de los campos que declara `SECCIONES[seccion]`."""
+    return any(fnmatchcase(nombre, patron) for patron in SECCIONES[seccion])
+
+
+def features_modelo(modelo):
+    """`(features, usadas)` de un modelo: todas las que recibe y las que tienen algun split.
+
+    Sin booster de LightGBM se toman todas como usadas.
+    """
+    features = list(getattr(modelo, "feature_name_", None) or getattr(modelo, "feature_names_in_", []))
+    booster = getattr(modelo, "booster_", None)
+    if booster is None:
+        return features, set(features)
+    splits = booster.feature_importance(importance_type="split")
+    return features, {f for f, k in zip(booster.feature_name(), splits) if k > 0}
+
+
+class PlanFeatures:
+    """Variables derivadas que necesitan los modelos de un motor (ver el modulo)."""
+
+    def __init__(self, nombre, pares, secciones=PLAN_FEATURES_SECCIONES):
+        """`pares` es la lista de `(modelo, scaler)` del motor (`scaler` puede ser `None`).
+
+        Con `secciones=False` no se omite ninguna seccion del XML.
+        """
+        esquema, usadas = {}, set()
+        for modelo, scaler in pares:
+            if scaler is not None:
+                esquema.update(dict.fromkeys(scaler.feature_names_in_))
+            features, con_split = features_modelo(modelo)
+            esquema.update(dict.fromkeys(features))
+            usadas |= con_split
+        necesarias = set()
+        pendientes = [f for f in usadas if f in DERIVADAS]
+        while pendientes:
+            f = pendientes.pop()
+            if f in necesarias:
+                continue
+            necesarias.add(f)
+            pendientes.extend(e for e in DERIVADAS[f][1] if e in DERIVADAS)
+        self.nombre = nombre
+        self.esquema = list(esquema)
+        self.usadas = frozenset(usadas)
+        self.necesarias = frozenset(necesarias)
+        self.omitidas = frozenset(set(DERIVADAS) - necesarias)
+        requeridos = usadas | set(self.entradas()) | set(SIEMPRE) | set(SIEMPRE_VARIANTE.get(nombre, ()))
+        omitir = {seccion for seccion in SECCIONES if not any(produce(seccion, f) for f in requeridos)} if secciones else set()
+        for seccion in SECCIONES:
+            if seccion not in omitir:
+                # Para llegar a una subseccion hay que recorrer su seccion
+                partes = seccion.split('/')
+                omitir -= {'/'.join(partes[:k]) for k in range(1, len(partes))}
+        self.secciones_omitidas = frozenset(omitir)
+        # Columnas del esquema que el plan deja sin calcular o sin extraer: se completan con NaN
+        self.rellenar = [
+            f for f in self.esquema
+            if f in self.omitidas or any(produce(seccion, f) for seccion in self.secciones_omitidas)
+        ]
+        omitido = sorted(self.omitidas) + sorted(self.secciones_omitidas)
+        self.firma = hashlib.sha1("|".join(omitido).encode()).hexdigest()[:12]
+
+    def calcular(self, nombre):
+        """True si la variable se calcula: no es derivada o el plan la necesita."""
+        return nombre not in self.omitidas
+
+    def filtrar(self, columnas):
+        """`columnas` (dict ordenado `nombre -> valores`) sin las derivadas omitidas."""
+        return {nombre: v for nombre, v in columnas.items() if nombre not in self.omitidas}
+
+    def completar(self, df):
+        """Agrega como NaN las columnas del esquema que el plan omitio (DataFrame), con un solo `reindex`."""
+        return ConstructorFeatures(df).completar(self.rellenar, np.nan).construir()
+
+    def completar_registro(self, registro):
+        """`completar` sobre el registro de la ruta escalar."""
+        for f in self.rellenar:
+            registro.setdefault(f, np.nan)
+        return registro
+
+    def entradas(self):
+        """Entradas (columnas del informe o familias) de las derivadas necesarias que no son derivadas."""
+        return sorted({e for f in self.necesarias for e in DERIVADAS[f][1] if e not in DERIVADAS})
+
+    def resumen(self):
+        """Lineas del plan por etapa: derivadas que se calculan y las que se omiten."""
+        lineas = [
+            f"[plan] {self.nombre}: esquema={len(self.esquema)} usadas={len(self.usadas)} "
+            f"derivadas={len(self.necesarias)}/{len(DERIVADAS)} entradas={len(self.entradas())} firma={self.firma}"
+        ]
+        for etapa, salidas in ETAPAS.items():
+            omitidas = [f for f in salidas if f in self.omitidas]
+            detalle = f" | omitidas: {', '.join(omitidas)}" if omitidas and etapa != "tendencia" else ""
+            lineas.append(f"[plan] {self.nombre}: {etapa} calcula {len(salidas) - len(omitidas)}/{len(salidas)}{detalle}")
+        secciones = [s for s in SECCIONES if s in self.secciones_omitidas]
+        detalle = f" | omitidas: {', '.join(secciones)}" if secciones else ""
+        lineas.append(f"[plan] {self.nombre}: secciones XML {len(SECCIONES) - len(secciones)}/{len(SECCIONES)}{detalle}")
+        return lineas
+
+    def registrar(self):
+        for linea in self.resumen():
+            logging.info(linea)
+        return self
+
+
+def plan_motor(nombre, pares, habilitado=True):
+    """Plan del motor (ya registrado en el log) o `None` si esta deshabilitado."""
+    if not habilitado:
+        logging.info("[plan] %s: deshabilitado, se calculan todas las variables", nombre)
+        return None
+    return PlanFeatures(nombre, pares).registrar()
+
+
+def _todas(nombre):
+    return True
+
+
+def calculador(plan):
+    """`plan.calcular`, o una funcion que calcula todo si no hay plan."""
+    return plan.calcular if plan is not None else _todas
+
+
+def secciones_omitidas(plan):
+    """Secciones del XML que la extraccion se salta (ninguna si no hay plan)."""
+    return plan.secciones_omitidas if plan is not None else frozenset()
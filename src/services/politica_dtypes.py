@@ -0,0 +1,214 @@
+"""Politica de dtypes compactos para los DataFrames extraidos y preprocesados.
+
+El pipeline deja las features en float64/int64 y los textos en object, que es
+lo que leen el scaler y los modelos. Lo que se guarda o se acumula por lotes
+(la extraccion masiva a Parquet, los reportes de memoria) puede ocupar mucho
+menos. La politica se declara en config.yaml (`dtypes`) con patrones de
+columna por tipo compacto:
+
+- `fecha`: textos de fecha a datetime64, con un solo `pd.to_datetime` para
+  todo el bloque de columnas. pandas no tiene resolucion de dia
+  (datetime64[D]): quedan en datetime64[ns], que ocupa 8 bytes.
+- `categoria`: estados de comportamiento y textos repetidos a `category`. Si
+  ya son codigos numericos, pasan a int8.
+- `int8`/`int16`/`int32`: conteos, indicadores y meses. Solo se reducen si
+  todos los valores son enteros y caben; con nulos se usa el entero nullable
+  de pandas.
+- `float32`: ratios que los modelos toleran (ver `verificar_politica`).
+
+Gana la primera regla que coincide, en ese orden. Una columna que no cumple su
+regla queda como estaba.
+
+La politica se aplica a lo que se guarda: el Parquet de la extraccion masiva
+(cuyo esquema fija `extraccion_masiva.tipos_parquet`) y los reportes. La
+prediccion, en linea y por lote (`predecir_lote`), no pasa por aqui: el
+pipeline compilado arma la matriz float64 del scaler directamente de las
+features, asi que compactar antes solo agregaria una conversion de ida y
+vuelta por lote, y los ratios en float32 dejarian de dar las mismas
+probabilidades bit a bit.
+
+`reporte_memoria` mide los bytes por fila de cada etapa antes y despues de
+compactar.
+"""
+import logging
+from fnmatch import fnmatchcase
+
+import numpy as np
+import pandas as pd
+
+from src.config.config import DTYPES_POLITICA
+from src.models.feature_utils import escalar_minmax, frame_modelo, matriz_scaler, probabilidad
+
+FECHA = "fecha"
+CATEGORIA = "categoria"
+FLOAT32 = "float32"
+ENTEROS = {"int8": np.int8, "int16": np.int16, "int32": np.int32}
+ORDEN = (FECHA, CATEGORIA, "int8", "int16", "int32", FLOAT32)
+
+M8_NS = np.dtype("datetime64[ns]")
+
+
+def reducir(valores, tipo):
+    """`valores` (arreglo numerico) en el dtype de `tipo`: `(arreglo, nulos)` o `None`.
+
+    `nulos` es la mascara de NaN de una columna entera que los tiene (o
+    `None`). Devuelve `None` si el tipo no es numerico o si algun valor no es
+    entero o no cabe.
+    """
+    if tipo == FLOAT32:
+        return (valores.astype(np.float32), None) if valores.dtype == np.float64 else None
+    dtype = np.int8 if tipo == CATEGORIA else ENTEROS.get(tipo)
+    if dtype is None or valores.dtype.kind not in "iuf":
+        return None
+    nulos = np.isnan(valores) if valores.dtype.kind == "f" else np.zeros(len(valores), dtype=bool)
+    validos = valores[~nulos]
+    if validos.size:
+        info = np.iinfo(dtype)
+        if validos.min() < info.min or validos.max() > info.max:
+            return None
+        if valores.dtype.kind == "f" and not np.array_equal(validos, np.trunc(validos)):
+            return None
+    enteros = np.where(nulos, 0, valores).astype(dtype)
+    return enteros, (nulos if nulos.any() else None)
+
+
+class PoliticaDtypes:
+    """Reglas `tipo -> patrones` con el tipo de cada columna memorizado."""
+
+    __slots__ = ("reglas", "_tipos")
+
+    def __init__(self, reglas):
+        self.reglas = tuple((tipo, tuple(reglas.get(tipo, ()))) for tipo in ORDEN)
+        self._tipos = {}
+
+    @classmethod
+    def desde_config(cls):
+        return cls(DTYPES_POLITICA)
+
+    def tipo(self, nombre):
+        """Tipo declarado para la columna `nombre` (`None` si ninguna regla coincide)."""
+        tipo = self._tipos.get(nombre, False)
+        if tipo is False:
+            nombre_texto = str(nombre)
+            tipo = next(
+                (t for t, patrones in self.reglas if any(fnmatchcase(nombre_texto, p) for p in patrones)),
+                None,
+            )
+            self._tipos[nombre] = tipo
+        return tipo
+
+    def compactar(self, df):
+        """DataFrame nuevo con la politica aplicada; `df` no se modifica."""
+        if not df.columns.is_unique:
+            logging.warning("[dtypes] columnas repetidas: no se compacta")
+            return df.copy()
+        columnas = {}
+        fechas = []
+        for nombre, serie in df.items():
+            tipo = self.tipo(nombre)
+            if tipo == FECHA:
+                fechas.append(nombre)
+            elif tipo is not None:
+                columnas[nombre] = _compactar_serie(serie, tipo)
+        if fechas:
+            columnas.update(_fechas(df, fechas))
+        return pd.DataFrame({nombre: columnas.get(nombre, df[nombre]) for nombre in df.columns}, index=df.index)
+
+
+def _compactar_serie(serie, tipo):
+    if tipo == CATEGORIA and serie.dtype == object:
+        return serie.astype("category")
+    if serie.dtype.kind not in "iuf":
+        return serie
+    reducida = reducir(serie.to_numpy(), tipo)
+    if reducida is None:
+        return serie
+    valores, nulos = reducida
+    if nulos is not None:
+        valores = pd.arrays.IntegerArray(valores, nulos)
+    return pd.Series(valores, index=serie.index, name=serie.name)
+
+
+def _fechas(df, nombres):
+    """Columnas de texto de `nombres` a datetime64 con un solo `pd.to_datetime`.
+
+    El formato se infiere sobre todo el bloque; una columna con textos que el
+    formato comun no reconoce se convierte sola y, si aun asi pierde valores,
+    queda como texto.
+    """
+    textos = [n for n in nombres if df[n].dtype == object]
+    if not textos:
+        return {}
+    n = len(df)
+    originales = df[textos].to_numpy()
+    convertidas = pd.to_datetime(pd.Series(originales.ravel(order="F"), dtype=object), errors="coerce")
+    if convertidas.dtype != M8_NS:
+        convertidas = None
+    resultado = {}
+    for j, nombre in enumerate(textos):
+        columna = originales[:, j]
+        con_valor = pd.notna(columna) & (columna != "")
+        valores = convertidas.to_numpy()[j * n:(j + 1) * n] if convertidas is not None else None
+        if valores is None or np.isnat(valores[con_valor]).any():
+            sola = pd.to_datetime(df[nombre], errors="coerce")
+            if sola.dtype != M8_NS or np.isnat(sola.to_numpy()[con_valor]).any():
+                continue
+            valores = sola.to_numpy()
+        resultado[nombre] = pd.Series(valores, index=df.index, name=nombre)
+    return resultado
+
+
+def bytes_por_fila(df):
+    """Memoria de `df` (con textos, sin indice) dividida por sus filas."""
+    return float(df.memory_usage(index=False, deep=True).sum()) / max(len(df), 1)
+
+
+def reporte_memoria(etapas, politica=None):
+    """Bytes por fila de cada etapa antes y despues de compactar.
+
+    `etapas` es un dict ordenado `etapa -> DataFrame` (p.e. las filas de un
+    lote concatenadas tras cada paso del pipeline). Devuelve una lista de
+    dicts y registra una linea `[dtypes]` por etapa.
+    """
+    politica = politica or POLITICA
+    filas = []
+    for nombre, df in etapas.items():
+        antes = bytes_por_fila(df)
+        despues = bytes_por_fila(politica.compactar(df))
+        filas.append({
+            "etapa": nombre,
+            "filas": len(df),
+            "columnas": len(df.columns),
+            "bytes_fila_antes": round(antes, 1),
+            "bytes_fila_despues": round(despues, 1),
+            "reduccion": round(1 - despues / antes, 3) if antes else 0.0,
+        })
+        logging.info(
+            "[dtypes] etapa=%s filas=%d columnas=%d bytes/fila %.0f -> %.0f (%.0f%%)",
+            nombre, len(df), len(df.columns), antes, despues, 100 * filas[-1]["reduccion"],
+        )
+    return filas
+
+
+def verificar_politica(df, modelos, politica=None):
+    """Diferencia maxima de probabilidad de cada modelo entre `df` y su version compactada.
+
+    `modelos` es una lista de `(nombre, modelo, scaler)`. La version compacta se
+    vuelve a float64 antes de escalar, como la leeria quien consume el Parquet.
+    Devuelve `{nombre: max |p - p_compacta|}`.
+    """
+    politica = politica or POLITICA
+    compacto = politica.compactar(df)
+    diferencias = {}
+    for nombre, modelo, scaler in modelos:
+        p = [
+            probabilidad(modelo, frame_modelo(d, escalar_minmax(matriz_scaler(d, scaler), scaler), scaler, modelo.feature_name_)
+                         .to_numpy(dtype=np.float64, na_value=np.nan))
+            for d in (df, compacto)
+        ]
+        diferencias[nombre] = float(np.nanmax(np.abs(p[0] - p[1]))) if len(df) else 0.0
+    logging.info("[dtypes] verificar_politica: %s", diferencias)
+    return diferencias
+
+
+POLITICA = PoliticaDtypes.desde_config()
@@ -0,0 +1,264 @@
+"""Nucleos vectorizados del post-procesamiento Experian.
+
+`procesar_cuotas_y_amortizacion` y `procesar_consultas_experian` (Regular y
+NCL) trabajan sobre familias de columnas: conteos de no vacios, sumas por fila,
+`isin`, maximos de fechas y diferencias en dias. Aqui cada familia se convierte
+una sola vez en un bloque NumPy `(n_filas, n_columnas)` y las variables se
+calculan con operaciones de arreglo, para 1 o N filas.
+
+Los nucleos replican la semantica de pandas que usan las versiones de
+referencia, incluido el dtype del resultado (familia vacia -> float64 0.0,
+familia entera -> int64) y el layout con que `nansum` recorre el bloque, para
+que el resultado sea identico bit a bit. Cuando la entrada se sale del caso
+soportado (columnas de texto, fechas con zona horaria, familias de fechas
+vacias) se devuelve `None` y el llamador usa la version de referencia.
+
+`verificar_postproceso` compara ambas rutas sobre un corpus de XML.
+"""
+import logging
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+NAT = np.iinfo(np.int64).min
+NS_DIA = 86_400_000_000_000
+M8_NS = np.dtype('M8[ns]')
+
+ENTIDADES_COMPETENCIA = [901344787.0, 901258467.0, 901308756.0, 901279350.0, 901310399.0]
+CODIGOS_BUENAS = [1.0, 3.0]
+CODIGOS_ACTIVAS = [1.0, 2.0]
+
+
+class BloqueFamilias:
+    """Familias numericas de un DataFrame en un solo bloque float64.
+
+    Las posiciones de todas las familias se concatenan y se toman con un solo
+    `iloc`; cada familia queda como una rebanada contigua (F-order, igual que
+    `df[cols].values`). `desde` devuelve `None` si alguna columna no es
+    numerica y hay que usar la ruta de referencia.
+    """
+
+    def __init__(self, valores, rangos, kinds):
+        self.valores = valores
+        self.rangos = rangos
+        self.kinds = kinds
+
+    @classmethod
+    def desde(cls, df, idx, familias):
+        posiciones = [idx.pos(f) for f in familias]
+        todas = np.concatenate(posiciones) if posiciones else np.empty(0, dtype=np.intp)
+        kinds = np.array([dt.kind for dt in df.dtypes.to_numpy()[todas]], dtype='<U1')
+        if not np.isin(kinds, ['i', 'f']).all():
+            return None
+        valores = df.iloc[:, todas].to_numpy(dtype=np.float64) if len(todas) else np.empty((len(df), 0))
+        if (np.abs(valores[:, kinds == 'i']) >= 2 ** 53).any():
+            # Enteros que float64 no representa exactamente
+            return None
+        rangos, inicio = {}, 0
+        for familia, pos in zip(familias, posiciones):
+            rangos[familia] = (inicio, inicio + len(pos))
+            inicio += len(pos)
+        return cls(valores, rangos, kinds)
+
+    def _rango(self, familias):
+        if isinstance(familias, str):
+            familias = (familias,)
+        return self.rangos[familias[0]][0], self.rangos[familias[-1]][1]
+
+    def __getitem__(self, familias):
+        """Bloque de una familia, o de varias consecutivas (p.e. activas + al dia)."""
+        inicio, fin = self._rango(familias)
+        return np.asfortranarray(self.valores[:, inicio:fin])
+
+    def entera(self, familias):
+        """True si `df[cols]` de la familia seria int64 (todas las columnas enteras)."""
+        inicio, fin = self._rango(familias)
+        return fin > inicio and bool((self.kinds[inicio:fin] == 'i').all())
+
+
+def nansum_filas(valores, entera=False):
+    """`DataFrame.sum(axis=1)`: NaN como 0, vacia -> float64 0.0, entera -> int64."""
+    if valores.shape[1] == 0:
+        return np.zeros(valores.shape[0])
+    if entera:
+        return valores.astype(np.int64).sum(axis=1)
+    mascara = np.isnan(valores)
+    if mascara.any():
+        # nanops copia (en orden C) antes de rellenar: mismo orden de suma
+        valores = valores.copy()
+        np.putmask(valores, mascara, 0)
+    return valores.sum(axis=1)
+
+
+def conteo_filas(valores):
+    """`DataFrame.count(axis=1)`: siempre int64."""
+    return (~np.isnan(valores)).sum(axis=1)
+
+
+def conteo_mascara(mascara):
+    """`mascara.sum(axis=1)` de un DataFrame booleano: vacia -> float64 0.0."""
+    if mascara.shape[1] == 0:
+        return np.zeros(mascara.shape[0])
+    return mascara.sum(axis=1)
+
+
+def dividir(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.true_divide(a, b)
+
+
+def sin_infinitos(valores):
+    return np.where(np.isinf(valores), np.nan, valores)
+
+
+def numerico(serie):
+    """`pd.to_numeric(serie, errors='coerce')` sin costo si ya es numerica."""
+    if serie.dtype.kind in 'if':
+        return serie.to_numpy()
+    return pd.to_numeric(serie, errors='coerce').to_numpy()
+
+
+@lru_cache(maxsize=8192)
+def _fecha_texto(texto):
+    """Conversion de un texto suelto, igual que `pd.to_datetime` sobre una columna de 1 fila."""
+    convertida = pd.to_datetime(pd.Series([texto], dtype=object), errors='coerce')
+    if convertida.dtype != M8_NS:
+        return None
+    return int(convertida.to_numpy().view(np.int64)[0])
+
+
+def fechas_ns(df, nombres):
+    """Columnas convertidas con `pd.to_datetime(errors='coerce')` como bloque int64 (ns, NaT=min).
+
+    Con una sola fila los textos se convierten uno a uno con memoria (misma
+    inferencia de formato que la columna de 1 elemento); con N filas se
+    convierte columna por columna como la referencia. `None` si alguna columna
+    no resulta datetime64[ns] sin zona horaria.
+    """
+    n = len(df)
+    bloque = np.empty((n, len(nombres)), dtype=np.int64)
+    for j, nombre in enumerate(nombres):
+        serie = df[nombre]
+        if serie.dtype == M8_NS:
+            bloque[:, j] = serie.to_numpy().view(np.int64)
+            continue
+        if n == 1 and serie.dtype == object and isinstance(serie.iat[0], str):
+            valor = _fecha_texto(serie.iat[0])
+            if valor is None:
+                return None
+            bloque[0, j] = valor
+            continue
+        convertida = pd.to_datetime(serie, errors='coerce')
+        if convertida.dtype != M8_NS:
+            return None
+        bloque[:, j] = convertida.to_numpy().view(np.int64)
+    return bloque
+
+
+def como_fecha(valores_ns):
+    return valores_ns.view(M8_NS)
+
+
+def max_fechas(bloque):
+    """`DataFrame.max(axis=1)` de columnas datetime64[ns]: NaT solo si toda la fila es NaT."""
+    return bloque.max(axis=1) if bloque.shape[1] else np.full(bloque.shape[0], NAT)
+
+
+def dias(a_ns, b_ns):
+    """`(a - b).dt.days`: piso en dias; float64 con NaN si hay NaT, si no int64."""
+    nulos = (a_ns == NAT) | (b_ns == NAT)
+    diferencia = (np.where(nulos, 0, a_ns) - np.where(nulos, 0, b_ns)) // NS_DIA
+    if nulos.any():
+        return np.where(nulos, np.nan, diferencia.astype(np.float64))
+    return diferencia
+
+
+def entero_nulable(valores):
+    """`.astype('Int64')` de un resultado entero o float con NaN."""
+    if valores.dtype.kind == 'f':
+        nulos = np.isnan(valores)
+        return pd.arrays.IntegerArray(np.where(nulos, 0, valores).astype(np.int64), nulos)
+    return pd.arrays.IntegerArray(valores.astype(np.int64), np.zeros(len(valores), dtype=bool))
+
+
+def piso_dia(valores_ns):
+    """Fecha sin hora (`str(fecha)[:10]` convertido de vuelta); NaT se conserva."""
+    return np.where(valores_ns == NAT, NAT, valores_ns - valores_ns % NS_DIA)
+
+
+def menos_un_mes(valores_ns):
+    """`fecha - pd.DateOffset(months=1)` vectorizado."""
+    return (pd.DatetimeIndex(como_fecha(valores_ns)) - pd.DateOffset(months=1)).asi8
+
+
+def mayores(bloque_ns, umbral_ns):
+    """`df[fechas].gt(umbral, axis=0)`: comparaciones con NaT son False."""
+    validos = (bloque_ns != NAT) & (umbral_ns != NAT)[:, None]
+    return validos & (bloque_ns > umbral_ns[:, None])
+
+
+def asignar(df, columnas):
+    """Asigna `columnas` (dict ordenado) como lo harian los `df[c] = v` sucesivos.
+
+    Las existentes se reemplazan en su lugar (las float64 con un solo `.loc`,
+    las que cambian de dtype rearmando el DataFrame una sola vez); las nuevas
+    se agregan al final en un solo `concat`, en el orden del dict. El `concat`
+    no copia los bloques de `df`: el resultado los comparte y `df`
+    queda en manos del nuevo DataFrame (el llamador es dueno de `df` y ya no
+    lo usa).
+    """
+    nuevas, flotantes, otras = {}, {}, {}
+    tipos = df.dtypes
+    for nombre, valores in columnas.items():
+        if nombre not in df.columns:
+            nuevas[nombre] = valores
+        elif tipos[nombre] == np.float64 and getattr(valores, 'dtype', None) == np.float64:
+            flotantes[nombre] = valores
+        else:
+            otras[nombre] = valores
+    if flotantes:
+        # float64 sobre float64: se escriben en su lugar con un solo .loc en vez de
+        # reemplazar columna por columna (mismo resultado, sin reorganizar bloques)
+        df.loc[:, list(flotantes)] = np.column_stack([np.asarray(v) for v in flotantes.values()])
+    if len(otras) > 1 and df.columns.is_unique:
+        # Cambian de dtype: se rearma el DataFrame una vez (mismas posiciones) en
+        # lugar de partir los bloques de `df` con un reemplazo por columna
+        orden = df.columns
+        reemplazo = pd.DataFrame(otras, index=df.index)
+        df = pd.concat([df.drop(columns=list(otras)), reemplazo], axis=1, copy=False).reindex(columns=orden, copy=False)
+    else:
+        for nombre, valores in otras.items():
+            df[nombre] = valores
+    if not nuevas:
+        return df
+    if all(isinstance(v, np.ndarray) and v.dtype == np.float64 and v.ndim == 1 for v in nuevas.values()):
+        # Todas float64: un solo bloque en lugar de un arreglo por columna
+        bloque = pd.DataFrame(np.column_stack(list(nuevas.values())), columns=list(nuevas), index=df.index)
+    else:
+        bloque = pd.DataFrame(nuevas, index=df.index)
+    return pd.concat([df, bloque], axis=1, copy=False)
+
+
+def verificar_postproceso(procesar_informe, xmls, engines=("etree", "stream", "lxml")):
+    """Compara la ruta vectorizada con la de referencia sobre un corpus de XML.
+
+    `procesar_informe` es el de `extraccion_API` o `extraccion_API_NCL`. Exige
+    igualdad exacta (valores, NaN, dtypes y orden de columnas) y devuelve la
+    lista de `(i, engine, error)` que no coinciden.
+    """
+    diferencias = []
+    for i, xml in enumerate(xmls):
+        for engine in engines:
+            referencia = procesar_informe(xml, engine=engine, vectorizado=False)
+            vectorizado = procesar_informe(xml, engine=engine, vectorizado=True)
+            if not isinstance(referencia, pd.DataFrame) or not isinstance(vectorizado, pd.DataFrame):
+                if type(referencia) is not type(vectorizado):
+                    diferencias.append((i, engine, "solo una ruta devolvio DataFrame"))
+                continue
+            try:
+                pd.testing.assert_frame_equal(vectorizado, referencia, check_exact=True)
+            except AssertionError as e:
+                diferencias.append((i, engine, str(e)))
+    logging.info("[extract] verificar_postproceso: %d XML, %d diferencias", len(xmls), len(diferencias))
+    return diferencias
@@ -2,16 +2,17 @@
 import pandas as pd
 import numpy as np
 import logging
-import json
 from sklearn.linear_model import LinearRegression
 
-from src.utils.helpers import cargar_json
-from src.utils.helpers import cargar_modelo, cargar_json, cargar_config
+from src.services import tendencias
+from src.services import registro
+from src.services.constructor_features import ConstructorFeatures
+from src.services.normalizacion import NORMALIZACION
 from src.config.config import (
-    PREPROC_COMMON_ERR,
     PREPROC_COMP_MAP,
     PREPROC_COMP_COLUMNS_NCLF,
     PREPROC_TENDENCIA_COLS_NCLF,
+    PREPROC_TENDENCIA_VECTORIZADA,
     PREPROC_NULOS_NCLF,
     PREPROC_IMPUTAR_NCLF,
     Var_pct_IPC_3,
@@ -21,43 +22,17 @@ from src.config.config import (
     Var_TD3
 )
 
-common_err = PREPROC_COMMON_ERR
-
-# Cargar los mapeos desde archivos JSON
-departamentos_colombia = cargar_json(
-    "data/departamentos_colombia.json"
-)
-tipo_trabajo_mapping = cargar_json("data/tipo_trabajo_mapping.json")
-genero_mapping = cargar_json("data/genero_mapping.json")
+# Mapeos de la tabla de normalizacion compartida (cargada una vez por proceso)
+common_err = NORMALIZACION.errores
+departamentos_colombia = NORMALIZACION.departamentos
+tipo_trabajo_mapping = NORMALIZACION.tipo_trabajo_mapping
+genero_mapping = NORMALIZACION.genero_mapping
 
 
 def calcular_variables_cliente(datos_cliente):
     logging.info("[preprocess_NCL] calcular_variables_cliente: start | type=%s", type(datos_cliente).__name__)
-    if isinstance(datos_cliente, pd.DataFrame):
-        if datos_cliente.empty:
-            raise ValueError("datos_cliente DataFrame vacío")
-        datos_dict = datos_cliente.iloc[0].to_dict()
-    elif isinstance(datos_cliente, pd.Series):
-        datos_dict = datos_cliente.to_dict()
-    elif isinstance(datos_cliente, dict):
-        datos_dict = dict(datos_cliente)
-    else:
-        raise TypeError(f"Tipo no soportado para datos_cliente: {type(datos_cliente)}")
+    datos_dict = _variables_sociodemograficas(registro.registro_desde(datos_cliente))
 
-    tipo_trabajo_val = datos_dict.get("tipo_trabajo")
-    genero_val = datos_dict.get("genero")
-    if isinstance(tipo_trabajo_val, pd.Series):
-        tipo_trabajo_val = tipo_trabajo_val.iloc[0]
-    if isinstance(genero_val, pd.Series):
-        genero_val = genero_val.iloc[0]
-
-    datos_dict["tipo_trabajo"] = tipo_trabajo_mapping.get(tipo_trabajo_val, None)
-    datos_dict["genero_cliente"] = genero_mapping.get(genero_val, None)
-
-    datos_dict["edad_cliente"] = datos_dict.pop("edad_al_contratar", 0)
-    datos_dict["tipo_trabajo_cliente"] = datos_dict.pop("tipo_trabajo", 0)
-    datos_dict["puntaje_p6"] = datos_dict.get("p6", 0)
-    
     logging.info("[preprocess_NCL] calcular_variables_cliente: socio-demográfico OK")
 
     datos_cliente_df = pd.DataFrame([datos_dict])
@@ -68,19 +43,19 @@ def calcular_variables_cliente(datos_cliente):
         datos_cliente_df.departamento_exp = (
             datos_cliente_df.departamento_exp.str.lower().str.strip()
         )
+        datos_cliente_df["region_exp"] = datos_cliente_df["departamento_exp"].map(NORMALIZACION.region_por_valor)
         datos_cliente_df["departamento_exp"] = datos_cliente_df["departamento_exp"].replace(common_err)
-        datos_cliente_df["region_exp"] = datos_cliente_df["departamento_exp"].map(departamentos_colombia)
     else:
         datos_cliente_df["region_exp"] = -1
 
+    datos_cliente_df["region_nac"] = datos_cliente_df["dpto_nac"].map(NORMALIZACION.region_por_valor)
     datos_cliente_df["dpto_nac"] = datos_cliente_df["dpto_nac"].replace(common_err)
-    datos_cliente_df["region_nac"] = datos_cliente_df["dpto_nac"].map(departamentos_colombia)
 
+    datos_cliente_df["region_res"] = datos_cliente_df["departamento_actual"].map(NORMALIZACION.region_por_valor)
     datos_cliente_df["departamento_actual"] = datos_cliente_df["departamento_actual"].replace(common_err)
-    datos_cliente_df["region_res"] = datos_cliente_df["departamento_actual"].map(departamentos_colombia)
 
+    datos_cliente_df["region_ret"] = datos_cliente_df["constitucion_department_retailer"].map(NORMALIZACION.region_por_valor)
     datos_cliente_df["constitucion_department_retailer"] = datos_cliente_df["constitucion_department_retailer"].replace(common_err)
-    datos_cliente_df["region_ret"] = datos_cliente_df["constitucion_department_retailer"].map(departamentos_colombia)
     
     datos_cliente_df['Var_pct_IPC_3'] = Var_pct_IPC_3
     datos_cliente_df['Var_TRM_1'] = Var_TRM_1
@@ -98,6 +73,36 @@ def calcular_variables_cliente(datos_cliente):
 
     return datos_cliente_df
 
+
+def _variables_sociodemograficas(datos_dict):
+    """Variables iniciales sobre el dict del cliente (comunes a la ruta pandas y la escalar)."""
+    tipo_trabajo_val = datos_dict.get("tipo_trabajo")
+    genero_val = datos_dict.get("genero")
+    if isinstance(tipo_trabajo_val, pd.Series):
+        tipo_trabajo_val = tipo_trabajo_val.iloc[0]
+    if isinstance(genero_val, pd.Series):
+        genero_val = genero_val.iloc[0]
+
+    datos_dict["tipo_trabajo"] = tipo_trabajo_mapping.get(tipo_trabajo_val, None)
+    datos_dict["genero_cliente"] = genero_mapping.get(genero_val, None)
+
+    datos_dict["edad_cliente"] = datos_dict.pop("edad_al_contratar", 0)
+    datos_dict["tipo_trabajo_cliente"] = datos_dict.pop("tipo_trabajo", 0)
+    datos_dict["puntaje_p6"] = datos_dict.get("p6", 0)
+    return datos_dict
+
+
+def calcular_variables_cliente_registro(datos_cliente):
+    """Ruta escalar de `calcular_variables_cliente`: devuelve el registro (dict) o `None`."""
+    datos_dict = _variables_sociodemograficas(registro.registro_desde(datos_cliente))
+    if not registro.regiones(datos_dict, NORMALIZACION):
+        return None
+    datos_dict.update(
+        Var_pct_IPC_3=Var_pct_IPC_3, Var_TRM_1=Var_TRM_1, IBR_Var=IBR_Var, Var_TPM_1=Var_TPM_1, Var_TD3=Var_TD3
+    )
+    logging.info("[preprocess_NCL] calcular_variables_cliente (registro): end | cols=%d", len(datos_dict))
+    return datos_dict
+
 def preprocesscomportamiento(df):
     logging.info("Preprocesando comportamiento...")
     df = pd.DataFrame(df)
@@ -123,7 +128,42 @@ def preprocesscomportamiento(df):
 
     return df
 
-def calcular_tendencia(df):
+def calcular_tendencia(df, vectorizado=None, plan=None):
+    """Features de tendencia de los saldos trimestrales y de las series de 12 meses.
+
+    Con `vectorizado` (por defecto `PREPROC_TENDENCIA_VECTORIZADA`) todas las
+    series se resumen de una vez sobre un tensor NumPy (ver `tendencias`); si
+    la entrada no lo admite se usa la version de referencia. `df` se modifica
+    en su lugar. Con `plan` (ver `plan_features`) la version vectorizada omite
+    las features que no usan los modelos.
+    """
+    if PREPROC_TENDENCIA_VECTORIZADA if vectorizado is None else vectorizado:
+        resultado = _calcular_tendencia_vectorizado(df, plan)
+        if resultado is not None:
+            return resultado
+    return _calcular_tendencia_referencia(df)
+
+
+def _calcular_tendencia_vectorizado(df, plan=None):
+    tri_cols = ['trimestre_1_saldo', 'trimestre_2_saldo', 'trimestre_3_saldo']
+    leidas = tendencias.series_numericas(df, tri_cols, rellenar=False)
+    if leidas is None or not np.isfinite(leidas[0]).all():
+        # Sin fillna: un saldo nulo hace fallar LinearRegression en la referencia
+        return None
+    saldos = leidas[0]
+    columnas = {col: np.zeros(len(df), dtype=np.int64) for j, col in enumerate(tri_cols) if j in tendencias.faltantes(df, tri_cols)}
+    if plan is None or plan.calcular("saldos_tri_tendencia"):
+        columnas["saldos_tri_tendencia"] = tendencias.pendientes(saldos.T[None, :, :])[0]
+    features = tendencias.features_tendencia(df, PREPROC_TENDENCIA_COLS_NCLF, plan=plan)
+    if features is None:
+        return None
+    columnas.update(features)
+
+    logging.info("Calculando tendencia (vectorizado) | series=%d filas=%d", len(PREPROC_TENDENCIA_COLS_NCLF), len(df))
+    return _completar_columnas(df, columnas)
+
+
+def _calcular_tendencia_referencia(df):
     logging.info("Calculando tendencia...")
     
     def calcular_pendiente(row):
@@ -187,22 +227,71 @@ def calcular_tendencia(df):
 
     logging.info(f"Tendencia para {col} calculada exitosamente.")
 
-    logging.info(f"Verificando columnas")
-    lista_nulos = PREPROC_NULOS_NCLF
-    
-    for col in lista_nulos:
-        if col not in df.columns:
-            df[col] = np.nan  
+    return _completar_columnas(df)
 
-    lista_imputar =   PREPROC_IMPUTAR_NCLF
 
+def _completar_columnas(df, columnas=None):
+    """Agrega `columnas` (dict ordenado) y las listas `nulos`/`imputar` faltantes de una vez.
+
+    Ver `ConstructorFeatures`: equivale a los `df[c] = ...` sucesivos.
+    """
+    logging.info(f"Verificando columnas")
+    df = (
+        ConstructorFeatures(df)
+        .update(columnas or {})
+        .completar(PREPROC_NULOS_NCLF, np.nan)
+        .completar(PREPROC_IMPUTAR_NCLF, 0)
+        .construir()
+    )
 
-    for col in lista_imputar:
-        if col not in df.columns:
-            df[col] = 0
-  
     df['agr_prinp_antiguedadDesde'] = pd.to_datetime(df['agr_prinp_antiguedadDesde'])
     df['agr_prinp_antiguedadDesde'] = (df['fechaConsulta'] - df['agr_prinp_antiguedadDesde']).dt.days
     df.replace([np.inf, -np.inf], np.nan, inplace=True)
 
     return df
+
+
+def preprocesscomportamiento_registro(datos):
+    """Ruta escalar de `preprocesscomportamiento` sobre el registro: lo devuelve o `None`."""
+    for col in PREPROC_COMP_COLUMNS_NCLF:
+        if col not in datos:
+            datos[col] = 1
+        else:
+            estado = PREPROC_COMP_MAP.get(datos[col]) if isinstance(datos[col], str) else None
+            # map + fillna(1): sin estado la columna queda float
+            datos[col] = estado if estado is not None else 1.0
+    if not registro.moras_trimestre(datos):
+        return None
+    return datos
+
+
+def calcular_tendencia_registro(datos, plan=None):
+    """Ruta escalar de `calcular_tendencia` sobre el registro: lo devuelve o `None`."""
+    tri_cols = ['trimestre_1_saldo', 'trimestre_2_saldo', 'trimestre_3_saldo']
+    saldos = registro.serie(datos, tri_cols, rellenar=False)
+    if saldos is None or not np.isfinite(saldos).all():
+        return None
+    for col in tri_cols:
+        datos.setdefault(col, 0)
+    if plan is None or plan.calcular("saldos_tri_tendencia"):
+        datos["saldos_tri_tendencia"] = registro.pendiente_saldos(saldos)
+    if not registro.tendencia(datos, PREPROC_TENDENCIA_COLS_NCLF, plan=plan):
+        return None
+    if not registro.completar(datos, PREPROC_NULOS_NCLF, PREPROC_IMPUTAR_NCLF):
+        return None
+    return datos
+
+
+def preprocesar_registro(datos_cliente, plan=None):
+    """`calcular_variables_cliente` -> `preprocesscomportamiento` -> `calcular_tendencia` por la ruta escalar.
+
+    Devuelve el registro (dict) del cliente, o `None` si la entrada no la
+    admite y hay que usar la ruta pandas (ver `registro`). `datos_cliente` no
+    se modifica.
+    """
+    datos = calcular_variables_cliente_registro(datos_cliente)
+    if datos is not None:
+        datos = preprocesscomportamiento_registro(datos)
+    if datos is not None:
+        datos = calcular_tendencia_registro(datos, plan)
+    return datos
@@ -0,0 +1,321 @@
+"""Ruta escalar: una solicitud como dict en lugar de un DataFrame de una fila.
+
+En tiempo real cada solicitud es un solo cliente, pero `calcular_variables_cliente`,
+`preprocesscomportamiento`, `calcular_tendencia` y `normalize_and_select`
+trabajan sobre un DataFrame de una fila: cada `replace`, `map`, `concat` o
+insercion de columna paga decenas de microsegundos fijos. Aqui el cliente es
+un *registro* (`dict` nombre -> valor Python, como `df.iloc[0].to_dict()`) y
+las mismas reglas se aplican valor a valor; las features de tendencia salen del
+mismo nucleo NumPy que la ruta vectorizada (`tendencias.features_series`) y la
+normalizacion de un vector float64. Pandas queda para el trabajo por lotes.
+
+Cada paso reproduce lo que haria pandas con el dtype que tendria la columna de
+una fila (int64, float64, object, datetime64). Si un valor se sale de los casos
+soportados (tipos raros, textos que pandas convertiria o rechazaria, fechas con
+zona horaria) la funcion devuelve `None` y el motor usa la ruta pandas desde el
+DataFrame original, que la ruta escalar nunca modifica.
+
+`comparar_registro` y `verificar_registro` comparan ambas rutas en el
+preprocesamiento y `verificar_ruta_escalar` en las probabilidades de un motor.
+"""
+import copy
+import logging
+import math
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from src.services import tendencias
+from src.services.comportamiento import columnas_comportamiento
+
+NAT = np.iinfo(np.int64).min
+NS_DIA = 86_400_000_000_000
+MAX_ENTERO_EXACTO = 2 ** 53
+
+
+def registro_desde(datos_cliente):
+    """Registro a partir de lo que recibe `calcular_variables_cliente` (DataFrame, Series o dict)."""
+    if isinstance(datos_cliente, pd.DataFrame):
+        if datos_cliente.empty:
+            raise ValueError("datos_cliente DataFrame vacío")
+        return datos_cliente.iloc[0].to_dict()
+    if isinstance(datos_cliente, pd.Series):
+        return datos_cliente.to_dict()
+    if isinstance(datos_cliente, dict):
+        return dict(datos_cliente)
+    raise TypeError(f"Tipo no soportado para datos_cliente: {type(datos_cliente)}")
+
+
+def es_nan(valor):
+    return isinstance(valor, float) and math.isnan(valor)
+
+
+def es_numero(valor):
+    """True si la columna de una fila seria int64 o float64 (no bool)."""
+    return isinstance(valor, (int, float, np.integer, np.floating)) and not isinstance(valor, (bool, np.bool_))
+
+
+def texto(valor):
+    """`str(valor)` como lo deja `astype(str)` en la columna de una fila."""
+    return valor if isinstance(valor, str) else str(valor)
+
+
+def departamento_exp(registro):
+    """`departamento_exp` como lo deja `calcular_variables_cliente`; `None` si no es texto.
+
+    Nulo -> `dpto_nac`; ciudad `BOGOTA D.C.` -> `bogota`; luego `.str.lower().str.strip()`,
+    que pandas solo admite sobre texto.
+    """
+    dpto_nac = registro["dpto_nac"]
+    ciudad = registro["ciudad_exp"]
+    valor = registro["departamento_exp"]
+    if valor is None or es_nan(valor):
+        valor = dpto_nac
+    if isinstance(ciudad, str):
+        if ciudad == 'BOGOTA D.C.':
+            valor = 'bogota'
+    elif not (ciudad is None or es_nan(ciudad) or es_numero(ciudad)):
+        return None
+    if not isinstance(valor, str):
+        return None
+    return valor.lower().strip()
+
+
+def regiones(registro, tabla):
+    """Reemplazos de departamento y regiones de `calcular_variables_cliente` (Regular y NCL).
+
+    `tabla` es la `TablaNormalizacion` compartida. Modifica `registro`;
+    devuelve `False` si hay que usar la ruta pandas.
+    """
+    if 'departamento_exp' in registro:
+        valor = departamento_exp(registro)
+        if valor is None:
+            return False
+        registro["departamento_exp"] = tabla.departamento(valor)
+        registro["region_exp"] = tabla.region(valor)
+    else:
+        registro["region_exp"] = -1
+    for columna, region in (
+        ("dpto_nac", "region_nac"),
+        ("departamento_actual", "region_res"),
+        ("constitucion_department_retailer", "region_ret"),
+    ):
+        valor = registro[columna]
+        registro[columna] = tabla.departamento(valor)
+        registro[region] = tabla.region(valor)
+    return True
+
+
+def estados_comportamiento(registro, codificador, mapa):
+    """Mapeo y conteos `estado_*.0` de `preprocesscomportamiento` (Regular) sobre el registro.
+
+    Mismo esquema que la ruta vectorizada: una columna por estado del mapa.
+    Devuelve `False` si hay que usar la ruta pandas.
+    """
+    mapeadas, comport = columnas_comportamiento(registro)
+    if not comport or codificador.tabla is None:
+        return False
+    for columna in mapeadas:
+        registro[columna] = mapa.get(texto(registro[columna]), np.nan)
+    valores = [registro[columna] for columna in comport]
+    flotante = any(es_nan(v) for v in valores)
+    nombres = codificador.nombres_conteos(flotante)
+    if any(nombre in registro for nombre in nombres):
+        return False
+    for estado, nombre in zip(codificador.estados.tolist(), nombres):
+        registro[nombre] = float(sum(1 for v in valores if v == estado))
+    return True
+
+
+def moras_trimestre(registro):
+    """`astype(str).str.replace('M ', '').astype(float)` de `trimestre_i_moraMaxima`."""
+    columnas = [f'trimestre_{i}_moraMaxima' for i in [1, 2, 3]]
+    if not all(columna in registro for columna in columnas):
+        return True
+    try:
+        convertidas = [float(texto(registro[columna]).replace('M ', '')) for columna in columnas]
+    except (TypeError, ValueError):
+        return False
+    registro.update(zip(columnas, convertidas))
+    return True
+
+
+def serie(registro, nombres, rellenar=True, faltante=0.0):
+    """Bloque float64 `(1, len(nombres))` como `tendencias.series_numericas`.
+
+    `None` si algun valor no es int/float o es un entero que float64 no
+    representa. Con `rellenar` los NaN pasan a 0.
+    """
+    fila = []
+    for nombre in nombres:
+        valor = registro.get(nombre, faltante)
+        if not es_numero(valor):
+            return None
+        if isinstance(valor, (int, np.integer)) and abs(valor) >= MAX_ENTERO_EXACTO:
+            return None
+        fila.append(float(valor))
+    valores = np.array([fila], dtype=np.float64)
+    if rellenar:
+        valores[np.isnan(valores)] = 0.0
+    return valores
+
+
+def tendencia(registro, columnas, meses=12, plan=None):
+    """Features de tendencia de las series de `columnas` (mismo nucleo que la ruta vectorizada).
+
+    Agrega al registro los meses faltantes (0.0), los meses como float y las
+    features (con `plan`, solo las necesarias). Devuelve `False` si hay que
+    usar la ruta pandas.
+    """
+    nombres = tendencias.nombres_series(columnas, meses)
+    valores = serie(registro, nombres)
+    if valores is None:
+        return False
+    sin_columna = [j for j, nombre in enumerate(nombres) if nombre not in registro]
+    features = tendencias.features_series(
+        valores, columnas, meses, sin_columna=sin_columna, cambios=range(len(nombres)), plan=plan
+    )
+    if features is None:
+        return False
+    registro.update((nombre, v[0].item()) for nombre, v in features.items())
+    return True
+
+
+def pendiente_saldos(saldos):
+    """`saldos_tri_tendencia` de un bloque `(1, 3)`, igual que la ruta vectorizada."""
+    return tendencias.pendientes(saldos.T[None, :, :])[0][0].item()
+
+
+@lru_cache(maxsize=8192)
+def _fecha_texto(valor):
+    convertida = pd.to_datetime(pd.Series([valor], dtype=object))
+    if convertida.dtype != np.dtype('M8[ns]'):
+        return None
+    return int(convertida.to_numpy().view(np.int64)[0])
+
+
+def fecha_ns(valor):
+    """`pd.to_datetime` de la columna de una fila en ns (`NAT` si es nula); `None` si no se admite."""
+    if valor is pd.NaT or valor is None or es_nan(valor):
+        return NAT
+    if isinstance(valor, pd.Timestamp):
+        return None if valor.tz is not None else valor.value
+    if isinstance(valor, str):
+        try:
+            return _fecha_texto(valor)
+        except (TypeError, ValueError, OverflowError):
+            return None
+    return None
+
+
+def completar(registro, nulos, imputar):
+    """Cierre de `calcular_tendencia`: columnas faltantes, antiguedad en dias e infinitos -> NaN.
+
+    Devuelve `False` si hay que usar la ruta pandas.
+    """
+    for columna in nulos:
+        registro.setdefault(columna, np.nan)
+    for columna in imputar:
+        registro.setdefault(columna, 0)
+    desde = fecha_ns(registro['agr_prinp_antiguedadDesde'])
+    consulta = registro['fechaConsulta']
+    if desde is None or not (consulta is pd.NaT or isinstance(consulta, pd.Timestamp)) or consulta.tz is not None:
+        return False
+    consulta = NAT if consulta is pd.NaT else consulta.value
+    if desde == NAT or consulta == NAT:
+        registro['agr_prinp_antiguedadDesde'] = np.nan
+    else:
+        registro['agr_prinp_antiguedadDesde'] = (consulta - desde) // NS_DIA
+    for nombre, valor in registro.items():
+        if isinstance(valor, float) and math.isinf(valor):
+            registro[nombre] = np.nan
+    return True
+
+
+def _iguales(a, b):
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    if a is pd.NaT or b is pd.NaT:
+        return a is b
+    try:
+        return bool(a == b) and (not es_numero(a) or es_numero(b))
+    except (TypeError, ValueError):
+        return False
+
+
+def comparar_registro(registro, df):
+    """Columnas de `df` (una fila, ruta pandas) cuyo valor no coincide con el registro."""
+    fila = df.iloc[0].to_dict()
+    distintas = [c for c in fila if c not in registro or not _iguales(registro[c], fila[c])]
+    distintas += [c for c in registro if c not in fila]
+    return distintas
+
+
+def verificar_registro(preprocesar, preprocesar_registro, dfs):
+    """Compara el preprocesamiento escalar con el de pandas sobre `dfs` (DataFrames de una fila).
+
+    `preprocesar(df)` es la cadena pandas y `preprocesar_registro(df)` la
+    escalar, p.e. `preprocess.preprocesar_registro`. Cada ruta recibe su
+    propia copia; los casos en que la ruta escalar devuelve `None` no cuentan
+    como diferencia. Devuelve la lista de `(i, error)`.
+    """
+    diferencias = []
+    escalares = 0
+    for i, df in enumerate(dfs):
+        try:
+            referencia = preprocesar(df.copy())
+        except Exception as e:
+            referencia = e
+        try:
+            registro = preprocesar_registro(df.copy())
+        except Exception as e:
+            registro = e
+        if registro is None:
+            continue
+        escalares += 1
+        if isinstance(referencia, Exception) or isinstance(registro, Exception):
+            if type(referencia) is not type(registro):
+                diferencias.append((i, f"pandas={referencia!r} escalar={registro!r}"))
+            continue
+        distintas = comparar_registro(registro, referencia)
+        if distintas:
+            diferencias.append((i, f"columnas distintas: {distintas[:20]}"))
+    logging.info(
+        "[preprocess] verificar_registro: %d DataFrames, %d por la ruta escalar, %d diferencias",
+        len(dfs), escalares, len(diferencias),
+    )
+    return diferencias
+
+
+def _copia(valor):
+    return valor.copy() if isinstance(valor, pd.DataFrame) else copy.deepcopy(valor)
+
+
+def verificar_ruta_escalar(motor, entradas):
+    """Compara `motor.calcular_probabilidades` por la ruta escalar y por la ruta pandas.
+
+    Cada elemento de `entradas` es la tupla de argumentos de
+    `calcular_probabilidades` (p.e. `(df,)` en Regular, `(df, tid)` en NCL,
+    `(datos_cliente, tid)` en Respaldo); cada ruta recibe su propia copia.
+    Exige probabilidades identicas bit a bit. Devuelve la lista de `(i, error)`.
+    """
+    diferencias = []
+    for i, argumentos in enumerate(entradas):
+        resultados = []
+        for escalar in (False, True):
+            try:
+                resultados.append(motor.calcular_probabilidades(*map(_copia, argumentos), escalar=escalar))
+            except Exception as e:
+                resultados.append(e)
+        pandas_, escalar_ = resultados
+        if isinstance(pandas_, Exception) or isinstance(escalar_, Exception):
+            if type(pandas_) is not type(escalar_):
+                diferencias.append((i, f"pandas={pandas_!r} escalar={escalar_!r}"))
+            continue
+        for nombre, a, b in zip(("H", "FPD"), pandas_, escalar_):
+            a, b = np.asarray(a), np.asarray(b)
+            if a.shape != b.shape or a.tobytes() != b.tobytes():
+                diferencias.append((i, f"{nombre}: pandas={a!r} escalar={b!r}"))
+    logging.info("[motor] verificar_ruta_escalar: %d entradas, %d diferencias", len(entradas), len(diferencias))
+    return diferencias
@@ -0,0 +1,394 @@
+"""Registro versionado de juegos de modelos, con cambio en caliente y reversion.
+
+Un juego (`JuegoModelos`) son los tres motores construidos desde una
+especificacion de artefactos (ver `motores`). Cada solicitud toma
+`REGISTRO.activo()` una vez al empezar y usa ese juego hasta responder. Cambiar
+de juego reasigna una sola referencia: una solicitud en curso termina con el
+juego con el que empezo y la siguiente ya ve el nuevo.
+
+`cargar` arma el juego nuevo en un hilo aparte, en tres fases cronometradas:
+
+    carga           construir_motores (pickles o almacen mapeado)
+    calentamiento   las solicitudes canario (`registro_modelos.canario`) en
+                    cada motor; una excepcion, un CodigoHortensia 99 o una
+                    version distinta a la cargada descartan el juego
+    activacion      cambio de referencia; el activo pasa a ser el anterior
+
+`revertir` intercambia activo y anterior sin cargar nada. Se guarda un solo
+anterior: los juegos mas viejos se liberan (el almacen de artefactos no
+retiene objetos que nadie usa).
+
+Con varios workers cada proceso tiene su registro. Una operacion se publica
+en `registro_modelos.estado_compartido`, con un numero de generacion, recien
+cuando el juego paso el canario y quedo activo: una carga descartada no llega
+al archivo. Los demas workers lo revisan cada `intervalo_segundos` desde
+`activo()` y la repiten: si la especificacion es la de su juego anterior
+cambian al instante, si no la cargan con su propio canario (esa copia ya no
+es la heredada del master). Una generacion que no pasa el canario en un
+worker queda descartada en ese worker y no se reintenta. Un proceso que
+arranca usa la especificacion publicada, tambien tras pasar el canario, si
+config.yaml no cambio desde que se publico; si el canario falla, o tras un
+despliegue que cambia config.yaml, manda config.yaml.
+"""
+import copy
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from src.config.config import (
+    REGISTRO_MODELOS_CANARIO,
+    REGISTRO_MODELOS_CANARIO_REPETICIONES,
+    REGISTRO_MODELOS_ESTADO,
+    REGISTRO_MODELOS_INTERVALO,
+)
+from src.services.motores import combinar, construir_motores, especificacion_config, huella_especificacion, ruta_proyecto
+
+
+def _ms(inicio):
+    return round((time.perf_counter() - inicio) * 1000, 1)
+
+
+def _ahora():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class JuegoModelos:
+    """Los tres motores de una especificacion, con su generacion y el tiempo de cada fase."""
+
+    def __init__(self, spec, motores, generacion, fases):
+        self.spec = spec
+        self.huella = huella_especificacion(spec)
+        self.regular, self.nclf, self.backup = motores
+        self.generacion = generacion
+        self.fases = fases
+        self.creado = _ahora()
+
+    def motores(self, motor_zf):
+        """Dict de motores para `decide_and_predict`."""
+        return {"contra": self.regular, "backup": self.backup, "NCL": self.nclf, "ZF": motor_zf}
+
+    def lotes(self):
+        """Metricas de la cola de micro-lotes de cada motor (`None` si esta desactivada)."""
+        return {
+            nombre: motor.pipeline.cola.resumen() if motor.pipeline.cola is not None else None
+            for nombre, motor in (("regular", self.regular), ("ncl", self.nclf), ("backup", self.backup))
+        }
+
+    def etapas(self):
+        """Tiempos p50/p99 de cada etapa del grafo de cada motor (ver grafo_etapas)."""
+        return {
+            nombre: motor.grafo.metricas.resumen()
+            for nombre, motor in (("regular", self.regular), ("ncl", self.nclf), ("backup", self.backup))
+        }
+
+    def resumen(self):
+        return {
+            "huella": self.huella,
+            "generacion": self.generacion,
+            "creado": self.creado,
+            "versiones": {
+                nombre: {"H": motor.version, "FPD": motor.version_fpd}
+                for nombre, motor in (("regular", self.regular), ("ncl", self.nclf), ("backup", self.backup))
+            },
+            "fases_ms": self.fases,
+            "spec": self.spec,
+        }
+
+
+def cargar_canario(ruta=None):
+    """Solicitudes canario: lista de `{"motor": "contra"|"NCL"|"backup", "solicitud": {...}}`."""
+    with open(ruta_proyecto(ruta or REGISTRO_MODELOS_CANARIO), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def calentar(motores, casos, repeticiones=REGISTRO_MODELOS_CANARIO_REPETICIONES):
+    """Corre cada caso canario en su motor; devuelve los ms de la primera y la ultima corrida.
+
+    Lanza `RuntimeError` si una respuesta es de error o no trae la version
+    del motor.
+    """
+    regular, nclf, backup = motores
+    por_clave = {"contra": regular, "NCL": nclf, "backup": backup}
+    tiempos = {}
+    for caso in casos:
+        motor = por_clave[caso["motor"]]
+        solicitud = caso["solicitud"]
+        grupo_retailer = solicitud.get("grupo_tienda") or solicitud.get("grupo_retailer")
+        ms = []
+        for _ in range(max(1, repeticiones)):
+            datos = copy.deepcopy(solicitud)
+            inicio = time.perf_counter()
+            respuesta = motor.predecir(datos, grupo_retailer)
+            ms.append(_ms(inicio))
+            if not isinstance(respuesta, dict) or str(respuesta.get("CodigoHortensia")) == "99":
+                raise RuntimeError(f"Canario {caso['motor']}: respuesta de error {respuesta!r}")
+            if respuesta.get("Motor") != motor.version:
+                raise RuntimeError(f"Canario {caso['motor']}: version {respuesta.get('Motor')!r}, se esperaba {motor.version!r}")
+        tiempos[caso["motor"]] = {"primera_ms": ms[0], "ultima_ms": ms[-1]}
+    return tiempos
+
+
+class RegistroModelos:
+    """Juego activo y anterior del proceso, cargas en segundo plano y sincronizacion entre workers."""
+
+    def __init__(self, estado_compartido=REGISTRO_MODELOS_ESTADO, canario=REGISTRO_MODELOS_CANARIO,
+                 repeticiones=REGISTRO_MODELOS_CANARIO_REPETICIONES, intervalo=REGISTRO_MODELOS_INTERVALO):
+        self.estado_compartido = ruta_proyecto(estado_compartido)
+        self.canario = canario
+        self.repeticiones = repeticiones
+        self.intervalo = intervalo
+        self._activo = None
+        self._anterior = None
+        # Serializa el cambio de referencias; las solicitudes leen sin bloquear
+        self._cambio = threading.Lock()
+        # Una operacion (carga o reversion) a la vez
+        self._operacion = threading.Lock()
+        self._hilo = None
+        # Ultima generacion publicada que este proceso aplico, y la ultima que descarto
+        self._generacion = 0
+        self._descartada = None
+        self._revisado = 0.0
+        self._origen = huella_especificacion(especificacion_config())
+        self.ultima_operacion = None
+
+    # --- estado compartido entre workers ---
+
+    def _leer(self):
+        try:
+            with open(self.estado_compartido, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logging.exception("[registro] Estado compartido ilegible: %s", self.estado_compartido)
+            return None
+
+    def _publicar(self, accion, spec):
+        """Escribe la operacion con la siguiente generacion (escritura atomica) y devuelve la generacion."""
+        estado = self._leer() or {}
+        generacion = max(int(estado.get("generacion", 0)), self._generacion) + 1
+        contenido = {
+            "generacion": generacion,
+            "accion": accion,
+            "spec": spec,
+            "origen": self._origen,
+            "pid": os.getpid(),
+            "fecha": _ahora(),
+        }
+        self.estado_compartido.parent.mkdir(parents=True, exist_ok=True)
+        fd, temporal = tempfile.mkstemp(dir=self.estado_compartido.parent, prefix=self.estado_compartido.name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(contenido, f, indent=2)
+            os.chmod(temporal, 0o644)
+            os.replace(temporal, self.estado_compartido)
+        except BaseException:
+            os.unlink(temporal)
+            raise
+        return generacion
+
+    # --- juego activo ---
+
+    def _iniciar(self):
+        """Crea el primer juego: el publicado si vale para este config.yaml y pasa el canario, si no el de config.yaml."""
+        with self._cambio:
+            if self._activo is None:
+                estado = self._leer()
+                juego = self._juego_publicado(estado) if estado is not None else None
+                if juego is None:
+                    spec = especificacion_config()
+                    inicio = time.perf_counter()
+                    motores = construir_motores(spec)
+                    juego = JuegoModelos(spec, motores, self._generacion, {"carga": _ms(inicio)})
+                self._activo = juego
+                self._revisado = time.monotonic()
+                logging.info("[registro] Juego %s activo (%s)", juego.huella, juego.fases)
+            return self._activo
+
+    def _juego_publicado(self, estado):
+        """Juego de la especificacion publicada en `estado`, calentado con el canario; `None` si no aplica o falla."""
+        generacion = int(estado.get("generacion", 0))
+        spec = especificacion_config()
+        if estado.get("origen") != self._origen or estado.get("spec") == spec:
+            # Publicado con otro config.yaml o igual al de config.yaml: no hay nada que adoptar
+            self._generacion = generacion
+            return None
+        fases = {}
+        try:
+            spec = combinar(spec, estado["spec"])
+            inicio = time.perf_counter()
+            motores = construir_motores(spec)
+            fases["carga"] = _ms(inicio)
+            inicio = time.perf_counter()
+            calentar(motores, cargar_canario(self.canario), self.repeticiones)
+            fases["calentamiento"] = _ms(inicio)
+        # cargar_modelo termina con sys.exit si un pickle no se puede leer
+        except (Exception, SystemExit) as e:
+            self._descartada = generacion
+            logging.warning("[registro] Juego publicado (generacion %d) descartado (%r): se usa config.yaml", generacion, e)
+            return None
+        self._generacion = generacion
+        logging.info("[registro] Se usa el juego publicado (generacion %d)", generacion)
+        return JuegoModelos(spec, motores, generacion, fases)
+
+    def activo(self):
+        """Juego activo (se crea la primera vez). Revisa antes si otro worker publico un cambio."""
+        if self._activo is None:
+            return self._iniciar()
+        if self.intervalo is not None and time.monotonic() - self._revisado >= self.intervalo:
+            self.sincronizar()
+        return self._activo
+
+    def cargando(self):
+        return self._hilo is not None and self._hilo.is_alive()
+
+    # --- operaciones ---
+
+    def sincronizar(self):
+        """Repite la operacion publicada por otro proceso si este aun no la aplico; True si la aplica."""
+        self._revisado = time.monotonic()
+        estado = self._leer()
+        if estado is None or self.cargando():
+            return False
+        generacion = int(estado.get("generacion", 0))
+        if generacion <= self._generacion or generacion == self._descartada:
+            return False
+        if estado.get("origen") != self._origen:
+            # Publicado con otro config.yaml: este proceso ya arranco con el nuevo
+            self._generacion = generacion
+            return False
+        return self._aplicar(estado.get("accion", "cargar"), estado["spec"], generacion)
+
+    def _aplicar(self, accion, spec, generacion=None, esperar=False):
+        """Aplica una operacion: cambio inmediato si `spec` es la del anterior, carga si no.
+
+        Sin `generacion` la operacion es de este proceso y se publica cuando
+        el juego queda activo; con `generacion` se repite una ya publicada.
+        Devuelve False, sin hacer nada, si hay otra operacion en curso o la
+        generacion ya se aplico.
+        """
+        if not self._operacion.acquire(blocking=False):
+            return False
+        hilo = None
+        try:
+            if self.cargando() or (generacion is not None and generacion <= self._generacion):
+                return False
+            huella = huella_especificacion(spec)
+            if self._activo is not None and self._activo.huella == huella:
+                if generacion is not None:
+                    self._generacion = generacion
+                self.ultima_operacion = {"accion": accion, "generacion": generacion, "huella": huella,
+                                         "estado": "sin_cambios", "inicio": _ahora(), "fases_ms": {}}
+                return True
+            if self._anterior is not None and self._anterior.huella == huella:
+                self._intercambiar(accion, generacion)
+                return True
+            self.ultima_operacion = {"accion": accion, "generacion": generacion, "huella": huella,
+                                     "estado": "cargando", "inicio": _ahora(), "fases_ms": {}}
+            hilo = self._hilo = threading.Thread(
+                target=self._cargar, args=(self.ultima_operacion, spec), name="registro-modelos", daemon=True,
+            )
+            hilo.start()
+        finally:
+            self._operacion.release()
+        if esperar and hilo is not None:
+            hilo.join()
+        return True
+
+    def _intercambiar(self, accion, generacion):
+        inicio = time.perf_counter()
+        with self._cambio:
+            self._activo, self._anterior = self._anterior, self._activo
+        activacion = _ms(inicio)
+        generacion = self._confirmar(accion, self._activo, generacion)
+        self.ultima_operacion = {"accion": accion, "generacion": generacion, "huella": self._activo.huella,
+                                 "estado": "activo", "inicio": _ahora(), "fases_ms": {"activacion": activacion}}
+        logging.info("[registro] %s: juego %s activo de nuevo (%s ms)", accion, self._activo.huella, activacion)
+
+    def _cargar(self, operacion, spec):
+        """Hilo de carga: carga, calentamiento y activacion del juego de `spec`."""
+        fases = operacion["fases_ms"]
+        try:
+            inicio = time.perf_counter()
+            motores = construir_motores(spec)
+            fases["carga"] = _ms(inicio)
+
+            operacion["estado"] = "calentando"
+            inicio = time.perf_counter()
+            operacion["canario"] = calentar(motores, cargar_canario(self.canario), self.repeticiones)
+            fases["calentamiento"] = _ms(inicio)
+
+            juego = JuegoModelos(spec, motores, operacion["generacion"], fases)
+            inicio = time.perf_counter()
+            with self._cambio:
+                self._activo, self._anterior = juego, self._activo
+            fases["activacion"] = _ms(inicio)
+        # cargar_modelo termina con sys.exit si un pickle no se puede leer
+        except (Exception, SystemExit) as e:
+            operacion["estado"] = "fallida"
+            operacion["error"] = repr(e)
+            if operacion["generacion"] is not None:
+                self._descartada = operacion["generacion"]
+            logging.exception("[registro] Carga %s descartada", operacion["generacion"] or "local")
+            return
+        operacion["generacion"] = self._confirmar(operacion["accion"], juego, operacion["generacion"])
+        operacion["estado"] = "activo"
+        logging.info("[registro] Juego %s activo (generacion %s): %s", juego.huella, juego.generacion, fases)
+
+    def _confirmar(self, accion, juego, generacion):
+        """Registra la generacion del juego ya activo; si la operacion es de este proceso la publica antes."""
+        if generacion is None:
+            try:
+                generacion = self._publicar(accion, juego.spec)
+            except OSError:
+                # El juego sigue activo en este worker; los demas no lo ven
+                logging.exception("[registro] No se pudo publicar el juego %s", juego.huella)
+                return None
+        self._generacion = generacion
+        juego.generacion = generacion
+        return generacion
+
+    def cargar(self, cambios, esperar=False):
+        """Carga en segundo plano el juego activo con `cambios` (ver `motores.combinar`) y lo publica si queda activo.
+
+        Lanza `ValueError` si los cambios no son validos y `RuntimeError` si ya
+        hay una carga u otra operacion en curso. Con `esperar` vuelve cuando termina la carga.
+        Devuelve la operacion (estado y tiempos por fase).
+        """
+        spec = combinar(self.activo().spec, cambios)
+        if self.cargando() or not self._aplicar("cargar", spec, esperar=esperar):
+            raise RuntimeError("Hay una carga de modelos en curso")
+        return self.ultima_operacion
+
+    def revertir(self):
+        """Vuelve al juego anterior (y lo publica para los demas workers).
+
+        Lanza `LookupError` si no hay juego anterior y `RuntimeError` si hay
+        una carga u otra operacion en curso.
+        """
+        anterior = self._anterior
+        if anterior is None:
+            raise LookupError("No hay juego anterior al que revertir")
+        if self.cargando() or not self._aplicar("revertir", anterior.spec):
+            raise RuntimeError("Hay una carga de modelos en curso")
+        return self.ultima_operacion
+
+    def estado(self):
+        """Juego activo y anterior, generacion y ultima operacion del proceso."""
+        activo = self.activo()
+        anterior = self._anterior
+        return {
+            "pid": os.getpid(),
+            "generacion": self._generacion,
+            "cargando": self.cargando(),
+            "activo": activo.resumen(),
+            "anterior": anterior.resumen() if anterior is not None else None,
+            "ultima_operacion": self.ultima_operacion,
+        }
+
+
+REGISTRO = RegistroModelos()
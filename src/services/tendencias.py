@@ -0,0 +1,230 @@
+"""Features de tendencia de series mensuales sobre un tensor NumPy.
+
+`calcular_tendencia` (Regular y NCL) resume cada serie de 12 meses de
+`PREPROC_TENDENCIA_COLS_*` (`cantidad_1..12`, `saldoTotal_1..12`, ...) en
+media, desviacion, maximo, minimo, pendiente, rango, cambio 1 -> 12, mes del
+maximo/minimo, variaciones porcentuales mes a mes y medias por trimestre.
+Aqui todas las series se apilan en un tensor `(series, meses, filas)` y las
+features salen de unas pocas operaciones de arreglo, para 1 o N filas.
+
+La pendiente es la de minimos cuadrados en forma cerrada (con mascara opcional
+de meses validos) en lugar de un `LinearRegression` por fila: coincide con
+sklearn salvo redondeo (~1e-15 relativo). Las demas features replican bit a
+bit las reducciones de pandas: la media recorre los meses con el mismo layout
+que `df[cols].mean(axis=1)` y la desviacion con el de `nanvar` (copia en orden
+C). Si la entrada se sale del caso soportado (columnas no numericas, enteros
+que float64 no representa, valores no finitos que sklearn rechazaria) se
+devuelve `None` y el llamador usa la version de referencia. Con un plan de
+features (ver `plan_features`) solo se calculan las features que usan los
+modelos del motor.
+
+`verificar_tendencia` compara ambas rutas sobre un conjunto de DataFrames.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+SUFIJOS_PENDIENTE = ("_tendencia",)
+
+
+def series_numericas(df, nombres, rellenar=True, faltante=0.0):
+    """Columnas `nombres` de `df` como bloque float64 `(filas, len(nombres))`.
+
+    Las columnas que no existen valen `faltante`; con `rellenar`, los NaN se
+    reemplazan por 0 (`fillna(0)`). Devuelve `(valores, cambios)`, donde
+    `cambios` lista las posiciones cuyo contenido en `df` cambia al rellenar o
+    pasar a float (las faltantes aparte, ver `faltantes`). `None` si alguna
+    columna no es entera ni float64, o trae enteros que float64 no representa.
+    """
+    if not df.columns.is_unique:
+        return None
+    n = len(df)
+    posiciones = df.columns.get_indexer(nombres)
+    presentes = np.flatnonzero(posiciones >= 0)
+    valores = np.full((n, len(nombres)), faltante, dtype=np.float64)
+    cambios = []
+    if len(presentes):
+        dtypes = df.dtypes.to_numpy()[posiciones[presentes]]
+        kinds = np.array([dt.kind for dt in dtypes], dtype='<U1')
+        if not all(dt.kind == 'i' or dt == np.float64 for dt in dtypes):
+            return None
+        bloque = df.iloc[:, posiciones[presentes]].to_numpy(dtype=np.float64)
+        enteras = kinds == 'i'
+        if (np.abs(bloque[:, enteras]) >= 2 ** 53).any():
+            return None
+        if rellenar:
+            nulos = np.isnan(bloque)
+            bloque[nulos] = 0.0
+            cambios = presentes[enteras | nulos.any(axis=0)].tolist()
+        valores[:, presentes] = bloque
+    return valores, cambios
+
+
+def faltantes(df, nombres):
+    return [j for j, nombre in enumerate(nombres) if nombre not in df.columns]
+
+
+def pendientes(Y, validos=None):
+    """Pendiente OLS de cada serie a lo largo del eje 1 de `Y` (`(series, meses, filas)`).
+
+    Equivale a `LinearRegression().fit(meses, y).coef_[0]` con meses 0..M-1.
+    Con `validos` (misma forma, booleano) solo cuentan los meses validos: una
+    serie sin meses validos da NaN y una con un solo mes (o sin variacion en
+    x) da 0, como sklearn.
+    """
+    meses = Y.shape[1]
+    x = np.arange(meses, dtype=np.float64)
+    if validos is None:
+        dx = x - x.mean()
+        centrada = Y - Y.mean(axis=1, keepdims=True)
+        return np.einsum('m,smn->sn', dx, centrada) / (dx @ dx)
+    peso = validos.astype(np.float64)
+    y = np.where(validos, Y, 0.0)
+    cantidad = peso.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_media = (peso * x[None, :, None]).sum(axis=1, keepdims=True) / cantidad
+        y_media = y.sum(axis=1, keepdims=True) / cantidad
+        dx = (x[None, :, None] - x_media) * peso
+        numerador = (dx * (y - y_media)).sum(axis=1)
+        denominador = (dx * dx).sum(axis=1)
+        resultado = np.where(denominador > 0, numerador / denominador, 0.0)
+    resultado[cantidad[:, 0, :] == 0] = np.nan
+    return resultado
+
+
+def _mes_de_columna(nombre):
+    """Mes que `idxmax(...).str.split('_', expand=True)[1]` extrae del nombre."""
+    return float(nombre.split('_')[1])
+
+
+def features_tendencia(df, columnas, meses=12, plan=None):
+    """Columnas que `calcular_tendencia` agrega o reemplaza para las series de `columnas`.
+
+    Devuelve un dict ordenado `nombre -> valores` en el mismo orden en que la
+    referencia hace sus `df[c] = ...`: por cada serie, primero los meses que
+    faltaban (0.0) y luego sus features. Los meses existentes que cambian con
+    `fillna(0).astype(float)` van tambien, para reemplazarse en su lugar.
+    Con `plan` (ver `plan_features`) solo van las features que el plan
+    necesita. `None` si hay que usar la referencia.
+    """
+    nombres = nombres_series(columnas, meses)
+    leidas = series_numericas(df, nombres)
+    if leidas is None:
+        return None
+    valores, cambios = leidas
+    return features_series(valores, columnas, meses, sin_columna=faltantes(df, nombres), cambios=cambios, plan=plan)
+
+
+def nombres_series(columnas, meses=12):
+    return [f"{col}_{i}" for col in columnas for i in range(1, meses + 1)]
+
+
+def nombres_features(col, meses=12):
+    """Features de la serie `col`, en el orden en que las agrega la referencia."""
+    return (
+        [col + sufijo for sufijo in ("_mean", "_std", "_max", "_min", "_tendencia", "_range")]
+        + [col + "cambio_1al12", col + "_mes_saldo_max", col + "_mes_saldo_min"]
+        + [f'var_pct_{col}_{i + 1}' for i in range(1, meses)]
+        + [f'mean_m_{col}_{i + 1}' for i in range(0, meses, 3)]
+    )
+
+
+def features_series(valores, columnas, meses=12, sin_columna=(), cambios=(), plan=None):
+    """Features de tendencia desde el bloque `valores` (`(filas, series * meses)`) ya leido.
+
+    `sin_columna` son las posiciones de los meses que no existian y
+    `cambios` las de los existentes que se reescriben (ver
+    `features_tendencia`). Con `plan` solo se resumen las series que tienen
+    alguna feature necesaria y solo se devuelven esas features; los meses van
+    siempre. `None` si hay valores no finitos.
+    """
+    if not np.isfinite(valores).all():
+        # LinearRegression rechaza inf: la referencia conserva ese error
+        return None
+    n = valores.shape[0]
+    nombres = nombres_series(columnas, meses)
+    sin_columna = set(sin_columna)
+    calcular = plan.calcular if plan is not None else None
+    activas = [
+        s for s, col in enumerate(columnas)
+        if calcular is None or any(calcular(nombre) for nombre in nombres_features(col, meses))
+    ]
+
+    features = {}
+    if activas:
+        S = len(activas)
+        bloque = valores if S == len(columnas) else valores[:, [s * meses + i for s in activas for i in range(meses)]]
+        # (series, meses, filas): cada serie es un bloque (meses, filas) en orden C, es
+        # decir `df[varcols].values` (filas, meses) en orden F como lo reduce pandas
+        Y = np.ascontiguousarray(bloque.T.reshape(S, meses, n))
+        media = Y.sum(axis=1) / meses
+        Z = Y.transpose(0, 2, 1).copy()
+        promedio = Z.sum(axis=2) / meses
+        desviacion = np.sqrt(((promedio[..., None] - Z) ** 2).sum(axis=2) / (meses - 1))
+        maximo = Y.max(axis=1)
+        minimo = Y.min(axis=1)
+        pendiente = pendientes(Y)
+        mes_columna = np.array([[_mes_de_columna(f"{columnas[s]}_{i}") for i in range(1, meses + 1)] for s in activas])
+        fila_serie = np.arange(S)[:, None]
+        mes_max = mes_columna[fila_serie, Y.argmax(axis=1)]
+        mes_min = mes_columna[fila_serie, Y.argmin(axis=1)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            var_pct = (Y[:, 1:] - Y[:, :-1]) / Y[:, :-1]
+        medias_trimestre = [Y[:, i:i + 3].sum(axis=1) / Y[:, i:i + 3].shape[1] for i in range(0, meses, 3)]
+        for k, s in enumerate(activas):
+            resumen = (
+                [media[k], desviacion[k], maximo[k], minimo[k], pendiente[k], maximo[k] - minimo[k]]
+                + [Y[k, -1] - Y[k, 0], mes_max[k], mes_min[k]]
+                + [var_pct[k, i - 1] for i in range(1, meses)]
+                + [trimestre[k] for trimestre in medias_trimestre]
+            )
+            features[s] = [
+                (nombre, v) for nombre, v in zip(nombres_features(columnas[s], meses), resumen)
+                if calcular is None or calcular(nombre)
+            ]
+
+    resultado = {}
+    for s in range(len(columnas)):
+        for i in range(meses):
+            j = s * meses + i
+            if j in sin_columna:
+                resultado[nombres[j]] = valores[:, j]
+        resultado.update(features.get(s, ()))
+    for j in cambios:
+        resultado[nombres[j]] = valores[:, j]
+    return resultado
+
+
+def verificar_tendencia(calcular_tendencia, dfs, rtol=1e-9):
+    """Compara la ruta vectorizada con la de referencia sobre `dfs`.
+
+    `calcular_tendencia` es el de `preprocess` o `preprocess_NCL`; cada ruta
+    recibe su propia copia. Exige igualdad exacta salvo en las pendientes
+    (`*_tendencia`), que se comparan con `rtol`. Devuelve la lista de
+    `(i, error)` que no coinciden.
+    """
+    diferencias = []
+    for i, df in enumerate(dfs):
+        try:
+            referencia = calcular_tendencia(df.copy(), vectorizado=False)
+        except Exception as e:
+            referencia = e
+        try:
+            vectorizado = calcular_tendencia(df.copy(), vectorizado=True)
+        except Exception as e:
+            vectorizado = e
+        if isinstance(referencia, Exception) or isinstance(vectorizado, Exception):
+            if type(referencia) is not type(vectorizado):
+                diferencias.append((i, f"referencia={referencia!r} vectorizado={vectorizado!r}"))
+            continue
+        try:
+            pd.testing.assert_index_equal(vectorizado.columns, referencia.columns)
+            pendiente = [c for c in referencia.columns if str(c).endswith(SUFIJOS_PENDIENTE)]
+            resto = referencia.columns.difference(pendiente, sort=False)
+            pd.testing.assert_frame_equal(vectorizado[resto], referencia[resto], check_exact=True)
+            pd.testing.assert_frame_equal(vectorizado[pendiente], referencia[pendiente], check_exact=False, rtol=rtol)
+        except AssertionError as e:
+            diferencias.append((i, str(e)))
+    logging.info("[preprocess] verificar_tendencia: %d DataFrames, %d diferencias", len(dfs), len(diferencias))
+    return diferencias
@@ -0,0 +1,159 @@
+"""Contabilidad de copias de DataFrame y memoria por etapa (modo depuracion).
+
+El pipeline de una solicitud trabaja sobre un DataFrame de una sola fila que
+pasa por varias etapas (extraccion, post-procesamiento, preprocesamiento,
+normalizacion). Con `debug.contar_copias: true` en config.yaml (o
+`activar()`), cada bloque `with etapa("nombre")` registra:
+
+- `copias`: llamadas a `DataFrame.copy()` (profundas) dentro de la etapa;
+  `superficiales` cuenta aparte las `copy(deep=False)`, que no duplican datos.
+- `bytes_copiados`: tamano (sin `deep`) de los DataFrames copiados.
+- `bytes_netos`: memoria que la etapa deja asignada al salir (tracemalloc).
+- `bytes_pico`: pico de memoria sobre el inicio de la etapa (tracemalloc).
+
+Las etapas se anidan (`solicitud/procesar_xml_experian/variables_income`) y
+cada una cuenta todo lo que ocurre dentro, incluidas sus sub-etapas. Las copias
+se atribuyen por hilo; tracemalloc es global al proceso, asi que las cifras de
+memoria solo son exactas con una solicitud a la vez.
+
+Desactivado, `etapa` no hace nada: no hay parche sobre pandas ni tracemalloc.
+"""
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+from src.config.config import DEBUG_CONTAR_COPIAS
+
+_COPY_PROPIO = 'copy' in pd.DataFrame.__dict__
+_copy_original = pd.DataFrame.copy
+
+_local = threading.local()
+_lock = threading.Lock()
+_totales = {}
+_estado = {"activo": False, "tracemalloc_propio": False}
+
+
+class _Etapa:
+    __slots__ = ("ruta", "copias", "superficiales", "bytes_copiados", "inicio", "pico")
+
+    def __init__(self, ruta, inicio):
+        self.ruta = ruta
+        self.copias = 0
+        self.superficiales = 0
+        self.bytes_copiados = 0
+        self.inicio = inicio
+        self.pico = inicio
+
+
+def _pila():
+    pila = getattr(_local, "pila", None)
+    if pila is None:
+        pila = _local.pila = []
+    return pila
+
+
+def _copy_contado(self, deep=True):
+    resultado = _copy_original(self, deep=deep)
+    pila = getattr(_local, "pila", None)
+    if pila:
+        if deep:
+            nbytes = int(self.memory_usage(index=True, deep=False).sum())
+            for abierta in pila:
+                abierta.copias += 1
+                abierta.bytes_copiados += nbytes
+        else:
+            # Copias superficiales (p.e. internas de pandas/sklearn): no duplican datos
+            for abierta in pila:
+                abierta.superficiales += 1
+    return resultado
+
+
+def activar(habilitado=True):
+    """Activa o desactiva la contabilidad (parche de `DataFrame.copy` + tracemalloc)."""
+    with _lock:
+        if habilitado == _estado["activo"]:
+            return
+        if habilitado:
+            pd.DataFrame.copy = _copy_contado
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _estado["tracemalloc_propio"] = True
+        else:
+            if _COPY_PROPIO:
+                pd.DataFrame.copy = _copy_original
+            else:
+                del pd.DataFrame.copy
+            if _estado["tracemalloc_propio"]:
+                tracemalloc.stop()
+                _estado["tracemalloc_propio"] = False
+        _estado["activo"] = habilitado
+    logging.info("[copias] contabilidad %s", "activada" if habilitado else "desactivada")
+
+
+def activo():
+    return _estado["activo"]
+
+
+@contextmanager
+def etapa(nombre):
+    """Delimita una etapa del pipeline; sin efecto si la contabilidad esta desactivada."""
+    if not _estado["activo"] or not tracemalloc.is_tracing():
+        yield
+        return
+    pila = _pila()
+    if pila:
+        # El pico de la etapa padre hasta aqui, antes de reiniciarlo para la hija
+        pila[-1].pico = max(pila[-1].pico, tracemalloc.get_traced_memory()[1])
+    tracemalloc.reset_peak()
+    ruta = f"{pila[-1].ruta}/{nombre}" if pila else nombre
+    actual = _Etapa(ruta, tracemalloc.get_traced_memory()[0])
+    pila.append(actual)
+    try:
+        yield
+    finally:
+        pila.pop()
+        memoria, pico = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (actual.inicio, actual.inicio)
+        actual.pico = max(actual.pico, pico)
+        if pila:
+            pila[-1].pico = max(pila[-1].pico, actual.pico)
+        _registrar(actual, memoria - actual.inicio, actual.pico - actual.inicio)
+
+
+def _registrar(cerrada, netos, pico):
+    with _lock:
+        total = _totales.setdefault(
+            cerrada.ruta,
+            {"llamadas": 0, "copias": 0, "superficiales": 0, "bytes_copiados": 0, "bytes_netos": 0, "bytes_pico_max": 0},
+        )
+        total["llamadas"] += 1
+        total["copias"] += cerrada.copias
+        total["superficiales"] += cerrada.superficiales
+        total["bytes_copiados"] += cerrada.bytes_copiados
+        total["bytes_netos"] += netos
+        total["bytes_pico_max"] = max(total["bytes_pico_max"], pico)
+    logging.info(
+        "[copias] etapa=%s copias=%d superficiales=%d bytes_copiados=%d bytes_netos=%d bytes_pico=%d",
+        cerrada.ruta, cerrada.copias, cerrada.superficiales, cerrada.bytes_copiados, netos, pico,
+    )
+
+
+def resumen():
+    """Totales acumulados por etapa: llamadas, copias, bytes copiados/netos y pico maximo.
+
+    `bytes_netos` es la suma sobre las llamadas; el promedio por solicitud es
+    `bytes_netos / llamadas`.
+    """
+    with _lock:
+        return {ruta: dict(total) for ruta, total in _totales.items()}
+
+
+def reiniciar():
+    with _lock:
+        _totales.clear()
+
+
+if DEBUG_CONTAR_COPIAS:
+    activar(True)
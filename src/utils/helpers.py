@@ -23,12 +23,25 @@ def cargar_config(path: str | None = None):
 def cargar_modelo(modelo_path):
     """
     Carga un modelo desde un archivo (p.e., pickle) usando joblib.
+
+    Con `artefactos.mmap` se carga desde el almacen de artefactos, con sus
+    arreglos mapeados de solo lectura (ver `almacen_artefactos`); si el
+    almacen falla se carga el pickle.
     
     Args:
         modelo_path (str o Path): ruta del archivo del modelo entrenado.
     Returns:
         object: instancia del modelo cargado.
     """
+    from src.config.config import ARTEFACTOS_MMAP
+
+    if ARTEFACTOS_MMAP and Path(modelo_path).exists():
+        try:
+            from src.services.almacen_artefactos import ALMACEN
+
+            return ALMACEN.cargar(modelo_path)
+        except Exception as e:
+            logging.warning("Almacen de artefactos no disponible para %s (%s): se carga el pickle", modelo_path, e)
     try:
         modelo = joblib.load(modelo_path)
         logging.info("Modelo cargado exitosamente desde %s", modelo_path)
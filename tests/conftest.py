@@ -0,0 +1,138 @@
+"""Corpus de prueba: las solicitudes canario y variaciones deterministas de ellas.
+
+`solicitudes_variadas` parte de cada solicitud canario y altera al azar (con
+semilla fija) atributos del XML Experian (numeros, fechas y codigos, incluidos
+valores vacios o invalidos), quita o duplica cuentas, consultas y meses y
+cambia campos del cliente. Cubre los casos borde que las solicitudes canario solas no tocan.
+"""
+import copy
+import random
+import re
+import xml.etree.ElementTree as ET
+from datetime import date, timedelta
+
+import pytest
+
+from src.services.registro_modelos import cargar_canario
+
+SEMILLA = 20240515
+VARIACIONES = 20
+
+FECHA = re.compile(r"^\d{4}-\d{2}-\d{2}")
+NUMERO = re.compile(r"^-?\d+(\.\d+)?$")
+
+# Elementos que el informe trae varias veces y que la extraccion agrega por familia
+REPETIBLES = {"CuentaCartera", "CuentaAhorro", "TarjetaCredito", "Consulta", "Valor", "EstadoCuenta", "Mes", "SaldosYMoras"}
+
+CLIENTE = {
+    "tipo_documento": [1, 6],
+    "edad_al_contratar": [18, 24, 45, 62, 80],
+    "tipo_trabajo": ["independiente", "pensionado", "empleado", 3, "otro"],
+    "genero": ["femenino", "masculino", 2],
+    "dpto_nac": ["bogota", "nortedesantander", "antioquia", "laguajira", "desconocido"],
+    "departamento_actual": ["antioquia", "bogota", "valledelcauca"],
+    "numero_hijos": [0, 1, 3, 7],
+    "tarjeta_credito": [0, 1],
+    "p3": [0, 1],
+}
+
+
+def _valor(rng, original, p_invalido=0.1):
+    if rng.random() < p_invalido:
+        return rng.choice(["", "N/A", "2024-13-45"])
+    if FECHA.match(original):
+        return (date(2024, 5, 15) - timedelta(days=rng.randint(0, 6000))).isoformat()
+    if NUMERO.match(original):
+        return rng.choice([
+            str(rng.randint(-1, 50)),
+            str(rng.randint(0, 10_000_000)),
+            f"{rng.uniform(-1, 1000):.2f}",
+            "-1",
+            "0",
+        ])
+    return rng.choice([original.upper(), original.lower(), "XX"])
+
+
+def variar_xml(xml, rng, p_atributo=0.15, p_quitar=0.08, p_duplicar=0.08):
+    """Copia de `xml` con atributos alterados y elementos quitados o duplicados."""
+    cabecera, cuerpo = xml.split("?>", 1) if xml.startswith("<?xml") else ("", xml)
+    raiz = ET.fromstring(cuerpo)
+    for padre in list(raiz.iter()):
+        for hijo in list(padre):
+            if hijo.tag not in REPETIBLES:
+                continue
+            if rng.random() < p_quitar:
+                padre.remove(hijo)
+            elif rng.random() < p_duplicar:
+                padre.insert(list(padre).index(hijo), copy.deepcopy(hijo))
+    for elemento in raiz.iter():
+        for nombre, valor in list(elemento.attrib.items()):
+            if rng.random() < p_atributo:
+                if rng.random() < 0.2:
+                    del elemento.attrib[nombre]
+                else:
+                    elemento.attrib[nombre] = _valor(rng, valor)
+    texto = ET.tostring(raiz, encoding="unicode")
+    return f"{cabecera}?>{texto}" if cabecera else texto
+
+
+def variar_solicitud(solicitud, rng):
+    variada = copy.deepcopy(solicitud)
+    cliente = variada["cliente"]
+    for campo, opciones in CLIENTE.items():
+        if rng.random() < 0.3:
+            cliente[campo] = rng.choice(opciones)
+    if variada.get("experianXML"):
+        variada["experianXML"] = variar_xml(variada["experianXML"], rng)
+    return variada
+
+
+@pytest.fixture(scope="session")
+def canario():
+    return cargar_canario()
+
+
+@pytest.fixture(scope="session")
+def solicitudes_variadas(canario):
+    """`[(motor, solicitud)]`: cada canario sin cambios y `VARIACIONES` variaciones de cada uno."""
+    rng = random.Random(SEMILLA)
+    casos = []
+    for caso in canario:
+        casos.append((caso["motor"], copy.deepcopy(caso["solicitud"])))
+        casos.extend((caso["motor"], variar_solicitud(caso["solicitud"], rng)) for _ in range(VARIACIONES))
+    return casos
+
+
+@pytest.fixture(scope="session")
+def xmls_variados(solicitudes_variadas):
+    """`{"contra"|"NCL": [xml]}` de las solicitudes con XML Experian."""
+    xmls = {}
+    for motor, solicitud in solicitudes_variadas:
+        if solicitud.get("experianXML"):
+            xmls.setdefault(motor, []).append(solicitud["experianXML"])
+    return xmls
+
+
+@pytest.fixture(scope="session")
+def juego():
+    """Juego de motores de config.yaml (el activo del registro del proceso)."""
+    from src.services.registro_modelos import REGISTRO
+
+    return REGISTRO.activo()
+
+
+def sin_seccion(xml, ruta):
+    """Copia de `xml` sin los elementos de `ruta` (`"Padre/Hijo"` o `"Hijo"`)."""
+    cabecera, cuerpo = xml.split("?>", 1) if xml.startswith("<?xml") else ("", xml)
+    raiz = ET.fromstring(cuerpo)
+    padre, _, tag = ruta.rpartition("/")
+    for elemento in list(raiz.iter()):
+        if not padre or elemento.tag == padre:
+            for hijo in elemento.findall(tag):
+                elemento.remove(hijo)
+    texto = ET.tostring(raiz, encoding="unicode")
+    return f"{cabecera}?>{texto}" if cabecera else texto
+
+
+def solicitud(canario, motor):
+    return copy.deepcopy(next(c["solicitud"] for c in canario if c["motor"] == motor))
@@ -0,0 +1,102 @@
+"""Cola de micro-lotes con un `puntuar` de prueba: tamano maximo, ventana y fallos por fila."""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from src.models.cola_lotes import ColaLotes
+
+MALA = -1.0
+
+
+class Puntuador:
+    """`puntuar` de prueba: dos "modelos" (x*2, x*3) que fallan si el lote trae una fila `MALA`."""
+
+    def __init__(self):
+        self.lotes = []
+        self._lock = threading.Lock()
+
+    def __call__(self, matriz):
+        with self._lock:
+            self.lotes.append(len(matriz))
+        if (matriz[:, 0] == MALA).any():
+            raise ValueError("fila invalida")
+        return matriz[:, 0] * 2, matriz[:, 0] * 3
+
+
+def _concurrentes(cola, valores):
+    """Llama a `cola.puntuar` a la vez desde un hilo por valor; devuelve resultado o excepcion de cada uno."""
+    resultados = [None] * len(valores)
+    barrera = threading.Barrier(len(valores))
+
+    def cliente(i):
+        barrera.wait()
+        try:
+            resultados[i] = cola.puntuar(np.array([valores[i]]))
+        except Exception as e:
+            resultados[i] = e
+
+    hilos = [threading.Thread(target=cliente, args=(i,)) for i in range(len(valores))]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join(10)
+    return resultados
+
+
+def _esperado(valor):
+    return (np.array([valor * 2]), np.array([valor * 3]))
+
+
+def _iguales(resultado, esperado):
+    assert not isinstance(resultado, Exception), resultado
+    assert len(resultado) == len(esperado)
+    for a, b in zip(resultado, esperado):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_lotes_no_superan_max_filas():
+    puntuador = Puntuador()
+    # La ventana es larga: los lotes se cierran al juntar max_filas, no por tiempo
+    cola = ColaLotes(puntuador, ventana_ms=5000, max_filas=4)
+    valores = [float(i) for i in range(8)]
+    inicio = time.perf_counter()
+    resultados = _concurrentes(cola, valores)
+    assert time.perf_counter() - inicio < 2.5
+    for valor, resultado in zip(valores, resultados):
+        _iguales(resultado, _esperado(valor))
+    assert puntuador.lotes == [4, 4]
+    resumen = cola.resumen()
+    assert resumen["lotes"] == 2 and resumen["filas"] == 8
+    assert resumen["tamano_lote"]["<=4"] == 2
+
+
+@pytest.mark.parametrize("ventana_ms", [0, 80])
+def test_ventana_vacia_el_lote_incompleto(ventana_ms):
+    puntuador = Puntuador()
+    cola = ColaLotes(puntuador, ventana_ms=ventana_ms, max_filas=64)
+    inicio = time.perf_counter()
+    _iguales(cola.puntuar(np.array([1.5])), _esperado(1.5))
+    transcurrido = time.perf_counter() - inicio
+    # Una fila sola se predice al vencer la ventana (de inmediato sin ventana)
+    assert ventana_ms / 1000 <= transcurrido < ventana_ms / 1000 + 1
+    assert puntuador.lotes == [1]
+
+
+def test_excepcion_solo_en_la_fila_que_falla():
+    puntuador = Puntuador()
+    cola = ColaLotes(puntuador, ventana_ms=2000, max_filas=5)
+    valores = [1.0, 2.0, MALA, 4.0, 5.0]
+    resultados = _concurrentes(cola, valores)
+    for valor, resultado in zip(valores, resultados):
+        if valor == MALA:
+            assert isinstance(resultado, ValueError)
+        else:
+            _iguales(resultado, _esperado(valor))
+    # El lote completo fallo y cada fila se predijo sola
+    assert puntuador.lotes == [5, 1, 1, 1, 1, 1]
+    assert cola.resumen()["lotes_fallidos"] == 1
+    # La cola sigue funcionando despues del fallo
+    for valor, resultado in zip(range(5), _concurrentes(cola, [float(v) for v in range(5)])):
+        _iguales(resultado, _esperado(valor))
@@ -0,0 +1,22 @@
+"""El evaluador NumPy da exactamente `predict_proba` de cada modelo LightGBM que se despliega."""
+import warnings
+
+import pytest
+
+from src.config.config import MODEL_PATHS, MODEL_PATHS_FPD
+from src.models.ensamble_numpy import EnsambleNumpy, conjunto_referencia, verificar_ensamble
+from src.utils.helpers import cargar_modelo
+
+MODELOS = {**MODEL_PATHS, **MODEL_PATHS_FPD}
+
+
+@pytest.mark.parametrize("nombre", list(MODELOS))
+def test_ensamble_igual_a_lightgbm(nombre):
+    modelo = cargar_modelo(MODELOS[nombre])
+    ensamble = EnsambleNumpy.compilar(modelo)
+    assert ensamble is not None, f"{nombre} no se pudo compilar"
+    X = conjunto_referencia(ensamble, 2000)
+    with warnings.catch_warnings():
+        # predict_proba advierte por los arreglos sin nombres de columnas
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        assert verificar_ensamble(modelo, X, ensamble) == []
@@ -0,0 +1,106 @@
+"""Extraccion del informe Experian sobre el corpus variado.
+
+Los engines `stream` y `lxml` agregan familias al vuelo y llenan un registro
+tipado, asi que su DataFrame no es columna a columna el de `etree`: se exige
+que las columnas en comun valgan lo mismo y que la respuesta de cada motor sea
+identica. El post-procesamiento vectorizado y la cache de informes deben dar
+exactamente el DataFrame de referencia. Un informe al que le falta una seccion
+entera hace fallar la extraccion: las dos rutas deben fallar con el mismo
+tipo de error.
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.models import predict_utils
+from src.models.predict_utils import CacheInformes, procesar_xml_experian
+from src.services import extraccion_API, extraccion_API_NCL
+from src.services.postproceso_vectorizado import verificar_postproceso
+
+VARIANTES = [("contra", extraccion_API), ("NCL", extraccion_API_NCL)]
+MOTORES = {"contra": "regular", "NCL": "nclf"}
+
+
+def _resultado(funcion, *args, **kwargs):
+    try:
+        return funcion(*args, **kwargs)
+    except Exception as e:
+        return e
+
+
+def _iguales(a, b):
+    if not isinstance(a, pd.DataFrame) or not isinstance(b, pd.DataFrame):
+        assert type(a) is type(b), f"{a!r} / {b!r}"
+        return
+    pd.testing.assert_frame_equal(a, b, check_exact=True)
+
+
+def _mismo_valor(a, b):
+    if pd.isna(a) and pd.isna(b):
+        return True
+    if isinstance(a, (int, float, np.number)) and isinstance(b, (int, float, np.number)):
+        return float(a) == float(b)
+    return a == b
+
+
+@pytest.mark.parametrize("motor, modulo", VARIANTES)
+@pytest.mark.parametrize("engine", ["stream", "lxml"])
+def test_engines_mismas_columnas_que_etree(xmls_variados, motor, modulo, engine):
+    for i, xml in enumerate(xmls_variados[motor]):
+        referencia = _resultado(modulo.procesar_informe, xml, engine="etree")
+        extraido = _resultado(modulo.procesar_informe, xml, engine=engine)
+        if not isinstance(referencia, pd.DataFrame) or not isinstance(extraido, pd.DataFrame):
+            assert type(referencia) is type(extraido), f"xml {i}: {referencia!r} / {extraido!r}"
+            continue
+        distintas = [
+            c for c in extraido.columns.intersection(referencia.columns)
+            if not _mismo_valor(extraido[c].iloc[0], referencia[c].iloc[0])
+        ]
+        assert distintas == [], f"xml {i}"
+
+
+@pytest.mark.parametrize("motor, modulo", VARIANTES)
+def test_engines_misma_respuesta(monkeypatch, juego, solicitudes_variadas, motor, modulo):
+    # La clave de la cache no incluye el engine
+    monkeypatch.setattr(predict_utils, "CACHE_INFORMES", CacheInformes(0, 60))
+    instancia = getattr(juego, MOTORES[motor])
+    for i, (m, solicitud) in enumerate(solicitudes_variadas):
+        if m != motor:
+            continue
+        respuestas = {}
+        for engine in ("etree", "stream", "lxml"):
+            monkeypatch.setattr(modulo, "EXTRACCION_ENGINE", engine)
+            respuestas[engine] = instancia.predecir(copy.deepcopy(solicitud), solicitud["grupo_tienda"])
+        assert respuestas["stream"] == respuestas["etree"], f"solicitud {i}"
+        assert respuestas["lxml"] == respuestas["etree"], f"solicitud {i}"
+
+
+@pytest.mark.parametrize("motor, modulo", VARIANTES)
+def test_postproceso_vectorizado_igual_a_referencia(xmls_variados, motor, modulo):
+    completos = []
+    for xml in xmls_variados[motor]:
+        referencia = _resultado(modulo.procesar_informe, xml, engine="etree", vectorizado=False)
+        if isinstance(referencia, Exception):
+            for engine in ("etree", "stream", "lxml"):
+                _iguales(_resultado(modulo.procesar_informe, xml, engine=engine, vectorizado=True), referencia)
+        else:
+            completos.append(xml)
+    assert len(completos) >= len(xmls_variados[motor]) // 2
+    assert verificar_postproceso(modulo.procesar_informe, completos) == []
+
+
+@pytest.mark.parametrize("motor, modulo", VARIANTES)
+def test_cache_devuelve_el_mismo_informe(monkeypatch, xmls_variados, motor, modulo):
+    cliente = {"dni_cliente": "1"}
+    for xml in xmls_variados[motor]:
+        monkeypatch.setattr(predict_utils, "CACHE_INFORMES", CacheInformes(0, 60))
+        sin_cache = _resultado(procesar_xml_experian, dict(cliente), xml, modulo.procesar_informe)
+        monkeypatch.setattr(predict_utils, "CACHE_INFORMES", CacheInformes(8, 60))
+        fallo = _resultado(procesar_xml_experian, dict(cliente), xml, modulo.procesar_informe)
+        acierto = _resultado(procesar_xml_experian, dict(cliente), xml, modulo.procesar_informe)
+        _iguales(fallo, sin_cache)
+        _iguales(acierto, sin_cache)
+        if isinstance(sin_cache, pd.DataFrame):
+            assert predict_utils.CACHE_INFORMES.estadisticas()["hits"] == 1
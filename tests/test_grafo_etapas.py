@@ -0,0 +1,117 @@
+"""Grafo de etapas: orden por dependencias, errores, cortes y ejecucion secuencial frente al pool."""
+import copy
+import threading
+import time
+
+import pytest
+
+from src.core import grafo_etapas
+from src.core.grafo_etapas import Corte, Etapa, GrafoEtapas
+from src.models import predict_utils
+from src.models.predict_utils import CacheInformes
+
+
+@pytest.fixture(params=[0, 2], ids=["hilos0", "hilos2"])
+def hilos(request, monkeypatch):
+    """Corre el test sin pool (`hilos: 0`) y con un pool propio de 2 hilos."""
+    monkeypatch.setattr(grafo_etapas, "GRAFO_ETAPAS_HILOS", request.param)
+    monkeypatch.setattr(grafo_etapas, "_pool", None)
+    yield request.param
+    if grafo_etapas._pool is not None:
+        grafo_etapas._pool.shutdown(wait=True)
+
+
+def _diamante(registro, falla=None, corte=None):
+    """x -> (a, b) -> c, declarado fuera de orden. `registro` guarda (etapa, hilo) al terminar cada una."""
+    lock = threading.Lock()
+
+    def etapa(nombre, funcion):
+        def correr(*args):
+            if nombre == falla:
+                raise ValueError(f"fallo {nombre}")
+            if nombre == corte:
+                raise Corte(f"corte {nombre}")
+            # La rama b tarda: si hay pool, a y b corren a la vez
+            if nombre == "b":
+                time.sleep(0.05)
+            resultado = funcion(*args)
+            with lock:
+                registro.append((nombre, threading.current_thread().name))
+            return resultado
+        return correr
+
+    return GrafoEtapas("prueba", [
+        Etapa("c", etapa("c", lambda a, b: a + b), entradas=("a", "b"), salidas=("c",)),
+        Etapa("b", etapa("b", lambda x: x * 10), entradas=("x",), salidas=("b",)),
+        Etapa("a", etapa("a", lambda x: (x + 1, x + 2)), entradas=("x",), salidas=("a", "a2")),
+    ], iniciales=("x",), salida="c")
+
+
+def test_orden_respeta_dependencias(hilos):
+    registro = []
+    grafo = _diamante(registro)
+    assert [e.nombre for e in grafo.orden] == ["b", "a", "c"]
+    assert grafo.ejecutar(x=1) == 12
+    nombres = [n for n, _ in registro]
+    assert nombres[-1] == "c" and sorted(nombres[:2]) == ["a", "b"]
+    en_pool = [n for n, hilo in registro if hilo.startswith("etapas")]
+    # Con pool una de las dos ramas listas corre en el pool; sin pool ninguna
+    assert len(en_pool) == (1 if hilos else 0)
+
+
+@pytest.mark.parametrize("falla", ["a", "b", "c"])
+def test_error_de_una_etapa_se_propaga(hilos, falla):
+    registro = []
+    grafo = _diamante(registro, falla=falla)
+    with pytest.raises(ValueError, match=f"fallo {falla}"):
+        grafo.ejecutar(x=1)
+    corridas = [n for n, _ in registro]
+    if falla == "c":
+        assert sorted(corridas) == ["a", "b"]
+    elif hilos:
+        # La otra rama termino antes de relanzar (se espera a las del pool) y c no corrio
+        assert corridas == [{"a": "b", "b": "a"}[falla]]
+    else:
+        # En orden: solo corrieron las etapas anteriores a la que fallo
+        anteriores = [e.nombre for e in grafo.orden]
+        assert corridas == anteriores[:anteriores.index(falla)]
+    assert grafo.metricas.resumen()["fallidas"] == 1
+
+
+def test_corte_devuelve_su_valor(hilos):
+    grafo = _diamante([], corte="a")
+    assert grafo.ejecutar(x=1) == "corte a"
+    assert grafo.metricas.resumen()["cortes"] == 1
+
+
+@pytest.mark.parametrize("etapas, iniciales, salida", [
+    ([Etapa("a", int, ("y",), ("a",))], ("x",), "a"),
+    ([Etapa("a", int, ("x",), ("a",)), Etapa("b", int, ("x",), ("a",))], ("x",), "a"),
+    ([Etapa("a", int, ("b",), ("a",)), Etapa("b", int, ("a",), ("b",))], (), "a"),
+    ([Etapa("a", int, ("x",), ("a",))], ("x",), "z"),
+])
+def test_grafos_invalidos(etapas, iniciales, salida):
+    with pytest.raises(ValueError):
+        GrafoEtapas("invalido", etapas, iniciales, salida)
+
+
+def test_faltan_valores_iniciales():
+    with pytest.raises(ValueError):
+        _diamante([]).ejecutar()
+
+
+def test_motores_iguales_con_y_sin_pool(monkeypatch, juego, solicitudes_variadas):
+    """Cada motor responde lo mismo con `hilos: 0` que con un pool de 2 hilos."""
+    monkeypatch.setattr(predict_utils, "CACHE_INFORMES", CacheInformes(0, 60))
+    motores = {"contra": juego.regular, "NCL": juego.nclf, "backup": juego.backup}
+    respuestas = {}
+    for n in (0, 2):
+        monkeypatch.setattr(grafo_etapas, "GRAFO_ETAPAS_HILOS", n)
+        monkeypatch.setattr(grafo_etapas, "_pool", None)
+        respuestas[n] = [
+            motores[m].predecir(copy.deepcopy(s), s.get("grupo_tienda") or s.get("grupo_retailer"))
+            for m, s in solicitudes_variadas
+        ]
+        if grafo_etapas._pool is not None:
+            grafo_etapas._pool.shutdown(wait=True)
+    assert respuestas[0] == respuestas[2]
@@ -0,0 +1,90 @@
+"""Que informes rechaza un motor segun el plan de features.
+
+Sin plan (el valor por defecto) un informe sin `InfoAgregada/Saldos/Mes` hace
+fallar `variables_income` y la solicitud recibe "Error Interno", como siempre.
+Con el plan activo las derivadas que leen esos meses no se calculan, porque
+ningun modelo las usa, y el mismo informe se puntua con esas columnas en NaN.
+
+Con `plan_features.secciones` la extraccion tambien se salta las secciones del
+XML que no producen ningun campo usado; la respuesta no cambia aunque esas
+secciones falten o traigan valores invalidos.
+"""
+import copy
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from src.config.config import MODEL_PATHS, MODEL_PATHS_FPD, SCALER_PATHS
+from src.services.hortensia_contraofertas_matrix import MotorPrediccionContraofertas
+from src.services.plan_features import PlanFeatures
+from tests.conftest import sin_seccion, solicitud
+
+
+@pytest.fixture(scope="module")
+def motor_con_plan():
+    return MotorPrediccionContraofertas(
+        MODEL_PATHS["hortensia"], SCALER_PATHS["min_max_scaler_experian_H"],
+        MODEL_PATHS_FPD["hortensia_fpd"], SCALER_PATHS["min_max_scaler_experian_FPD"],
+        plan_features=True,
+    )
+
+
+@pytest.fixture
+def sin_meses(canario):
+    datos = solicitud(canario, "contra")
+    datos["experianXML"] = sin_seccion(datos["experianXML"], "Saldos/Mes")
+    return datos
+
+
+def test_plan_apagado_por_defecto(juego):
+    assert juego.regular.plan is None
+    assert juego.nclf.plan is None
+    assert juego.backup.plan is None
+
+
+def test_sin_plan_se_rechaza_el_informe_sin_meses(juego, sin_meses):
+    respuesta = juego.regular.predecir(copy.deepcopy(sin_meses), sin_meses["grupo_tienda"])
+    assert str(respuesta["CodigoHortensia"]) == "99"
+    assert respuesta["Mensaje"] == "Error Interno."
+
+
+def test_con_plan_se_puntua_el_informe_sin_meses(motor_con_plan, sin_meses):
+    respuesta = motor_con_plan.predecir(copy.deepcopy(sin_meses), sin_meses["grupo_tienda"])
+    assert str(respuesta["CodigoHortensia"]) != "99"
+
+
+def _corromper(xml, ruta):
+    """Copia de `xml` con todos los atributos bajo los elementos de `ruta` en "N/A"."""
+    cabecera, cuerpo = xml.split("?>", 1) if xml.startswith("<?xml") else ("", xml)
+    raiz = ET.fromstring(cuerpo)
+    padre, _, tag = ruta.rpartition("/")
+    for elemento in list(raiz.iter()):
+        if not padre or elemento.tag == padre.rpartition("/")[2]:
+            for hijo in elemento.findall(tag):
+                for nodo in hijo.iter():
+                    for nombre in nodo.attrib:
+                        nodo.attrib[nombre] = "N/A"
+    texto = ET.tostring(raiz, encoding="unicode")
+    return f"{cabecera}?>{texto}" if cabecera else texto
+
+
+def test_secciones_omitidas_no_cambian_la_respuesta(motor_con_plan, canario):
+    """Saltarse una seccion omitida da la misma respuesta que extraerla, aunque falte o este corrupta."""
+    pares = [(motor_con_plan.modelo_h, motor_con_plan.min_max_scaler_H),
+             (motor_con_plan.modelo_fpd, motor_con_plan.min_max_scaler_FPD)]
+    con_secciones = PlanFeatures("regular", pares, secciones=True)
+    sin_secciones = PlanFeatures("regular", pares, secciones=False)
+    assert con_secciones.secciones_omitidas and not sin_secciones.secciones_omitidas
+    base = solicitud(canario, "contra")
+    original = motor_con_plan.plan
+    for ruta in sorted(con_secciones.secciones_omitidas):
+        seccion = ruta.rpartition("/")[2]
+        for xml in (sin_seccion(base["experianXML"], seccion), _corromper(base["experianXML"], seccion)):
+            respuestas = []
+            for plan in (sin_secciones, con_secciones):
+                motor_con_plan.plan = plan
+                datos = copy.deepcopy(base)
+                datos["experianXML"] = xml
+                respuestas.append(motor_con_plan.predecir(datos, datos["grupo_tienda"]))
+            assert respuestas[0] == respuestas[1], ruta
+    motor_con_plan.plan = original
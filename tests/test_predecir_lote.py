@@ -0,0 +1,58 @@
+"""`predecir_lote` frente a `predecir` en los tres motores, sobre el corpus variado.
+
+Cada respuesta del lote debe ser la que da `predecir` a la misma solicitud
+sola, incluidas las de error: una solicitud que falla recibe su
+`error_response` y las demas del lote se responden igual que sin ella.
+"""
+import copy
+
+import pytest
+
+from src.models import predict_utils
+from src.models.predict_utils import CacheInformes
+
+MOTORES = {"contra": "regular", "NCL": "nclf", "backup": "backup"}
+
+
+def _grupo(solicitud):
+    return solicitud.get("grupo_tienda") or solicitud.get("grupo_retailer")
+
+
+def _rota(solicitud):
+    rota = copy.deepcopy(solicitud)
+    if rota.get("experianXML"):
+        rota["experianXML"] = "<Informe><sin cerrar"
+    else:
+        rota["cliente"]["edad_al_contratar"] = "abc"
+    return rota
+
+
+@pytest.fixture(autouse=True)
+def sin_cache(monkeypatch):
+    monkeypatch.setattr(predict_utils, "CACHE_INFORMES", CacheInformes(0, 60))
+
+
+@pytest.mark.parametrize("motor", list(MOTORES))
+def test_lote_igual_a_predecir(juego, solicitudes_variadas, motor):
+    instancia = getattr(juego, MOTORES[motor])
+    solicitudes = [s for m, s in solicitudes_variadas if m == motor]
+    esperadas = [instancia.predecir(copy.deepcopy(s), _grupo(s)) for s in solicitudes]
+    lote = instancia.predecir_lote([copy.deepcopy(s) for s in solicitudes], [_grupo(s) for s in solicitudes])
+    assert len(lote) == len(esperadas)
+    for i, (respuesta, esperada) in enumerate(zip(lote, esperadas)):
+        assert respuesta == esperada, f"solicitud {i}"
+
+
+@pytest.mark.parametrize("motor", list(MOTORES))
+def test_lote_con_una_solicitud_que_falla(juego, canario, motor):
+    instancia = getattr(juego, MOTORES[motor])
+    buena = next(c["solicitud"] for c in canario if c["motor"] == motor)
+    rota = _rota(buena)
+    solicitudes = [buena, rota, buena]
+    esperada = instancia.predecir(copy.deepcopy(buena), _grupo(buena))
+    error = instancia.predecir(copy.deepcopy(rota), _grupo(rota))
+    assert str(error["CodigoHortensia"]) == "99"
+    assert str(esperada["CodigoHortensia"]) != "99"
+
+    lote = instancia.predecir_lote([copy.deepcopy(s) for s in solicitudes], _grupo(buena))
+    assert lote == [esperada, error, esperada]
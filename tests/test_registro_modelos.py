@@ -0,0 +1,128 @@
+"""Registro de modelos: validacion de cambios, canario, reversion, sincronizacion y 409.
+
+Cada test usa su propio registro con el estado compartido en `tmp_path`, sin
+revision periodica (`intervalo=None`) y una sola corrida del canario.
+"""
+import json
+
+import pytest
+
+from src.services.motores import combinar, especificacion_config
+from src.services.registro_modelos import RegistroModelos
+from tests.conftest import sin_seccion, solicitud
+
+MODELO_AJENO = "src/artifacts/hortensia/modelo_h_backup_61.pkl"
+
+
+def _registro(ruta):
+    return RegistroModelos(estado_compartido=ruta, repeticiones=1, intervalo=None)
+
+
+def _version(nombre):
+    return {"versions_hortensia": {"hortensia_contraofertas": nombre}}
+
+
+@pytest.fixture
+def estado(tmp_path):
+    return tmp_path / "registro_modelos.json"
+
+
+@pytest.fixture
+def registro(estado):
+    registro = _registro(estado)
+    registro.activo()
+    return registro
+
+
+@pytest.mark.parametrize("cambios", [
+    {"model_paths": {"hortensia": "/etc/passwd"}},
+    {"model_paths": {"hortensia": "src/artifacts/../config/config.yaml"}},
+    {"model_paths": {"hortensia": "src/artifacts/hortensia/no_existe.pkl"}},
+    {"model_paths": {"hortensia": "src/artifacts/hortensia"}},
+    {"model_paths": {"otro": MODELO_AJENO}},
+    {"model_paths": {"hortensia": 3}},
+    {"umbrales": {}},
+    [],
+])
+def test_combinar_rechaza_especificaciones_invalidas(cambios):
+    with pytest.raises(ValueError):
+        combinar(especificacion_config(), cambios)
+
+
+def test_combinar_normaliza_rutas_dentro_de_artifacts():
+    spec = combinar(especificacion_config(), {"model_paths": {"hortensia": f"./src/artifacts/../artifacts/hortensia/{MODELO_AJENO.rsplit('/', 1)[1]}"}})
+    assert spec["model_paths"]["hortensia"] == MODELO_AJENO
+
+
+def test_canario_fallido_deja_el_juego_activo(canario, estado, tmp_path):
+    # Un canario que el motor rechaza (ver test_plan_features) descarta cualquier juego
+    datos = solicitud(canario, "contra")
+    datos["experianXML"] = sin_seccion(datos["experianXML"], "Saldos/Mes")
+    ruta_canario = tmp_path / "canario.json"
+    ruta_canario.write_text(json.dumps([{"motor": "contra", "solicitud": datos}]), encoding="utf-8")
+    registro = RegistroModelos(estado_compartido=estado, canario=ruta_canario, repeticiones=1, intervalo=None)
+    activo = registro.activo()
+
+    operacion = registro.cargar(_version("prueba"), esperar=True)
+    assert operacion["estado"] == "fallida"
+    assert "Canario contra" in operacion["error"]
+    assert registro.activo() is activo
+    assert registro._anterior is None
+    # Una carga descartada no se publica
+    assert not estado.exists()
+
+
+def test_revertir_vuelve_al_juego_anterior(registro):
+    original = registro.activo()
+    operacion = registro.cargar(_version("prueba"), esperar=True)
+    assert operacion["estado"] == "activo"
+    nuevo = registro.activo()
+    assert nuevo is not original and nuevo.regular.version == "prueba"
+
+    registro.revertir()
+    assert registro.activo() is original
+    assert registro._anterior is nuevo
+
+
+def test_revertir_sin_anterior(registro):
+    with pytest.raises(LookupError):
+        registro.revertir()
+
+
+def test_sincronizar_aplica_generaciones_nuevas_e_ignora_las_viejas(registro, estado):
+    otro = _registro(estado)
+    otro.activo()
+    registro.cargar(_version("prueba"), esperar=True)
+    publicado = json.loads(estado.read_text(encoding="utf-8"))
+
+    assert otro.sincronizar()
+    otro._hilo.join()
+    assert otro.activo().huella == registro.activo().huella
+    assert otro._generacion == publicado["generacion"]
+
+    # Una generacion que no es mayor que la aplicada no se repite
+    viejo = dict(publicado, spec=combinar(publicado["spec"], _version("vieja")))
+    estado.write_text(json.dumps(viejo), encoding="utf-8")
+    assert not otro.sincronizar()
+    assert otro.activo().regular.version == "prueba"
+
+
+def test_carga_concurrente_responde_409(registro, monkeypatch):
+    from src.api import admin, routes
+    from src.api.flask_app import app
+
+    monkeypatch.setattr(admin, "REGISTRO", registro)
+    monkeypatch.setattr(routes, "PASSWORD", "clave")
+    cliente = app.test_client()
+    auth = (routes.USERNAME, "clave")
+
+    # Otra operacion en curso: el lock de operaciones esta tomado
+    registro._operacion.acquire()
+    try:
+        with pytest.raises(RuntimeError):
+            registro.cargar(_version("prueba"))
+        respuesta = cliente.post("/admin/modelos/cargar", json=_version("prueba"), auth=auth)
+        assert respuesta.status_code == 409
+    finally:
+        registro._operacion.release()
+    assert registro.ultima_operacion is None
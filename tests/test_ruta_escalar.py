@@ -0,0 +1,49 @@
+"""La ruta escalar (registro dict) da las mismas probabilidades, bit a bit, que la ruta pandas en cada motor."""
+import copy
+
+import pytest
+
+from src.models.predict_utils import extraer_datos_cliente_campos, extraer_datos_iniciales
+from src.services.registro import verificar_ruta_escalar
+
+MOTORES = {"contra": "regular", "NCL": "nclf", "backup": "backup"}
+
+
+def _entradas(motor, instancia, solicitudes):
+    """Argumentos de `calcular_probabilidades` de cada solicitud, como los arma `predecir`."""
+    entradas = []
+    for m, solicitud in solicitudes:
+        if m != motor:
+            continue
+        solicitud = copy.deepcopy(solicitud)
+        if motor == "backup":
+            entradas.append(extraer_datos_iniciales(solicitud, ["score_experian"]))
+            continue
+        datos_cliente, xml, _, _, _, tid = extraer_datos_cliente_campos(solicitud, ["p6", "score_experian"])
+        try:
+            df = instancia.procesar_xml(datos_cliente, xml)
+        except Exception:
+            # Informe que la extraccion rechaza: no llega a calcular_probabilidades
+            continue
+        entradas.append((df,) if motor == "contra" else (df, tid))
+    return entradas
+
+
+@pytest.mark.parametrize("motor", list(MOTORES))
+def test_ruta_escalar_igual_a_pandas(monkeypatch, juego, solicitudes_variadas, motor):
+    instancia = getattr(juego, MOTORES[motor])
+    entradas = _entradas(motor, instancia, solicitudes_variadas)
+    assert len(entradas) >= 10
+
+    escalares = []
+    original = instancia.generar_probabilidad_registro
+
+    def contar(*args, **kwargs):
+        resultado = original(*args, **kwargs)
+        escalares.append(resultado is not None)
+        return resultado
+
+    monkeypatch.setattr(instancia, "generar_probabilidad_registro", contar)
+    assert verificar_ruta_escalar(instancia, entradas) == []
+    # La comparacion no vale si la ruta escalar siempre cae a la de pandas
+    assert sum(escalares) >= len(entradas) // 2